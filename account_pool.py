@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+ACME账户池
+把订单分散到多个ACME账户，按账户跟踪新订单速率限制的剩余额度
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from acme import messages
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from acme_client import ACMEClient, RateLimitedError
+from fsutil import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Let's Encrypt: 每个账户每3小时最多300个新订单
+NEW_ORDERS_PER_WINDOW = 300
+NEW_ORDERS_WINDOW = 3 * 3600
+# 被限速但CA没有返回Retry-After时的等待时间
+DEFAULT_RETRY_AFTER = 3600
+
+
+class AccountBudget:
+    """单个账户在滑动窗口内的订单记录和限速状态"""
+
+    __slots__ = ('orders', 'blocked_until')
+
+    def __init__(self, orders: Optional[List[float]] = None, blocked_until: float = 0.0):
+        self.orders = orders or []
+        self.blocked_until = blocked_until
+
+    def remaining(self, now: float, limit: int, window: float) -> int:
+        self.orders = [t for t in self.orders if t > now - window]
+        return limit - len(self.orders)
+
+    def available_at(self, now: float, limit: int, window: float) -> float:
+        """最早可以创建下一个订单的时间"""
+        at = max(now, self.blocked_until)
+        if self.remaining(now, limit, window) <= 0:
+            at = max(at, self.orders[-limit] + window)
+        return at
+
+
+class AccountPool:
+    """
+    多账户ACME客户端池
+
+    每次创建订单时选择当前剩余额度最多且未被限速的账户；CA返回 rateLimited 时
+    按Retry-After暂停该账户并换用下一个账户。订单记录可以持久化，使多次运行
+    （如cron）共享同一个限速窗口。
+    """
+
+    def __init__(
+            self,
+            clients: List[ACMEClient],
+            orders_per_window: int = NEW_ORDERS_PER_WINDOW,
+            window: float = NEW_ORDERS_WINDOW,
+            max_wait: float = 0,
+            state_file: Optional[str] = None,
+            clock: Callable[[], float] = time.time,
+            sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        Args:
+            clients: ACME客户端列表（每个客户端使用独立的 account_dir）
+            orders_per_window: 每个账户在窗口内允许的订单数
+            window: 限速窗口（秒）
+            max_wait: 所有账户都没有额度时最多等待的时间（秒），超过则放弃
+            state_file: 订单记录持久化文件（可选）
+            clock: 时间函数（测试时可替换）
+            sleep: 等待函数（测试时可替换）
+        """
+        if not clients:
+            raise ValueError("账户池至少需要一个ACME客户端")
+        self.clients = clients
+        self.orders_per_window = orders_per_window
+        self.window = window
+        self.max_wait = max_wait
+        self.state_file = state_file
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.budgets: Dict[str, AccountBudget] = {self._key(c): AccountBudget() for c in clients}
+        self._load()
+
+    @staticmethod
+    def _key(acme_client: ACMEClient) -> str:
+        return str(acme_client.account_dir)
+
+    def revoke(self, cert: x509.Certificate, reason: int = 0, account: Optional[str] = None) -> None:
+        """
+        吊销证书
+
+        优先使用颁发该证书的账户（account 为证书目录中记录的账户标识）；没有记录或
+        该账户不在池中时依次尝试各账户，CA返回 unauthorized（账户无权吊销）时换用下一个。
+
+        Raises:
+            messages.Error: 所有账户都无权吊销或其他CA错误
+        """
+        clients = sorted(self.clients, key=lambda c: c.account_id != account)
+        for acme_client in clients:
+            try:
+                acme_client.revoke(cert, reason)
+                return
+            except messages.Error as e:
+                if e.code != 'unauthorized' or acme_client is clients[-1]:
+                    raise
+                logger.info(f"账户 {acme_client.account_dir} 无权吊销该证书，尝试下一个账户")
+
+    def _load(self) -> None:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取账户池状态失败: {e}")
+            return
+        for key, item in state.items():
+            if key in self.budgets:
+                self.budgets[key] = AccountBudget(item.get('orders'), item.get('blocked_until', 0.0))
+
+    def _save(self) -> None:
+        if not self.state_file:
+            return
+        state = {key: {'orders': budget.orders, 'blocked_until': budget.blocked_until}
+                 for key, budget in self.budgets.items()}
+        try:
+            write_atomic(self.state_file, json.dumps(state, indent=2))
+        except OSError as e:
+            logger.warning(f"保存账户池状态失败: {e}")
+
+    def remaining(self) -> Dict[str, int]:
+        """每个账户当前窗口内的剩余订单额度"""
+        now = self.clock()
+        with self._lock:
+            return {key: budget.remaining(now, self.orders_per_window, self.window)
+                    for key, budget in self.budgets.items()}
+
+    def _reserve(self, exclude: set) -> Tuple[Optional[ACMEClient], float]:
+        """
+        选择账户并预先占用一个订单额度
+
+        Returns:
+            (账户, 0) 或 (None, 最早可用时间)
+        """
+        now = self.clock()
+        best, best_remaining, earliest = None, 0, float('inf')
+        with self._lock:
+            for acme_client in self.clients:
+                key = self._key(acme_client)
+                budget = self.budgets[key]
+                available_at = budget.available_at(now, self.orders_per_window, self.window)
+                if available_at > now:
+                    earliest = min(earliest, available_at)
+                    continue
+                if key in exclude:
+                    continue
+                remaining = budget.remaining(now, self.orders_per_window, self.window)
+                if remaining > best_remaining:
+                    best, best_remaining = acme_client, remaining
+            if best is not None:
+                self.budgets[self._key(best)].orders.append(now)
+                self._save()
+                return best, 0
+        return None, earliest
+
+    def _release(self, acme_client: ACMEClient, retry_after: Optional[float]) -> None:
+        """订单被拒绝: 退回额度并暂停该账户"""
+        now = self.clock()
+        with self._lock:
+            budget = self.budgets[self._key(acme_client)]
+            if budget.orders:
+                budget.orders.pop()
+            budget.blocked_until = now + (retry_after if retry_after is not None else DEFAULT_RETRY_AFTER)
+            self._save()
+
+    def start_order(
+            self,
+            domains: List[str],
+            cert_dir: str = "./certs",
+            key_size: int = 2048
+    ) -> Optional[Tuple[ACMEClient, Tuple[Path, messages.OrderResource, rsa.RSAPrivateKey]]]:
+        """
+        选择账户并创建订单
+
+        Returns:
+            (负责该订单的ACME客户端, generate_certificate的结果)，失败返回None
+        """
+        deadline = self.clock() + self.max_wait
+        rejected = set()
+        while True:
+            acme_client, available_at = self._reserve(rejected)
+            if acme_client is None:
+                if available_at == float('inf') or available_at > deadline:
+                    logger.error("所有ACME账户的订单额度均已用完")
+                    return None
+                wait = available_at - self.clock()
+                logger.info(f"所有ACME账户暂时没有额度，等待 {wait:.0f} 秒")
+                self.sleep(max(0.0, wait))
+                rejected.clear()
+                continue
+
+            logger.info(f"使用ACME账户: {acme_client.account_dir} ({acme_client.email})")
+            try:
+                result = acme_client.generate_certificate(domains, cert_dir, key_size)
+            except RateLimitedError as e:
+                logger.warning(f"账户 {acme_client.account_dir} 被限速: {e}")
+                self._release(acme_client, e.retry_after)
+                rejected.add(self._key(acme_client))
+                continue
+            if not result:
+                return None
+            return acme_client, result
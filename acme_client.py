@@ -4,13 +4,17 @@ ACME客户端
 使用certbot库与Let's Encrypt交互
 """
 
+import json
 import logging
 import os
+import threading
 import time
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 from typing import List, Optional, Tuple
+from urllib.parse import urlparse
 
-from acme import challenges, client, crypto_util as acme_crypto, messages
+from acme import challenges, client, crypto_util as acme_crypto, errors, messages
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import rsa
@@ -18,8 +22,78 @@ from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.x509.oid import NameOID
 import josepy as jose
 
+from bundle_formats import BundleWriter
+from chain_store import ChainStore
+from fsutil import write_atomic
+from tracing import tracer
+
 logger = logging.getLogger(__name__)
 
+# 证书目录中记录颁发账户（账户密钥指纹）的文件；隐藏文件不会被分发或由证书服务发布
+ACCOUNT_FILE = '.account'
+
+
+def issuing_account(cert_path: Path) -> Optional[str]:
+    """证书目录中记录的颁发账户，没有记录时返回None"""
+    try:
+        return (Path(cert_path) / ACCOUNT_FILE).read_text(encoding='utf-8').strip() or None
+    except OSError:
+        return None
+
+
+def invalid_identifiers(order: messages.OrderResource) -> List[str]:
+    """订单中验证失败的授权对应的域名（通配符授权带 *. 前缀）"""
+    return [('*.' if authz.body.wildcard else '') + authz.body.identifier.value
+            for authz in order.authorizations if authz.body.status == messages.STATUS_INVALID]
+
+
+class RateLimitedError(Exception):
+    """ACME服务器返回 rateLimited 错误"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After响应头（秒数或HTTP日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TracingClientNetwork(client.ClientNetwork):
+    """
+    为每次ACME HTTP请求记录span的ClientNetwork，并记录最近一次响应的Retry-After
+
+    同一账户的网络对象由多个线程共用，retry_after 按线程记录，
+    每个响应都会覆盖它（非429/503响应为None），不会沿用更早请求的值。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._last_response = threading.local()
+
+    @property
+    def retry_after(self) -> Optional[float]:
+        """当前线程最近一次响应的Retry-After（秒）"""
+        return getattr(self._last_response, 'retry_after', None)
+
+    def _send_request(self, method, url, *args, **kwargs):
+        self._last_response.retry_after = None
+        with tracer.span('acme.request', method=method, path=urlparse(url).path):
+            response = super()._send_request(method, url, *args, **kwargs)
+        if response.status_code in (429, 503):
+            self._last_response.retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        return response
+
 
 class ACMEClient:
     """ACME客户端,用于与Let's Encrypt交互"""
@@ -32,7 +106,10 @@ class ACMEClient:
             self,
             email: str,
             account_dir: str = "./accounts",
-            staging: bool = False
+            staging: bool = False,
+            poll_interval: float = 5,
+            chain_link: str = 'hardlink',
+            bundle_writer: Optional[BundleWriter] = None
     ):
         """
         初始化ACME客户端
@@ -41,6 +118,9 @@ class ACMEClient:
             email: 联系邮箱
             account_dir: 账户密钥存储目录
             staging: 是否使用测试环境
+            poll_interval: 轮询订单状态的间隔（秒）
+            chain_link: chain.pem 链接到共享证书链存储的方式（hardlink、symlink 或 copy）
+            bundle_writer: 保存证书时额外生成的证书包格式（PKCS#12等，可选）
         """
         self.email = email
         self.account_dir = Path(account_dir)
@@ -48,6 +128,9 @@ class ACMEClient:
 
         self.staging = staging
         self.directory_url = self.STAGING_URL if staging else self.PRODUCTION_URL
+        self.poll_interval = poll_interval
+        self.chain_link = chain_link
+        self.bundle_writer = bundle_writer
 
         # 初始化账户
         self.account_key = self._load_or_create_account_key()
@@ -56,6 +139,22 @@ class ACMEClient:
         env = "测试" if staging else "生产"
         logger.info(f"ACME客户端初始化成功({env}环境)")
 
+    @property
+    def account_id(self) -> str:
+        """账户标识（账户密钥的JWK指纹，与账户目录位置无关）"""
+        return jose.b64encode(self.account_key.thumbprint()).decode('ascii')
+
+    def revoke(self, cert: x509.Certificate, reason: int = 0, account: Optional[str] = None) -> None:
+        """
+        吊销证书（失败时抛出ACME客户端的异常）
+
+        Args:
+            cert: 要吊销的证书
+            reason: 吊销原因代码
+            account: 颁发该证书的账户（与 AccountPool.revoke 接口一致，单账户时忽略）
+        """
+        self.acme_client.revoke(cert, reason)
+
     def _load_or_create_account_key(self) -> jose.JWKRSA:
         """
         加载或创建账户密钥
@@ -104,10 +203,17 @@ class ACMEClient:
         """
         from acme import errors
 
-        net = client.ClientNetwork(self.account_key, user_agent='letsencrypt-dnsla/1.0')
+        net = TracingClientNetwork(self.account_key, user_agent='letsencrypt-dnsla/1.0')
         directory = messages.Directory.from_json(net.get(self.directory_url).json())
         acme_client = client.ClientV2(directory, net=net)
 
+        # 复用缓存的注册信息，避免每次启动都请求newAccount
+        regr = self._load_registration()
+        if regr is not None:
+            net.account = regr
+            logger.info(f"使用缓存的账户注册信息,URI: {regr.uri}")
+            return acme_client
+
         # 智能账户管理
         try:
             logger.info(f"尝试注册或获取账户: {self.email}")
@@ -158,9 +264,48 @@ class ACMEClient:
             raise Exception("账户未能正确设置,无法继续")
 
         logger.info(f"账户已成功设置,URI: {net.account.uri}")
+        self._save_registration(net.account)
 
         return acme_client
 
+    @property
+    def registration_file(self) -> Path:
+        # 注册信息与目录地址绑定，测试环境和生产环境各自缓存
+        env = "staging" if self.staging else "production"
+        return self.account_dir / f"registration-{env}.json"
+
+    def _load_registration(self) -> Optional[messages.RegistrationResource]:
+        """
+        加载缓存的账户注册信息
+
+        缓存记录了注册时的账户密钥指纹和目录地址；邮箱、账户密钥（重新生成或替换）
+        或目录地址不一致时忽略缓存，重新向CA查询账户。
+        """
+        if not self.registration_file.exists():
+            return None
+        try:
+            data = json.loads(self.registration_file.read_text())
+            if data.get('account_key') != self.account_id or data.get('directory_url') != self.directory_url:
+                logger.info("账户密钥或目录地址已变化，忽略账户注册缓存")
+                return None
+            regr = messages.RegistrationResource.from_json(data['registration'])
+        except Exception as e:
+            logger.warning(f"读取账户注册缓存失败: {e}")
+            return None
+        if self.email not in regr.body.emails:
+            return None
+        return regr
+
+    def _save_registration(self, regr: messages.RegistrationResource) -> None:
+        try:
+            write_atomic(str(self.registration_file), json.dumps({
+                'account_key': self.account_id,
+                'directory_url': self.directory_url,
+                'registration': regr.to_json(),
+            }))
+        except Exception as e:
+            logger.warning(f"保存账户注册缓存失败: {e}")
+
     def get_dns_challenge_data(
         self, 
         authz: messages.AuthorizationResource,
@@ -217,12 +362,13 @@ class ACMEClient:
             max_attempts: 最大尝试次数
 
         Returns:
-            完成的订单资源,失败返回None
+            完成的订单资源；授权验证失败时返回状态为invalid、authorizations 只包含失败授权的订单
+            （见 invalid_identifiers）；其他失败返回None
         """
         logger.info("等待Let's Encrypt验证DNS记录...")
 
         for attempt in range(max_attempts):
-            time.sleep(5)  # 每5秒检查一次
+            time.sleep(self.poll_interval)  # 默认每5秒检查一次
 
             try:
                 order = self.acme_client.poll_and_finalize(order)
@@ -233,6 +379,12 @@ class ACMEClient:
 
                 logger.debug(f"订单状态: {order.body.status} (尝试 {attempt + 1}/{max_attempts})")
 
+            except errors.ValidationError as e:
+                # 授权已失效，重试不会成功
+                failed = order.update(body=order.body.update(status=messages.STATUS_INVALID),
+                                      authorizations=list(e.failed_authzrs))
+                logger.error(f"域名验证失败: {', '.join(invalid_identifiers(failed))}")
+                return failed
             except Exception as e:
                 logger.error(f"轮询订单状态失败: {e}")
                 continue
@@ -295,71 +447,110 @@ class ACMEClient:
 
         # 生成私钥
         logger.info("生成证书私钥...")
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=key_size,
-            backend=default_backend()
-        )
+        with tracer.span('acme.key_generation', key_size=key_size):
+            private_key = rsa.generate_private_key(
+                public_exponent=65537,
+                key_size=key_size,
+                backend=default_backend()
+            )
 
-        # 保存私钥
-        key_file = cert_path / "privkey.pem"
-        with open(key_file, 'wb') as f:
-            f.write(private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption()
-            ))
-        os.chmod(key_file, 0o600)
+        # 私钥在证书签发后与证书一起保存（见 save_certificate），
+        # 订单失败时不会替换证书目录中仍在使用的私钥
 
         # 生成CSR
         logger.info("生成证书签名请求...")
         csr_pem = self._generate_csr(domains, private_key)
 
         # 创建订单
-        order = self.acme_client.new_order(csr_pem)
+        with tracer.span('acme.new_order', domains=len(domains)):
+            try:
+                order = self.acme_client.new_order(csr_pem)
+            except messages.Error as e:
+                if e.code == 'rateLimited':
+                    retry_after = getattr(self.acme_client.net, 'retry_after', None)
+                    raise RateLimitedError(str(e), retry_after) from e
+                raise
 
         return cert_path, order, private_key
 
+    def start_order(
+            self,
+            domains: List[str],
+            cert_dir: str = "./certs",
+            key_size: int = 2048
+    ) -> Optional[Tuple['ACMEClient', Tuple[Path, messages.OrderResource, rsa.RSAPrivateKey]]]:
+        """
+        创建订单并返回负责该订单的客户端（与 AccountPool.start_order 接口一致）
+
+        Returns:
+            (ACME客户端, generate_certificate的结果)，失败返回None
+        """
+        try:
+            result = self.generate_certificate(domains, cert_dir, key_size)
+        except RateLimitedError as e:
+            logger.error(f"创建订单被限速: {e}")
+            return None
+        if not result:
+            return None
+        return self, result
+
     def save_certificate(
             self,
             order: messages.OrderResource,
             cert_path: Path,
-            domains: List[str]
+            domains: List[str],
+            private_key: Optional[rsa.RSAPrivateKey] = None
     ) -> bool:
         """
         保存证书文件
 
+        每个文件先写临时文件再重命名，读取方不会看到半写入的文件；
+        私钥最先写入，fullchain.pem 最后写入，可作为整个证书包已更新的标志。
+
         Args:
             order: 已完成的订单
             cert_path: 证书保存路径
             domains: 域名列表
+            private_key: 证书私钥（generate_certificate 返回的私钥）
 
         Returns:
             是否成功
         """
         try:
+            cert_path.mkdir(parents=True, exist_ok=True)
+            key_file = cert_path / "privkey.pem"
+            if private_key is not None:
+                write_atomic(str(key_file), private_key.private_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PrivateFormat.TraditionalOpenSSL,
+                    encryption_algorithm=serialization.NoEncryption()
+                ).decode('ascii'), mode=0o600)
+            # 记录颁发账户，使用账户池时用同一账户吊销
+            write_atomic(str(cert_path / ACCOUNT_FILE), self.account_id + '\n')
+
+            # 保存服务器证书(cert.pem)，中间证书链(chain.pem)链接到按内容寻址的共享存储
+            leaf, intermediates = ChainStore(str(cert_path.parent), self.chain_link).save(
+                cert_path, order.fullchain_pem)
+            cert_file, chain_file = cert_path / "cert.pem", cert_path / "chain.pem"
+
+            # 预先生成的证书包格式
+            bundles = []
+            if self.bundle_writer:
+                if private_key is None:
+                    private_key = serialization.load_pem_private_key(key_file.read_bytes(), password=None)
+                bundles = self.bundle_writer.write(cert_path, leaf, intermediates, private_key)
+
             # 保存完整证书链
             fullchain_file = cert_path / "fullchain.pem"
-            with open(fullchain_file, 'w') as f:
-                f.write(order.fullchain_pem)
-
-            # 保存证书(不含中间证书)
-            cert_file = cert_path / "cert.pem"
-            with open(cert_file, 'w') as f:
-                # fullchain包含服务器证书和中间证书,我们只取第一个
-                certs = order.fullchain_pem.split('\n\n')
-                f.write(certs[0] + '\n')
-
-            # 保存中间证书链
-            chain_file = cert_path / "chain.pem"
-            with open(chain_file, 'w') as f:
-                f.write('\n\n'.join(certs[1:]))
+            write_atomic(str(fullchain_file), order.fullchain_pem)
 
             logger.info(f"证书已保存到: {cert_path}")
             logger.info(f"  - 完整证书链: {fullchain_file}")
             logger.info(f"  - 服务器证书: {cert_file}")
             logger.info(f"  - 中间证书链: {chain_file}")
-            logger.info(f"  - 私钥: {cert_path / 'privkey.pem'}")
+            logger.info(f"  - 私钥: {key_file}")
+            for bundle_file in bundles:
+                logger.info(f"  - 证书包: {bundle_file}")
 
             return True
 
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+配置加载基准测试
+生成包含大量域名的配置文件，比较 yaml.safe_load、编译（无缓存）和读取编译缓存的耗时
+
+用法:
+    python -m benchmarks.bench_config
+    python -m benchmarks.bench_config --domains 20000 --subdomains 5
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from config_loader import load_compiled, yaml_loader
+
+
+def build_config(domains: int, subdomains: int) -> str:
+    lines = [
+        'letsencrypt:',
+        '  email: "bench@example.com"',
+        'dnsla:',
+        '  api_id: "id"',
+        '  api_secret: "secret"',
+        'domains:',
+    ]
+    for i in range(domains):
+        lines.append(f'  - domain: "zone{i}.example.com"')
+        lines.append(f'    domain_id: "{85369994254488576 + i}"')
+        lines.append('    subdomains:')
+        lines.extend(f'      - "host{j}"' for j in range(subdomains))
+    return '\n'.join(lines) + '\n'
+
+
+def timed(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='配置加载基准测试')
+    parser.add_argument('--domains', type=int, default=10000, help='域名配置数量')
+    parser.add_argument('--subdomains', type=int, default=5, help='每个域名的子域名数量')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数（取中位数）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = Path(workdir) / 'config.yaml'
+        path.write_text(build_config(args.domains, args.subdomains))
+        print(f"配置文件: {path.stat().st_size / 1024 / 1024:.2f} MiB, YAML加载器: {yaml_loader().__name__}")
+
+        results = {
+            'yaml.safe_load': timed(lambda: yaml.safe_load(path.read_text()), args.repeat),
+            '编译（无缓存）': timed(lambda: load_compiled(str(path), cache_file=''), args.repeat),
+        }
+        load_compiled(str(path))
+        results['编译缓存'] = timed(lambda: load_compiled(str(path)), args.repeat)
+
+        for name, seconds in results.items():
+            print(f"  {name:<16} {seconds * 1000:>9.1f} ms")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
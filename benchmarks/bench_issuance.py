@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+离线颁发基准测试
+使用本地DNS.LA模拟服务器和进程内ACME桩，测量不同批量下的
+颁发吞吐量、单订单延迟、API调用次数和内存占用
+
+用法:
+    python -m benchmarks.bench_issuance
+    python -m benchmarks.bench_issuance --sizes 1 10 100 --output result.json
+    python -m benchmarks.bench_issuance --compare result.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from benchmarks.fake_dnsla import FakeDNSLAServer
+from cert_manager import CertificateManager
+from dnsla_client import DNSLAClient
+
+BASE_DOMAIN = 'bench.example.com'
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_batch(size: int, args, ca: StubCA) -> Dict:
+    """颁发一批证书并收集统计数据"""
+    workdir = Path(tempfile.mkdtemp(prefix='bench-'))
+    try:
+        with FakeDNSLAServer(latency=args.dns_latency, error_rate=args.error_rate,
+                             max_page_size=args.page_size, seed=args.seed) as dns_server:
+            domain_id = dns_server.add_domain(BASE_DOMAIN)
+            acme_server = StubACMEServer(dns_server.resolve_txt, latency=args.acme_latency, ca=ca, seed=args.seed)
+            acme = StubACMEClient(acme_server, str(workdir / 'accounts'))
+            dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+            manager = CertificateManager(dns, acme, BASE_DOMAIN, domain_id, propagation_seconds=0)
+
+            latencies = []
+            failures = 0
+            tracemalloc.start()
+            start = time.perf_counter()
+            for i in range(size):
+                domains = [f'site{i}.{BASE_DOMAIN}'] + [f'alt{j}.site{i}.{BASE_DOMAIN}' for j in range(args.sans - 1)]
+                order_start = time.perf_counter()
+                if manager.issue_certificate(domains, cert_dir=str(workdir / 'certs'), key_size=args.key_size) is None:
+                    failures += 1
+                latencies.append(time.perf_counter() - order_start)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            return {
+                'size': size,
+                'failures': failures,
+                'elapsed_seconds': round(elapsed, 4),
+                'throughput_per_second': round(size / elapsed, 3) if elapsed else 0.0,
+                'latency_p50_seconds': round(_percentile(latencies, 50), 4),
+                'latency_p95_seconds': round(_percentile(latencies, 95), 4),
+                'latency_max_seconds': round(max(latencies), 4),
+                'dnsla_calls': {f'{method} {path}': count for (method, path), count in sorted(dns_server.calls.items())},
+                'dnsla_calls_per_order': round(sum(dns_server.calls.values()) / size, 2),
+                'acme_calls': dict(sorted(acme_server.calls.items())),
+                'leftover_records': dns_server.record_count(),
+                'peak_traced_memory_bytes': peak,
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(current: Dict, baseline: Dict) -> None:
+    """打印与基线结果的对比"""
+    baseline_by_size = {batch['size']: batch for batch in baseline['batches']}
+    keys = ['throughput_per_second', 'latency_p50_seconds', 'latency_p95_seconds',
+            'dnsla_calls_per_order', 'peak_traced_memory_bytes']
+    print("\n与基线对比:")
+    for batch in current['batches']:
+        base = baseline_by_size.get(batch['size'])
+        if not base:
+            continue
+        print(f"  批量 {batch['size']}:")
+        for key in keys:
+            old, new = base.get(key), batch.get(key)
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            print(f"    {key}: {old} -> {new} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线颁发基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000], help='批量大小')
+    parser.add_argument('--sans', type=int, default=2, help='每个证书的域名数量')
+    parser.add_argument('--key-size', type=int, default=2048, help='证书RSA密钥大小')
+    parser.add_argument('--dns-latency', type=float, default=0.0, help='DNS.LA模拟延迟（秒）')
+    parser.add_argument('--acme-latency', type=float, default=0.0, help='ACME模拟延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='DNS.LA错误注入概率')
+    parser.add_argument('--page-size', type=int, default=100, help='DNS.LA单页最大记录数')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('-o', '--output', help='结果JSON输出文件')
+    parser.add_argument('--compare', help='与之前的结果JSON对比')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    ca = StubCA()
+    result = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'batches': [],
+    }
+
+    for size in args.sizes:
+        batch = run_batch(size, args, ca)
+        result['batches'].append(batch)
+        print(f"批量 {size:>5}: {batch['throughput_per_second']:>8} 证书/秒, "
+              f"p50 {batch['latency_p50_seconds']}s, p95 {batch['latency_p95_seconds']}s, "
+              f"{batch['dnsla_calls_per_order']} 次DNS.LA调用/订单, 失败 {batch['failures']}")
+
+    result['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+工作队列扩展性基准测试
+用模拟耗时的续期任务（ACME和DNS.LA等待）测量不同工作节点数下的吞吐量，
+每个工作节点是一个独立线程，与队列的交互走同一个SQLite文件
+
+用法:
+    python -m benchmarks.bench_queue
+    python -m benchmarks.bench_queue --jobs 400 --zones 40 --workers 1 2 4 8 -o queue.json
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from work_queue import SQLiteWorkQueue, Worker
+
+
+class SleepingManager:
+    """续期耗时固定的证书管理器替身"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def renew_certificate(self, domains, cert_dir, key_size, renew_days):
+        time.sleep(self.latency)
+        return Path(cert_dir) / domains[0]
+
+    def flush_deploy_hooks(self):
+        return {}
+
+
+def run(workers: int, args) -> float:
+    """所有任务完成的耗时（秒）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteWorkQueue(str(Path(tmp) / 'queue.db'), steal_after=args.steal_after)
+        for i in range(args.jobs):
+            zone = f'zone{i % args.zones}.example'
+            queue.enqueue([f'site{i}.{zone}'], zone)
+        # 先登记所有节点，避免最先启动的节点领走全部分片
+        for n in range(workers):
+            queue.heartbeat(f'worker-{n}')
+
+        stop = threading.Event()
+        threads = []
+        for n in range(workers):
+            worker = Worker(queue, SleepingManager(args.latency), f'worker-{n}', tmp, batch_size=args.batch)
+            threads.append(threading.Thread(target=worker.run, args=(stop, 0.05)))
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while queue.stats()['done'] < args.jobs:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='工作队列扩展性基准测试')
+    parser.add_argument('--jobs', type=int, default=200, help='任务数')
+    parser.add_argument('--zones', type=int, default=40, help='托管域名数（分片键）')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='工作节点数')
+    parser.add_argument('--latency', type=float, default=0.05, help='单个任务的模拟耗时（秒）')
+    parser.add_argument('--batch', type=int, default=5, help='每次领取的任务数')
+    parser.add_argument('--steal-after', type=float, default=1.0,
+                        help='空闲节点领取其他分片任务前的等待时间（秒，负数表示不领取）')
+    parser.add_argument('-o', '--output', help='结果JSON输出文件')
+    args = parser.parse_args()
+    if args.steal_after < 0:
+        args.steal_after = None
+
+    results = {}
+    for workers in args.workers:
+        elapsed = run(workers, args)
+        results[workers] = {'seconds': round(elapsed, 3), 'jobs_per_second': round(args.jobs / elapsed, 1)}
+    base = results[args.workers[0]]['jobs_per_second'] / args.workers[0]
+    for workers, result in results.items():
+        print(f"{workers:>3} 个工作节点  {result['seconds']:>7.2f} 秒  {result['jobs_per_second']:>7.1f} 任务/秒  "
+              f"扩展效率 {result['jobs_per_second'] / (base * workers):.0%}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'jobs': args.jobs, 'zones': args.zones, 'latency': args.latency, 'results': results},
+                      f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+记录遍历内存基准测试
+比较逐页累积原始字典（get_record_list）和逐条遍历精简记录（iter_records）
+在扫描大量记录时的峰值内存
+
+用法:
+    python -m benchmarks.bench_records
+    python -m benchmarks.bench_records --records 50000 --zones 4
+"""
+
+import argparse
+import logging
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from benchmarks.fake_dnsla import FakeDNSLAServer, TXT_TYPE
+import dnsla_client
+from dnsla_client import DNSLAClient
+
+
+def measure(name: str, func: Callable[[], int]) -> Dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} {count:>8} 条  {elapsed:>7.2f}s  峰值 {peak / 1024 / 1024:>8.2f} MiB")
+    return {'records': count, 'elapsed_seconds': elapsed, 'peak_traced_memory_bytes': peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='记录遍历内存基准测试')
+    parser.add_argument('--records', type=int, default=20000, help='记录总数')
+    parser.add_argument('--zones', type=int, default=4, help='托管域名数量')
+    parser.add_argument('--page-size', type=int, default=500, help='每页记录数')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    with FakeDNSLAServer(max_page_size=args.page_size) as server:
+        zone_ids = [server.add_domain(f'zone{i}.example.com') for i in range(args.zones)]
+        for i in range(args.records):
+            server.add_record(zone_ids[i % args.zones], TXT_TYPE, f'host{i}', f'value-{i:08d}' * 4)
+
+        client = DNSLAClient('test-id', 'test-secret', base_url=server.base_url)
+
+        def accumulate_dicts() -> int:
+            records = []
+            for zone_id in zone_ids:
+                page_index = 1
+                while True:
+                    page = client.get_record_list(zone_id, page_index=page_index, page_size=args.page_size)
+                    records.extend(page)
+                    if len(page) < args.page_size:
+                        break
+                    page_index += 1
+            return len(records)
+
+        def stream_records() -> int:
+            return sum(1 for zone_id in zone_ids for _ in client.iter_records(zone_id, page_size=args.page_size))
+
+        def collect_records() -> int:
+            return len([r for zone_id in zone_ids for r in client.iter_records(zone_id, page_size=args.page_size)])
+
+        measure('get_record_list (dict)', accumulate_dicts)
+        measure('iter_records (流式遍历)', stream_records)
+        measure('iter_records (全部保留)', collect_records)
+        if dnsla_client.ijson is None:
+            print("提示: 未安装 ijson，iter_records 按页整体解析")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+命令行冷启动基准测试
+在新的Python进程中运行各子命令，测量启动耗时，并用 -X importtime
+检查是否导入了不需要的重量级依赖
+
+用法:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --repeat 20 -o startup.json
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.fake_acme import StubCA
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 只读命令不应导入的模块
+HEAVY_MODULES = ('acme', 'josepy', 'requests', 'cert_manager', 'dnsla_client')
+
+CONFIG = """
+letsencrypt:
+  email: "bench@example.com"
+  cert_dir: "{cert_dir}"
+  account_dir: "{workdir}/accounts"
+  history_file: "{workdir}/history.json"
+dnsla:
+  api_id: "id"
+  api_secret: "secret"
+domains:
+  - domain: "example.com"
+    domain_id: "1"
+    subdomains: ["@", "www"]
+"""
+
+# 子命令 -> 命令行参数（均不访问网络）
+COMMANDS = {
+    'help': ['--help'],
+    'issue --help': ['issue', '--help'],
+    'info': ['info'],
+    'list': ['list'],
+    'plan': ['plan'],
+    'metrics': ['metrics'],
+}
+
+
+def write_fixture(workdir: Path) -> Path:
+    """生成配置文件和一个证书，供 info/list/metrics 读取"""
+    cert_dir = workdir / 'certs'
+    (cert_dir / 'example.com').mkdir(parents=True)
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    csr = (x509.CertificateSigningRequestBuilder()
+           .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'example.com')]))
+           .add_extension(x509.SubjectAlternativeName([x509.DNSName('example.com')]), critical=False)
+           .sign(key, hashes.SHA256()))
+    fullchain = StubCA().issue(csr)
+    (cert_dir / 'example.com' / 'cert.pem').write_text(fullchain.split('\n\n')[0] + '\n')
+    (cert_dir / 'example.com' / 'privkey.pem').write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+    config = workdir / 'config.yaml'
+    config.write_text(CONFIG.format(cert_dir=cert_dir, workdir=workdir))
+    return config
+
+
+def run(args: List[str], workdir: Path, importtime: bool = False) -> subprocess.CompletedProcess:
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [str(ROOT / 'main.py')] + args
+    return subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+
+
+def imported_modules(stderr: str) -> List[str]:
+    """解析 -X importtime 输出中的顶层模块名"""
+    modules = set()
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            modules.add(name.split('.')[0])
+    return sorted(modules)
+
+
+def measure(name: str, args: List[str], config: Path, workdir: Path, repeat: int) -> Dict:
+    full_args = ['-c', str(config)] + args
+    run(full_args, workdir)  # 预热（生成字节码和配置缓存）
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run(full_args, workdir)
+        samples.append(time.perf_counter() - start)
+
+    modules = imported_modules(run(full_args, workdir, importtime=True).stderr)
+    heavy = [module for module in HEAVY_MODULES if module in modules]
+    return {
+        'command': name,
+        'returncode': result.returncode,
+        'median_seconds': round(statistics.median(samples), 4),
+        'min_seconds': round(min(samples), 4),
+        'modules': len(modules),
+        'heavy_modules': heavy,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='命令行冷启动基准测试')
+    parser.add_argument('--repeat', type=int, default=10, help='每个命令的运行次数')
+    parser.add_argument('--commands', nargs='+', choices=sorted(COMMANDS), help='只测量指定命令')
+    parser.add_argument('-o', '--output', help='结果JSON输出文件')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        config = write_fixture(workdir)
+        for name in args.commands or COMMANDS:
+            result = measure(name, COMMANDS[name], config, workdir, args.repeat)
+            results.append(result)
+            heavy = ', '.join(result['heavy_modules']) or '-'
+            print(f"{name:<14} {result['median_seconds'] * 1000:>8.1f} ms  "
+                  f"{result['modules']:>4} 个顶层模块  重量级依赖: {heavy}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+TLS端点验证基准测试
+启动一组本地端点（HTTPS、MySQL、PostgreSQL，带模拟网络延迟），
+比较逐个验证与并发验证的总耗时
+
+用法:
+    python -m benchmarks.bench_verify
+    python -m benchmarks.bench_verify --endpoints 300 --delay 0.05 -o verify.json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fake_acme import StubCA
+from benchmarks.fake_tls import FakeTLSFleet, make_certificate
+from tls_verify import CertificateInventory, Endpoint, verify_endpoints
+
+PROTOCOLS = ('https', 'mysql', 'postgres')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TLS端点验证基准测试')
+    parser.add_argument('--endpoints', type=int, default=90, help='端点数量')
+    parser.add_argument('--delay', type=float, default=0.05, help='每个端点握手前的模拟延迟（秒）')
+    parser.add_argument('--concurrency', type=int, default=100, help='并发验证的最大连接数')
+    parser.add_argument('-o', '--output', help='结果JSON输出文件')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_dir = Path(tmp) / 'certs'
+        cert_file, key_file, _ = make_certificate(StubCA(), ['localhost'], cert_dir / 'localhost')
+        inventory = CertificateInventory.from_cert_dir(str(cert_dir))
+
+        with FakeTLSFleet() as fleet:
+            endpoints = []
+            for i in range(args.endpoints):
+                url = fleet.add(PROTOCOLS[i % len(PROTOCOLS)], cert_file, key_file, delay=args.delay)
+                endpoints.append(Endpoint(url, server_name='localhost'))
+
+            results = {}
+            for name, concurrency in (('sequential', 1), ('concurrent', args.concurrency)):
+                start = time.perf_counter()
+                verified = verify_endpoints(endpoints, inventory, timeout=10,
+                                            concurrency=concurrency, verify_chain=False)
+                elapsed = time.perf_counter() - start
+                failed = [result for result in verified if not result.ok]
+                latencies = [result.latency for result in verified if result.latency is not None]
+                results[name] = {
+                    'seconds': round(elapsed, 3),
+                    'failed': len(failed),
+                    'handshake_p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+                }
+                print(f"{name:<12} {elapsed:>7.2f} 秒  失败 {len(failed)}  "
+                      f"握手中位数 {results[name]['handshake_p50_ms']} ms")
+
+    speedup = results['sequential']['seconds'] / max(results['concurrent']['seconds'], 1e-9)
+    print(f"\n{args.endpoints} 个端点，并发验证加速 {speedup:.1f} 倍")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'endpoints': args.endpoints, 'delay': args.delay, 'results': results}, f, indent=2)
+        print(f"结果已保存到: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+进程内ACME服务器桩
+实现 ACMEClient 用到的 ClientV2 子集（new_order / answer_challenge /
+poll_and_finalize / revoke），通过回调查询TXT记录完成DNS-01验证，
+并使用本地CA签发真实的X.509证书
+"""
+
+import hashlib
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import josepy as jose
+from acme import challenges, errors, messages
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import AuthorityInformationAccessOID, NameOID
+
+from acme_client import ACMEClient
+
+
+class StubCA:
+    """本地根证书 + 中间证书，用于签发测试证书"""
+
+    def __init__(self, validity_days: int = 90, ocsp_url: Optional[str] = None):
+        self.validity_days = validity_days
+        # 设置后签发的证书带AIA扩展（OCSP地址）
+        self.ocsp_url = ocsp_url
+        now = datetime.now(timezone.utc)
+
+        self.root_key = ec.generate_private_key(ec.SECP256R1())
+        root_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Stub Root CA')])
+        self.root_cert = self._build(root_name, root_name, self.root_key.public_key(),
+                                     self.root_key, now, 3650, ca=True)
+
+        self.intermediate_key = ec.generate_private_key(ec.SECP256R1())
+        intermediate_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Stub Intermediate E1')])
+        self.intermediate_cert = self._build(intermediate_name, root_name, self.intermediate_key.public_key(),
+                                             self.root_key, now, 1825, ca=True)
+
+    @staticmethod
+    def _build(subject, issuer, public_key, signing_key, now, days, ca=False, sans=None, ocsp_url=None):
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(subject)
+            .issuer_name(issuer)
+            .public_key(public_key)
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(minutes=5))
+            .not_valid_after(now + timedelta(days=days))
+            .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+        )
+        if sans:
+            builder = builder.add_extension(x509.SubjectAlternativeName(sans), critical=False)
+        if ocsp_url:
+            builder = builder.add_extension(x509.AuthorityInformationAccess([x509.AccessDescription(
+                AuthorityInformationAccessOID.OCSP, x509.UniformResourceIdentifier(ocsp_url))]), critical=False)
+        return builder.sign(signing_key, hashes.SHA256())
+
+    def issue(self, csr: x509.CertificateSigningRequest) -> str:
+        """根据CSR签发证书，返回与Let's Encrypt格式一致的fullchain PEM"""
+        sans = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        leaf = self._build(
+            csr.subject, self.intermediate_cert.subject, csr.public_key(), self.intermediate_key,
+            datetime.now(timezone.utc), self.validity_days, sans=list(sans), ocsp_url=self.ocsp_url
+        )
+        blocks = [cert.public_bytes(serialization.Encoding.PEM).decode().strip()
+                  for cert in (leaf, self.intermediate_cert)]
+        return '\n\n'.join(blocks) + '\n'
+
+
+class StubACMEServer:
+    """
+    ACME服务器桩（替代 acme.client.ClientV2）
+
+    验证时调用 resolver(完整验证域名) 获取TXT记录值，
+    例如 FakeDNSLAServer.resolve_txt。可以按账户限制订单数以模拟 rateLimited 错误。
+    通过验证的授权按账户复用（与Let's Encrypt一样，后续订单中直接为valid）。
+    """
+
+    def __init__(
+            self,
+            resolver: Callable[[str], List[str]],
+            latency: float = 0.0,
+            ca: Optional[StubCA] = None,
+            seed: int = 0,
+            orders_per_account: Optional[int] = None,
+            retry_after: float = 60
+    ):
+        """
+        Args:
+            resolver: TXT记录查询函数
+            latency: 每次ACME调用的模拟延迟（秒）
+            ca: 签发证书使用的CA（默认新建）
+            seed: 生成挑战token的随机数种子
+            orders_per_account: 每个账户允许的订单数，超出后返回 rateLimited（默认不限制）
+            retry_after: rateLimited 错误附带的Retry-After（秒）
+        """
+        self.resolver = resolver
+        self.latency = latency
+        self.ca = ca or StubCA()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        # 挑战URL -> 状态
+        self.challenge_status: Dict[str, messages.Status] = {}
+        # 挑战URL -> 验证域名（_acme-challenge.<identifier>）
+        self.challenge_names: Dict[str, str] = {}
+        self.orders_per_account = orders_per_account
+        self.retry_after = retry_after
+        # 挑战URL -> (账户, 标识, 是否通配符)
+        self.challenge_owners: Dict[str, tuple] = {}
+        # 已通过验证的 (账户, 标识, 是否通配符)，之后的订单直接复用
+        self.valid_authorizations: set = set()
+        self.calls: Counter = Counter()
+        # 账户 -> 成功创建的订单数
+        self.account_orders: Counter = Counter()
+        self.revoked: List[int] = []
+        # 证书序列号 -> 颁发账户（与Let's Encrypt一样，其他账户无权吊销）
+        self.issued_by: Dict[int, str] = {}
+        # 接下来这么多次吊销请求返回错误
+        self.fail_revocations = 0
+
+    def _call(self, name: str) -> None:
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def new_order(self, csr_pem: bytes, account: str = '') -> messages.OrderResource:
+        self._call('new_order')
+        with self._lock:
+            if self.orders_per_account is not None and self.account_orders[account] >= self.orders_per_account:
+                raise messages.Error.with_code('rateLimited', detail='too many new orders for this account')
+            self.account_orders[account] += 1
+        csr = x509.load_pem_x509_csr(csr_pem)
+        names = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName).value.get_values_for_type(x509.DNSName)
+
+        authorizations = []
+        with self._lock:
+            order_id = next(self._ids)
+            for name in names:
+                wildcard = name.startswith('*.')
+                identifier = name[2:] if wildcard else name
+                token = bytes(self._random.getrandbits(8) for _ in range(32))
+                url = f'https://acme.stub/chall/{order_id}/{next(self._ids)}'
+                owner = (account, identifier, wildcard)
+                status = messages.STATUS_VALID if owner in self.valid_authorizations else messages.STATUS_PENDING
+                self.challenge_status[url] = status
+                self.challenge_names[url] = f'_acme-challenge.{identifier}'
+                self.challenge_owners[url] = owner
+                challenge = messages.ChallengeBody(
+                    chall=challenges.DNS01(token=token),
+                    _url=url,
+                    status=status,
+                )
+                authz = messages.Authorization(
+                    identifier=messages.Identifier(typ=messages.IDENTIFIER_FQDN, value=identifier),
+                    challenges=[challenge],
+                    status=status,
+                    wildcard=wildcard or None,
+                )
+                authorizations.append(messages.AuthorizationResource(
+                    body=authz, uri=f'https://acme.stub/authz/{order_id}/{len(authorizations)}'))
+
+        body = messages.Order(
+            identifiers=[messages.Identifier(typ=messages.IDENTIFIER_FQDN, value=name) for name in names],
+            status=messages.STATUS_PENDING,
+        )
+        return messages.OrderResource(body=body, uri=f'https://acme.stub/order/{order_id}',
+                                      authorizations=authorizations, csr_pem=csr_pem)
+
+    def answer_challenge(self, challb: messages.ChallengeBody, response: challenges.DNS01Response):
+        """检查TXT记录并立即给出验证结果"""
+        self._call('answer_challenge')
+        key_authorization = response.key_authorization
+        if not key_authorization.startswith(challb.chall.encode('token') + '.'):
+            status = messages.STATUS_INVALID
+        else:
+            expected = jose.b64encode(hashlib.sha256(key_authorization.encode()).digest()).decode()
+            values = self.resolver(self.challenge_names[challb.uri])
+            status = messages.STATUS_VALID if expected in values else messages.STATUS_INVALID
+        with self._lock:
+            self.challenge_status[challb.uri] = status
+            if status == messages.STATUS_VALID:
+                self.valid_authorizations.add(self.challenge_owners[challb.uri])
+        return challb.update(status=status)
+
+    def poll_and_finalize(self, orderr: messages.OrderResource, deadline=None,
+                          account: str = '') -> messages.OrderResource:
+        self._call('poll_and_finalize')
+        statuses = [self.challenge_status.get(challb.uri)
+                    for authz in orderr.authorizations for challb in authz.body.challenges]
+        # 与 acme 库一致：ValidationError 只携带验证失败的授权
+        failed = [authz.update(body=authz.body.update(status=messages.STATUS_INVALID))
+                  for authz in orderr.authorizations
+                  if any(self.challenge_status.get(challb.uri) == messages.STATUS_INVALID
+                         for challb in authz.body.challenges)]
+        if failed:
+            raise errors.ValidationError(failed)
+        if not all(status == messages.STATUS_VALID for status in statuses):
+            return orderr
+
+        csr = x509.load_pem_x509_csr(orderr.csr_pem)
+        fullchain_pem = self.ca.issue(csr)
+        with self._lock:
+            self.issued_by[x509.load_pem_x509_certificate(fullchain_pem.encode()).serial_number] = account
+        return orderr.update(body=orderr.body.update(status=messages.STATUS_VALID), fullchain_pem=fullchain_pem)
+
+    def revoke(self, cert, reason: int, account: str = '') -> None:
+        self._call('revoke')
+        with self._lock:
+            if self.issued_by.get(cert.serial_number, account) != account:
+                raise messages.Error.with_code('unauthorized', detail='account is not authorized to revoke')
+            if self.fail_revocations > 0:
+                self.fail_revocations -= 1
+                raise messages.Error(typ='urn:ietf:params:acme:error:serverInternal', detail='stub failure')
+            if cert.serial_number in self.revoked:
+                raise messages.Error(typ='urn:ietf:params:acme:error:alreadyRevoked',
+                                     detail='Certificate already revoked')
+            self.revoked.append(cert.serial_number)
+
+
+class StubAccountSession:
+    """
+    单个账户与 StubACMEServer 的会话
+
+    new_order 带上账户标识，使服务器桩可以按账户限速；颁发和吊销同样带上账户标识，
+    其他账户吊销时返回 unauthorized；
+    被限速时与 TracingClientNetwork 一样在 net.retry_after 中给出Retry-After。
+    """
+
+    def __init__(self, server: StubACMEServer, account: str):
+        self.server = server
+        self.account = account
+        self.net = SimpleNamespace(retry_after=None)
+
+    def new_order(self, csr_pem: bytes) -> messages.OrderResource:
+        self.net.retry_after = None
+        try:
+            return self.server.new_order(csr_pem, account=self.account)
+        except messages.Error:
+            self.net.retry_after = self.server.retry_after
+            raise
+
+    def poll_and_finalize(self, orderr: messages.OrderResource, deadline=None) -> messages.OrderResource:
+        return self.server.poll_and_finalize(orderr, deadline, account=self.account)
+
+    def revoke(self, cert, reason: int) -> None:
+        self.server.revoke(cert, reason, account=self.account)
+
+    def __getattr__(self, name):
+        return getattr(self.server, name)
+
+
+class StubACMEClient(ACMEClient):
+    """
+    连接 StubACMEServer 的 ACMEClient
+
+    除账户注册外，CSR生成、挑战数据计算、轮询和证书保存都走 ACMEClient 的真实代码。
+    """
+
+    def __init__(self, server: StubACMEServer, account_dir: str, email: str = 'bench@example.com'):
+        self.stub_server = server
+        super().__init__(email=email, account_dir=account_dir, staging=True, poll_interval=0)
+
+    def _create_acme_client(self) -> StubAccountSession:
+        return StubAccountSession(self.stub_server, str(self.account_dir))
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+本地DNS.LA API模拟服务器
+按照 dns/*.md 文档实现域名和解析记录接口，支持延迟、分页和错误注入；
+FakeNameserver 以UDP权威DNS服务器的形式提供同一份记录，可模拟记录生效延迟
+"""
+
+import base64
+import itertools
+import json
+import random
+import socket
+import struct
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+# 记录类型编号（与 DNSLAClient.RECORD_TYPES 对应）
+CNAME_TYPE = 5
+TXT_TYPE = 16
+
+
+class FakeDNSLAServer:
+    """
+    DNS.LA API模拟服务器
+
+    用法:
+        with FakeDNSLAServer(api_id='id', api_secret='secret') as server:
+            server.add_domain('example.com')
+            client = DNSLAClient('id', 'secret', base_url=server.base_url)
+    """
+
+    def __init__(
+            self,
+            api_id: str = 'test-id',
+            api_secret: str = 'test-secret',
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            max_page_size: int = 100,
+            seed: int = 0,
+            visibility_delay: float = 0.0,
+            min_ttl: int = 1
+    ):
+        """
+        Args:
+            api_id: 期望的API ID
+            api_secret: 期望的API Secret
+            latency: 每个请求的模拟延迟（秒）
+            error_rate: 随机返回业务错误（code 500）的概率
+            max_page_size: 单页最大记录数，超出时截断
+            seed: 随机数种子（保证多次运行结果可比较）
+            visibility_delay: 新记录在权威DNS查询（authoritative_txt）中可见前的延迟（秒）
+            min_ttl: 允许的最小TTL，低于该值的添加请求返回错误
+        """
+        self.token = base64.b64encode(f"{api_id}:{api_secret}".encode()).decode()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_page_size = max_page_size
+        self.visibility_delay = visibility_delay
+        self.min_ttl = min_ttl
+        self._random = random.Random(seed)
+        self._ids = itertools.count(85369994254488576)
+        self._lock = threading.Lock()
+
+        # 域名ID -> 域名
+        self.domains: Dict[str, str] = {}
+        # 域名ID -> {记录ID -> 记录}
+        self.records: Dict[str, Dict[str, Dict]] = {}
+        # 记录ID -> 添加时间（time.monotonic）
+        self._created: Dict[str, float] = {}
+        # (HTTP方法, 路径) -> 调用次数
+        self.calls: Counter = Counter()
+        # (HTTP方法, 路径) -> 剩余需要注入的错误次数
+        self._fail_next: Counter = Counter()
+
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeDNSLAServer':
+        handler = type('FakeDNSLAHandler', (_Handler,), {'backend': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-dnsla', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    # ------------------------------------------------------------------
+    # 测试辅助
+    # ------------------------------------------------------------------
+
+    def _next_id(self) -> str:
+        return str(next(self._ids))
+
+    def add_domain(self, domain: str) -> str:
+        """直接添加托管域名，返回域名ID"""
+        with self._lock:
+            domain_id = self._next_id()
+            self.domains[domain_id] = domain
+            self.records[domain_id] = {}
+        return domain_id
+
+    def add_record(self, domain_id: str, record_type: int, host: str, data: str, ttl: int = 600) -> str:
+        """直接添加解析记录（不计入调用次数）"""
+        with self._lock:
+            return self._insert_record(domain_id, record_type, host, data, ttl)
+
+    def _insert_record(self, domain_id: str, record_type: int, host: str, data: str, ttl: int) -> str:
+        record_id = self._next_id()
+        now = int(time.time())
+        self._created[record_id] = time.monotonic()
+        self.records[domain_id][record_id] = {
+            'id': record_id,
+            'createdAt': now,
+            'updatedAt': now,
+            'domainId': domain_id,
+            'groupId': '',
+            'groupName': '',
+            'host': host,
+            'displayHost': host,
+            'type': record_type,
+            'lineId': '',
+            'lineCode': '',
+            'lineName': '',
+            'data': data,
+            'displayData': data,
+            'ttl': ttl,
+            'weight': 1,
+            'preference': 1,
+            'domaint': False,
+            'system': False,
+            'disable': False,
+        }
+        return record_id
+
+    def fail_next(self, method: str, path: str, times: int = 1) -> None:
+        """让接下来的若干次指定请求返回业务错误"""
+        self._fail_next[(method, path)] += times
+
+    def resolve_txt(self, fqdn: str, max_depth: int = 8) -> List[str]:
+        """
+        模拟递归DNS查询: 返回完整域名上的TXT记录值（跟随CNAME）
+
+        Args:
+            fqdn: 完整域名（如 _acme-challenge.www.example.com）
+            max_depth: 最多跟随的CNAME层数
+        """
+        fqdn = fqdn.rstrip('.')
+        with self._lock:
+            for _ in range(max_depth):
+                records = self._records_at(fqdn)
+                cname = [r['data'] for r in records if r['type'] == CNAME_TYPE]
+                if not cname:
+                    return [r['data'] for r in records if r['type'] == TXT_TYPE]
+                fqdn = cname[0].rstrip('.')
+        return []
+
+    def authoritative_txt(self, fqdn: str) -> List[str]:
+        """模拟权威服务器的TXT应答: 不跟随CNAME，只返回已过 visibility_delay 的记录"""
+        visible_before = time.monotonic() - self.visibility_delay
+        with self._lock:
+            return [r['data'] for r in self._records_at(fqdn.rstrip('.'))
+                    if r['type'] == TXT_TYPE and self._created.get(r['id'], 0) <= visible_before]
+
+    def _records_at(self, fqdn: str) -> List[Dict]:
+        """返回完整域名上所有启用的记录（取最长匹配的托管域名）"""
+        best = None
+        for domain_id, domain in self.domains.items():
+            if (fqdn == domain or fqdn.endswith('.' + domain)) and (best is None or len(domain) > len(best[1])):
+                best = (domain_id, domain)
+        if best is None:
+            return []
+        domain_id, domain = best
+        host = '@' if fqdn == domain else fqdn[:-(len(domain) + 1)]
+        return [r for r in self.records[domain_id].values() if r['host'] == host and not r['disable']]
+
+    def record_count(self) -> int:
+        with self._lock:
+            return sum(len(records) for records in self.records.values())
+
+    def reset_calls(self) -> None:
+        self.calls.clear()
+
+    # ------------------------------------------------------------------
+    # API实现
+    # ------------------------------------------------------------------
+
+    def handle(self, method: str, path: str, params: Dict, body: Dict) -> Dict:
+        """处理一次API调用，返回响应JSON"""
+        self.calls[(method, path)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self._fail_next[(method, path)] > 0:
+            self._fail_next[(method, path)] -= 1
+            return {'code': 500, 'msg': 'injected error', 'data': None}
+        if self.error_rate and self._random.random() < self.error_rate:
+            return {'code': 500, 'msg': 'injected error', 'data': None}
+
+        route = getattr(self, f"_api_{method.lower()}_{path.strip('/').replace('/', '_')}", None)
+        if route is None:
+            return {'code': 400, 'msg': f'unknown endpoint {method} {path}', 'data': None}
+
+        with self._lock:
+            try:
+                return {'code': 200, 'msg': '', 'data': route(params, body)}
+            except (KeyError, ValueError) as e:
+                return {'code': 400, 'msg': f'bad request: {e}', 'data': None}
+
+    def _api_get_api_domain(self, params, body):
+        name = params.get('domain')
+        domain_id = params.get('id')
+        for candidate_id, domain in self.domains.items():
+            if candidate_id == domain_id or domain == name:
+                return {'id': candidate_id, 'domain': domain, 'displayDomain': domain}
+        raise KeyError('domain not found')
+
+    def _api_post_api_domain(self, params, body):
+        domain_id = self._next_id()
+        self.domains[domain_id] = body['domain']
+        self.records[domain_id] = {}
+        return {'id': domain_id}
+
+    def _api_delete_api_domain(self, params, body):
+        domain_id = params['id']
+        del self.domains[domain_id]
+        del self.records[domain_id]
+        return None
+
+    def _api_get_api_recordList(self, params, body):
+        page_index = int(params['pageIndex'])
+        page_size = min(int(params['pageSize']), self.max_page_size)
+        records = self.records[params['domainId']].values()
+
+        if 'type' in params:
+            records = [r for r in records if r['type'] == int(params['type'])]
+        if 'host' in params:
+            records = [r for r in records if r['host'] == params['host']]
+        if 'data' in params:
+            records = [r for r in records if r['data'] == params['data']]
+        records = list(records)
+
+        start = (page_index - 1) * page_size
+        return {'total': len(records), 'results': records[start:start + page_size]}
+
+    def _api_post_api_record(self, params, body):
+        domain_id = body['domainId']
+        if domain_id not in self.records:
+            raise KeyError('domain not found')
+        if int(body['ttl']) < self.min_ttl:
+            raise ValueError(f'ttl must be at least {self.min_ttl}')
+        record_id = self._insert_record(domain_id, int(body['type']), body.get('host') or '@',
+                                        body['data'], int(body['ttl']))
+        return {'id': record_id}
+
+    def _find_record(self, record_id: str) -> Dict:
+        for records in self.records.values():
+            if record_id in records:
+                return records[record_id]
+        raise KeyError('record not found')
+
+    def _api_put_api_record(self, params, body):
+        record = self._find_record(body['id'])
+        for key in ('type', 'host', 'data', 'ttl'):
+            if key in body:
+                record[key] = body[key]
+        record['displayHost'] = record['host']
+        record['displayData'] = record['data']
+        record['updatedAt'] = int(time.time())
+        return None
+
+    def _api_delete_api_record(self, params, body):
+        record = self._find_record(params['id'])
+        del self.records[record['domainId']][record['id']]
+        return None
+
+    def _api_put_api_recordDisable(self, params, body):
+        record = self._find_record(body['id'])
+        record['disable'] = bool(body.get('disable', False))
+        return None
+
+
+class FakeNameserver:
+    """
+    UDP权威DNS服务器，只回答TXT查询
+
+    用法:
+        with FakeNameserver(dns_server) as nameserver:
+            query_txt(name, nameserver.host, port=nameserver.port)
+    """
+
+    def __init__(self, backend: FakeDNSLAServer):
+        self.backend = backend
+        self.queries = 0
+        self._socket: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self._socket.getsockname()[0]
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1]
+
+    def start(self) -> 'FakeNameserver':
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self._thread = threading.Thread(target=self._serve, name='fake-nameserver', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _serve(self):
+        sock = self._socket
+        while True:
+            try:
+                data, address = sock.recvfrom(512)
+            except OSError:
+                return
+            self.queries += 1
+            try:
+                sock.sendto(self._answer(data), address)
+            except (OSError, IndexError, struct.error):
+                continue
+
+    def _answer(self, query: bytes) -> bytes:
+        query_id = struct.unpack('!H', query[:2])[0]
+        labels, offset = [], 12
+        while query[offset]:
+            length = query[offset]
+            labels.append(query[offset + 1:offset + 1 + length].decode('ascii'))
+            offset += length + 1
+        question = query[12:offset + 5]
+
+        values = self.backend.authoritative_txt('.'.join(labels))
+        answers = b''
+        for value in values:
+            encoded = value.encode('utf-8')
+            chunks = b''.join(struct.pack('!B', len(encoded[i:i + 255])) + encoded[i:i + 255]
+                              for i in range(0, len(encoded), 255))
+            # 名称使用指向问题部分的压缩指针
+            answers += struct.pack('!HHHIH', 0xC00C, TXT_TYPE, 1, 60, len(chunks)) + chunks
+
+        flags = 0x8400 if values else 0x8403  # 权威应答；没有记录时返回NXDOMAIN
+        return struct.pack('!HHHHHH', query_id, flags, 1, len(values), 0, 0) + question + answers
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """HTTP层: 认证、参数解析和JSON编码"""
+
+    backend: FakeDNSLAServer = None
+    protocol_version = 'HTTP/1.1'
+
+    def _dispatch(self, method: str):
+        if self.headers.get('Authorization') != f'Basic {self.backend.token}':
+            self._send(401, {'code': 401, 'msg': 'unauthorized', 'data': None})
+            return
+
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        self._send(200, self.backend.handle(method, url.path, params, body))
+
+    def _send(self, status: int, payload: Dict):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+本地OCSP响应者
+在后台线程中运行HTTP服务，用 StubCA 的中间证书签名OCSP响应，用于测试 ocsp 模块
+
+用法:
+    with StubOCSPResponder(ca) as responder:
+        ca.ocsp_url = responder.url
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509 import ocsp
+
+from benchmarks.fake_acme import StubCA
+
+
+class StubOCSPResponder:
+    """
+    OCSP响应者
+
+    Attributes:
+        certificates: 可以应答的证书 {序列号: 证书}（由测试登记；未登记的证书应答 UNAUTHORIZED）
+        revoked: 已吊销的序列号
+        requests: 收到的请求数
+        delay: 每个请求的模拟延迟（秒）
+        validity: 响应有效期（thisUpdate 到 nextUpdate）
+        corrupt_signature: 返回签名被篡改的响应（测试签名校验）
+    """
+
+    def __init__(self, ca: StubCA, validity: timedelta = timedelta(days=7), delay: float = 0.0):
+        self.ca = ca
+        self.validity = validity
+        self.delay = delay
+        self.certificates: Dict[int, x509.Certificate] = {}
+        self.revoked = set()
+        self.requests = 0
+        self.corrupt_signature = False
+        self._lock = threading.Lock()
+
+        responder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                der = responder.respond(ocsp.load_der_ocsp_request(body))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/ocsp-response')
+                self.send_header('Content-Length', str(len(der)))
+                self.end_headers()
+                self.wfile.write(der)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def register(self, fullchain_file: str) -> x509.Certificate:
+        """登记证书（读取证书链中的服务器证书）"""
+        with open(fullchain_file, 'rb') as f:
+            cert = x509.load_pem_x509_certificates(f.read())[0]
+        self.certificates[cert.serial_number] = cert
+        return cert
+
+    def respond(self, request: ocsp.OCSPRequest, now: Optional[datetime] = None) -> bytes:
+        with self._lock:
+            self.requests += 1
+        if self.delay:
+            time.sleep(self.delay)
+        cert = self.certificates.get(request.serial_number)
+        if cert is None:
+            return ocsp.OCSPResponseBuilder.build_unsuccessful(
+                ocsp.OCSPResponseStatus.UNAUTHORIZED).public_bytes(serialization.Encoding.DER)
+
+        now = now or datetime.now(timezone.utc)
+        if request.serial_number in self.revoked:
+            status, revoked_at = ocsp.OCSPCertStatus.REVOKED, now - timedelta(hours=1)
+        else:
+            status, revoked_at = ocsp.OCSPCertStatus.GOOD, None
+        builder = (
+            ocsp.OCSPResponseBuilder()
+            .add_response(cert, self.ca.intermediate_cert, hashes.SHA1(), status,
+                          now - timedelta(minutes=1), now - timedelta(minutes=1) + self.validity,
+                          revoked_at, None)
+            .responder_id(ocsp.OCSPResponderEncoding.HASH, self.ca.intermediate_cert)
+        )
+        der = builder.sign(self.ca.intermediate_key, hashes.SHA256()).public_bytes(serialization.Encoding.DER)
+        if self.corrupt_signature:
+            signature = ocsp.load_der_ocsp_response(der).signature
+            der = der.replace(signature, signature[:-1] + bytes([signature[-1] ^ 1]))
+        return der
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+本地SSH替身
+接受与 ssh 相同形式的参数（选项、[user@]host、远程命令），在本机用 sh 执行远程命令，
+用于在没有SSH服务器的环境中测试证书分发
+
+用法（分发配置）:
+    ssh_command: ["python", "-m", "benchmarks.fake_ssh"]
+"""
+
+import os
+import subprocess
+import sys
+
+# 带参数的ssh选项
+OPTIONS_WITH_VALUE = {'-p', '-o', '-i', '-l', '-F', '-J'}
+
+
+def main(argv):
+    args = list(argv)
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option in OPTIONS_WITH_VALUE and args:
+            args.pop(0)
+    if len(args) < 2:
+        print("用法: fake_ssh [选项] [user@]host 命令", file=sys.stderr)
+        return 255
+    host, command = args[0], ' '.join(args[1:])
+    env = dict(os.environ, FAKE_SSH_HOST=host)
+    return subprocess.call(['sh', '-c', command], env=env)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+本地TLS端点模拟
+在后台线程中运行多个TLS服务端，支持直接TLS（HTTPS）和
+MySQL、PostgreSQL的STARTTLS握手，用于测试 tls_verify
+"""
+
+import socket
+import socketserver
+import ssl
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from benchmarks.fake_acme import StubCA
+from tls_verify import MYSQL_CLIENT_PROTOCOL_41, MYSQL_CLIENT_SECURE_CONNECTION, MYSQL_CLIENT_SSL
+
+
+def make_certificate(ca: StubCA, names: List[str], directory: Path) -> Tuple[str, str, int]:
+    """
+    用 StubCA 签发证书并写入 directory（fullchain.pem、privkey.pem）
+
+    Returns:
+        (证书链文件, 私钥文件, 序列号)
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    csr = (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, names[0])]))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(name) for name in names]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    fullchain = ca.issue(csr)
+    directory.mkdir(parents=True, exist_ok=True)
+    cert_file, key_file = directory / 'fullchain.pem', directory / 'privkey.pem'
+    cert_file.write_text(fullchain)
+    (directory / 'cert.pem').write_text(fullchain.split('\n\n')[0] + '\n')
+    key_file.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    serial = x509.load_pem_x509_certificate(fullchain.encode()).serial_number
+    return str(cert_file), str(key_file), serial
+
+
+def _mysql_handshake_packet(ssl_enabled: bool) -> bytes:
+    capabilities = MYSQL_CLIENT_PROTOCOL_41 | MYSQL_CLIENT_SECURE_CONNECTION
+    if ssl_enabled:
+        capabilities |= MYSQL_CLIENT_SSL
+    payload = (
+        b'\x0a' + b'8.0.0-fake\x00' + struct.pack('<I', 1) + b'12345678' + b'\x00'
+        + struct.pack('<H', capabilities & 0xffff) + b'\x2d' + struct.pack('<H', 2)
+        + struct.pack('<H', capabilities >> 16) + b'\x15' + b'\x00' * 10 + b'123456789012\x00'
+    )
+    return len(payload).to_bytes(3, 'little') + b'\x00' + payload
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    """只读取 size 字节（不能多读，之后的数据属于TLS握手）"""
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        data += chunk
+    return data
+
+
+class FakeTLSFleet:
+    """
+    一组本地TLS端点（每个端点一个线程化TCP服务器）
+
+    用法:
+        with FakeTLSFleet() as fleet:
+            url = fleet.add('postgres', cert_file, key_file)
+    """
+
+    def __init__(self):
+        self._servers: List[socketserver.ThreadingTCPServer] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def add(self, protocol: str, cert_file: str, key_file: str, delay: float = 0.0,
+            ssl_enabled: bool = True) -> str:
+        """
+        启动一个端点
+
+        Args:
+            protocol: https、mysql 或 postgres
+            cert_file: 证书链文件
+            key_file: 私钥文件
+            delay: TLS握手前的模拟延迟（秒）
+            ssl_enabled: 数据库端点是否声明支持SSL
+
+        Returns:
+            端点地址（如 postgres://127.0.0.1:54321）
+        """
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                sock = self.request
+                try:
+                    if delay:
+                        time.sleep(delay)
+                    if protocol == 'mysql':
+                        sock.sendall(_mysql_handshake_packet(ssl_enabled))
+                        if not ssl_enabled:
+                            return
+                        header = _recv_exactly(sock, 4)
+                        _recv_exactly(sock, int.from_bytes(header[:3], 'little'))
+                    elif protocol == 'postgres':
+                        _recv_exactly(sock, 8)
+                        sock.sendall(b'S' if ssl_enabled else b'N')
+                        if not ssl_enabled:
+                            return
+                    with context.wrap_socket(sock, server_side=True) as tls:
+                        # 等待客户端关闭连接
+                        tls.recv(1)
+                except (OSError, ssl.SSLError, ConnectionError):
+                    pass
+
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        self._servers.append(server)
+        return f"{protocol}://127.0.0.1:{server.server_address[1]}"
+
+
+def root_ca_file(ca: StubCA, directory: Path) -> str:
+    """把 StubCA 的根证书写入文件（用于 cafile）"""
+    path = directory / 'stub-root.pem'
+    path.write_bytes(ca.root_cert.public_bytes(serialization.Encoding.PEM))
+    return str(path)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+证书包格式
+颁发时在证书目录中预先生成下游系统需要的格式（PKCS#12、HAProxy合并PEM、DER），
+使用方不再需要在每次启动时转换；格式通过注册表扩展
+"""
+
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Mapping, Optional
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+from chain_store import to_pem
+from fsutil import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class BundleFormat:
+    """一种证书包格式"""
+
+    __slots__ = ('name', 'filename', 'mode', 'build')
+
+    def __init__(self, name: str, filename: str, mode: int, build: Callable[..., bytes]):
+        """
+        Args:
+            name: 格式名称（配置中使用）
+            filename: 证书目录中的文件名
+            mode: 文件权限（包含私钥的格式为0600）
+            build: build(名称, 服务器证书, 中间证书列表, 私钥, 选项) -> 文件内容
+        """
+        self.name = name
+        self.filename = filename
+        self.mode = mode
+        self.build = build
+
+
+# 格式名称 -> 格式
+FORMATS: Dict[str, BundleFormat] = {}
+
+
+def register_format(name: str, filename: str, mode: int = 0o644):
+    """
+    注册证书包格式的装饰器
+
+    用法:
+        @register_format('jks-pem', 'keystore.pem', mode=0o600)
+        def build_jks_pem(domain, cert, intermediates, private_key, options) -> bytes:
+            ...
+    """
+    def decorator(build: Callable[..., bytes]) -> Callable[..., bytes]:
+        FORMATS[name] = BundleFormat(name, filename, mode, build)
+        return build
+    return decorator
+
+
+def _private_pem(private_key) -> bytes:
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()
+    )
+
+
+@register_format('pkcs12', 'bundle.p12', mode=0o600)
+def build_pkcs12(domain: str, cert: x509.Certificate, intermediates: List[x509.Certificate],
+                 private_key, options: Mapping) -> bytes:
+    """PKCS#12（Java keystore、Windows等）；选项 pkcs12_password 设置密码，未设置时不加密"""
+    password = options.get('pkcs12_password')
+    encryption = (serialization.BestAvailableEncryption(password.encode('utf-8'))
+                  if password else serialization.NoEncryption())
+    return pkcs12.serialize_key_and_certificates(
+        domain.encode('utf-8'), private_key, cert, intermediates or None, encryption
+    )
+
+
+@register_format('haproxy', 'haproxy.pem', mode=0o600)
+def build_haproxy(domain: str, cert: x509.Certificate, intermediates: List[x509.Certificate],
+                  private_key, options: Mapping) -> bytes:
+    """HAProxy合并PEM（服务器证书、中间证书、私钥在同一文件中）"""
+    return to_pem([cert] + intermediates).encode('ascii') + _private_pem(private_key)
+
+
+@register_format('der', 'cert.der')
+def build_der(domain: str, cert: x509.Certificate, intermediates: List[x509.Certificate],
+              private_key, options: Mapping) -> bytes:
+    """DER编码的服务器证书（部分数据库驱动、嵌入式设备）"""
+    return cert.public_bytes(serialization.Encoding.DER)
+
+
+class BundleWriter:
+    """按配置的格式在证书目录中生成证书包文件"""
+
+    def __init__(self, formats: Iterable[str], options: Optional[Mapping] = None):
+        """
+        Args:
+            formats: 格式名称列表（见 FORMATS）
+            options: 格式选项（如 pkcs12_password）
+
+        Raises:
+            ValueError: 格式未注册
+        """
+        unknown = [name for name in formats if name not in FORMATS]
+        if unknown:
+            raise ValueError(f"不支持的证书包格式: {', '.join(unknown)}（可用: {', '.join(sorted(FORMATS))}）")
+        self.formats = [FORMATS[name] for name in formats]
+        self.options = dict(options or {})
+
+    @classmethod
+    def from_config(cls, certificate: Mapping) -> Optional['BundleWriter']:
+        """
+        根据 certificate 配置创建（未配置 bundle_formats 时返回None）
+
+        配置示例:
+            certificate:
+              bundle_formats: [pkcs12, haproxy, der]
+              pkcs12_password: "changeit"
+        """
+        formats = certificate.get('bundle_formats') or []
+        if not formats:
+            return None
+        return cls(formats, {'pkcs12_password': certificate.get('pkcs12_password')})
+
+    def write(self, cert_path: Path, cert: x509.Certificate, intermediates: List[x509.Certificate],
+              private_key) -> List[Path]:
+        """
+        生成所有格式（每个文件原子写入）
+
+        Returns:
+            写入的文件
+        """
+        written = []
+        for bundle_format in self.formats:
+            path = cert_path / bundle_format.filename
+            data = bundle_format.build(cert_path.name, cert, intermediates, private_key, self.options)
+            write_atomic(str(path), data, mode=bundle_format.mode)
+            written.append(path)
+        return written
+
+    def write_existing(self, cert_path: Path) -> List[Path]:
+        """为已有的证书目录生成（读取 fullchain.pem 和 privkey.pem）"""
+        certs = x509.load_pem_x509_certificates((cert_path / 'fullchain.pem').read_bytes())
+        private_key = serialization.load_pem_private_key((cert_path / 'privkey.pem').read_bytes(), password=None)
+        return self.write(cert_path, certs[0], certs[1:], private_key)
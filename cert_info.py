@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+证书信息
+读取和显示本地证书文件，只依赖cryptography，不需要创建DNS/ACME客户端
+"""
+
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+logger = logging.getLogger(__name__)
+
+
+def read_certificate_info(cert_file: str) -> Optional[Dict]:
+    """
+    读取证书文件并提取信息（不依赖DNS/ACME客户端）
+
+    Args:
+        cert_file: 证书文件路径
+
+    Returns:
+        证书信息字典
+    """
+    cert_path = Path(cert_file)
+    if not cert_path.exists():
+        logger.error(f"证书文件不存在: {cert_file}")
+        return None
+
+    try:
+        with open(cert_path, 'rb') as f:
+            cert_data = f.read()
+
+        cert = x509.load_pem_x509_certificate(cert_data, default_backend())
+
+        # 提取信息
+        info = {
+            'subject': cert.subject.rfc4514_string(),
+            'issuer': cert.issuer.rfc4514_string(),
+            'serial_number': cert.serial_number,
+            'not_valid_before': cert.not_valid_before_utc,
+            'not_valid_after': cert.not_valid_after_utc,
+            'version': cert.version.name,
+            'signature_algorithm': cert.signature_algorithm_oid._name,
+            'domains': [],
+        }
+
+        # 提取SAN（Subject Alternative Names）
+        try:
+            san_ext = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+            info['domains'] = [name.value for name in san_ext.value]
+        except x509.ExtensionNotFound:
+            pass
+
+        # 计算剩余天数
+        now = datetime.utcnow()
+        days_remaining = (cert.not_valid_after_utc.replace(tzinfo=None) - now).days
+        info['days_remaining'] = days_remaining
+
+        return info
+
+    except Exception as e:
+        logger.error(f"读取证书信息失败: {e}")
+        return None
+
+
+def list_certificates(cert_dir: str = "./certs") -> List[Dict]:
+    """
+    列出所有证书
+
+    Args:
+        cert_dir: 证书存储目录
+
+    Returns:
+        证书信息列表
+    """
+    cert_path = Path(cert_dir)
+    if not cert_path.exists():
+        logger.warning(f"证书目录不存在: {cert_dir}")
+        return []
+
+    certificates = []
+
+    for domain_dir in cert_path.iterdir():
+        if domain_dir.is_dir():
+            cert_file = domain_dir / "cert.pem"
+            if cert_file.exists():
+                info = read_certificate_info(str(cert_file))
+                if info:
+                    info['domain'] = domain_dir.name
+                    info['cert_path'] = str(domain_dir)
+                    certificates.append(info)
+
+    return certificates
+
+
+def display_certificate_info(cert_file: str):
+    """
+    显示证书信息（格式化输出）
+
+    Args:
+        cert_file: 证书文件路径
+    """
+    info = read_certificate_info(cert_file)
+    if not info:
+        return
+
+    print("\n" + "=" * 70)
+    print("证书信息")
+    print("=" * 70)
+    print(f"主题: {info['subject']}")
+    print(f"颁发者: {info['issuer']}")
+    print(f"序列号: {info['serial_number']}")
+    print(f"版本: {info['version']}")
+    print(f"签名算法: {info['signature_algorithm']}")
+    print(f"生效时间: {info['not_valid_before']}")
+    print(f"过期时间: {info['not_valid_after']}")
+    print(f"剩余天数: {info['days_remaining']} 天")
+    print(f"\n域名列表:")
+    for domain in info['domains']:
+        print(f"  - {domain}")
+    print("=" * 70)
@@ -6,15 +6,31 @@
 
 import logging
 import os
-from datetime import datetime, timedelta
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Union
 
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 
-from acme_client import ACMEClient
-from dnsla_client import DNSLAClient
+import metrics
+from acme_client import ACMEClient, invalid_identifiers, issuing_account
+from account_pool import AccountPool
+from cert_info import display_certificate_info, list_certificates, read_certificate_info
+from delegation import ChallengeDelegation
+from deploy_hooks import DeployHooks, HookResult
+from dnsla_client import DNSLAClient, DNSLAError
+from ocsp import OCSPPrefetcher
+from propagation import PropagationChecker, ZoneStats
+from rate_limits import OrderPlanner, PlannedOrder
+from tracing import tracer
+
+if TYPE_CHECKING:
+    # locking 依赖 fcntl，只在配置了多节点锁时由 main.py 导入
+    from locking import LockManager
 
 logger = logging.getLogger(__name__)
 
@@ -22,33 +38,191 @@ logger = logging.getLogger(__name__)
 class CertificateManager:
     """证书管理器"""
 
+    # 低TTL被托管域名拒绝时依次尝试的TTL（秒）
+    TTL_STEPS = (60, 120, 300, 600)
+    # DNS.LA确认不存在的托管域名的缓存时间（秒），之后重新查询
+    MISSING_ZONE_TTL = 300
+
     def __init__(
             self,
             dnsla_client: DNSLAClient,
-            acme_client: ACMEClient,
+            acme_client: Union[ACMEClient, AccountPool],
             base_domain: str,
             domain_id: str,
-            propagation_seconds: int = 120
+            propagation_seconds: int = 120,
+            zones: Optional[Dict[str, str]] = None,
+            max_zone_workers: int = 8,
+            follow_cnames: bool = False,
+            cname_cache_file: Optional[str] = None,
+            cname_cache_ttl: int = 3600,
+            challenge_ttl: int = 600,
+            zone_stats: Optional[ZoneStats] = None,
+            propagation_checker: Optional[PropagationChecker] = None,
+            planner: Optional[OrderPlanner] = None,
+            deploy_hooks: Optional[DeployHooks] = None,
+            ocsp: Optional[OCSPPrefetcher] = None,
+            locks: Optional['LockManager'] = None
     ):
         """
         初始化证书管理器
 
         Args:
             dnsla_client: DNS.LA客户端
-            acme_client: ACME客户端
+            acme_client: ACME客户端，或在多个账户之间分配订单的账户池
             base_domain: DNS.LA管理的基础域名（如 rho.im）
             domain_id: DNS.LA域名ID
             propagation_seconds: DNS记录生效等待时间（秒）
+            zones: 其他DNS.LA托管域名 {域名: 域名ID}，用于颁发跨多个域名的证书
+            max_zone_workers: 跨域名并发设置DNS记录的最大线程数
+            follow_cnames: 是否跟随 _acme-challenge 的CNAME，把验证记录写入委派的验证域名
+            cname_cache_file: CNAME目标缓存文件（可选）
+            cname_cache_ttl: CNAME目标缓存有效期（秒）
+            challenge_ttl: 验证记录TTL（秒），托管域名不允许时自动提高
+            zone_stats: 托管域名统计（最小TTL、生效耗时），默认只保存在内存中
+            propagation_checker: 主动检查记录生效的检查器，未设置时固定等待 propagation_seconds
+            planner: 速率限制规划器（记录颁发历史，批量颁发时按CA限制安排订单）
+            deploy_hooks: 部署钩子（收集有变化的证书，由 flush_deploy_hooks 统一重载服务）
+            ocsp: OCSP响应预取（新证书保存后、重载服务前获取OCSP响应）
+            locks: 多节点部署时的证书锁（同一证书同时只由一个节点颁发）
         """
         self.dns = dnsla_client
         self.acme = acme_client
         self.base_domain = base_domain
         self.domain_id = domain_id
         self.propagation_seconds = propagation_seconds
+        self.max_zone_workers = max_zone_workers
+        self.challenge_ttl = challenge_ttl
+        self.zone_stats = zone_stats or (propagation_checker.stats if propagation_checker else ZoneStats())
+        self.propagation_checker = propagation_checker
+        self.planner = planner
+        self.deploy_hooks = deploy_hooks
+        self.ocsp = ocsp
+        self.locks = locks
+        # 当前线程的进度回调（见 report_progress）
+        self._progress = threading.local()
+        # 当前线程持有的证书租约（见 _locked）
+        self._lease = threading.local()
+        # 主域名 -> 进程内互斥锁（守护进程、工作节点和任务API共用同一个管理器时不会同时处理同一证书）
+        self._domain_locks: Dict[str, threading.Lock] = {}
+        self._domain_locks_guard = threading.Lock()
+
+        # 托管域名 -> 域名ID（未配置的域名在首次使用时通过API查询并缓存）
+        self.zones: Dict[str, str] = {base_domain: domain_id}
+        if zones:
+            self.zones.update(zones)
+        # 确认不存在的托管域名 -> 缓存过期时间（time.monotonic）
+        self._missing_zones: Dict[str, float] = {}
+        self._zone_lock = threading.Lock()
+
+        self.delegation = None
+        if follow_cnames:
+            self.delegation = ChallengeDelegation(
+                self.dns, self._find_zone, ttl=cname_cache_ttl, cache_file=cname_cache_file
+            )
 
         logger.info(f"证书管理器初始化成功 (基础域名: {base_domain})")
 
-    def _extract_host_from_validation_name(self, validation_name: str) -> str:
+    @contextmanager
+    def report_progress(self, callback: Callable[[str], None]):
+        """
+        在当前线程的颁发/续期过程中按步骤回调 callback(步骤)
+
+        步骤: order、challenges、dns_setup、propagation、validation、cleanup、save，
+        以及续期时的 up_to_date（无需续期）和 locked（由其他节点处理）
+        """
+        previous = getattr(self._progress, 'callback', None)
+        self._progress.callback = callback
+        try:
+            yield
+        finally:
+            self._progress.callback = previous
+
+    def _report(self, stage: str) -> None:
+        callback = getattr(self._progress, 'callback', None)
+        if callback:
+            try:
+                callback(stage)
+            except Exception as e:
+                logger.debug(f"进度回调失败: {e}")
+
+    def _find_zone(self, name: str) -> Optional[Tuple[str, str]]:
+        """
+        查找名称所属的DNS.LA托管域名
+
+        优先匹配已知域名中最长的后缀；都不匹配时从长到短依次向DNS.LA查询，
+        找到的托管域名一直缓存，DNS.LA确认不存在的结果缓存 MISSING_ZONE_TTL 秒，
+        查询失败不缓存。第一个标签（_acme-challenge）
+        不会作为托管域名查询。
+
+        Args:
+            name: 验证域名（如 _acme-challenge.www.example.net）
+
+        Returns:
+            (托管域名, 域名ID)，找不到返回None
+        """
+        labels = name.rstrip('.').split('.')
+        candidates = ['.'.join(labels[i:]) for i in range(len(labels) - 1)]
+
+        for candidate in candidates:
+            if candidate in self.zones:
+                return candidate, self.zones[candidate]
+
+        with self._zone_lock:
+            for candidate in candidates[1:]:
+                if self._missing_zones.get(candidate, 0) > time.monotonic():
+                    continue
+                try:
+                    domain_info = self.dns.get_domain_info(candidate, raise_errors=True)
+                except Exception as e:
+                    # 查询失败不能当作不存在：更短的后缀可能是错误的托管域名，本次放弃且不缓存
+                    logger.error(f"查询托管域名 {candidate} 失败: {e}")
+                    return None
+                if domain_info and domain_info.get('id'):
+                    logger.info(f"发现托管域名: {candidate} (ID: {domain_info['id']})")
+                    self.zones[candidate] = str(domain_info['id'])
+                    self._missing_zones.pop(candidate, None)
+                    return candidate, self.zones[candidate]
+                self._missing_zones[candidate] = time.monotonic() + self.MISSING_ZONE_TTL
+
+        return None
+
+    def _zone_name(self, zone_id: str) -> str:
+        """根据域名ID查找托管域名"""
+        for name, candidate_id in self.zones.items():
+            if candidate_id == zone_id:
+                return name
+        return zone_id
+
+    def _add_challenge_record(self, zone_id: str, host: str, value: str) -> Optional[str]:
+        """
+        添加验证记录，TTL被托管域名拒绝时逐级提高并记住该域名允许的最小TTL
+
+        只有DNS.LA明确拒绝TTL时才提高TTL；其他错误（网络、认证、服务端错误、限速）直接失败。
+
+        Returns:
+            新记录的ID，失败返回None
+        """
+        zone_name = self._zone_name(zone_id)
+        ttl = max(self.challenge_ttl, self.zone_stats.min_ttl(zone_name))
+        fallbacks = [step for step in self.TTL_STEPS if step > ttl]
+        while True:
+            try:
+                record_id = self.dns.add_txt_record(domain_id=zone_id, host=host, value=value, ttl=ttl,
+                                                    raise_errors=True)
+            except DNSLAError as e:
+                if not e.ttl_rejected or not fallbacks:
+                    return None
+                logger.warning(f"  TTL {ttl} 被拒绝，尝试 TTL {fallbacks[0]}")
+                ttl = fallbacks.pop(0)
+                continue
+            except Exception:
+                return None
+            if record_id and ttl > max(self.challenge_ttl, self.zone_stats.min_ttl(zone_name)):
+                logger.info(f"  托管域名 {zone_name} 的最小TTL记为 {ttl}")
+                self.zone_stats.set_min_ttl(zone_name, ttl)
+            return record_id
+
+    def _extract_host_from_validation_name(self, validation_name: str, zone: Optional[str] = None) -> str:
         """
         从验证域名提取主机头
 
@@ -59,25 +233,99 @@ class CertificateManager:
 
         Args:
             validation_name: 验证域名（如_acme-challenge.db.dev.n.rho.im）
+            zone: 验证域名所属的托管域名（默认基础域名）
 
         Returns:
             主机头
         """
-        # 移除基础域名部分
-        if validation_name.endswith('.' + self.base_domain):
-            # 去掉 .base_domain 后缀
-            host = validation_name[:-(len(self.base_domain) + 1)]
-        elif validation_name == self.base_domain:
+        zone = zone or self.base_domain
+
+        # 移除托管域名部分
+        if validation_name.endswith('.' + zone):
+            # 去掉 .zone 后缀
+            host = validation_name[:-(len(zone) + 1)]
+        elif validation_name == zone:
             # 根域名使用 @
             host = '@'
         else:
             # 不应该发生，但以防万一
-            logger.warning(f"验证域名 {validation_name} 不属于基础域名 {self.base_domain}")
+            logger.warning(f"验证域名 {validation_name} 不属于托管域名 {zone}")
             host = validation_name
 
         logger.debug(f"验证域名 {validation_name} -> 主机头 {host}")
         return host
 
+    def _for_each_zone(self, func: Callable, groups: Dict[str, list]) -> Dict[str, object]:
+        """
+        对每个托管域名的一批记录执行func(域名ID, 记录列表)，多个域名时并发执行
+
+        Returns:
+            {域名ID: func返回值}
+        """
+        if len(groups) <= 1:
+            return {zone_id: func(zone_id, items) for zone_id, items in groups.items()}
+
+        with ThreadPoolExecutor(max_workers=min(len(groups), self.max_zone_workers)) as executor:
+            futures = {zone_id: executor.submit(func, zone_id, items) for zone_id, items in groups.items()}
+            return {zone_id: future.result() for zone_id, future in futures.items()}
+
+    def _provision_zone(self, zone_id: str, challenge_records: List[Tuple]) -> Tuple[List[Tuple], bool]:
+        """
+        在一个托管域名中设置验证记录
+
+        挑战按主机头分组: 同时包含根域名和通配符（example.com 和 *.example.com）时，
+        两个挑战共用 _acme-challenge 主机头，该主机头的所有验证值作为一组一次性设置。
+        已存在且值正确的记录会直接复用，其他旧记录会被删除。
+
+        Args:
+            zone_id: 域名ID
+            challenge_records: [(主机头, 验证值, 挑战), ...]
+
+        Returns:
+            (本次使用的记录 [(记录ID, 域名ID, 主机头), ...], 是否全部成功)
+        """
+        # 主机头 -> 验证值集合（保持顺序）
+        values_by_host: Dict[str, Dict[str, None]] = {}
+        for host, validation_value, _ in challenge_records:
+            values_by_host.setdefault(host, {})[validation_value] = None
+
+        # 所有主机头只查询一次旧记录
+        reusable: Dict[Tuple[str, str], str] = {}
+        for record in self.dns.find_txt_records_for_hosts(zone_id, values_by_host):
+            key = (record.host, record.data)
+            if record.data in values_by_host[record.host] and key not in reusable:
+                reusable[key] = record.id
+            else:
+                self.dns.delete_record(record.id)
+
+        records = []
+        for host, values in values_by_host.items():
+            if len(values) > 1:
+                logger.info(f"  主机头 {host} 共 {len(values)} 个验证值")
+            for validation_value in values:
+                record_id = reusable.get((host, validation_value))
+                if record_id is None:
+                    # 添加新的验证记录
+                    record_id = self._add_challenge_record(zone_id, host, validation_value)
+                if not record_id:
+                    logger.error(f"添加DNS记录失败: {host}")
+                    return records, False
+                records.append((record_id, zone_id, host))
+        return records, True
+
+    def _delete_zone_records(self, zone_id: str, records: List[Tuple]) -> None:
+        """删除一个托管域名中的验证记录"""
+        for record_id, _, host in records:
+            self.dns.delete_record(record_id)
+            logger.info(f"  已删除: {host}")
+
+    def _cleanup_records(self, record_ids: List[Tuple]) -> None:
+        """按托管域名并发删除验证记录"""
+        groups: Dict[str, List[Tuple]] = {}
+        for record in record_ids:
+            groups.setdefault(record[1], []).append(record)
+        self._for_each_zone(self._delete_zone_records, groups)
+
     def issue_certificate(
             self,
             domains: List[str],
@@ -93,8 +341,141 @@ class CertificateManager:
             key_size: RSA密钥大小
 
         Returns:
-            证书目录路径，失败返回None
+            证书目录路径，失败或证书正由其他节点颁发时返回None
         """
+        return self._locked(domains[0], self._issue_locked, domains, cert_dir, key_size)
+
+    def _locked(self, domain: str, func: Callable[..., Optional[Path]], *args) -> Optional[Path]:
+        """
+        持有证书锁执行 func，证书正由其他节点处理时返回None
+
+        同一进程内先等待该证书的进程内锁（其他线程完成后，续期会看到新证书而不再重复续期），
+        配置了多节点锁时再获取租约。
+        """
+        with self._domain_locks_guard:
+            domain_lock = self._domain_locks.setdefault(domain, threading.Lock())
+        with domain_lock:
+            return self._lease_locked(domain, func, *args)
+
+    def _lease_locked(self, domain: str, func: Callable[..., Optional[Path]], *args) -> Optional[Path]:
+        if not self.locks:
+            return func(*args)
+        from locking import LockHeld
+        try:
+            with self.locks.hold(f"cert:{domain}") as lease:
+                self._lease.current = lease
+                try:
+                    return func(*args)
+                finally:
+                    self._lease.current = None
+        except LockHeld as e:
+            logger.info(f"跳过证书 {domain}: {e}")
+            metrics.ACME_ORDERS.inc(outcome='locked')
+            self._report('locked')
+            return None
+
+    def _lease_lost(self) -> bool:
+        """当前线程持有的证书租约是否已失效（续约失败或已被其他节点接管）"""
+        lease = getattr(self._lease, 'current', None)
+        if lease is None or self.locks.check(lease):
+            return False
+        logger.error(f"证书租约 {lease.name} 已失效，停止本次颁发")
+        metrics.ACME_ORDERS.inc(outcome='lease_lost')
+        return True
+
+    def _issue_locked(self, domains: List[str], cert_dir: str, key_size: int) -> Optional[Path]:
+        start = time.perf_counter()
+        with tracer.span('issue', domain=domains[0], san_count=len(domains)) as span:
+            cert_path = self._issue_certificate(domains, cert_dir, key_size)
+            span.set_attribute('success', cert_path is not None)
+        tracer.flush()
+
+        if cert_path:
+            self._record_issued(domains[0], cert_path, time.perf_counter() - start)
+            if self.planner:
+                self.planner.history.record_issuance(domains, self.planner.clock())
+            if self.ocsp:
+                # 服务重载后直接装订，不需要再冷启动请求OCSP
+                self.ocsp.refresh_certificate(cert_path, force=True)
+            if self.deploy_hooks:
+                self.deploy_hooks.notify(domains[0], str(cert_path), domains)
+        return cert_path
+
+    def issue_batch(
+            self,
+            certificates: List[List[str]],
+            cert_dir: str = "./certs",
+            key_size: int = 2048,
+            max_wait: float = 0
+    ) -> Tuple[Dict[str, Optional[Path]], List[PlannedOrder]]:
+        """
+        按速率限制规划批量颁发证书
+
+        可以立即执行的订单先执行；需要推迟的订单在 max_wait 内的会等待后执行，
+        其余的返回给调用方稍后处理。
+
+        Args:
+            certificates: 证书域名列表的列表
+            cert_dir: 证书存储目录
+            key_size: RSA密钥大小
+            max_wait: 最多等待的秒数
+
+        Returns:
+            ({主域名: 证书目录路径或None}, 推迟的订单)
+        """
+        if self.planner:
+            plan = self.planner.plan(certificates)
+            clock = self.planner.clock
+        else:
+            plan = [PlannedOrder(list(names), 0) for names in certificates]
+            clock = time.time
+
+        results: Dict[str, Optional[Path]] = {}
+        deferred: List[PlannedOrder] = []
+        for order in plan:
+            wait = order.not_before - clock()
+            if wait > max_wait:
+                logger.warning(f"证书 {order.names[0]} 推迟 {wait:.0f} 秒 ({order.reason})")
+                deferred.append(order)
+                continue
+            if wait > 0:
+                time.sleep(wait)
+            results[order.names[0]] = self.issue_certificate(order.names, cert_dir, key_size)
+        return results, deferred
+
+    def flush_deploy_hooks(self, domain: Optional[str] = None) -> Dict[str, HookResult]:
+        """
+        为本次运行中有证书变化的服务各执行一次重载命令（运行结束时调用）
+
+        Args:
+            domain: 只返回涉及该证书的服务的结果（包括其他线程同时执行的 flush 中的重载）
+
+        Returns:
+            {服务名称: 执行结果}
+        """
+        if not self.deploy_hooks:
+            return {}
+        results = self.deploy_hooks.flush()
+        if domain is None:
+            return results
+        return self.deploy_hooks.results_for(domain)
+
+    def _record_issued(self, domain: str, cert_path: Path, duration: float):
+        """颁发成功后增量更新指标"""
+        metrics.CERT_RENEWAL_SECONDS.set(duration, domain=domain)
+        metrics.CERT_RENEWAL_TIMESTAMP.set(time.time(), domain=domain)
+        cert_file = cert_path / "cert.pem"
+        info = self.get_certificate_info(str(cert_file))
+        if info:
+            metrics.registry.inventory.update(cert_path.name, info['not_valid_after'], cert_file.stat().st_mtime)
+
+    def _issue_certificate(
+            self,
+            domains: List[str],
+            cert_dir: str,
+            key_size: int
+    ) -> Optional[Path]:
+        """颁发证书的具体流程（每个步骤记录一个span）"""
         logger.info("=" * 60)
         logger.info("开始颁发证书")
         logger.info(f"域名: {', '.join(domains)}")
@@ -103,95 +484,153 @@ class CertificateManager:
 
         # 1. 生成证书和创建订单
         logger.info("\n[步骤 1/5] 生成证书私钥和创建ACME订单...")
-        result = self.acme.generate_certificate(domains, cert_dir, key_size)
-        if not result:
+        self._report('order')
+        with tracer.span('issue.order'):
+            started = self.acme.start_order(domains, cert_dir, key_size)
+        if not started:
+            metrics.ACME_ORDERS.inc(outcome='error')
             return None
 
-        cert_path, order, private_key = result
+        # 同一订单的挑战、轮询和保存必须使用创建订单的账户
+        acme, (cert_path, order, private_key) = started
 
         # 2. 获取DNS挑战
         logger.info("\n[步骤 2/5] 获取DNS-01挑战...")
+        self._report('challenges')
         dns_challenges = []
+        reused = 0
         for authz in order.authorizations:
+            from acme import challenges, messages
+            if authz.body.status == messages.STATUS_VALID:
+                # 授权仍然有效（如分组未变化的续期），无需重新验证
+                reused += 1
+                continue
             for challenge in authz.body.challenges:
-                from acme import challenges
                 if isinstance(challenge.chall, challenges.DNS01):
                     # 保存授权和挑战的元组
                     dns_challenges.append((authz, challenge))
 
-        if not dns_challenges:
+        if not dns_challenges and not reused:
             logger.error("未找到DNS-01挑战")
+            metrics.ACME_ORDERS.inc(outcome='error')
             return None
 
         logger.info(f"获取到 {len(dns_challenges)} 个DNS-01挑战")
+        if reused:
+            logger.info(f"复用 {reused} 个有效授权")
 
         # 3. 设置DNS验证记录
         logger.info("\n[步骤 3/5] 设置DNS验证记录...")
+        self._report('dns_setup')
         record_ids = []
 
-        for authz, challenge in dns_challenges:
-            domain, validation_name, validation_value = self.acme.get_dns_challenge_data(authz, challenge)
-
-            # 提取主机头
-            host = self._extract_host_from_validation_name(validation_name)
-
-            logger.info(f"  域名: {domain}")
-            logger.info(f"  完整验证域名: {validation_name}")
-            logger.info(f"  DNS.LA 主机头: {host}")
-            logger.info(f"  验证值: {validation_value}")
-
-            # 删除旧的验证记录（如果存在）
-            self.dns.delete_txt_records(self.domain_id, host)
-
-            # 添加新的验证记录
-            record_id = self.dns.add_txt_record(
-                domain_id=self.domain_id,
-                host=host,
-                value=validation_value,
-                ttl=600  # 10分钟TTL
-            )
-
-            if record_id:
-                record_ids.append((record_id, host, challenge))
-            else:
-                logger.error(f"添加DNS记录失败: {host}")
+        with tracer.span('issue.dns_setup', challenges=len(dns_challenges)):
+            # 按托管域名分组: 域名ID -> [(主机头, 验证值, 挑战), ...]
+            zone_records: Dict[str, List[Tuple]] = {}
+            # 托管域名 -> {完整验证域名: 验证值集合}，用于检查记录生效
+            expected: Dict[str, Dict[str, set]] = {}
+            for authz, challenge in dns_challenges:
+                domain, validation_name, validation_value = acme.get_dns_challenge_data(authz, challenge)
+
+                # 存在CNAME委派时，验证记录写入委派目标所在的验证域名
+                if self.delegation:
+                    try:
+                        validation_name = self.delegation.resolve(validation_name)
+                    except Exception:
+                        # 无法确定委派目标时不写入任何记录
+                        metrics.ACME_ORDERS.inc(outcome='dns_error')
+                        return None
+
+                zone = self._find_zone(validation_name)
+                if zone is None:
+                    logger.error(f"验证域名 {validation_name} 不属于任何DNS.LA托管域名")
+                    metrics.ACME_ORDERS.inc(outcome='dns_error')
+                    return None
+                zone_name, zone_id = zone
+
+                # 提取主机头
+                host = self._extract_host_from_validation_name(validation_name, zone_name)
+
+                logger.info(f"  域名: {domain}")
+                logger.info(f"  完整验证域名: {validation_name}")
+                logger.info(f"  DNS.LA 托管域名: {zone_name}")
+                logger.info(f"  DNS.LA 主机头: {host}")
+                logger.info(f"  验证值: {validation_value}")
+                zone_records.setdefault(zone_id, []).append((host, validation_value, challenge))
+                expected.setdefault(zone_name, {}).setdefault(validation_name, set()).add(validation_value)
+
+            # 每个托管域名批量设置，多个托管域名之间并发
+            results = self._for_each_zone(self._provision_zone, zone_records)
+            for added, _ in results.values():
+                record_ids.extend(added)
+
+            if not all(ok for _, ok in results.values()):
                 # 清理已添加的记录
-                for rid, _, _ in record_ids:
-                    self.dns.delete_record(rid)
+                self._cleanup_records(record_ids)
+                metrics.ACME_ORDERS.inc(outcome='dns_error')
                 return None
 
         # 4. 等待DNS记录生效
-        logger.info(f"\n[步骤 4/5] 等待DNS记录生效（{self.propagation_seconds}秒）...")
-        self.dns.wait_for_propagation(self.propagation_seconds)
+        self._report('propagation')
+        propagation_start = time.perf_counter()
+        if not record_ids:
+            logger.info("\n[步骤 4/5] 所有授权均有效，跳过DNS记录生效等待")
+        elif self.propagation_checker:
+            logger.info("\n[步骤 4/5] 查询权威DNS服务器，等待DNS记录生效...")
+            with tracer.span('issue.propagation', zones=len(expected)) as span:
+                span.set_attribute('visible', self.propagation_checker.wait(expected, self.propagation_seconds))
+        else:
+            logger.info(f"\n[步骤 4/5] 等待DNS记录生效（{self.propagation_seconds}秒）...")
+            with tracer.span('issue.propagation', seconds=self.propagation_seconds):
+                self.dns.wait_for_propagation(self.propagation_seconds)
+        metrics.PROPAGATION_SECONDS.observe(time.perf_counter() - propagation_start)
 
         # 5. 回答挑战并等待验证
         logger.info("\n[步骤 5/5] 提交挑战响应并等待Let's Encrypt验证...")
-        for record_id, host, challenge in record_ids:
-            if not self.acme.answer_challenge(challenge):
-                logger.error("提交挑战响应失败")
-                # 清理DNS记录
-                for rid, _, _ in record_ids:
-                    self.dns.delete_record(rid)
-                return None
-
-        # 轮询订单状态
-        completed_order = self.acme.poll_order(order)
+        self._report('validation')
+        with tracer.span('issue.validation'):
+            for _, challenge in dns_challenges:
+                if not acme.answer_challenge(challenge):
+                    logger.error("提交挑战响应失败")
+                    # 清理DNS记录
+                    self._cleanup_records(record_ids)
+                    metrics.ACME_ORDERS.inc(outcome='error')
+                    return None
+
+            # 轮询订单状态
+            completed_order = acme.poll_order(order)
+
+        # 租约失效时其他节点可能已在处理同一证书（并复用了这些记录），由它负责清理和保存
+        if self._lease_lost():
+            return None
 
         # 6. 清理DNS验证记录
         logger.info("\n清理DNS验证记录...")
-        for record_id, host, _ in record_ids:
-            self.dns.delete_record(record_id)
-            logger.info(f"  已删除: {host}")
+        self._report('cleanup')
+        with tracer.span('issue.cleanup', records=len(record_ids)):
+            self._cleanup_records(record_ids)
 
         # 7. 保存证书
         if completed_order and completed_order.fullchain_pem:
+            if self._lease_lost():
+                return None
             logger.info("\n保存证书文件...")
-            if self.acme.save_certificate(completed_order, cert_path, domains):
+            self._report('save')
+            with tracer.span('issue.save'):
+                saved = acme.save_certificate(completed_order, cert_path, domains, private_key)
+            if saved:
+                metrics.ACME_ORDERS.inc(outcome='valid')
                 logger.info("\n" + "=" * 60)
                 logger.info("证书颁发成功！")
                 logger.info(f"证书路径: {cert_path}")
                 logger.info("=" * 60)
                 return cert_path
+            metrics.ACME_ORDERS.inc(outcome='error')
+        else:
+            metrics.ACME_ORDERS.inc(outcome='invalid')
+            if self.planner and completed_order:
+                # CA的失败验证限制按主机名计数，只计入验证失败的授权
+                self.planner.history.record_failure(invalid_identifiers(completed_order), self.planner.clock())
 
         logger.error("\n证书颁发失败")
         return None
@@ -206,46 +645,7 @@ class CertificateManager:
         Returns:
             证书信息字典
         """
-        cert_path = Path(cert_file)
-        if not cert_path.exists():
-            logger.error(f"证书文件不存在: {cert_file}")
-            return None
-
-        try:
-            with open(cert_path, 'rb') as f:
-                cert_data = f.read()
-
-            cert = x509.load_pem_x509_certificate(cert_data, default_backend())
-
-            # 提取信息
-            info = {
-                'subject': cert.subject.rfc4514_string(),
-                'issuer': cert.issuer.rfc4514_string(),
-                'serial_number': cert.serial_number,
-                'not_valid_before': cert.not_valid_before_utc,
-                'not_valid_after': cert.not_valid_after_utc,
-                'version': cert.version.name,
-                'signature_algorithm': cert.signature_algorithm_oid._name,
-                'domains': [],
-            }
-
-            # 提取SAN（Subject Alternative Names）
-            try:
-                san_ext = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
-                info['domains'] = [name.value for name in san_ext.value]
-            except x509.ExtensionNotFound:
-                pass
-
-            # 计算剩余天数
-            now = datetime.utcnow()
-            days_remaining = (cert.not_valid_after_utc.replace(tzinfo=None) - now).days
-            info['days_remaining'] = days_remaining
-
-            return info
-
-        except Exception as e:
-            logger.error(f"读取证书信息失败: {e}")
-            return None
+        return read_certificate_info(cert_file)
 
     def check_certificate_expiry(
             self,
@@ -293,18 +693,34 @@ class CertificateManager:
             renew_days: 提前续期天数
 
         Returns:
-            证书目录路径，失败返回None
+            证书目录路径，失败或证书正由其他节点续期时返回None
         """
+        # 持有锁后再检查，其他节点刚在共享存储上续期过的证书不会再续期一次
+        return self._locked(domains[0], self._renew_locked, domains, cert_dir, key_size, renew_days)
+
+    def _renew_locked(self, domains: List[str], cert_dir: str, key_size: int, renew_days: int) -> Optional[Path]:
         cert_file = Path(cert_dir) / domains[0] / "cert.pem"
 
         # 检查是否需要续期
         if not self.check_certificate_expiry(str(cert_file), renew_days):
             logger.info("证书无需续期")
+            self._report('up_to_date')
             return Path(cert_dir) / domains[0]
 
         # 颁发新证书
         logger.info("开始续期证书...")
-        return self.issue_certificate(domains, cert_dir, key_size)
+        return self._issue_locked(domains, cert_dir, key_size)
+
+    def revoke(self, cert: x509.Certificate, reason: int = 0, account: Optional[str] = None) -> None:
+        """
+        吊销证书（失败时抛出ACME客户端的异常）
+
+        Args:
+            cert: 要吊销的证书
+            reason: 吊销原因代码
+            account: 颁发该证书的账户（见 acme_client.issuing_account），使用账户池时用该账户吊销
+        """
+        self.acme.revoke(cert, reason, account)
 
     def revoke_certificate(self, cert_file: str, reason: int = 0) -> bool:
         """
@@ -334,11 +750,7 @@ class CertificateManager:
             cert = x509.load_pem_x509_certificate(cert_data, default_backend())
 
             # 吊销证书
-            from acme import messages
-            self.acme.acme_client.revoke(
-                messages.Revocation(certificate=cert),
-                reason=reason
-            )
+            self.revoke(cert, reason, issuing_account(cert_path.parent))
 
             logger.info(f"证书已吊销: {cert_file}")
             return True
@@ -357,24 +769,7 @@ class CertificateManager:
         Returns:
             证书信息列表
         """
-        cert_path = Path(cert_dir)
-        if not cert_path.exists():
-            logger.warning(f"证书目录不存在: {cert_dir}")
-            return []
-
-        certificates = []
-
-        for domain_dir in cert_path.iterdir():
-            if domain_dir.is_dir():
-                cert_file = domain_dir / "cert.pem"
-                if cert_file.exists():
-                    info = self.get_certificate_info(str(cert_file))
-                    if info:
-                        info['domain'] = domain_dir.name
-                        info['cert_path'] = str(domain_dir)
-                        certificates.append(info)
-
-        return certificates
+        return list_certificates(cert_dir)
 
     def display_certificate_info(self, cert_file: str):
         """
@@ -383,25 +778,7 @@ class CertificateManager:
         Args:
             cert_file: 证书文件路径
         """
-        info = self.get_certificate_info(cert_file)
-        if not info:
-            return
-
-        print("\n" + "=" * 70)
-        print("证书信息")
-        print("=" * 70)
-        print(f"主题: {info['subject']}")
-        print(f"颁发者: {info['issuer']}")
-        print(f"序列号: {info['serial_number']}")
-        print(f"版本: {info['version']}")
-        print(f"签名算法: {info['signature_algorithm']}")
-        print(f"生效时间: {info['not_valid_before']}")
-        print(f"过期时间: {info['not_valid_after']}")
-        print(f"剩余天数: {info['days_remaining']} 天")
-        print(f"\n域名列表:")
-        for domain in info['domains']:
-            print(f"  - {domain}")
-        print("=" * 70)
+        display_certificate_info(cert_file)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+证书服务API
+只读HTTP接口，按名称提供证书包（证书链、私钥、元数据），支持强ETag、
+If-None-Match 条件请求、长轮询和SSE变化通知；客户端无需扫描证书目录
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 长轮询的最长等待时间（秒）
+MAX_WAIT = 300
+
+
+class CertificateBundle:
+    """一个证书目录的内存快照"""
+
+    __slots__ = ('name', 'files', 'file_etags', 'etag', 'metadata', 'version', 'signature')
+
+    def __init__(self, name: str, files: Dict[str, bytes], metadata: Dict, version: int, signature: Tuple):
+        self.name = name
+        self.files = files
+        self.file_etags = {filename: _etag(data) for filename, data in files.items()}
+        sha256 = hashlib.sha256()
+        for filename in sorted(files):
+            sha256.update(filename.encode() + b'\0' + files[filename] + b'\0')
+        self.etag = f'"{sha256.hexdigest()}"'
+        self.metadata = metadata
+        self.version = version
+        self.signature = signature
+
+    def to_dict(self) -> Dict:
+        """文本文件放在 files 中，二进制文件（如 bundle.p12、ocsp.der）以base64放在 binary_files 中"""
+        files, binary_files = {}, {}
+        for filename, data in self.files.items():
+            try:
+                files[filename] = data.decode('utf-8')
+            except UnicodeDecodeError:
+                binary_files[filename] = base64.b64encode(data).decode('ascii')
+        return {
+            'name': self.name,
+            'etag': self.etag,
+            'metadata': self.metadata,
+            'files': files,
+            'binary_files': binary_files,
+        }
+
+
+def _etag(data: bytes) -> str:
+    return f'"{hashlib.sha256(data).hexdigest()}"'
+
+
+def _matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match 是否匹配（支持逗号分隔的多个ETag和 *）"""
+    if not if_none_match or etag is None:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+def _signature(path: Path) -> Tuple:
+    """目录中文件的 (名称, 修改时间, 大小)，用于判断是否需要重新读取"""
+    entries = []
+    for file in sorted(path.iterdir()):
+        if file.is_file() and not file.name.startswith('.'):
+            stat = file.stat()
+            entries.append((file.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(entries)
+
+
+def _read_bundle(path: Path) -> Tuple[Dict[str, bytes], Dict]:
+    """
+    读取证书目录并校验私钥与证书匹配
+
+    Raises:
+        ValueError: 证书无法解析，或私钥与证书不匹配（目录正在更新）
+    """
+    files = {}
+    for file in sorted(path.iterdir()):
+        if file.is_file() and not file.name.startswith('.'):
+            files[file.name] = file.read_bytes()
+
+    cert = x509.load_pem_x509_certificate(files['fullchain.pem'])
+    if 'privkey.pem' in files:
+        key = serialization.load_pem_private_key(files['privkey.pem'], password=None)
+        public_format = (serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+        if key.public_key().public_bytes(*public_format) != cert.public_key().public_bytes(*public_format):
+            raise ValueError("私钥与证书不匹配")
+
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+        domains = san.value.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        domains = []
+    metadata = {
+        'domains': domains,
+        'serial': format(cert.serial_number, 'x'),
+        'issuer': cert.issuer.rfc4514_string(),
+        'not_before': cert.not_valid_before_utc.isoformat(),
+        'not_after': cert.not_valid_after_utc.isoformat(),
+    }
+    return files, metadata
+
+
+class CertificateStore:
+    """
+    证书目录的内存索引
+
+    refresh() 只比较文件的修改时间和大小，变化的目录才重新读取；
+    每次变化分配递增的版本号，等待者通过条件变量被唤醒。版本号从启动时的
+    毫秒时间戳开始，重启后客户端保存的 Last-Event-ID 仍然小于新的版本号。
+    """
+
+    def __init__(self, cert_dir: str):
+        self.cert_dir = Path(cert_dir)
+        self.version = int(time.time() * 1000)
+        self._listing_etag = _etag(b'')
+        self._bundles: Dict[str, CertificateBundle] = {}
+        # 已删除的证书: 名称 -> 删除时的版本号
+        self._removed: Dict[str, int] = {}
+        self._condition = threading.Condition()
+        self._refresh_lock = threading.Lock()
+        self.closed = False
+        self.watchers = 0
+
+    def refresh(self) -> List[str]:
+        """
+        重新扫描证书目录
+
+        Returns:
+            发生变化（更新或删除）的证书名称
+        """
+        with self._refresh_lock:
+            found = {}
+            if self.cert_dir.exists():
+                for path in sorted(self.cert_dir.iterdir()):
+                    if path.is_dir() and (path / 'fullchain.pem').exists():
+                        try:
+                            found[path.name] = (path, _signature(path))
+                        except OSError:
+                            continue
+
+            updated = []
+            for name, (path, signature) in found.items():
+                current = self._bundles.get(name)
+                if current is not None and current.signature == signature:
+                    continue
+                try:
+                    files, metadata = _read_bundle(path)
+                except (OSError, KeyError, ValueError) as e:
+                    # 目录正在写入，下次刷新时重试
+                    logger.debug(f"跳过证书 {name}: {e}")
+                    continue
+                if current is not None and current.files == files:
+                    current.signature = signature
+                    continue
+                updated.append((name, files, metadata, signature))
+            removed = [name for name in self._bundles if name not in found]
+
+            if not updated and not removed:
+                return []
+            with self._condition:
+                for name, files, metadata, signature in updated:
+                    self.version += 1
+                    self._bundles[name] = CertificateBundle(name, files, metadata, self.version, signature)
+                    self._removed.pop(name, None)
+                for name in removed:
+                    self.version += 1
+                    del self._bundles[name]
+                    self._removed[name] = self.version
+                self._listing_etag = _etag(''.join(
+                    f'{name}={bundle.etag};' for name, bundle in sorted(self._bundles.items())).encode())
+                self._condition.notify_all()
+            changed = [name for name, *_ in updated] + removed
+            logger.info(f"证书服务已更新: {', '.join(changed)}")
+            return changed
+
+    def get(self, name: str) -> Optional[CertificateBundle]:
+        return self._bundles.get(name)
+
+    def listing(self) -> Dict:
+        bundles = list(self._bundles.values())
+        return {
+            'version': self.version,
+            'certificates': {
+                bundle.name: {
+                    'etag': bundle.etag,
+                    'domains': bundle.metadata['domains'],
+                    'not_after': bundle.metadata['not_after'],
+                } for bundle in sorted(bundles, key=lambda bundle: bundle.name)
+            },
+        }
+
+    def listing_etag(self) -> str:
+        return self._listing_etag
+
+    def changes_since(self, version: int) -> List[Tuple[int, str, Optional[CertificateBundle]]]:
+        """版本号大于 version 的变化: (版本号, 名称, 证书包或None表示已删除)，按版本号排序"""
+        with self._condition:
+            changes = [(bundle.version, name, bundle) for name, bundle in self._bundles.items()
+                       if bundle.version > version]
+            changes += [(removed, name, None) for name, removed in self._removed.items() if removed > version]
+        return sorted(changes, key=lambda change: change[0])
+
+    def wait(self, predicate, timeout: float) -> bool:
+        """等待 predicate() 为真（每次变化时重新检查），超时或关闭时返回 False"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not predicate():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.closed:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def watch(self, delta: int) -> None:
+        """SSE连接数加减（同时更新指标）"""
+        with self._condition:
+            self.watchers += delta
+            metrics.CERT_SERVER_WATCHERS.set(self.watchers)
+
+    def close(self) -> None:
+        """唤醒所有等待者（停止服务时调用）"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class _CertificateHandler(BaseHTTPRequestHandler):
+    """
+    路由:
+        GET /certificates                  证书列表（?wait=秒 配合 If-None-Match 长轮询）
+        GET /certificates/<名称>           证书包JSON（文件内容和元数据）
+        GET /certificates/<名称>/<文件名>  单个文件（如 fullchain.pem、privkey.pem）
+        GET /events                        SSE变化通知（支持 Last-Event-ID 续传）
+    """
+
+    store: CertificateStore = None
+    token: Optional[str] = None
+    keepalive: float = 15.0
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+
+        authorization = self.headers.get('Authorization') or ''
+        if self.token and not hmac.compare_digest(authorization.encode(), f'Bearer {self.token}'.encode()):
+            self._send_error(401, 'unauthorized', route='auth')
+            return
+        if parts == ['events']:
+            self._events(query)
+        elif parts == ['certificates']:
+            self._listing(query)
+        elif len(parts) in (2, 3) and parts[0] == 'certificates':
+            self._certificate(parts[1], parts[2] if len(parts) == 3 else None, query)
+        else:
+            self._send_error(404, 'not found', route='other')
+
+    def _wait_seconds(self, query: Dict) -> float:
+        try:
+            return min(max(float(query.get('wait', ['0'])[0]), 0.0), MAX_WAIT)
+        except ValueError:
+            return 0.0
+
+    def _listing(self, query: Dict):
+        etag = self.headers.get('If-None-Match')
+        wait = self._wait_seconds(query)
+        if etag and wait:
+            self.store.wait(lambda: not _matches(etag, self.store.listing_etag()), wait)
+        current = self.store.listing_etag()
+        if _matches(etag, current):
+            self._send(304, b'', route='list', etag=current)
+            return
+        body = json.dumps(self.store.listing(), ensure_ascii=False).encode('utf-8')
+        self._send(200, body, route='list', etag=current, content_type='application/json')
+
+    def _certificate(self, name: str, filename: Optional[str], query: Dict):
+        route = 'file' if filename else 'bundle'
+
+        def current_etag() -> Optional[str]:
+            bundle = self.store.get(name)
+            if bundle is None:
+                return None
+            return bundle.file_etags.get(filename) if filename else bundle.etag
+
+        etag = self.headers.get('If-None-Match')
+        wait = self._wait_seconds(query)
+        if etag and wait and current_etag() is not None:
+            self.store.wait(lambda: not _matches(etag, current_etag()), wait)
+
+        bundle = self.store.get(name)
+        if bundle is None or (filename and filename not in bundle.files):
+            self._send_error(404, 'not found', route=route)
+            return
+        if filename:
+            body, current = bundle.files[filename], bundle.file_etags[filename]
+            content_type = 'application/x-pem-file' if filename.endswith('.pem') else 'application/octet-stream'
+        else:
+            body, current = json.dumps(bundle.to_dict(), ensure_ascii=False).encode('utf-8'), bundle.etag
+            content_type = 'application/json'
+        if _matches(etag, current):
+            self._send(304, b'', route=route, etag=current)
+            return
+        self._send(200, body, route=route, etag=current, content_type=content_type)
+
+    def _events(self, query: Dict):
+        last_id = self.headers.get('Last-Event-ID') or query.get('since', [None])[0]
+        try:
+            version = int(last_id) if last_id is not None else self.store.version
+        except ValueError:
+            version = self.store.version
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        metrics.CERT_SERVER_REQUESTS.inc(route='events', status='200')
+        self.store.watch(1)
+        try:
+            self.wfile.write(f': version {self.store.version}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+            while not self.store.closed:
+                if self.store.wait(lambda: self.store.version > version, self.keepalive):
+                    for change_version, name, bundle in self.store.changes_since(version):
+                        if bundle is None:
+                            event, data = 'removed', {'name': name}
+                        else:
+                            event, data = 'updated', {'name': name, 'etag': bundle.etag,
+                                                      'metadata': bundle.metadata}
+                        self.wfile.write(
+                            f'id: {change_version}\nevent: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8'))
+                        version = change_version
+                else:
+                    # 注释行保持连接，同时发现已断开的客户端
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.store.watch(-1)
+
+    def _send(self, status: int, body: bytes, route: str, etag: Optional[str] = None,
+              content_type: str = 'application/json'):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        metrics.CERT_SERVER_REQUESTS.inc(route=route, status=str(status))
+
+    def _send_error(self, status: int, message: str, route: str):
+        body = json.dumps({'error': message}).encode('utf-8')
+        self._send(status, body, route=route)
+
+    def log_message(self, format, *args):
+        logger.debug("cert-server: " + format % args)
+
+
+class CertificateServer:
+    """
+    证书服务（HTTP服务器、证书索引和后台刷新线程）
+
+    用法:
+        server = CertificateServer(cert_dir, host='127.0.0.1', port=8480).start()
+        ...
+        server.stop()
+    """
+
+    def __init__(
+            self,
+            cert_dir: str,
+            host: str = '127.0.0.1',
+            port: int = 8480,
+            token: Optional[str] = None,
+            poll_interval: float = 5.0,
+            keepalive: float = 15.0
+    ):
+        """
+        Args:
+            cert_dir: 证书存储目录
+            host: 监听地址（接口会返回私钥，默认只监听本机）
+            port: 监听端口
+            token: 访问令牌（可选，请求需带 Authorization: Bearer <令牌>）
+            poll_interval: 检查证书目录变化的间隔（秒）
+            keepalive: SSE保活注释的间隔（秒）
+        """
+        self.store = CertificateStore(cert_dir)
+        self.poll_interval = poll_interval
+        handler = type('CertificateHandler', (_CertificateHandler,),
+                       {'store': self.store, 'token': token, 'keepalive': keepalive})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._stopped = threading.Event()
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'CertificateServer':
+        self.store.refresh()
+        threading.Thread(target=self.httpd.serve_forever, name='cert-server', daemon=True).start()
+        threading.Thread(target=self._poll, name='cert-server-poll', daemon=True).start()
+        logger.info(f"证书服务已启动: {self.url}/certificates")
+        return self
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.store.refresh()
+            except Exception as e:
+                logger.warning(f"刷新证书目录失败: {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.store.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+中间证书链存储
+按内容寻址保存中间证书链（<证书目录>/.chains/<SHA-256>.pem），每个证书目录中的
+chain.pem 是指向同一文件的硬链接或符号链接；解析后的中间证书按文件缓存在内存中
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+
+from fsutil import write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = '.chains'
+# 保存（共享锁）与清理（排他锁）互斥
+LOCK_FILE = '.chains.lock'
+LINK_MODES = ('hardlink', 'symlink', 'copy')
+
+# 已解析的证书链: (设备, inode, 修改时间, 大小) -> 中间证书列表
+_parsed: 'OrderedDict[Tuple[int, int, int, int], List[x509.Certificate]]' = OrderedDict()
+_parsed_lock = threading.Lock()
+_PARSED_MAX = 256
+
+
+def split_chain(fullchain_pem: str) -> Tuple[x509.Certificate, List[x509.Certificate]]:
+    """
+    解析证书链中的所有PEM块（不依赖块之间的空行）
+
+    Returns:
+        (服务器证书, 中间证书列表)
+
+    Raises:
+        ValueError: 证书链中没有证书
+    """
+    certs = x509.load_pem_x509_certificates(fullchain_pem.encode('ascii'))
+    return certs[0], certs[1:]
+
+
+def to_pem(certs: List[x509.Certificate]) -> str:
+    return ''.join(cert.public_bytes(serialization.Encoding.PEM).decode('ascii') for cert in certs)
+
+
+def chain_digest(intermediates: List[x509.Certificate]) -> str:
+    """证书链的内容地址（各中间证书DER的SHA-256）"""
+    digest = hashes.Hash(hashes.SHA256())
+    for cert in intermediates:
+        digest.update(cert.public_bytes(serialization.Encoding.DER))
+    return digest.finalize().hex()
+
+
+def load_intermediates(chain_file: str) -> List[x509.Certificate]:
+    """
+    读取证书链文件，按文件身份缓存解析结果
+
+    共享同一存储文件的硬链接和符号链接只解析一次；文件被替换后
+    （inode或修改时间变化）重新解析。
+    """
+    stat = os.stat(chain_file)
+    key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _parsed_lock:
+        certs = _parsed.get(key)
+        if certs is not None:
+            _parsed.move_to_end(key)
+            return certs
+    with open(chain_file, 'rb') as f:
+        data = f.read()
+    certs = x509.load_pem_x509_certificates(data) if data.strip() else []
+    with _parsed_lock:
+        _parsed[key] = certs
+        while len(_parsed) > _PARSED_MAX:
+            _parsed.popitem(last=False)
+    return certs
+
+
+@contextmanager
+def _file_lock(fd: int, exclusive: bool) -> Iterator[None]:
+    """
+    对打开的锁文件加锁
+
+    POSIX上使用 flock（按打开的文件加锁，同一进程的不同线程之间同样互斥）；
+    Windows上使用 msvcrt.locking，只支持独占锁；两者都不可用时不加锁。
+    """
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    elif msvcrt is not None:
+        while True:
+            try:
+                # LK_LOCK 重试10次（约10秒）仍失败时抛出OSError，继续等待
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        yield
+
+
+class ChainStore:
+    """
+    内容寻址的中间证书链存储
+
+    数千个证书通常共享同样的一两条中间证书链，每条链只在存储目录中保存一次。
+    """
+
+    def __init__(self, cert_dir: str, link: str = 'hardlink'):
+        """
+        Args:
+            cert_dir: 证书存储目录（存储目录为其中的 .chains）
+            link: chain.pem 的创建方式: hardlink、symlink 或 copy
+                  （不支持硬链接或符号链接的文件系统上自动退回下一种方式）
+        """
+        if link not in LINK_MODES:
+            raise ValueError(f"不支持的证书链链接方式: {link}")
+        self.cert_dir = Path(cert_dir)
+        self.store_dir = self.cert_dir / STORE_DIR
+        self.link = link
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        self.cert_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.cert_dir / LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with _file_lock(fd, exclusive):
+                yield
+        finally:
+            os.close(fd)
+
+    def add(self, intermediates: List[x509.Certificate]) -> Path:
+        """保存证书链（已存在时直接返回），返回存储文件路径"""
+        path = self.store_dir / f"{chain_digest(intermediates)}.pem"
+        if not path.exists():
+            write_atomic(str(path), to_pem(intermediates))
+        return path
+
+    def save(self, cert_path: Path, fullchain_pem: str) -> Tuple[x509.Certificate, List[x509.Certificate]]:
+        """
+        解析证书链，写入 cert.pem，并把 chain.pem 链接到存储中的证书链
+
+        Args:
+            cert_path: 证书目录
+            fullchain_pem: 完整证书链PEM
+
+        Returns:
+            (服务器证书, 中间证书列表)
+        """
+        leaf, intermediates = split_chain(fullchain_pem)
+        write_atomic(str(cert_path / 'cert.pem'), to_pem([leaf]))
+        # 写入存储到创建链接之间不能被清理，否则 chain.pem 会指向已删除的文件
+        with self._locked(exclusive=False):
+            self.link_chain(self.add(intermediates), cert_path / 'chain.pem')
+        return leaf, intermediates
+
+    def link_chain(self, source: Path, target: Path) -> None:
+        """原子替换 target 为指向 source 的链接（或副本）"""
+        modes = LINK_MODES[LINK_MODES.index(self.link):]
+        for mode in modes:
+            if mode == 'copy':
+                write_atomic(str(target), source.read_text(encoding='ascii'))
+                return
+            tmp_path = target.parent / f'.tmp-{os.urandom(6).hex()}'
+            try:
+                if mode == 'hardlink':
+                    os.link(str(source), str(tmp_path))
+                else:
+                    os.symlink(os.path.relpath(str(source), str(target.parent)), str(tmp_path))
+                os.replace(str(tmp_path), str(target))
+                return
+            except OSError as e:
+                if tmp_path.is_symlink() or tmp_path.exists():
+                    tmp_path.unlink()
+                logger.debug(f"无法以 {mode} 方式创建 {target}: {e}")
+
+    def prune(self) -> int:
+        """
+        删除不再被任何 chain.pem 引用的证书链
+
+        按 chain.pem 的内容（而不是文件身份）判断引用，copy 方式和退回为副本的 chain.pem
+        同样保留其证书链；清理期间等待进行中的保存完成。
+
+        Returns:
+            删除的文件数
+        """
+        if not self.store_dir.exists():
+            return 0
+        with self._locked(exclusive=True):
+            referenced = set()
+            for chain_file in self.cert_dir.glob('*/chain.pem'):
+                try:
+                    referenced.add(chain_digest(load_intermediates(str(chain_file))))
+                except (OSError, ValueError):
+                    continue
+            removed = 0
+            for path in self.store_dir.glob('*.pem'):
+                if path.stem not in referenced:
+                    path.unlink()
+                    removed += 1
+        return removed
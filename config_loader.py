@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+配置加载
+校验 config.yaml 并编译为只读、带索引的配置对象；
+编译结果按文件内容的哈希缓存为pickle文件，配置未修改时跳过YAML解析
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 修改校验规则或编译结果结构时递增，使旧缓存失效
+SCHEMA_VERSION = 2
+
+class ConfigError(Exception):
+    """配置文件无效"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("配置文件无效:\n" + "\n".join(f"  - {error}" for error in errors))
+        self.errors = errors
+
+
+class FrozenDict(Mapping):
+    """只读字典"""
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data: Dict):
+        self._data = data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"FrozenDict({self._data!r})"
+
+    def __getstate__(self):
+        return self._data
+
+    def __setstate__(self, state):
+        self._data = state
+
+
+def freeze(value):
+    """递归地把字典和列表转换为只读的 FrozenDict 和元组"""
+    if isinstance(value, dict):
+        return FrozenDict({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+# 配置段 -> {键: (类型, 默认值)}，默认值为 REQUIRED 表示必填
+REQUIRED = object()
+SCHEMA = {
+    'letsencrypt': {
+        'email': (str, REQUIRED),
+        'staging': (bool, False),
+        'cert_dir': (str, './certs'),
+        'account_dir': (str, './accounts'),
+    },
+    'dnsla': {
+        'base_url': (str, 'https://api.dns.la'),
+        'api_id': (str, REQUIRED),
+        'api_secret': (str, REQUIRED),
+        'propagation_seconds': (int, 120),
+    },
+    'certificate': {
+        'key_size': (int, 2048),
+        'renew_days': (int, 30),
+    },
+}
+
+
+# 可选配置段中的集合: (配置段, 键) -> (集合类型, 每一项的必填字段)
+# 配置段未配置时保持缺省（不填充），配置了才校验
+SECTION_ITEMS = {
+    ('letsencrypt', 'accounts'): (list, ('account_dir',)),
+    ('deploy', 'services'): (dict, ('command',)),
+    ('distribute', 'nodes'): (list, ('name', 'path')),
+    ('verify', 'endpoints'): (list, ('url',)),
+}
+# 配置了该段时的必填项
+SECTION_REQUIRED = {
+    'coordination': ('path',),
+    'work_queue': ('path',),
+}
+# 配置段中 host:port 形式的监听地址
+LISTEN_SECTIONS = ('metrics', 'cert_server', 'job_api')
+
+
+def _validate_sections(config: Dict, errors: List[str]) -> None:
+    """校验可选配置段中运行时直接按键读取的字段"""
+    for section in sorted(set(SECTION_REQUIRED) | set(LISTEN_SECTIONS) | {s for s, _ in SECTION_ITEMS}):
+        values = config.get(section)
+        if values is not None and not isinstance(values, dict):
+            errors.append(f"{section}: 应为映射")
+
+    for section, keys in SECTION_REQUIRED.items():
+        values = config.get(section)
+        if isinstance(values, dict):
+            for key in keys:
+                if values.get(key) is None:
+                    errors.append(f"{section}.{key}: 缺少必填项")
+
+    for section in LISTEN_SECTIONS:
+        values = config.get(section)
+        listen = values.get('listen') if isinstance(values, dict) else None
+        if listen is not None and not str(listen).rpartition(':')[2].isdigit():
+            errors.append(f"{section}.listen: 应为 host:port 形式，实际为 {listen!r}")
+
+    for (section, key), (container, fields) in SECTION_ITEMS.items():
+        values = config.get(section)
+        items = values.get(key) if isinstance(values, dict) else None
+        if items is None:
+            continue
+        path = f"{section}.{key}"
+        if not isinstance(items, container):
+            errors.append(f"{path}: 应为{'映射' if container is dict else '列表'}")
+            continue
+        entries = items.items() if container is dict else enumerate(items)
+        for name, item in entries:
+            item_path = f"{path}.{name}" if container is dict else f"{path}[{name}]"
+            if isinstance(item, str) and (section, key) == ('verify', 'endpoints'):
+                # 端点可以直接写URL
+                continue
+            if not isinstance(item, dict):
+                errors.append(f"{item_path}: 应为映射")
+                continue
+            for field in fields:
+                if item.get(field) is None:
+                    errors.append(f"{item_path}.{field}: 缺少必填项")
+
+
+def _check_type(value, expected: type, path: str, errors: List[str]):
+    """检查类型（整数和字符串之间的常见写法会被规范化）"""
+    if expected is str and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    if expected is int and isinstance(value, str) and value.isdigit():
+        return int(value)
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        errors.append(f"{path}: 应为 {expected.__name__}，实际为 {type(value).__name__}")
+    return value
+
+
+def validate(raw) -> Dict:
+    """
+    校验配置并填充默认值
+
+    Args:
+        raw: yaml解析得到的配置
+
+    Returns:
+        规范化后的配置字典
+
+    Raises:
+        ConfigError: 配置无效（列出所有错误）
+    """
+    errors: List[str] = []
+    if not isinstance(raw, dict):
+        raise ConfigError(["配置文件应为YAML映射"])
+    config = dict(raw)
+
+    for section, fields in SCHEMA.items():
+        values = config.get(section)
+        if values is None:
+            values = {}
+        elif not isinstance(values, dict):
+            errors.append(f"{section}: 应为映射")
+            continue
+        values = dict(values)
+        for key, (expected, default) in fields.items():
+            path = f"{section}.{key}"
+            if values.get(key) is None:
+                if default is REQUIRED:
+                    errors.append(f"{path}: 缺少必填项")
+                else:
+                    values[key] = default
+                continue
+            values[key] = _check_type(values[key], expected, path, errors)
+        config[section] = values
+    _validate_sections(config, errors)
+
+    domains = config.get('domains')
+    if not isinstance(domains, list) or not domains:
+        errors.append("domains: 至少需要配置一个域名")
+        domains = []
+    entries = []
+    for i, entry in enumerate(domains):
+        path = f"domains[{i}]"
+        if not isinstance(entry, dict):
+            errors.append(f"{path}: 应为映射")
+            continue
+        entry = dict(entry)
+        for key in ('domain', 'domain_id'):
+            if entry.get(key) is None:
+                errors.append(f"{path}.{key}: 缺少必填项")
+            else:
+                entry[key] = _check_type(entry[key], str, f"{path}.{key}", errors)
+        subdomains = entry.get('subdomains', ['@'])
+        if not isinstance(subdomains, list) or not all(isinstance(s, str) for s in subdomains):
+            errors.append(f"{path}.subdomains: 应为字符串列表")
+            subdomains = ['@']
+        entry['subdomains'] = subdomains
+        entries.append(entry)
+    config['domains'] = entries
+
+    seen = set()
+    for entry in entries:
+        if entry.get('domain') in seen:
+            errors.append(f"domains: 域名 {entry['domain']} 重复配置")
+        seen.add(entry.get('domain'))
+
+    if errors:
+        raise ConfigError(errors)
+    return config
+
+
+def entry_domains(entry: Mapping) -> List[str]:
+    """根据一个域名配置（domain + subdomains）生成域名列表"""
+    base_domain = entry['domain']
+    domains = []
+    for subdomain in entry.get('subdomains', ['@']):
+        if subdomain == '@':
+            domains.append(base_domain)
+        elif subdomain.startswith('*.'):
+            # 通配符域名
+            domains.append(subdomain)
+        else:
+            domains.append(f"{subdomain}.{base_domain}")
+    return domains
+
+
+class CompiledConfig(FrozenDict):
+    """
+    编译后的配置
+
+    与原始配置一样按键访问（只读），另外提供预先计算的索引:
+    - zones: {托管域名: 域名ID}
+    - names: {托管域名: 该域名配置生成的证书域名元组}
+    - all_names: 所有域名配置的主机名清单
+    """
+
+    __slots__ = ('zones', 'names', 'all_names')
+
+    def __init__(self, config: Dict):
+        super().__init__(freeze(config)._data)
+        self.zones = FrozenDict({entry['domain']: entry['domain_id'] for entry in config['domains']})
+        self.names = FrozenDict({entry['domain']: tuple(entry_domains(entry)) for entry in config['domains']})
+        self.all_names = tuple(name for names in self.names.values() for name in names)
+
+    def __getstate__(self):
+        return self._data, self.zones, self.names, self.all_names
+
+    def __setstate__(self, state):
+        self._data, self.zones, self.names, self.all_names = state
+
+    @property
+    def primary(self) -> Mapping:
+        """第一个域名配置（命令行默认使用的域名）"""
+        return self['domains'][0]
+
+
+def yaml_loader() -> type:
+    """YAML加载器（安装了libyaml时使用C解析器）"""
+    # 缓存命中时不需要解析YAML，推迟导入以节省启动时间
+    import yaml
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def compile_config(text: str) -> CompiledConfig:
+    """解析、校验并编译配置文本"""
+    import yaml
+    return CompiledConfig(validate(yaml.load(text, Loader=yaml_loader())))
+
+
+def default_cache_file(config_path: Path) -> Path:
+    return config_path.with_name(f".{config_path.name}.cache")
+
+
+def load_compiled(config_file: str, cache_file: Optional[str] = None) -> CompiledConfig:
+    """
+    加载编译后的配置
+
+    缓存以配置文件内容的SHA-256和 SCHEMA_VERSION 为键；缓存不可用时重新编译并写回。
+
+    Args:
+        config_file: 配置文件路径
+        cache_file: 缓存文件路径（默认与配置文件同目录的 .<文件名>.cache，空字符串表示不使用缓存）
+
+    Raises:
+        FileNotFoundError: 配置文件不存在
+        ConfigError: 配置无效
+    """
+    config_path = Path(config_file)
+    data = config_path.read_bytes()
+    key = (SCHEMA_VERSION, hashlib.sha256(data).hexdigest())
+    cache_path = default_cache_file(config_path) if cache_file is None else (Path(cache_file) if cache_file else None)
+
+    if cache_path and cache_path.exists():
+        try:
+            with open(cache_path, 'rb') as f:
+                # 反序列化pickle可以执行任意代码，只信任当前用户写入的缓存
+                _check_cache_owner(os.fstat(f.fileno()))
+                cached_key, compiled = pickle.load(f)
+            if cached_key == key:
+                return compiled
+        except Exception as e:
+            logger.debug(f"配置缓存不可用: {e}")
+
+    compiled = compile_config(data.decode('utf-8'))
+
+    if cache_path:
+        try:
+            _write_cache(cache_path, key, compiled)
+        except OSError as e:
+            logger.debug(f"写入配置缓存失败: {e}")
+    return compiled
+
+
+def _check_cache_owner(st: os.stat_result) -> None:
+    """
+    检查缓存文件属于当前用户且组和其他用户不可写
+
+    Raises:
+        PermissionError: 缓存文件不可信
+    """
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise PermissionError(f"缓存文件属于其他用户 (uid={st.st_uid})")
+    if st.st_mode & 0o022:
+        raise PermissionError(f"缓存文件可被组或其他用户写入 (mode={st.st_mode & 0o777:o})")
+
+
+def _write_cache(cache_path: Path, key: Tuple, compiled: CompiledConfig) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=str(cache_path.parent), prefix=cache_path.name + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, compiled), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
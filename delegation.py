@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+验证记录CNAME委派
+将 _acme-challenge.<名称> 通过CNAME指向一个专用的小型验证域名，
+验证记录写入该域名而不是生产域名
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from dnsla_client import DNSLAClient
+from fsutil import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class ChallengeDelegation:
+    """
+    查找并缓存验证域名的CNAME目标
+
+    CNAME记录通过DNS.LA API按主机头精确查询（只返回一条记录，与生产域名的大小无关），
+    结果（包括没有CNAME的情况）在内存中缓存，可选持久化到JSON文件供下次运行复用；
+    查询失败不会被当作没有CNAME缓存，没有缓存可用时抛出异常。
+    """
+
+    def __init__(
+            self,
+            dns_client: DNSLAClient,
+            find_zone: Callable[[str], Optional[Tuple[str, str]]],
+            ttl: int = 3600,
+            negative_ttl: int = 300,
+            cache_file: Optional[str] = None,
+            clock: Callable[[], float] = time.time
+    ):
+        """
+        Args:
+            dns_client: DNS.LA客户端
+            find_zone: 查找名称所属托管域名的函数，返回 (托管域名, 域名ID)
+            ttl: CNAME目标的缓存有效期（秒）
+            negative_ttl: 没有CNAME时的缓存有效期（秒）
+            cache_file: 缓存持久化文件（可选）
+            clock: 时间函数（测试时可替换）
+        """
+        self.dns = dns_client
+        self.find_zone = find_zone
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_file = cache_file
+        self.clock = clock
+        self._lock = threading.Lock()
+        # 验证域名 -> (CNAME目标或None, 过期时间)
+        self._cache: Dict[str, Tuple[Optional[str], float]] = self._load()
+
+    def _load(self) -> Dict[str, Tuple[Optional[str], float]]:
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return {name: (target, expires) for name, (target, expires) in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取CNAME缓存失败，将重新查询: {e}")
+            return {}
+
+    def _save(self) -> None:
+        if not self.cache_file:
+            return
+        try:
+            write_atomic(self.cache_file, json.dumps(self._cache, indent=2))
+        except OSError as e:
+            logger.warning(f"保存CNAME缓存失败: {e}")
+
+    def _lookup(self, validation_name: str) -> Optional[str]:
+        """
+        通过DNS.LA API查询验证域名的CNAME记录
+
+        Raises:
+            Exception: API请求失败，或找不到所属托管域名（托管域名查询失败时同样找不到，不能当作没有CNAME）
+        """
+        zone = self.find_zone(validation_name)
+        if zone is None:
+            raise LookupError(f"{validation_name} 不属于任何DNS.LA托管域名")
+        zone_name, zone_id = zone
+        host = validation_name[:-(len(zone_name) + 1)] if validation_name != zone_name else '@'
+
+        records = self.dns.get_record_list(zone_id, record_type='CNAME', host=host, raise_errors=True)
+        if not records:
+            return None
+        return records[0]['data'].rstrip('.')
+
+    def resolve(self, validation_name: str) -> str:
+        """
+        返回实际应写入验证记录的域名
+
+        Args:
+            validation_name: 验证域名（如 _acme-challenge.www.example.com）
+
+        Returns:
+            CNAME目标（存在委派时）或原验证域名
+
+        Raises:
+            Exception: 查询失败且没有缓存（不能确定是否存在委派，不能把记录写入生产域名）
+        """
+        now = self.clock()
+        cached = self._cache.get(validation_name)
+        if cached and cached[1] > now:
+            target = cached[0]
+        else:
+            try:
+                target = self._lookup(validation_name)
+            except Exception as e:
+                if not cached:
+                    logger.error(f"查询 {validation_name} 的CNAME失败: {e}")
+                    raise
+                # 不缓存失败结果；有过期的缓存时继续使用（委派很少变化），下次重新查询
+                logger.warning(f"查询 {validation_name} 的CNAME失败，使用过期的缓存: {e}")
+                return cached[0] or validation_name
+            with self._lock:
+                self._cache[validation_name] = (target, now + (self.ttl if target else self.negative_ttl))
+                self._save()
+
+        if target:
+            logger.info(f"  CNAME委派: {validation_name} -> {target}")
+            return target
+        return validation_name
+
+    def invalidate(self, validation_name: Optional[str] = None) -> None:
+        """清除缓存（不指定名称时清除全部）"""
+        with self._lock:
+            if validation_name:
+                self._cache.pop(validation_name, None)
+            else:
+                self._cache.clear()
+            self._save()
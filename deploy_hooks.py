@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+部署钩子
+在一次运行中按服务收集有变化的证书，运行结束时每个服务只执行一次重载命令；
+多个服务的命令并行执行，带超时，并记录耗时和失败次数
+"""
+
+import fnmatch
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Mapping, Optional, Union
+
+import metrics
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class DeployTarget:
+    """一个需要在证书更新后重载的服务"""
+
+    __slots__ = ('name', 'command', 'domains', 'timeout')
+
+    def __init__(self, name: str, command: Union[str, List[str]],
+                 domains: Iterable[str] = ('*',), timeout: Optional[float] = None):
+        """
+        Args:
+            name: 服务名称（如 nginx、mysql）
+            command: 重载命令（字符串按shell语法拆分，不经过shell执行）
+            domains: 触发重载的证书域名或通配模式（匹配证书目录名或证书中的任一域名）
+            timeout: 命令超时（秒），为空时使用 DeployHooks 的默认值
+        """
+        self.name = name
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.domains = [domain.lower() for domain in domains]
+        self.timeout = timeout
+
+    def wants(self, names: Iterable[str]) -> bool:
+        return any(fnmatch.fnmatchcase(name.lower(), pattern) for pattern in self.domains for name in names)
+
+
+class HookResult:
+    """一次重载命令的执行结果"""
+
+    __slots__ = ('service', 'domains', 'returncode', 'duration', 'error', 'output', 'timed_out')
+
+    def __init__(self, service: str, domains: List[str], returncode: Optional[int],
+                 duration: float, error: str = '', output: str = '', timed_out: bool = False):
+        self.service = service
+        self.domains = domains
+        self.returncode = returncode
+        self.duration = duration
+        self.error = error
+        self.output = output
+        self.timed_out = timed_out
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.error and not self.timed_out
+
+    @property
+    def failure_reason(self) -> str:
+        if self.timed_out:
+            return 'timeout'
+        return 'error' if self.error else 'exit'
+
+    def __repr__(self) -> str:
+        return f"HookResult({self.service!r}, certificates={len(self.domains)}, returncode={self.returncode}, error={self.error!r})"
+
+
+class DeployHooks:
+    """
+    部署钩子
+
+    notify() 记录有变化的证书，flush() 为每个受影响的服务执行一次重载命令。
+    命令的环境变量:
+        DEPLOY_SERVICE: 服务名称
+        DEPLOY_DOMAINS: 有变化的证书（主域名，空格分隔）
+        DEPLOY_CERT_PATHS: 有变化的证书目录（os.pathsep 分隔）
+    """
+
+    def __init__(self, targets: List[DeployTarget], timeout: float = 60, max_workers: int = 4):
+        """
+        Args:
+            targets: 服务列表
+            timeout: 默认命令超时（秒）
+            max_workers: 最多并行执行的命令数
+        """
+        self.targets = targets
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        # 服务名称 -> {主域名: 证书目录}
+        self._pending: Dict[str, Dict[str, str]] = {}
+        # 主域名 -> {服务名称: 证书变化后最近一次执行结果}
+        self._results: Dict[str, Dict[str, HookResult]] = {}
+        # 同时只执行一次 flush，等待中的调用可以看到进行中的 flush 的结果
+        self._flush_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> 'DeployHooks':
+        """
+        根据配置创建
+
+        配置示例:
+            deploy:
+              timeout: 60
+              max_workers: 4
+              services:
+                nginx:
+                  command: "systemctl reload nginx"
+                mysql:
+                  command: "mysql -e 'ALTER INSTANCE RELOAD TLS'"
+                  domains: ["db.example.com"]
+                  timeout: 30
+        """
+        targets = [
+            DeployTarget(name, service['command'], service.get('domains', ('*',)), service.get('timeout'))
+            for name, service in (config.get('services') or {}).items()
+        ]
+        return cls(targets, timeout=config.get('timeout', 60), max_workers=config.get('max_workers', 4))
+
+    def notify(self, domain: str, cert_path: str, names: Iterable[str] = ()) -> List[str]:
+        """
+        记录一个有变化的证书
+
+        Args:
+            domain: 证书主域名
+            cert_path: 证书目录
+            names: 证书中的域名
+
+        Returns:
+            需要重载的服务名称
+        """
+        names = [domain] + list(names)
+        services = [target.name for target in self.targets if target.wants(names)]
+        with self._lock:
+            for service in services:
+                self._pending.setdefault(service, {})[domain] = str(cert_path)
+            self._results.pop(domain, None)
+        return services
+
+    def pending(self) -> Dict[str, List[str]]:
+        """{服务名称: 有变化的证书主域名}"""
+        with self._lock:
+            return {service: sorted(certs) for service, certs in self._pending.items()}
+
+    def results_for(self, domain: str) -> Dict[str, HookResult]:
+        """证书最近一次变化后各服务的执行结果（包括由其他线程的 flush 执行的重载）"""
+        with self._lock:
+            return dict(self._results.get(domain, {}))
+
+    def _run(self, target: DeployTarget, certs: Dict[str, str]) -> HookResult:
+        domains = sorted(certs)
+        env = dict(os.environ)
+        env.update({
+            'DEPLOY_SERVICE': target.name,
+            'DEPLOY_DOMAINS': ' '.join(domains),
+            'DEPLOY_CERT_PATHS': os.pathsep.join(certs[domain] for domain in domains),
+        })
+        timeout = target.timeout if target.timeout is not None else self.timeout
+
+        start = time.perf_counter()
+        with tracer.span('deploy.hook', service=target.name, certificates=len(domains)) as span:
+            try:
+                process = subprocess.Popen(
+                    target.command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    text=True, start_new_session=(os.name == 'posix')
+                )
+            except OSError as e:
+                result = HookResult(target.name, domains, None, time.perf_counter() - start, error=str(e))
+            else:
+                try:
+                    output, _ = process.communicate(timeout=timeout)
+                    result = HookResult(target.name, domains, process.returncode,
+                                        time.perf_counter() - start, output=output.strip())
+                except subprocess.TimeoutExpired:
+                    self._kill(process)
+                    output, _ = process.communicate()
+                    result = HookResult(target.name, domains, process.returncode, time.perf_counter() - start,
+                                        error=f"超时 ({timeout} 秒)", output=(output or '').strip(), timed_out=True)
+            span.set_attribute('success', result.ok)
+
+        metrics.DEPLOY_HOOK_SECONDS.observe(result.duration, service=target.name)
+        if result.ok:
+            logger.info(f"已重载 {target.name}（{len(domains)} 个证书，{result.duration:.2f} 秒）")
+        else:
+            metrics.DEPLOY_HOOK_FAILURES.inc(service=target.name, reason=result.failure_reason)
+            logger.error(f"重载 {target.name} 失败: {result.error or f'退出码 {result.returncode}'} {result.output}")
+        return result
+
+    @staticmethod
+    def _kill(process: subprocess.Popen) -> None:
+        """结束命令及其子进程"""
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError:
+            pass
+
+    def flush(self) -> Dict[str, HookResult]:
+        """
+        为每个有变化证书的服务执行一次重载命令（并行）
+
+        执行失败的服务的证书重新加入待处理列表，下一次 flush 时重试。
+
+        Returns:
+            {服务名称: 执行结果}
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return {}
+
+            targets = {target.name: target for target in self.targets}
+            jobs = [(targets[service], certs) for service, certs in pending.items()]
+            logger.info(f"执行部署钩子: {', '.join(f'{t.name}({len(c)})' for t, c in jobs)}")
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(jobs))) as executor:
+                results = list(executor.map(lambda job: self._run(*job), jobs))
+            self._record(pending, results)
+        return {result.service: result for result in results}
+
+    def _record(self, pending: Dict[str, Dict[str, str]], results: List[HookResult]) -> None:
+        with self._lock:
+            for result in results:
+                for domain in result.domains:
+                    # 执行期间又有变化的证书等待下一次执行的结果
+                    if domain not in self._pending.get(result.service, {}):
+                        self._results.setdefault(domain, {})[result.service] = result
+                if not result.ok:
+                    # 执行期间又有变化的证书保留较新的路径
+                    certs = self._pending.setdefault(result.service, {})
+                    for domain, cert_path in pending[result.service].items():
+                        certs.setdefault(domain, cert_path)
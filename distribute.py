@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+证书分发
+把证书目录中的证书包并行推送到多个节点（SSH、本地/挂载目录），或发布为
+供节点通过HTTP拉取的归档；按内容哈希跳过未变化的证书包，并向节点发送变化通知
+"""
+
+import fnmatch
+import hashlib
+import io
+import json
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Mapping, Optional
+
+import metrics
+from bundle_formats import FORMATS
+from fsutil import write_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SSH_COMMAND = ('ssh', '-o', 'BatchMode=yes')
+
+
+def private_files() -> set:
+    """包含私钥的文件名（privkey.pem 和权限为0600的证书包格式）"""
+    return {'privkey.pem'} | {fmt.filename for fmt in FORMATS.values() if fmt.mode & 0o077 == 0}
+
+
+class Bundle:
+    """一个证书目录（证书、证书链、私钥等文件）及其内容哈希"""
+
+    __slots__ = ('domain', 'path', 'files', 'digest')
+
+    def __init__(self, domain: str, path: Path, files: List[str], digest: str):
+        self.domain = domain
+        self.path = path
+        self.files = files
+        self.digest = digest
+
+    @classmethod
+    def load(cls, path: Path) -> 'Bundle':
+        """读取目录中的所有普通文件（忽略隐藏文件）并计算哈希"""
+        sha256 = hashlib.sha256()
+        files = []
+        for file in sorted(path.iterdir()):
+            if file.is_file() and not file.name.startswith('.'):
+                files.append(file.name)
+                sha256.update(file.name.encode() + b'\0')
+                sha256.update(file.read_bytes())
+                sha256.update(b'\0')
+        return cls(path.name, path, files, sha256.hexdigest())
+
+    def add_to(self, archive: tarfile.TarFile, exclude: Iterable[str] = ()) -> None:
+        """以 <域名>/<文件名> 的形式加入tar归档（保留文件权限）"""
+        exclude = set(exclude)
+        for name in self.files:
+            if name not in exclude:
+                archive.add(str(self.path / name), arcname=f"{self.domain}/{name}")
+
+    def __repr__(self) -> str:
+        return f"Bundle({self.domain!r}, digest={self.digest[:12]})"
+
+
+def load_bundles(cert_dir: str) -> Dict[str, Bundle]:
+    """扫描证书目录中的证书包（包含 fullchain.pem 的子目录）"""
+    bundles = {}
+    root = Path(cert_dir)
+    if not root.exists():
+        return bundles
+    for path in sorted(root.iterdir()):
+        if path.is_dir() and (path / 'fullchain.pem').exists():
+            bundles[path.name] = Bundle.load(path)
+    return bundles
+
+
+def make_archive(bundles: Iterable[Bundle], exclude: Iterable[str] = ()) -> bytes:
+    buffer = io.BytesIO()
+    # chain.pem 可能是指向证书链存储的链接，归档中保存为普通文件
+    with tarfile.open(fileobj=buffer, mode='w', dereference=True) as archive:
+        for bundle in bundles:
+            bundle.add_to(archive, exclude)
+    return buffer.getvalue()
+
+
+def _swap_script(base: str) -> str:
+    """远程shell脚本: 从标准输入解包，逐个目录替换（旧目录先移走再删除）"""
+    base = shlex.quote(base)
+    return (
+        f'set -e; base={base}; mkdir -p "$base"; incoming="$base/.incoming.$$"; '
+        'mkdir -p "$incoming"; tar -x -C "$incoming"; '
+        'for dir in "$incoming"/*; do name=$(basename "$dir"); '
+        'rm -rf "$base/.old.$name"; '
+        'if [ -e "$base/$name" ]; then mv "$base/$name" "$base/.old.$name"; fi; '
+        'mv "$dir" "$base/$name"; rm -rf "$base/.old.$name"; done; '
+        'rmdir "$incoming"'
+    )
+
+
+class Node:
+    """一个分发目标节点"""
+
+    __slots__ = ('name', 'transport', 'path', 'host', 'user', 'port', 'domains',
+                 'notify_url', 'remote_command', 'base_url')
+
+    def __init__(
+            self,
+            name: str,
+            transport: str,
+            path: str,
+            host: Optional[str] = None,
+            user: Optional[str] = None,
+            port: Optional[int] = None,
+            domains: Iterable[str] = ('*',),
+            notify_url: Optional[str] = None,
+            remote_command: Optional[str] = None,
+            base_url: Optional[str] = None
+    ):
+        """
+        Args:
+            name: 节点名称
+            transport: ssh、local 或 pull
+            path: 节点上的证书目录（ssh、local），或拉取归档的发布目录（pull）
+            host: SSH主机
+            user: SSH用户
+            port: SSH端口
+            domains: 分发到该节点的证书（域名或通配模式）
+            notify_url: 有变化时POST变化通知（JSON）的地址
+            remote_command: 有变化时在节点上执行的命令（仅ssh）
+            base_url: 拉取归档的HTTP地址前缀（仅pull，写入变化通知）
+        """
+        if transport not in TRANSPORTS:
+            raise ValueError(f"节点 {name}: 不支持的传输方式 {transport}")
+        if transport == 'ssh' and not host:
+            raise ValueError(f"节点 {name}: ssh 传输需要 host")
+        self.name = name
+        self.transport = transport
+        self.path = path
+        self.host = host
+        self.user = user
+        self.port = port
+        self.domains = [domain.lower() for domain in domains]
+        self.notify_url = notify_url
+        self.remote_command = remote_command
+        self.base_url = base_url
+
+    @classmethod
+    def from_config(cls, item: Mapping) -> 'Node':
+        return cls(
+            item['name'], item.get('transport', 'ssh'), item['path'],
+            host=item.get('host'), user=item.get('user'), port=item.get('port'),
+            domains=item.get('domains', ('*',)), notify_url=item.get('notify_url'),
+            remote_command=item.get('remote_command'), base_url=item.get('base_url')
+        )
+
+    def wants(self, domain: str) -> bool:
+        return any(fnmatch.fnmatchcase(domain.lower(), pattern) for pattern in self.domains)
+
+
+class NodeResult:
+    """一个节点的分发结果"""
+
+    __slots__ = ('node', 'sent', 'skipped', 'duration', 'error')
+
+    def __init__(self, node: str, sent: List[str], skipped: int, duration: float, error: str = ''):
+        self.node = node
+        self.sent = sent
+        self.skipped = skipped
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+    def __repr__(self) -> str:
+        return f"NodeResult({self.node!r}, sent={len(self.sent)}, skipped={self.skipped}, error={self.error!r})"
+
+
+def _ssh_transfer(distributor: 'Distributor', node: Node, bundles: List[Bundle]) -> None:
+    """通过一次SSH连接以tar流推送所有变化的证书包"""
+    target = f"{node.user}@{node.host}" if node.user else node.host
+    command = list(distributor.ssh_command)
+    if node.port:
+        command += ['-p', str(node.port)]
+    script = _swap_script(node.path)
+    if node.remote_command:
+        domains = shlex.quote(' '.join(bundle.domain for bundle in bundles))
+        script += f'; export DEPLOY_DOMAINS={domains}; {node.remote_command}'
+    command += [target, script]
+    completed = subprocess.run(command, input=make_archive(bundles), stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, timeout=distributor.timeout)
+    if completed.returncode != 0:
+        raise RuntimeError(f"ssh 退出码 {completed.returncode}: {completed.stderr.decode('utf-8', 'replace').strip()}")
+
+
+def _local_transfer(distributor: 'Distributor', node: Node, bundles: List[Bundle]) -> None:
+    """复制到本地或挂载的目录（先复制到临时目录再替换）"""
+    base = Path(node.path)
+    base.mkdir(parents=True, exist_ok=True)
+    for bundle in bundles:
+        incoming = Path(tempfile.mkdtemp(dir=str(base), prefix='.incoming.'))
+        for name in bundle.files:
+            shutil.copy2(str(bundle.path / name), str(incoming / name))
+        target, old = base / bundle.domain, base / f'.old.{bundle.domain}'
+        shutil.rmtree(str(old), ignore_errors=True)
+        if target.exists():
+            os.replace(str(target), str(old))
+        os.replace(str(incoming), str(target))
+        shutil.rmtree(str(old), ignore_errors=True)
+
+
+def _publish_pull(distributor: 'Distributor', node: Node, bundles: List[Bundle]) -> None:
+    """
+    发布供节点通过HTTP拉取的归档
+
+    发布目录（由任意静态HTTP服务器提供）中每个证书一个 <域名>.tar，
+    manifest.json 记录 {域名: 哈希}，节点比较哈希后只下载变化的归档。
+    静态服务器没有认证，归档中不包含私钥（privkey.pem、PKCS#12、HAProxy合并PEM），
+    节点通过需要令牌的证书服务API（cert_server）获取私钥。
+    """
+    base = Path(node.path)
+    base.mkdir(parents=True, exist_ok=True)
+    exclude = private_files()
+    for bundle in bundles:
+        write_atomic(str(base / f'{bundle.domain}.tar'), make_archive([bundle], exclude))
+
+    manifest_file = base / 'manifest.json'
+    manifest = {}
+    if manifest_file.exists():
+        manifest = json.loads(manifest_file.read_text(encoding='utf-8'))
+    manifest.update({bundle.domain: bundle.digest for bundle in bundles})
+    write_atomic(str(manifest_file), json.dumps(manifest, indent=2, sort_keys=True))
+
+
+TRANSPORTS: Dict[str, Callable[['Distributor', Node, List[Bundle]], None]] = {
+    'ssh': _ssh_transfer,
+    'local': _local_transfer,
+    'pull': _publish_pull,
+}
+
+
+class Distributor:
+    """
+    证书分发器
+
+    每个节点已收到的证书包哈希保存在状态文件中，只传输哈希变化的证书包；
+    节点之间并行，同一节点的所有变化一次传输。传输成功后向节点发送变化通知。
+    """
+
+    def __init__(
+            self,
+            nodes: List[Node],
+            state_file: Optional[str] = None,
+            max_workers: int = 8,
+            timeout: float = 120,
+            ssh_command: Iterable[str] = DEFAULT_SSH_COMMAND
+    ):
+        """
+        Args:
+            nodes: 节点列表
+            state_file: 分发状态文件（可选，未设置时每次运行都完整分发）
+            max_workers: 最多并行的节点数
+            timeout: 单个节点传输和通知的超时（秒）
+            ssh_command: ssh命令及公共参数
+        """
+        self.nodes = nodes
+        self.state_file = state_file
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.ssh_command = tuple(ssh_command)
+        self._lock = threading.Lock()
+        # 节点名称 -> {域名: 已分发的哈希}
+        self.state: Dict[str, Dict[str, str]] = self._load()
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> 'Distributor':
+        """
+        根据配置创建
+
+        配置示例:
+            distribute:
+              state_file: "./distribution-state.json"
+              max_workers: 8
+              nodes:
+                - name: web1
+                  transport: ssh
+                  host: web1.internal
+                  user: deploy
+                  path: /etc/ssl/letsencrypt
+                  remote_command: "sudo systemctl reload nginx"
+                - name: sidecars
+                  transport: pull
+                  path: /var/www/cert-bundles
+                  base_url: "https://certs.internal/bundles"
+                  notify_url: "https://hooks.internal/certs"
+        """
+        return cls(
+            [Node.from_config(item) for item in config.get('nodes') or []],
+            state_file=config.get('state_file'),
+            max_workers=config.get('max_workers', 8),
+            timeout=config.get('timeout', 120),
+            ssh_command=config.get('ssh_command') or DEFAULT_SSH_COMMAND
+        )
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取分发状态失败: {e}")
+            return {}
+
+    def _save(self) -> None:
+        if self.state_file:
+            write_atomic(self.state_file, json.dumps(self.state, indent=2, sort_keys=True))
+
+    def changes(self, node: Node, bundles: Dict[str, Bundle]) -> List[Bundle]:
+        """节点需要更新的证书包（哈希与上次分发不同）"""
+        sent = self.state.get(node.name, {})
+        return [bundle for domain, bundle in bundles.items()
+                if node.wants(domain) and sent.get(domain) != bundle.digest]
+
+    def _notify(self, node: Node, bundles: List[Bundle]) -> None:
+        """POST变化通知: {"node": 名称, "changed": [{"domain", "digest", "url"?}, ...]}"""
+        changed = []
+        for bundle in bundles:
+            item = {'domain': bundle.domain, 'digest': bundle.digest}
+            if node.base_url:
+                item['url'] = f"{node.base_url.rstrip('/')}/{bundle.domain}.tar"
+            changed.append(item)
+        body = json.dumps({'node': node.name, 'changed': changed}).encode('utf-8')
+        request = urllib.request.Request(node.notify_url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def _distribute_node(self, node: Node, bundles: Dict[str, Bundle], force: bool) -> NodeResult:
+        wanted = [bundle for domain, bundle in bundles.items() if node.wants(domain)]
+        changed = wanted if force else self.changes(node, bundles)
+        skipped = len(wanted) - len(changed)
+        if not changed:
+            metrics.DISTRIBUTED_BUNDLES.inc(skipped, node=node.name, outcome='skipped')
+            return NodeResult(node.name, [], skipped, 0.0)
+
+        start = time.perf_counter()
+        try:
+            TRANSPORTS[node.transport](self, node, changed)
+        except Exception as e:
+            duration = time.perf_counter() - start
+            logger.error(f"分发到节点 {node.name} 失败: {e}")
+            metrics.DISTRIBUTED_BUNDLES.inc(len(changed), node=node.name, outcome='failed')
+            return NodeResult(node.name, [], skipped, duration, error=str(e))
+
+        if node.notify_url:
+            try:
+                self._notify(node, changed)
+            except Exception as e:
+                # 不记录分发状态，下次运行重新传输（传输是幂等的）并再次通知
+                duration = time.perf_counter() - start
+                error = f"通知失败: {e}"
+                logger.warning(f"节点 {node.name} {error}")
+                metrics.DISTRIBUTED_BUNDLES.inc(len(changed), node=node.name, outcome='failed')
+                return NodeResult(node.name, [], skipped, duration, error=error)
+
+        with self._lock:
+            sent = self.state.setdefault(node.name, {})
+            sent.update({bundle.domain: bundle.digest for bundle in changed})
+            self._save()
+        metrics.DISTRIBUTED_BUNDLES.inc(len(changed), node=node.name, outcome='sent')
+        if skipped:
+            metrics.DISTRIBUTED_BUNDLES.inc(skipped, node=node.name, outcome='skipped')
+        duration = time.perf_counter() - start
+        logger.info(f"已分发 {len(changed)} 个证书到节点 {node.name}（跳过 {skipped} 个，{duration:.2f} 秒）")
+        return NodeResult(node.name, [bundle.domain for bundle in changed], skipped, duration)
+
+    def distribute(self, cert_dir: str, nodes: Optional[Iterable[str]] = None,
+                   force: bool = False) -> List[NodeResult]:
+        """
+        分发证书目录中的证书包
+
+        Args:
+            cert_dir: 证书存储目录
+            nodes: 只分发到这些节点（默认全部）
+            force: 忽略已分发的哈希，全部重新传输
+
+        Returns:
+            每个节点的分发结果
+        """
+        bundles = load_bundles(cert_dir)
+        selected = None if nodes is None else set(nodes)
+        targets = [node for node in self.nodes if selected is None or node.name in selected]
+        if not targets:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(targets))) as executor:
+            return list(executor.map(lambda node: self._distribute_node(node, bundles, force), targets))
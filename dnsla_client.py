@@ -7,15 +7,170 @@ DNS.LA API 客户端
 import base64
 import json
 import logging
+import threading
 import time
-from typing import Dict, List, Optional
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 
 import requests
 
+from tracing import tracer
+
+try:
+    import ijson
+except ImportError:  # 可选依赖: 未安装时按页整体解析
+    ijson = None
 
 logger = logging.getLogger(__name__)
 
 
+class DNSLAError(Exception):
+    """DNS.LA返回的业务错误（响应中的 code 不是200）"""
+
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+    @property
+    def ttl_rejected(self) -> bool:
+        """请求因TTL低于托管域名（套餐）允许的最小值被拒绝（错误信息提到TTL）"""
+        return self.code != 500 and 'ttl' in str(self).lower()
+
+
+class DNSRecord:
+    """
+    精简的DNS记录
+
+    只保留颁发流程和批量扫描用到的字段，使用 __slots__ 避免每条记录一个字典。
+    """
+
+    __slots__ = ('id', 'host', 'type', 'data', 'ttl', 'disable')
+
+    def __init__(self, id: str, host: str = '', type: int = 0, data: str = '', ttl: int = 0, disable: bool = False):
+        self.id = id
+        self.host = host
+        self.type = type
+        self.data = data
+        self.ttl = ttl
+        self.disable = disable
+
+    @classmethod
+    def from_dict(cls, record: Dict) -> 'DNSRecord':
+        return cls(**{key: record[key] for key in cls.__slots__ if key in record})
+
+    def __repr__(self) -> str:
+        return f"DNSRecord(id={self.id!r}, host={self.host!r}, type={self.type}, data={self.data!r})"
+
+
+def _parse_record_page(response: requests.Response) -> Dict:
+    """
+    解析记录列表响应，结果中的记录直接构造为 DNSRecord
+
+    安装了 ijson 时从响应流中逐条构造记录，不会在内存中保留完整的JSON文档；
+    否则按页整体解析后立即转换。
+    """
+    if ijson is None:
+        payload = response.json()
+        data = payload.get('data') or {}
+        payload['data'] = {
+            'total': data.get('total', 0),
+            'results': [DNSRecord.from_dict(record) for record in data.get('results') or []],
+        }
+        return payload
+
+    results: List[DNSRecord] = []
+    payload = {'data': {'total': 0, 'results': results}}
+    fields = None
+    response.raw.decode_content = True
+    for prefix, event, value in ijson.parse(response.raw):
+        if prefix == 'data.results.item':
+            if event == 'start_map':
+                fields = {}
+            elif event == 'end_map':
+                results.append(DNSRecord(**fields))
+                fields = None
+        elif fields is not None:
+            key = prefix[len('data.results.item.'):]
+            if key in DNSRecord.__slots__:
+                fields[key] = value
+        elif prefix in ('code', 'msg'):
+            payload[prefix] = value
+        elif prefix == 'data.total':
+            payload['data']['total'] = value
+    return payload
+
+
+class RequestCounter:
+    """
+    DNS.LA请求计数钩子
+
+    按 (操作, HTTP方法, 端点) 统计请求次数，用于检查每个操作的API调用预算。
+
+    用法:
+        with client.count_requests() as counter:
+            with counter.operation('issue'):
+                manager.issue_certificate(domains)
+        counter.assert_budget({'POST /api/record': 2, 'GET /api/recordList': 1}, operation='issue')
+    """
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self._local = threading.local()
+
+    def __call__(self, method: str, endpoint: str, duration: float, error) -> None:
+        operation = getattr(self._local, 'operation', None)
+        self.counts[(operation, method, endpoint)] += 1
+
+    @contextmanager
+    def operation(self, name: str):
+        """在上下文内发出的请求归入指定操作"""
+        previous = getattr(self._local, 'operation', None)
+        self._local.operation = name
+        try:
+            yield self
+        finally:
+            self._local.operation = previous
+
+    def by_endpoint(self, operation: Optional[str] = None) -> Dict[str, int]:
+        """
+        按端点汇总请求次数
+
+        Args:
+            operation: 只统计指定操作（为空时统计全部）
+
+        Returns:
+            {'GET /api/recordList': 次数, ...}
+        """
+        result: Dict[str, int] = {}
+        for (op, method, endpoint), count in self.counts.items():
+            if operation is None or op == operation:
+                key = f"{method} {endpoint}"
+                result[key] = result.get(key, 0) + count
+        return result
+
+    def total(self, operation: Optional[str] = None) -> int:
+        return sum(self.by_endpoint(operation).values())
+
+    def assert_budget(self, budget: Dict[str, int], operation: Optional[str] = None) -> None:
+        """
+        检查请求次数是否在预算内
+
+        Args:
+            budget: {'METHOD /endpoint': 最大次数}，未列出的端点预算为0
+            operation: 只检查指定操作
+
+        Raises:
+            AssertionError: 超出预算
+        """
+        actual = self.by_endpoint(operation)
+        over = {key: (count, budget.get(key, 0)) for key, count in actual.items()
+                if count > budget.get(key, 0)}
+        if over:
+            details = ', '.join(f"{key}: {count} > {limit}" for key, (count, limit) in sorted(over.items()))
+            raise AssertionError(f"DNS.LA请求超出预算: {details}")
+
+
 class DNSLAClient:
     """DNS.LA API客户端"""
     
@@ -46,6 +201,9 @@ class DNSLAClient:
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
         
+        # 请求钩子: hook(method, endpoint, duration, error)，用于指标和调用计数
+        self.request_hooks: List[Callable] = []
+        
         # 计算Basic Auth token
         self.auth_token = self._calculate_auth_token()
         self.session.headers.update({
@@ -67,13 +225,20 @@ class DNSLAClient:
         logger.debug(f"计算得到的Auth Token: {token}")
         return token
     
-    def _request(self, method: str, endpoint: str, **kwargs) -> Dict:
+    def _request(
+        self,
+        method: str,
+        endpoint: str,
+        parse: Optional[Callable[[requests.Response], Dict]] = None,
+        **kwargs
+    ) -> Dict:
         """
         发送API请求
         
         Args:
             method: HTTP方法
             endpoint: API端点
+            parse: 响应解析函数（指定时以流的方式读取响应）
             **kwargs: 其他请求参数
             
         Returns:
@@ -83,38 +248,74 @@ class DNSLAClient:
             Exception: API请求失败时抛出异常
         """
         url = f"{self.base_url}{endpoint}"
+        start = time.perf_counter()
+        error = None
         
-        try:
-            response = self.session.request(method, url, **kwargs)
-            response.raise_for_status()
+        with tracer.span('dnsla.request', method=method, endpoint=endpoint):
+            try:
+                response = self.session.request(method, url, stream=parse is not None, **kwargs)
+                response.raise_for_status()
+                
+                with response:
+                    data = parse(response) if parse else response.json()
+                
+                if data.get('code') != 200:
+                    error_msg = data.get('msg', 'Unknown error')
+                    raise DNSLAError(f"API错误: {error_msg} (code: {data.get('code')})", data.get('code'))
+                
+                return data
             
-            data = response.json()
-            
-            if data.get('code') != 200:
-                error_msg = data.get('msg', 'Unknown error')
-                raise Exception(f"API错误: {error_msg} (code: {data.get('code')})")
-            
-            return data
-        
-        except requests.exceptions.RequestException as e:
-            logger.error(f"API请求失败: {e}")
-            raise
+            except requests.exceptions.RequestException as e:
+                error = e
+                logger.error(f"API请求失败: {e}")
+                raise
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                if self.request_hooks:
+                    duration = time.perf_counter() - start
+                    for hook in self.request_hooks:
+                        hook(method, endpoint, duration, error)
     
-    def get_domain_info(self, domain: str) -> Optional[Dict]:
+    @contextmanager
+    def count_requests(self):
+        """临时挂载一个RequestCounter，退出上下文时移除"""
+        counter = RequestCounter()
+        self.request_hooks.append(counter)
+        try:
+            yield counter
+        finally:
+            self.request_hooks.remove(counter)
+    
+    def get_domain_info(self, domain: str, raise_errors: bool = False) -> Optional[Dict]:
         """
         获取域名信息
         
         Args:
             domain: 域名
+            raise_errors: 查询失败（网络、认证、服务端错误）时抛出异常，只有明确的不存在才返回None
+                          （默认记录日志并返回None，无法与域名不存在区分）
             
         Returns:
             域名信息字典，如果域名不存在返回None
         """
         try:
             response = self._request('GET', f'/api/domain', params={'domain': domain})
-            return response.get('data')
+            return response.get('data') or None
+        except DNSLAError as e:
+            # 业务错误码400（请求错误）表示账户下没有这个域名
+            if e.code == 400:
+                logger.debug(f"域名不存在: {domain} ({e})")
+                return None
+            logger.error(f"获取域名信息失败: {e}")
+            if raise_errors:
+                raise
+            return None
         except Exception as e:
             logger.error(f"获取域名信息失败: {e}")
+            if raise_errors:
+                raise
             return None
     
     def get_record_list(
@@ -125,6 +326,7 @@ class DNSLAClient:
         record_type: Optional[str] = None,
         host: Optional[str] = None,
         data: Optional[str] = None,
+        raise_errors: bool = False,
     ) -> List[Dict]:
         """
         获取DNS记录列表
@@ -136,6 +338,7 @@ class DNSLAClient:
             record_type: 记录类型（如'TXT'）
             host: 主机头
             data: 记录值
+            raise_errors: 请求失败时抛出异常（默认记录日志并返回空列表，无法与没有记录区分）
             
         Returns:
             DNS记录列表
@@ -160,8 +363,55 @@ class DNSLAClient:
             return records
         except Exception as e:
             logger.error(f"获取DNS记录列表失败: {e}")
+            if raise_errors:
+                raise
             return []
     
+    def iter_records(
+        self,
+        domain_id: str,
+        record_type: Optional[str] = None,
+        host: Optional[str] = None,
+        page_size: int = 100
+    ) -> Iterator[DNSRecord]:
+        """
+        逐页遍历DNS记录
+        
+        每次只保留一页记录，适合扫描大型域名。按响应中的 total 判断是否还有下一页，
+        列表查询次数为 ceil(匹配记录数 / page_size)，至少1次；
+        服务器单页上限小于 page_size 时按实际返回的条数继续翻页。
+        
+        Args:
+            domain_id: 域名ID
+            record_type: 记录类型（如'TXT'）
+            host: 主机头
+            page_size: 每页记录数
+            
+        Yields:
+            DNSRecord
+        """
+        params = {'pageSize': page_size, 'domainId': domain_id}
+        if record_type:
+            params['type'] = self.RECORD_TYPES.get(record_type.upper())
+        if host is not None:
+            params['host'] = host
+        
+        page_index = 1
+        seen = 0
+        while True:
+            params['pageIndex'] = page_index
+            try:
+                response = self._request('GET', '/api/recordList', parse=_parse_record_page, params=params)
+            except Exception as e:
+                logger.error(f"获取DNS记录列表失败: {e}")
+                return
+            records = response['data']['results']
+            yield from records
+            seen += len(records)
+            if not records or seen >= response['data']['total']:
+                return
+            page_index += 1
+    
     def add_record(
         self,
         domain_id: str,
@@ -169,6 +419,7 @@ class DNSLAClient:
         host: str,
         data: str,
         ttl: int = 600,
+        raise_errors: bool = False,
         **kwargs
     ) -> Optional[str]:
         """
@@ -180,6 +431,7 @@ class DNSLAClient:
             host: 主机头
             data: 记录值
             ttl: TTL值
+            raise_errors: 请求失败时抛出异常（默认记录日志并返回None）
             **kwargs: 其他参数（groupId, lineId, preference, weight, dominant）
             
         Returns:
@@ -205,6 +457,8 @@ class DNSLAClient:
             return record_id
         except Exception as e:
             logger.error(f"添加DNS记录失败: {e}")
+            if raise_errors:
+                raise
             return None
     
     def delete_record(self, record_id: str) -> bool:
@@ -276,12 +530,43 @@ class DNSLAClient:
             data=value
         )
     
+    def find_txt_records_for_hosts(
+        self,
+        domain_id: str,
+        hosts: Iterable[str],
+        page_size: int = 100
+    ) -> List[DNSRecord]:
+        """
+        一次性查找多个主机头的TXT记录
+        
+        只有一个主机头时按主机头筛选；多个主机头时分页列出全部TXT记录后在本地过滤，
+        避免每个主机头单独查询一次。此时列表查询次数取决于区域中的TXT记录总数：
+        ceil(TXT记录数 / page_size)，至少1次；TXT记录不超过 page_size 时为1次。
+        
+        Args:
+            domain_id: 域名ID
+            hosts: 主机头集合
+            page_size: 每页记录数
+            
+        Returns:
+            匹配的TXT记录列表
+        """
+        hosts = set(hosts)
+        if not hosts:
+            return []
+        if len(hosts) == 1:
+            records = self.iter_records(domain_id, record_type='TXT', host=next(iter(hosts)), page_size=page_size)
+        else:
+            records = self.iter_records(domain_id, record_type='TXT', page_size=page_size)
+        return [record for record in records if record.host in hosts]
+    
     def add_txt_record(
         self,
         domain_id: str,
         host: str,
         value: str,
-        ttl: int = 600
+        ttl: int = 600,
+        raise_errors: bool = False
     ) -> Optional[str]:
         """
         添加TXT记录（用于ACME验证）
@@ -291,6 +576,7 @@ class DNSLAClient:
             host: 主机头
             value: TXT记录值
             ttl: TTL值（默认600秒，10分钟）
+            raise_errors: 请求失败时抛出异常（默认记录日志并返回None）
             
         Returns:
             新记录的ID，失败返回None
@@ -301,7 +587,8 @@ class DNSLAClient:
             record_type='TXT',
             host=host,
             data=value,
-            ttl=ttl
+            ttl=ttl,
+            raise_errors=raise_errors
         )
     
     def delete_txt_records(self, domain_id: str, host: str) -> int:
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+文件系统工具
+原子写入证书、密钥和状态文件
+"""
+
+import os
+import tempfile
+from typing import Union
+
+
+def write_atomic(path: str, content: Union[str, bytes], mode: int = 0o644) -> None:
+    """
+    先写临时文件再重命名，避免读取方看到半写入的文件（content为bytes时按二进制写入）
+
+    重命名前把临时文件刷到磁盘，断电后不会留下指向空文件的新名称。
+
+    Args:
+        path: 目标文件路径（目录不存在时自动创建）
+        content: 文件内容
+        mode: 文件权限
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        if isinstance(content, bytes):
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    _fsync_directory(directory)
+
+
+def _fsync_directory(directory: str) -> None:
+    """刷新目录项，使重命名本身持久化（Windows不支持打开目录，跳过）"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
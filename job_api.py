@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+按需颁发的任务API
+HTTP接口接受颁发和续期请求，立即返回任务ID；任务在常驻进程中复用已初始化的
+DNS.LA和ACME客户端执行，并发数有上限。同一组域名（SAN集合）的重复请求合并为一个任务，
+任务状态和各步骤进度可以通过查询、长轮询或SSE获取
+"""
+
+import hmac
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import metrics
+
+if TYPE_CHECKING:
+    from cert_manager import CertificateManager
+
+logger = logging.getLogger(__name__)
+
+# 长轮询的最长等待时间（秒）
+MAX_WAIT = 300
+# 每个证书最多的域名数（Let's Encrypt限制）
+MAX_NAMES = 100
+JOB_KINDS = ('issue', 'renew')
+FINISHED = ('succeeded', 'failed')
+_HOSTNAME = re.compile(r'^(\*\.)?([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}$')
+
+
+class JobConflict(Exception):
+    """同一组域名已有无法合并的任务在执行"""
+
+    def __init__(self, job: 'IssuanceJob'):
+        super().__init__(f"任务 {job.id} 正在{job.kind}同一组域名")
+        self.job = job
+
+
+def validate_request(body: Dict) -> Tuple[str, List[str]]:
+    """
+    校验任务请求
+
+    Returns:
+        (任务类型, 域名列表)
+
+    Raises:
+        ValueError: 请求无效
+    """
+    kind = body.get('type', 'issue')
+    if kind not in JOB_KINDS:
+        raise ValueError(f"type 必须是 {' 或 '.join(JOB_KINDS)}")
+    domains = body.get('domains')
+    if not isinstance(domains, list) or not domains or len(domains) > MAX_NAMES:
+        raise ValueError(f"domains 必须是1到{MAX_NAMES}个域名的列表")
+    for domain in domains:
+        if not isinstance(domain, str) or not _HOSTNAME.match(domain):
+            raise ValueError(f"无效的域名: {domain!r}")
+    # 去重并保留顺序（第一个为主域名）
+    return kind, list(dict.fromkeys(domain.lower() for domain in domains))
+
+
+class IssuanceJob:
+    """一个颁发或续期任务"""
+
+    __slots__ = ('id', 'kind', 'domains', 'key', 'status', 'stage', 'requests', 'created_at',
+                 'started_at', 'finished_at', 'cert_path', 'error', 'hooks', 'events')
+
+    def __init__(self, job_id: str, kind: str, domains: List[str], created_at: float):
+        self.id = job_id
+        self.kind = kind
+        self.domains = domains
+        # 合并键: SAN集合（与顺序无关）
+        self.key = tuple(sorted(domains))
+        self.status = 'queued'
+        self.stage: Optional[str] = None
+        self.requests = 1
+        self.created_at = created_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cert_path: Optional[str] = None
+        self.error: Optional[str] = None
+        self.hooks: Dict[str, bool] = {}
+        # (事件序号, 事件类型, 数据)
+        self.events: List[Tuple[int, str, Dict]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def to_dict(self, events: bool = False) -> Dict:
+        data = {
+            'id': self.id,
+            'type': self.kind,
+            'domains': self.domains,
+            'status': self.status,
+            'stage': self.stage,
+            'requests': self.requests,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'cert_path': self.cert_path,
+            'error': self.error,
+            'hooks': self.hooks,
+        }
+        if events:
+            data['events'] = [{'id': seq, 'event': event, **payload} for seq, event, payload in self.events]
+        return data
+
+
+class JobRunner:
+    """
+    任务执行器
+
+    所有任务共享一个证书管理器（已注册的ACME账户、DNS.LA会话和托管域名缓存），
+    最多 max_concurrency 个任务同时执行，其余排队。
+    """
+
+    def __init__(
+            self,
+            manager: 'CertificateManager',
+            cert_dir: str,
+            key_size: int = 2048,
+            renew_days: int = 30,
+            max_concurrency: int = 2,
+            history: int = 1000,
+            clock: Callable[[], float] = time.time
+    ):
+        """
+        Args:
+            manager: 证书管理器
+            cert_dir: 证书存储目录
+            key_size: RSA密钥大小
+            renew_days: 续期任务的提前续期天数
+            max_concurrency: 最多同时执行的任务数
+            history: 保留的已完成任务数
+            clock: 时钟（测试用）
+        """
+        self.manager = manager
+        self.cert_dir = cert_dir
+        self.key_size = key_size
+        self.renew_days = renew_days
+        self.history = history
+        self.clock = clock
+        self.jobs: Dict[str, IssuanceJob] = {}
+        # SAN集合 -> 未完成的任务
+        self._active: Dict[Tuple[str, ...], IssuanceJob] = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count(1)
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='job')
+        self.closed = False
+
+    def submit(self, kind: str, domains: List[str]) -> Tuple[IssuanceJob, bool]:
+        """
+        提交任务；同一SAN集合已有未完成的任务时合并到该任务
+
+        排队中的续期任务遇到颁发请求时升级为颁发；正在执行的续期任务不能升级。
+
+        Returns:
+            (任务, 是否合并到已有任务)
+
+        Raises:
+            JobConflict: 同一SAN集合的续期任务正在执行，而请求的是颁发
+        """
+        with self._cond:
+            key = tuple(sorted(domains))
+            existing = self._active.get(key)
+            if existing is not None:
+                if kind == 'issue' and existing.kind == 'renew':
+                    if existing.status != 'queued':
+                        raise JobConflict(existing)
+                    existing.kind = 'issue'
+                existing.requests += 1
+                self._event(existing, 'coalesced', {'requests': existing.requests, 'type': existing.kind})
+                metrics.JOB_API_JOBS.inc(outcome='coalesced')
+                return existing, True
+
+            job = IssuanceJob(f"{int(self.clock())}-{next(self._ids)}", kind, domains, self.clock())
+            self.jobs[job.id] = job
+            self._active[key] = job
+            self._event(job, 'queued', {'type': kind, 'domains': domains})
+            self._trim()
+        metrics.JOB_API_JOBS.inc(outcome='submitted')
+        self._executor.submit(self._run, job)
+        return job, False
+
+    def get(self, job_id: str) -> Optional[IssuanceJob]:
+        with self._cond:
+            return self.jobs.get(job_id)
+
+    def listing(self) -> List[Dict]:
+        with self._cond:
+            return [job.to_dict() for job in reversed(list(self.jobs.values()))]
+
+    def wait(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        """等待 predicate 成立（任务有新事件时重新检查），超时返回False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.closed or predicate(), timeout) and not self.closed
+
+    def events_since(self, job: IssuanceJob, seq: int) -> List[Tuple[int, str, Dict]]:
+        with self._cond:
+            return [event for event in job.events if event[0] > seq]
+
+    def close(self) -> None:
+        """停止接受新的等待；正在执行的任务继续完成"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False)
+
+    def _event(self, job: IssuanceJob, event: str, payload: Dict) -> None:
+        """记录事件并唤醒等待者（调用方持有 _cond）"""
+        job.events.append((next(self._seq), event, dict(payload, time=self.clock())))
+        self._cond.notify_all()
+
+    def _update(self, job: IssuanceJob, event: str, **fields) -> None:
+        with self._cond:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            self._event(job, event, fields)
+
+    def _trim(self) -> None:
+        """只保留最近 history 个已完成的任务（调用方持有 _cond）"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def _run(self, job: IssuanceJob) -> None:
+        self._update(job, 'started', status='running', started_at=self.clock())
+        cert_path, error, hooks = None, '任务意外中断', {}
+        # 无论执行中出现什么异常，都要释放合并键并发出终止事件，否则等待中的客户端和后续提交会一直挂起
+        try:
+            metrics.JOB_API_RUNNING.set(self._running())
+            try:
+                with self.manager.report_progress(lambda stage: self._update(job, 'progress', stage=stage)):
+                    if job.kind == 'issue':
+                        cert_path = self.manager.issue_certificate(job.domains, self.cert_dir, self.key_size)
+                    else:
+                        cert_path = self.manager.renew_certificate(job.domains, self.cert_dir, self.key_size,
+                                                                   self.renew_days)
+                error = None if cert_path else ('证书正由其他节点处理' if job.stage == 'locked' else '颁发失败')
+            except Exception as e:
+                logger.exception(f"任务 {job.id} 执行失败")
+                cert_path, error = None, str(e)
+
+            if cert_path and job.stage != 'up_to_date':
+                # 与其他任务的证书合并重载；只记录涉及本任务证书的服务
+                try:
+                    for service, result in self.manager.flush_deploy_hooks(job.domains[0]).items():
+                        hooks[service] = result.ok
+                except Exception as e:
+                    logger.exception(f"任务 {job.id} 重载服务失败")
+                    error = f"重载服务失败: {e}"
+        finally:
+            with self._cond:
+                self._active.pop(job.key, None)
+                for name, value in (('cert_path', str(cert_path) if cert_path else None), ('error', error),
+                                    ('hooks', hooks), ('finished_at', self.clock()),
+                                    ('status', 'succeeded' if cert_path else 'failed')):
+                    setattr(job, name, value)
+                self._event(job, job.status, {'cert_path': job.cert_path, 'error': error, 'hooks': hooks})
+                self._trim()
+            metrics.JOB_API_JOBS.inc(outcome=job.status)
+            metrics.JOB_API_RUNNING.set(self._running())
+            logger.info(f"任务 {job.id} ({job.kind} {job.domains[0]}) {job.status}")
+
+    def _running(self) -> int:
+        with self._cond:
+            return sum(1 for job in self._active.values() if job.status == 'running')
+
+
+class _JobHandler(BaseHTTPRequestHandler):
+    """
+    路由:
+        POST /jobs                 提交任务 {"type": "issue"|"renew", "domains": [...]}，返回202和任务
+        GET  /jobs                 最近的任务
+        GET  /jobs/<ID>            任务状态和事件（?wait=秒 长轮询直到任务完成）
+        GET  /jobs/<ID>/events     SSE进度事件（支持 Last-Event-ID 续传，任务完成后关闭）
+    """
+
+    runner: JobRunner = None
+    token: Optional[str] = None
+    keepalive: float = 15.0
+
+    def _authorized(self) -> bool:
+        authorization = self.headers.get('Authorization') or ''
+        if self.token and not hmac.compare_digest(authorization.encode(), f'Bearer {self.token}'.encode()):
+            self._send_json(401, {'error': 'unauthorized'}, route='auth')
+            return False
+        return True
+
+    def _parts(self) -> Tuple[List[str], Dict]:
+        url = urlsplit(self.path)
+        return [unquote(part) for part in url.path.strip('/').split('/') if part], parse_qs(url.query)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        parts, _ = self._parts()
+        if parts != ['jobs']:
+            self._send_json(404, {'error': 'not found'}, route='other')
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError('请求体必须是JSON对象')
+            kind, domains = validate_request(body)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)}, route='submit')
+            return
+        try:
+            job, coalesced = self.runner.submit(kind, domains)
+        except JobConflict as e:
+            self._send_json(409, {'error': str(e), 'job': e.job.to_dict()}, route='submit')
+            return
+        self._send_json(202, dict(job.to_dict(), coalesced=coalesced), route='submit',
+                        headers={'Location': f'/jobs/{job.id}'})
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts, query = self._parts()
+        if parts == ['jobs']:
+            self._send_json(200, self.runner.listing(), route='list')
+            return
+        job = self.runner.get(parts[1]) if len(parts) in (2, 3) and parts[0] == 'jobs' else None
+        if job is None or (len(parts) == 3 and parts[2] != 'events'):
+            self._send_json(404, {'error': 'not found'}, route='other')
+        elif len(parts) == 3:
+            self._events(job)
+        else:
+            try:
+                wait = min(max(float(query.get('wait', ['0'])[0]), 0.0), MAX_WAIT)
+            except ValueError:
+                wait = 0.0
+            if wait:
+                self.runner.wait(lambda: job.finished, wait)
+            self._send_json(200, job.to_dict(events=True), route='job')
+
+    def _events(self, job: IssuanceJob):
+        try:
+            seq = int(self.headers.get('Last-Event-ID') or 0)
+        except ValueError:
+            seq = 0
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        metrics.JOB_API_REQUESTS.inc(route='events', status='200')
+        try:
+            while True:
+                finished = job.finished
+                for event_seq, event, payload in self.runner.events_since(job, seq):
+                    data = json.dumps(dict(payload, job=job.id), ensure_ascii=False)
+                    self.wfile.write(f'id: {event_seq}\nevent: {event}\ndata: {data}\n\n'.encode('utf-8'))
+                    seq = event_seq
+                self.wfile.flush()
+                if finished or self.runner.closed:
+                    return
+                if not self.runner.wait(lambda: bool(self.runner.events_since(job, seq)), self.keepalive):
+                    # 注释行保持连接，同时发现已断开的客户端
+                    self.wfile.write(b': keepalive\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, status: int, data, route: str, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        metrics.JOB_API_REQUESTS.inc(route=route, status=str(status))
+
+    def log_message(self, format, *args):
+        logger.debug("job-api: " + format % args)
+
+
+class JobServer:
+    """
+    任务API服务
+
+    用法:
+        server = JobServer(runner, host='127.0.0.1', port=8490, token='...').start()
+        ...
+        server.stop()
+    """
+
+    def __init__(self, runner: JobRunner, host: str = '127.0.0.1', port: int = 8490,
+                 token: Optional[str] = None, keepalive: float = 15.0):
+        """
+        Args:
+            runner: 任务执行器
+            host: 监听地址
+            port: 监听端口
+            token: 访问令牌（可选，请求需带 Authorization: Bearer <令牌>）
+            keepalive: SSE保活注释的间隔（秒）
+        """
+        self.runner = runner
+        handler = type('JobHandler', (_JobHandler,), {'runner': runner, 'token': token, 'keepalive': keepalive})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'JobServer':
+        threading.Thread(target=self.httpd.serve_forever, name='job-api', daemon=True).start()
+        logger.info(f"任务API已启动: {self.url}/jobs")
+        return self
+
+    def stop(self) -> None:
+        self.runner.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+分布式锁和主节点选举
+多台主机运行本工具时，按证书加租约锁，避免同一证书被同时续期（重复的CA和DNS.LA请求、
+互相删除验证记录）；守护进程模式通过同一租约机制选举主节点，只有主节点执行续期
+"""
+
+import json
+import logging
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Mapping, Optional, Set, Type
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LockHeld(Exception):
+    """锁由其他节点持有"""
+
+    def __init__(self, name: str, owner: Optional[str] = None):
+        super().__init__(f"{name} 由 {owner or '其他节点'} 持有")
+        self.name = name
+        self.owner = owner
+
+
+class Lease:
+    """
+    租约
+
+    token 在每次新获取时递增（fencing token），续约时不变；
+    持有者可以据此判断租约是否已被其他节点接管。
+    """
+
+    __slots__ = ('name', 'owner', 'token', 'expires_at')
+
+    def __init__(self, name: str, owner: str, token: int, expires_at: float):
+        self.name = name
+        self.owner = owner
+        self.token = token
+        self.expires_at = expires_at
+
+    def __repr__(self) -> str:
+        return f"Lease({self.name!r}, owner={self.owner!r}, token={self.token})"
+
+
+class LockBackend(ABC):
+    """
+    租约存储接口
+
+    所有节点的时钟需要大致同步（租约按墙上时间过期）。
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+
+    @abstractmethod
+    def acquire(self, name: str, owner: str, ttl: float) -> Optional[Lease]:
+        """获取租约（未被持有、已过期或已由 owner 持有时成功），失败返回None"""
+
+    @abstractmethod
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        """续约，租约已过期并被其他节点接管时返回False"""
+
+    @abstractmethod
+    def release(self, lease: Lease) -> None:
+        """释放租约（仍由该租约持有时）"""
+
+    @abstractmethod
+    def holder(self, name: str) -> Optional[Lease]:
+        """当前有效的租约"""
+
+
+# 租约文件路径 -> 进程内互斥锁
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+class FileLockBackend(LockBackend):
+    """
+    共享目录中的租约文件（<目录>/<名称>.lease）
+
+    读改写期间用 fcntl.lockf 加锁（NFS上通过NLM/NFSv4锁生效），
+    租约本身按过期时间失效，持有者崩溃不会留下永久的锁。
+    """
+
+    def __init__(self, directory: str, clock: Callable[[], float] = time.time):
+        super().__init__(clock)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, name: str) -> Path:
+        return self.directory / (re.sub(r'[^A-Za-z0-9_.-]', '_', name) + '.lease')
+
+    @contextmanager
+    def _locked(self, name: str) -> Iterator[int]:
+        path = str(self._path(name))
+        # POSIX记录锁属于进程，同一进程内的线程之间另用互斥锁
+        with _thread_locks_guard:
+            thread_lock = _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+        # 只有文件后端需要 fcntl（不支持的平台上改用 sqlite 后端）
+        import fcntl
+        with thread_lock:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+                yield fd
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _read(fd: int) -> Dict:
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = b''
+        while True:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            data += chunk
+        try:
+            return json.loads(data) if data.strip() else {}
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _write(fd: int, record: Dict) -> None:
+        data = json.dumps(record).encode('utf-8')
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, data)
+        os.fsync(fd)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> Optional[Lease]:
+        with self._locked(name) as fd:
+            record = self._read(fd)
+            now = self.clock()
+            if record.get('owner') not in (None, owner) and record.get('expires_at', 0) > now:
+                return None
+            token = record.get('token', 0)
+            if record.get('owner') != owner or record.get('expires_at', 0) <= now:
+                token += 1
+            lease = Lease(name, owner, token, now + ttl)
+            self._write(fd, {'owner': owner, 'token': token, 'expires_at': lease.expires_at})
+            return lease
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        with self._locked(lease.name) as fd:
+            record = self._read(fd)
+            now = self.clock()
+            if record.get('token') != lease.token or record.get('owner') != lease.owner \
+                    or record.get('expires_at', 0) <= now:
+                return False
+            lease.expires_at = now + ttl
+            self._write(fd, {'owner': lease.owner, 'token': lease.token, 'expires_at': lease.expires_at})
+            return True
+
+    def release(self, lease: Lease) -> None:
+        with self._locked(lease.name) as fd:
+            record = self._read(fd)
+            if record.get('token') == lease.token and record.get('owner') == lease.owner:
+                # 保留token，下一次获取时继续递增
+                self._write(fd, {'token': lease.token, 'expires_at': 0})
+
+    def holder(self, name: str) -> Optional[Lease]:
+        with self._locked(name) as fd:
+            record = self._read(fd)
+        if record.get('owner') and record.get('expires_at', 0) > self.clock():
+            return Lease(name, record['owner'], record['token'], record['expires_at'])
+        return None
+
+
+class SQLiteLockBackend(LockBackend):
+    """SQLite数据库中的租约表（每个操作一个 BEGIN IMMEDIATE 事务）"""
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        super().__init__(clock)
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS leases ('
+                'name TEXT PRIMARY KEY, owner TEXT, token INTEGER NOT NULL, expires_at REAL NOT NULL)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def acquire(self, name: str, owner: str, ttl: float) -> Optional[Lease]:
+        with self._transaction() as conn:
+            row = conn.execute('SELECT owner, token, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+            now = self.clock()
+            current_owner, token, expires_at = row if row else (None, 0, 0)
+            if current_owner not in (None, owner) and expires_at > now:
+                return None
+            if current_owner != owner or expires_at <= now:
+                token += 1
+            lease = Lease(name, owner, token, now + ttl)
+            conn.execute(
+                'INSERT OR REPLACE INTO leases (name, owner, token, expires_at) VALUES (?, ?, ?, ?)',
+                (name, owner, token, lease.expires_at)
+            )
+            return lease
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        with self._transaction() as conn:
+            now = self.clock()
+            cursor = conn.execute(
+                'UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ? AND token = ? AND expires_at > ?',
+                (now + ttl, lease.name, lease.owner, lease.token, now)
+            )
+            if cursor.rowcount != 1:
+                return False
+            lease.expires_at = now + ttl
+            return True
+
+    def release(self, lease: Lease) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE leases SET owner = NULL, expires_at = 0 WHERE name = ? AND owner = ? AND token = ?',
+                (lease.name, lease.owner, lease.token)
+            )
+
+    def holder(self, name: str) -> Optional[Lease]:
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT owner, token, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+        finally:
+            conn.close()
+        if row and row[0] and row[2] > self.clock():
+            return Lease(name, row[0], row[1], row[2])
+        return None
+
+
+# 后端名称 -> 后端类（构造参数为 path）
+BACKENDS: Dict[str, Type[LockBackend]] = {
+    'file': FileLockBackend,
+    'sqlite': SQLiteLockBackend,
+}
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LockManager:
+    """
+    按名称持有租约，持有期间由后台线程每 ttl/3 秒续约
+
+    用法:
+        with locks.hold('example.com') as lease:
+            ...  # 持有期间 lease 不会过期；续约失败时 locks.lost(lease) 为真
+    """
+
+    def __init__(self, backend: LockBackend, node_id: Optional[str] = None, ttl: float = 60):
+        """
+        Args:
+            backend: 租约存储
+            node_id: 本节点标识（默认 主机名-进程号）
+            ttl: 租约有效期（秒），节点崩溃后其他节点最多等待这么久即可接管
+        """
+        self.backend = backend
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self._lost: Dict[int, bool] = {}
+        # 本进程持有的租约名称（后端按 node_id 判断持有者，同一进程的线程之间需另外互斥）
+        self._held: Set[str] = set()
+        self._held_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> 'LockManager':
+        """
+        根据配置创建
+
+        配置示例:
+            coordination:
+              backend: sqlite           # file 或 sqlite
+              path: /shared/letsencrypt/locks.db
+              ttl: 30
+              node_id: web1             # 可选
+        """
+        backend_name = config.get('backend', 'file')
+        if backend_name not in BACKENDS:
+            raise ValueError(f"不支持的锁后端: {backend_name}（可用: {', '.join(sorted(BACKENDS))}）")
+        return cls(BACKENDS[backend_name](config['path']), config.get('node_id'), config.get('ttl', 60))
+
+    def lost(self, lease: Lease) -> bool:
+        """租约是否在持有期间续约失败（可能已被其他节点接管）"""
+        return self._lost.get(id(lease), False)
+
+    def check(self, lease: Lease) -> bool:
+        """
+        租约是否仍由本次持有（未续约失败，且存储中的 fencing token 未变）
+
+        执行不可重复的副作用（删除DNS记录、写入证书）之前调用；
+        存储暂时不可用时按本地记录的过期时间判断。
+        """
+        if self.lost(lease):
+            return False
+        try:
+            current = self.backend.holder(lease.name)
+        except Exception as e:
+            logger.warning(f"查询租约 {lease.name} 失败: {e}")
+            return lease.expires_at > self.backend.clock()
+        return current is not None and current.owner == lease.owner and current.token == lease.token
+
+    @contextmanager
+    def hold(self, name: str) -> Iterator[Lease]:
+        """
+        持有租约直到退出上下文
+
+        Raises:
+            LockHeld: 租约由其他节点或本进程的其他线程持有
+        """
+        with self._held_lock:
+            if name in self._held:
+                metrics.LOCK_ACQUISITIONS.inc(outcome='busy')
+                raise LockHeld(name, self.node_id)
+            self._held.add(name)
+        try:
+            lease = self.backend.acquire(name, self.node_id, self.ttl)
+        except BaseException:
+            self._unhold(name)
+            raise
+        if lease is None:
+            self._unhold(name)
+            metrics.LOCK_ACQUISITIONS.inc(outcome='busy')
+            holder = self.backend.holder(name)
+            raise LockHeld(name, holder.owner if holder else None)
+        metrics.LOCK_ACQUISITIONS.inc(outcome='acquired')
+
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.ttl / 3):
+                try:
+                    renewed = self.backend.renew(lease, self.ttl)
+                except Exception as e:
+                    logger.warning(f"续约 {name} 失败: {e}")
+                    continue
+                if not renewed:
+                    self._lost[id(lease)] = True
+                    logger.error(f"租约 {name} 已失效（可能已被其他节点接管）")
+                    return
+
+        thread = threading.Thread(target=heartbeat, name=f'lease-{name}', daemon=True)
+        thread.start()
+        try:
+            yield lease
+        finally:
+            stop.set()
+            thread.join()
+            self._lost.pop(id(lease), None)
+            try:
+                self.backend.release(lease)
+            except Exception as e:
+                logger.warning(f"释放租约 {name} 失败（将在 {self.ttl} 秒后过期）: {e}")
+            finally:
+                self._unhold(name)
+
+    def _unhold(self, name: str) -> None:
+        with self._held_lock:
+            self._held.discard(name)
+
+
+class LeaderElector:
+    """
+    主节点选举
+
+    后台线程每 ttl/3 秒竞选（获取或续约名为 name 的租约）；主节点崩溃后
+    其他节点最多在 ttl + ttl/3 秒内接管，主节点正常退出时立即释放。
+    """
+
+    def __init__(self, backend: LockBackend, node_id: Optional[str] = None, ttl: float = 15,
+                 name: str = 'leader'):
+        self.backend = backend
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self.name = name
+        self._lease: Optional[Lease] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.changed = threading.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        lease = self._lease
+        return lease is not None and lease.expires_at > self.backend.clock()
+
+    def campaign(self) -> bool:
+        """竞选一次，返回是否为主节点"""
+        with self._lock:
+            was_leader = self._lease is not None
+            try:
+                if self._lease is not None and self.backend.renew(self._lease, self.ttl):
+                    pass
+                else:
+                    self._lease = self.backend.acquire(self.name, self.node_id, self.ttl)
+            except Exception as e:
+                # 存储不可用时保留现有租约直到过期，不会出现两个主节点
+                logger.warning(f"主节点选举失败: {e}")
+            leader = self.is_leader
+            if not leader:
+                self._lease = None
+            if leader != was_leader:
+                logger.info(f"节点 {self.node_id} {'成为主节点' if leader else '不再是主节点'}")
+                self.changed.set()
+            metrics.LEADER.set(1 if leader else 0)
+            return leader
+
+    def start(self) -> 'LeaderElector':
+        self.campaign()
+
+        def run():
+            while not self._stop.wait(self.ttl / 3):
+                self.campaign()
+
+        self._thread = threading.Thread(target=run, name='leader-election', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """停止竞选并释放主节点租约（其他节点可以立即接管）"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        with self._lock:
+            if self._lease is not None:
+                try:
+                    self.backend.release(self._lease)
+                except Exception as e:
+                    logger.warning(f"释放主节点租约失败: {e}")
+                self._lease = None
+        metrics.LEADER.set(0)
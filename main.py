@@ -7,13 +7,18 @@ Let's Encrypt 证书管理工具
 import argparse
 import logging
 import sys
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
-import yaml
-
-from acme_client import ACMEClient
-from cert_manager import CertificateManager
-from dnsla_client import DNSLAClient
+# 各子命令只在需要时导入依赖（acme、josepy、requests、cryptography、yaml等），
+# 使 --help、info、list 等命令启动更快
+if TYPE_CHECKING:
+    from cert_manager import CertificateManager
+    from config_loader import CompiledConfig
+    from rate_limits import OrderPlanner
+    from san_optimizer import SANOptimizer
 
 
 # 配置日志
@@ -30,48 +35,233 @@ def setup_logging(verbose: bool = False):
     )
 
 
-def load_config(config_file: str = 'config.yaml') -> dict:
-    """加载配置文件"""
+def load_config(config_file: str = 'config.yaml') -> 'CompiledConfig':
+    """加载配置文件（校验后编译，按文件哈希缓存）"""
     config_path = Path(config_file)
     if not config_path.exists():
         print(f"错误: 配置文件不存在: {config_file}")
         print("请先复制config.yaml.example为config.yaml并修改配置")
         sys.exit(1)
 
-    with open(config_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+    from config_loader import load_compiled
+    return load_compiled(config_file)
+
+
+def create_acme_client(letsencrypt: dict, certificate: Optional[dict] = None):
+    """根据 letsencrypt 配置创建ACME客户端或账户池（certificate 配置中的证书包格式在保存证书时生成）"""
+    from acme_client import ACMEClient
+    from bundle_formats import BundleWriter
+
+    chain_link = letsencrypt.get('chain_link', 'hardlink')
+    bundle_writer = BundleWriter.from_config(certificate or {})
+    clients = [ACMEClient(
+        email=letsencrypt['email'],
+        account_dir=letsencrypt['account_dir'],
+        staging=letsencrypt['staging'],
+        chain_link=chain_link,
+        bundle_writer=bundle_writer
+    )]
+    for account in letsencrypt.get('accounts') or []:
+        clients.append(ACMEClient(
+            email=account.get('email', letsencrypt['email']),
+            account_dir=account['account_dir'],
+            staging=letsencrypt['staging'],
+            chain_link=chain_link,
+            bundle_writer=bundle_writer
+        ))
+    if len(clients) == 1:
+        return clients[0]
+
+    from account_pool import AccountPool, NEW_ORDERS_PER_WINDOW
+    return AccountPool(
+        clients,
+        orders_per_window=letsencrypt.get('orders_per_account', NEW_ORDERS_PER_WINDOW),
+        max_wait=letsencrypt.get('account_max_wait', 0),
+        state_file=letsencrypt.get('account_pool_state')
+    )
 
 
-def create_manager(config: dict) -> CertificateManager:
+def create_manager(config: 'CompiledConfig') -> 'CertificateManager':
     """创建证书管理器"""
+    import metrics
+    from cert_manager import CertificateManager
+    from dnsla_client import DNSLAClient
+    from propagation import PropagationChecker, ZoneStats
+
     # 创建DNS客户端
     dns_client = DNSLAClient(
         api_id=config['dnsla']['api_id'],
         api_secret=config['dnsla']['api_secret'],
         base_url=config['dnsla']['base_url']
     )
+    dns_client.request_hooks.append(metrics.observe_dnsla_request)
 
-    # 创建ACME客户端
-    acme_client = ACMEClient(
-        email=config['letsencrypt']['email'],
-        account_dir=config['letsencrypt']['account_dir'],
-        staging=config['letsencrypt']['staging']
-    )
+    # 创建ACME客户端（配置了多个账户时使用账户池）
+    acme_client = create_acme_client(config['letsencrypt'], config['certificate'])
+
+    # 托管域名统计（最小TTL、记录生效耗时）
+    zone_stats = ZoneStats(config['dnsla'].get('zone_stats_file'))
+    propagation_checker = None
+    nameservers = config['dnsla'].get('nameservers')
+    if nameservers:
+        propagation_checker = PropagationChecker(
+            nameservers, zone_stats, interval=config['dnsla'].get('propagation_interval', 2)
+        )
 
     # 创建证书管理器
     manager = CertificateManager(
         dnsla_client=dns_client,
         acme_client=acme_client,
-        base_domain=config['domains'][0]['domain'],
-        domain_id=config['domains'][0]['domain_id'],
-        propagation_seconds=config['dnsla']['propagation_seconds']
+        base_domain=config.primary['domain'],
+        domain_id=config.primary['domain_id'],
+        propagation_seconds=config['dnsla']['propagation_seconds'],
+        zones=dict(config.zones),
+        follow_cnames=config['dnsla'].get('follow_cnames', False),
+        cname_cache_file=config['dnsla'].get('cname_cache_file'),
+        cname_cache_ttl=config['dnsla'].get('cname_cache_ttl', 3600),
+        challenge_ttl=config['dnsla'].get('challenge_ttl', 600),
+        zone_stats=zone_stats,
+        propagation_checker=propagation_checker,
+        planner=create_planner(config),
+        deploy_hooks=create_deploy_hooks(config),
+        ocsp=create_ocsp_prefetcher(config),
+        locks=create_lock_manager(config)
     )
 
     return manager
 
 
+def create_deploy_hooks(config: 'CompiledConfig'):
+    """根据 deploy 配置创建部署钩子（未配置时返回None）"""
+    deploy = config.get('deploy')
+    if not deploy or not deploy.get('services'):
+        return None
+    from deploy_hooks import DeployHooks
+    return DeployHooks.from_config(deploy)
+
+
+def create_lock_manager(config: 'CompiledConfig'):
+    """根据 coordination 配置创建证书锁（未配置时返回None，单节点运行）"""
+    coordination = config.get('coordination')
+    if not coordination:
+        return None
+    from locking import LockManager
+    return LockManager.from_config(coordination)
+
+
+def create_ocsp_prefetcher(config: 'CompiledConfig'):
+    """根据 ocsp 配置创建OCSP响应预取（未配置或未启用时返回None）"""
+    ocsp_config = config.get('ocsp')
+    if not ocsp_config or not ocsp_config.get('enabled', True):
+        return None
+    from ocsp import OCSPPrefetcher
+    return OCSPPrefetcher(
+        config['letsencrypt']['cert_dir'],
+        max_workers=ocsp_config.get('max_workers', 16),
+        timeout=ocsp_config.get('timeout', 10)
+    )
+
+
+def refresh_ocsp(prefetcher, deploy_hooks=None, force: bool = False) -> list:
+    """
+    刷新所有证书的OCSP响应，响应有更新的证书交给部署钩子重载服务
+    （nginx 等只在重载时读取 ssl_stapling_file）
+    """
+    results = prefetcher.refresh(force=force)
+    if deploy_hooks:
+        from cert_info import read_certificate_info
+        for result in results:
+            if result.status == 'fetched':
+                cert_path = Path(prefetcher.cert_dir) / result.domain
+                info = read_certificate_info(str(cert_path / 'cert.pem')) or {}
+                deploy_hooks.notify(result.domain, str(cert_path), info.get('domains') or [result.domain])
+    return results
+
+
+def config_domains(config: 'CompiledConfig') -> list:
+    """根据配置文件中的第一个域名配置生成证书域名列表"""
+    return list(config.names[config.primary['domain']])
+
+
+def create_planner(config: 'CompiledConfig') -> 'OrderPlanner':
+    """根据配置创建速率限制规划器（未配置历史文件时只在内存中记录）"""
+    from rate_limits import IssuanceHistory, OrderPlanner
+
+    history = IssuanceHistory(config['letsencrypt'].get('history_file'))
+    return OrderPlanner(history)
+
+
+def parse_listen(listen: str):
+    """解析 host:port 形式的监听地址"""
+    host, _, port = str(listen).rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def write_metrics_textfile(config: 'CompiledConfig'):
+    """cron模式: 同步证书目录后写出node-exporter textfile"""
+    textfile = (config.get('metrics') or {}).get('textfile')
+    if not textfile:
+        return
+    import metrics
+    from cert_info import read_certificate_info
+    metrics.registry.inventory.refresh(config['letsencrypt']['cert_dir'], read_certificate_info)
+    metrics.registry.write_textfile(textfile)
+
+
+def create_optimizer(config: 'CompiledConfig') -> 'SANOptimizer':
+    """根据配置创建SAN分组优化器"""
+    from san_optimizer import SANOptimizer
+
+    return SANOptimizer(
+        max_sans=config['certificate'].get('max_sans', 100),
+        wildcard_threshold=config['certificate'].get('wildcard_threshold', 0),
+        state_file=config['letsencrypt'].get('san_groups_file')
+    )
+
+
+def run_deploy_hooks(manager: 'CertificateManager') -> bool:
+    """为有证书变化的服务各执行一次重载命令，返回是否全部成功"""
+    return print_hook_results(manager.flush_deploy_hooks())
+
+
+def print_hook_results(results: dict) -> bool:
+    """打印部署钩子的执行结果，返回是否全部成功"""
+    if results:
+        print("\n部署钩子:")
+    for service, result in results.items():
+        status = '✓' if result.ok else f"✗ {result.error or f'退出码 {result.returncode}'}"
+        print(f"  {status} {service}（{len(result.domains)} 个证书，{result.duration:.2f} 秒）")
+    return all(result.ok for result in results.values())
+
+
+def cmd_issue_all(args, config):
+    """为配置文件中的所有主机名分组颁发证书"""
+    manager = create_manager(config)
+    groups = create_optimizer(config).optimize(list(config.all_names))
+
+    print(f"\n准备颁发 {len(groups)} 个证书")
+    results, deferred = manager.issue_batch(
+        groups,
+        cert_dir=config['letsencrypt']['cert_dir'],
+        key_size=config['certificate']['key_size']
+    )
+
+    failed = [domain for domain, cert_path in results.items() if cert_path is None]
+    for domain, cert_path in results.items():
+        print(f"  {'✓' if cert_path else '✗'} {domain}")
+    for order in deferred:
+        print(f"  … {order.names[0]}（因速率限制推迟）")
+    hooks_ok = run_deploy_hooks(manager)
+    if failed or not hooks_ok:
+        sys.exit(1)
+
+
 def cmd_issue(args, config):
     """颁发证书命令"""
+    if args.all:
+        cmd_issue_all(args, config)
+        return
+
     manager = create_manager(config)
 
     # 获取域名列表
@@ -79,18 +269,7 @@ def cmd_issue(args, config):
         domains = args.domains
     else:
         # 从配置文件读取
-        base_domain = config['domains'][0]['domain']
-        subdomains = config['domains'][0].get('subdomains', ['@'])
-
-        domains = []
-        for subdomain in subdomains:
-            if subdomain == '@':
-                domains.append(base_domain)
-            elif subdomain.startswith('*.'):
-                # 通配符域名
-                domains.append(subdomain)
-            else:
-                domains.append(f"{subdomain}.{base_domain}")
+        domains = config_domains(config)
 
     print(f"\n准备为以下域名颁发证书:")
     for domain in domains:
@@ -111,30 +290,57 @@ def cmd_issue(args, config):
         # 显示证书信息
         cert_file = cert_path / "cert.pem"
         manager.display_certificate_info(str(cert_file))
+        if not run_deploy_hooks(manager):
+            sys.exit(1)
     else:
         print("\n✗ 证书颁发失败")
         sys.exit(1)
 
 
+def renew_groups(manager: 'CertificateManager', config: 'CompiledConfig') -> dict:
+    """
+    按与 issue --all 相同的SAN分组逐个续期（未到期的证书直接跳过）
+
+    Returns:
+        {主域名: 证书目录路径或None}
+    """
+    results = {}
+    for group in create_optimizer(config).optimize(list(config.all_names)):
+        results[group[0]] = manager.renew_certificate(
+            domains=group,
+            cert_dir=config['letsencrypt']['cert_dir'],
+            key_size=config['certificate']['key_size'],
+            renew_days=config['certificate']['renew_days']
+        )
+    return results
+
+
+def cmd_renew_all(args, config):
+    """续期配置文件中所有主机名的证书分组"""
+    manager = create_manager(config)
+    results = renew_groups(manager, config)
+
+    print(f"\n检查了 {len(results)} 个证书")
+    for domain, cert_path in results.items():
+        print(f"  {'✓' if cert_path else '✗'} {domain}")
+    hooks_ok = run_deploy_hooks(manager)
+    if not all(results.values()) or not hooks_ok:
+        sys.exit(1)
+
+
 def cmd_renew(args, config):
     """续期证书命令"""
+    if args.all:
+        cmd_renew_all(args, config)
+        return
+
     manager = create_manager(config)
 
     # 获取域名列表
     if args.domains:
         domains = args.domains
     else:
-        base_domain = config['domains'][0]['domain']
-        subdomains = config['domains'][0].get('subdomains', ['@'])
-
-        domains = []
-        for subdomain in subdomains:
-            if subdomain == '@':
-                domains.append(base_domain)
-            elif subdomain.startswith('*.'):
-                domains.append(subdomain)
-            else:
-                domains.append(f"{subdomain}.{base_domain}")
+        domains = config_domains(config)
 
     # 续期证书
     cert_path = manager.renew_certificate(
@@ -147,35 +353,37 @@ def cmd_renew(args, config):
     if cert_path:
         print(f"\n✓ 证书续期成功！")
         print(f"证书路径: {cert_path}")
+        if not run_deploy_hooks(manager):
+            sys.exit(1)
     else:
         print("\n✗ 证书续期失败")
         sys.exit(1)
 
 
 def cmd_info(args, config):
-    """查看证书信息命令"""
-    manager = create_manager(config)
+    """查看证书信息命令（只读取本地证书，不创建DNS/ACME客户端）"""
+    from cert_info import display_certificate_info
 
     if args.cert_file:
         # 查看指定证书
-        manager.display_certificate_info(args.cert_file)
+        display_certificate_info(args.cert_file)
     else:
         # 查看域名证书
-        domain = args.domain or config['domains'][0]['domain']
+        domain = args.domain or config.primary['domain']
         cert_file = Path(config['letsencrypt']['cert_dir']) / domain / "cert.pem"
 
         if not cert_file.exists():
             print(f"错误: 证书不存在: {cert_file}")
             sys.exit(1)
 
-        manager.display_certificate_info(str(cert_file))
+        display_certificate_info(str(cert_file))
 
 
 def cmd_list(args, config):
-    """列出所有证书命令"""
-    manager = create_manager(config)
+    """列出所有证书命令（只读取本地证书，不创建DNS/ACME客户端）"""
+    from cert_info import list_certificates
 
-    certificates = manager.list_certificates(config['letsencrypt']['cert_dir'])
+    certificates = list_certificates(config['letsencrypt']['cert_dir'])
 
     if not certificates:
         print("没有找到任何证书")
@@ -198,14 +406,86 @@ def cmd_list(args, config):
         print("-" * 80)
 
 
+def cmd_revoke_bulk(args, config):
+    """批量吊销命令: 按条件选择证书，确认一次后并发吊销，可选重新颁发"""
+    from revocation import REASONS, BulkRevoker, CertificateSelector, RevocationJournal
+
+    cert_dir = config['letsencrypt']['cert_dir']
+    journal = RevocationJournal(
+        args.journal or config['letsencrypt'].get('revocation_journal', './revocations.jsonl')
+    )
+
+    if args.resume:
+        targets = journal.pending()
+        if not targets:
+            print(f"吊销日志中没有未完成的证书: {journal.path}")
+            return
+    else:
+        try:
+            selector = CertificateSelector(
+                domains=args.match or (),
+                serials=args.serial or (),
+                issued_after=args.issued_after,
+                issued_before=args.issued_before,
+                key_hashes=args.key_hash or ()
+            )
+        except ValueError as e:
+            print(f"错误: {e}")
+            sys.exit(1)
+        targets = selector.select(cert_dir)
+        if not targets:
+            print("没有匹配的证书")
+            return
+
+    print(f"\n警告: 即将以 {REASONS[args.reason]} 为原因吊销 {len(targets)} 个证书:")
+    for target in targets:
+        print(f"  - {target.domain} (序列号 {target.serial_hex}, {len(target.names)} 个域名)")
+    if args.reissue:
+        print("吊销后将为这些证书颁发替换证书")
+    if not args.yes:
+        confirm = input("确认吊销? (yes/no): ")
+        if confirm.lower() != 'yes':
+            print("已取消")
+            return
+
+    manager = create_manager(config)
+    revoker = BulkRevoker(manager, journal, reason=args.reason, max_workers=args.concurrency, rate=args.rate)
+    results = revoker.revoke(targets, reissue=args.reissue)
+    revoked = [target for target in targets if results.get(target.serial_hex)]
+    print(f"\n已吊销 {len(revoked)}/{len(targets)} 个证书（进度日志: {journal.path}）")
+
+    # 继续之前的运行时，按选中时的要求重新颁发
+    to_reissue = [target for target in revoked
+                  if args.reissue or journal.reissue_requested(target.serial_hex)]
+    hooks_ok = True
+    if to_reissue:
+        reissued = revoker.reissue(
+            to_reissue,
+            cert_dir=cert_dir,
+            key_size=config['certificate']['key_size']
+        )
+        for domain, cert_path in reissued.items():
+            print(f"  {'✓' if cert_path else '✗'} {domain}")
+        hooks_ok = run_deploy_hooks(manager)
+    # 只看本次运行的证书，日志中其他运行留下的记录不影响结果
+    failed = bool(journal.pending(target.serial_hex for target in targets)) or not hooks_ok
+    if failed:
+        print("部分证书未完成，可使用 --resume 继续")
+        sys.exit(1)
+
+
 def cmd_revoke(args, config):
     """吊销证书命令"""
+    if args.resume or args.match or args.serial or args.key_hash or args.issued_after or args.issued_before:
+        cmd_revoke_bulk(args, config)
+        return
+
     manager = create_manager(config)
 
     if args.cert_file:
         cert_file = args.cert_file
     else:
-        domain = args.domain or config['domains'][0]['domain']
+        domain = args.domain or config.primary['domain']
         cert_file = Path(config['letsencrypt']['cert_dir']) / domain / "cert.pem"
         cert_file = str(cert_file)
 
@@ -230,14 +510,16 @@ def cmd_revoke(args, config):
 
 def cmd_test_dns(args, config):
     """测试DNS API命令"""
+    from dnsla_client import DNSLAClient
+
     dns_client = DNSLAClient(
         api_id=config['dnsla']['api_id'],
         api_secret=config['dnsla']['api_secret'],
         base_url=config['dnsla']['base_url']
     )
 
-    domain = config['domains'][0]['domain']
-    domain_id = config['domains'][0]['domain_id']
+    domain = config.primary['domain']
+    domain_id = config.primary['domain_id']
 
     print(f"\n测试DNS.LA API...")
     print(f"域名: {domain}")
@@ -277,6 +559,381 @@ def cmd_test_dns(args, config):
     print("\nDNS API测试完成")
 
 
+def cmd_plan(args, config):
+    """规划命令: 按速率限制打包并安排证书订单（不访问CA）"""
+    planner = create_planner(config)
+    names = args.domains or list(config.all_names)
+
+    # 规划只是预览，不更新保存的分组
+    optimizer = create_optimizer(config)
+    optimizer.state_file = None
+    plan = planner.plan(optimizer.optimize(names))
+    now = planner.clock()
+    print(f"\n{len(names)} 个域名打包为 {len(plan)} 个证书订单:")
+    for order in plan:
+        if order.not_before > now:
+            when = f"推迟 {(order.not_before - now) / 3600:.1f} 小时 ({order.reason})"
+        else:
+            when = "立即"
+        print(f"  - {order.names[0]} 等 {len(order.names)} 个域名: {when}")
+
+
+def cmd_bundles(args, config):
+    """证书包命令: 为已有证书生成配置的证书包格式（PKCS#12、HAProxy、DER等）"""
+    from bundle_formats import FORMATS, BundleWriter
+
+    formats = args.formats or config['certificate'].get('bundle_formats') or []
+    if not formats:
+        print(f"没有配置证书包格式（certificate.bundle_formats，可用: {', '.join(sorted(FORMATS))}）")
+        return
+    try:
+        writer = BundleWriter(formats, {'pkcs12_password': config['certificate'].get('pkcs12_password')})
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    cert_dir = Path(config['letsencrypt']['cert_dir'])
+    paths = [cert_dir / domain for domain in args.domains] if args.domains else sorted(
+        path for path in cert_dir.glob('*') if (path / 'fullchain.pem').exists())
+    failed = False
+    for path in paths:
+        try:
+            written = writer.write_existing(path)
+            print(f"  ✓ {path.name}: {', '.join(file.name for file in written)}")
+        except (OSError, ValueError) as e:
+            failed = True
+            print(f"  ✗ {path.name}: {e}")
+    if failed:
+        sys.exit(1)
+
+
+def cmd_ocsp(args, config):
+    """OCSP命令: 为证书目录中的所有证书获取或刷新OCSP响应（ocsp.der）"""
+    from ocsp import OCSPPrefetcher
+    # 未在配置中启用时也可以手动刷新
+    prefetcher = create_ocsp_prefetcher(config) or OCSPPrefetcher(config['letsencrypt']['cert_dir'])
+    deploy_hooks = create_deploy_hooks(config)
+
+    results = refresh_ocsp(prefetcher, deploy_hooks, force=args.force)
+    if not results:
+        print("证书目录中没有证书")
+        return
+    labels = {'fetched': '已更新', 'fresh': '仍有效', 'no_url': '无OCSP地址', 'revoked': '已吊销', 'error': '失败'}
+    for result in results:
+        status = '✓' if result.ok else '✗'
+        detail = f"，下次刷新 {result.refresh_at.strftime('%Y-%m-%d %H:%M')}" if result.refresh_at else ''
+        error = f"  {result.error}" if result.error and result.status == 'error' else ''
+        print(f"  {status} {result.domain}: {labels[result.status]}{detail}{error}")
+    hooks_ok = print_hook_results(deploy_hooks.flush()) if deploy_hooks else True
+    if not hooks_ok or not all(result.ok for result in results):
+        sys.exit(1)
+
+
+def create_distributor(config: 'CompiledConfig'):
+    """根据 distribute 配置创建证书分发器（未配置节点时返回None）"""
+    distribute = config.get('distribute')
+    if not distribute or not distribute.get('nodes'):
+        return None
+    from distribute import Distributor
+    return Distributor.from_config(distribute)
+
+
+def cmd_distribute(args, config):
+    """分发命令: 把证书包推送到配置的节点（跳过未变化的证书包）"""
+    try:
+        distributor = create_distributor(config)
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+    if distributor is None:
+        print("没有配置分发节点（在配置文件的 distribute.nodes 中配置）")
+        return
+
+    results = distributor.distribute(config['letsencrypt']['cert_dir'], nodes=args.nodes, force=args.force)
+    for result in results:
+        status = '✓' if result.ok else '✗'
+        detail = f"  {result.error}" if result.error else ''
+        print(f"  {status} {result.node}: 发送 {len(result.sent)} 个，跳过 {result.skipped} 个"
+              f"（{result.duration:.2f} 秒）{detail}")
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+
+def create_coordinator(config: 'CompiledConfig'):
+    """根据 work_queue 配置创建队列协调节点（未配置时返回None）"""
+    queue_config = config.get('work_queue')
+    if not queue_config:
+        return None
+    from work_queue import Coordinator, create_queue
+    return Coordinator(create_queue(queue_config), config.names.keys())
+
+
+def enqueue_due(coordinator, config: 'CompiledConfig') -> int:
+    """把配置中所有到期的证书分组加入工作队列"""
+    groups = create_optimizer(config).optimize(list(config.all_names))
+    return coordinator.enqueue_due(
+        groups, config['letsencrypt']['cert_dir'], config['certificate']['renew_days']
+    )
+
+
+def cmd_queue(args, config):
+    """工作队列命令: 协调节点加入到期任务，工作节点领取并续期"""
+    from locking import default_node_id
+    from work_queue import Worker
+
+    coordinator = create_coordinator(config)
+    if coordinator is None:
+        print("没有配置工作队列（在配置文件的 work_queue 中配置）")
+        sys.exit(1)
+    queue = coordinator.queue
+
+    if args.action == 'enqueue':
+        added = enqueue_due(coordinator, config)
+        print(f"已加入 {added} 个续期任务")
+    elif args.action == 'worker':
+        queue_config = config['work_queue']
+        worker = Worker(
+            queue,
+            create_manager(config),
+            args.worker_id or default_node_id(),
+            config['letsencrypt']['cert_dir'],
+            key_size=config['certificate']['key_size'],
+            renew_days=config['certificate']['renew_days'],
+            batch_size=queue_config.get('batch_size', 10),
+            retry_delay=queue_config.get('retry_delay', 60)
+        )
+        print(f"工作节点 {worker.worker_id} 已启动")
+        try:
+            worker.run(poll_interval=queue_config.get('poll_interval', 10))
+        except KeyboardInterrupt:
+            print("\n工作节点已停止")
+        return
+
+    labels = {'ready': '等待中', 'leased': '执行中', 'done': '已完成', 'failed': '失败'}
+    for status, count in queue.stats().items():
+        print(f"  {labels[status]}: {count}")
+
+
+def cmd_verify(args, config):
+    """验证命令: 并发检查各服务端点上部署的证书"""
+    from tls_verify import CertificateInventory, Endpoint, endpoints_from_config, verify_endpoints
+
+    verify_config = config.get('verify') or {}
+    try:
+        if args.endpoints:
+            endpoints = [Endpoint(url) for url in args.endpoints]
+        else:
+            endpoints = endpoints_from_config(verify_config)
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+    if not endpoints:
+        print("没有需要验证的端点（在配置文件的 verify.endpoints 中配置，或使用 -e 指定）")
+        return
+
+    inventory = CertificateInventory.from_cert_dir(config['letsencrypt']['cert_dir'])
+    start = time.perf_counter()
+    results = verify_endpoints(
+        endpoints,
+        inventory,
+        timeout=args.timeout or verify_config.get('timeout', 5),
+        concurrency=args.concurrency or verify_config.get('concurrency', 100),
+        verify_chain=not args.insecure and verify_config.get('verify_chain', True),
+        cafile=args.cafile or verify_config.get('cafile')
+    )
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        url = result.endpoint.url
+        if result.status == 'ok':
+            print(f"  ✓ {url}  握手 {result.latency * 1000:.1f} ms  序列号 {result.served_serial:x}")
+        elif result.status == 'mismatch':
+            print(f"  ✗ {url}  序列号不一致: 服务端 {result.served_serial:x}，本地 {result.expected_serial:x}")
+        elif result.status == 'unknown':
+            print(f"  ? {url}  本地没有对应的证书（服务端序列号 {result.served_serial:x}）")
+        else:
+            print(f"  ✗ {url}  {result.error}")
+
+    passed = sum(1 for result in results if result.ok)
+    print(f"\n验证完成: {passed}/{len(results)} 个端点通过，耗时 {elapsed:.2f} 秒")
+    if passed < len(results):
+        sys.exit(1)
+
+
+def cmd_metrics(args, config):
+    """输出指标命令"""
+    import metrics
+    from cert_info import read_certificate_info
+
+    metrics.registry.inventory.refresh(config['letsencrypt']['cert_dir'], read_certificate_info)
+    textfile = args.textfile or (config.get('metrics') or {}).get('textfile')
+    if textfile:
+        metrics.registry.write_textfile(textfile)
+        print(f"指标已写出: {textfile}")
+    else:
+        print(metrics.registry.render(), end='')
+
+
+def create_cert_server(config: 'CompiledConfig'):
+    """根据 cert_server 配置创建证书服务API（未配置 listen 时返回None）"""
+    server_config = config.get('cert_server') or {}
+    if not server_config.get('listen'):
+        return None
+    from cert_server import CertificateServer
+    host, port = parse_listen(server_config['listen'])
+    return CertificateServer(
+        config['letsencrypt']['cert_dir'], host, port,
+        token=server_config.get('token'),
+        poll_interval=server_config.get('poll_interval', 5.0)
+    )
+
+
+def create_job_server(config: 'CompiledConfig', manager: 'CertificateManager'):
+    """根据 job_api 配置创建任务API（未配置 listen 时返回None），任务复用守护进程的证书管理器"""
+    api_config = config.get('job_api') or {}
+    if not api_config.get('listen'):
+        return None
+    from job_api import JobRunner, JobServer
+    runner = JobRunner(
+        manager,
+        config['letsencrypt']['cert_dir'],
+        key_size=config['certificate']['key_size'],
+        renew_days=config['certificate']['renew_days'],
+        max_concurrency=api_config.get('max_concurrency', 2),
+        history=api_config.get('history', 1000)
+    )
+    host, port = parse_listen(api_config['listen'])
+    return JobServer(runner, host, port, token=api_config.get('token'))
+
+
+def cmd_api(args, config):
+    """任务API命令: 只运行按需颁发的HTTP接口（不执行定期续期）"""
+    manager = create_manager(config)
+    job_server = create_job_server(config, manager)
+    if job_server is None:
+        print("没有配置任务API（在配置文件的 job_api.listen 中配置）")
+        sys.exit(1)
+    job_server.start()
+    print(f"任务API已启动: {job_server.url}/jobs")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\n任务API已停止")
+    finally:
+        job_server.stop()
+
+
+def cmd_daemon(args, config):
+    """守护进程命令: 定期续期并提供指标端点、证书服务API和任务API"""
+    import metrics
+
+    from chain_store import ChainStore
+
+    manager = create_manager(config)
+    distributor = create_distributor(config)
+    coordinator = create_coordinator(config)
+    cert_dir = config['letsencrypt']['cert_dir']
+    # 清理续期后不再被引用的中间证书链
+    chains = ChainStore(cert_dir)
+    metrics_config = config.get('metrics') or {}
+    daemon_config = config.get('daemon') or {}
+    interval = args.interval or daemon_config.get('interval', 43200)
+
+    # 启动时扫描一次证书目录，之后由证书管理器增量更新
+    metrics.registry.inventory.refresh(cert_dir, manager.get_certificate_info)
+
+    server = None
+    if metrics_config.get('listen'):
+        host, port = parse_listen(metrics_config['listen'])
+        server = metrics.start_http_server(host, port)
+    cert_server = create_cert_server(config)
+    if cert_server:
+        cert_server.start()
+        print(f"证书服务已启动: {cert_server.url}/certificates")
+    job_server = create_job_server(config, manager)
+    if job_server:
+        job_server.start()
+        print(f"任务API已启动: {job_server.url}/jobs")
+
+    # 多节点部署时只有主节点执行续期，主节点失效后其他节点在租约过期后接管
+    elector = None
+    if manager.locks:
+        from locking import LeaderElector
+        coordination = config['coordination']
+        elector = LeaderElector(manager.locks.backend, manager.locks.node_id,
+                                ttl=coordination.get('leader_ttl', 15)).start()
+
+    print(f"守护进程已启动，每 {interval} 秒检查一次续期")
+    next_run = 0.0
+    try:
+        while True:
+            if elector and not elector.is_leader:
+                # 备用节点：等待成为主节点，接管后立即检查一次
+                next_run = 0.0
+                elector.changed.wait(elector.ttl / 3)
+                elector.changed.clear()
+                continue
+            if time.monotonic() < next_run:
+                if elector:
+                    elector.changed.wait(min(next_run - time.monotonic(), elector.ttl / 3))
+                    elector.changed.clear()
+                else:
+                    time.sleep(next_run - time.monotonic())
+                continue
+            next_run = time.monotonic() + interval
+            try:
+                if coordinator:
+                    # 工作队列模式: 只加入到期任务，由工作节点续期
+                    enqueue_due(coordinator, config)
+                else:
+                    # 与 issue --all 和工作队列使用同样的分组
+                    renew_groups(manager, config)
+            except Exception as e:
+                logging.getLogger(__name__).error(f"续期检查失败: {e}")
+            if manager.ocsp:
+                try:
+                    refresh_ocsp(manager.ocsp, manager.deploy_hooks)
+                except Exception as e:
+                    logging.getLogger(__name__).error(f"刷新OCSP响应失败: {e}")
+            try:
+                manager.flush_deploy_hooks()
+            except Exception as e:
+                logging.getLogger(__name__).error(f"执行部署钩子失败: {e}")
+            try:
+                chains.prune()
+            except Exception as e:
+                logging.getLogger(__name__).error(f"清理证书链失败: {e}")
+            if cert_server:
+                # 立即通知等待中的客户端，不必等下一次目录检查
+                try:
+                    cert_server.store.refresh()
+                except Exception as e:
+                    logging.getLogger(__name__).warning(f"刷新证书目录失败: {e}")
+            if distributor:
+                try:
+                    distributor.distribute(cert_dir)
+                except Exception as e:
+                    logging.getLogger(__name__).error(f"分发证书失败: {e}")
+
+            if metrics_config.get('textfile'):
+                try:
+                    metrics.registry.write_textfile(metrics_config['textfile'])
+                except OSError as e:
+                    logging.getLogger(__name__).warning(f"写出指标失败: {e}")
+    except KeyboardInterrupt:
+        print("\n守护进程已停止")
+    finally:
+        if elector:
+            elector.stop()
+        if server:
+            server.shutdown()
+        if cert_server:
+            cert_server.stop()
+        if job_server:
+            job_server.stop()
+
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(
@@ -287,6 +944,7 @@ def main():
   # 颁发证书
   %(prog)s issue
   %(prog)s issue -d example.com -d www.example.com
+  %(prog)s issue --all
 
   # 续期证书
   %(prog)s renew
@@ -301,8 +959,41 @@ def main():
   # 吊销证书
   %(prog)s revoke -d example.com
 
+  # 密钥泄露后批量吊销并重新颁发（中断后使用 --resume 继续）
+  %(prog)s revoke --key-hash 3f2a9c -r 1 --reissue
+
   # 测试DNS API
   %(prog)s test-dns
+
+  # 按速率限制规划证书订单
+  %(prog)s plan
+
+  # 为已有证书生成PKCS#12、HAProxy合并PEM等格式
+  %(prog)s bundles -f pkcs12 haproxy
+
+  # 刷新OCSP响应（装订用的 ocsp.der）
+  %(prog)s ocsp
+
+  # 把证书分发到配置的节点
+  %(prog)s distribute
+
+  # 工作队列: 加入到期的证书，在多个进程或主机上运行工作节点
+  %(prog)s queue enqueue
+  %(prog)s queue worker
+  %(prog)s queue status
+
+  # 验证服务端点上部署的证书
+  %(prog)s verify
+  %(prog)s verify -e https://example.com mysql://db.example.com:3306
+
+  # 输出Prometheus指标
+  %(prog)s metrics
+
+  # 按需颁发的任务API（提交任务立即返回任务ID）
+  %(prog)s api
+
+  # 守护进程模式（定期续期，提供指标端点）
+  %(prog)s daemon
         """
     )
 
@@ -327,6 +1018,11 @@ def main():
         nargs='+',
         help='域名列表（不指定则使用配置文件）'
     )
+    parser_issue.add_argument(
+        '--all',
+        action='store_true',
+        help='为配置文件中所有域名的主机名优化分组并批量颁发'
+    )
 
     # renew命令
     parser_renew = subparsers.add_parser('renew', help='续期证书')
@@ -335,6 +1031,11 @@ def main():
         nargs='+',
         help='域名列表（不指定则使用配置文件）'
     )
+    parser_renew.add_argument(
+        '--all',
+        action='store_true',
+        help='按 issue --all 的分组续期配置文件中所有域名的证书'
+    )
 
     # info命令
     parser_info = subparsers.add_parser('info', help='查看证书信息')
@@ -367,10 +1068,166 @@ def main():
         choices=[0, 1, 3, 4, 5],
         help='吊销原因 (0=unspecified, 1=keyCompromise, 3=affiliationChanged, 4=superseded, 5=cessationOfOperation)'
     )
+    # 批量吊销（指定任一选择条件或 --resume 时启用）
+    parser_revoke.add_argument(
+        '--match',
+        nargs='+',
+        help='批量: 按域名或通配模式选择（匹配证书目录名或证书中的任一域名）'
+    )
+    parser_revoke.add_argument(
+        '--serial',
+        nargs='+',
+        help='批量: 按序列号选择（十进制，或0x前缀/冒号分隔的十六进制）'
+    )
+    parser_revoke.add_argument(
+        '--issued-after',
+        type=datetime.fromisoformat,
+        help='批量: 只选择此时间之后颁发的证书（ISO格式，默认UTC）'
+    )
+    parser_revoke.add_argument(
+        '--issued-before',
+        type=datetime.fromisoformat,
+        help='批量: 只选择此时间之前颁发的证书（ISO格式，默认UTC）'
+    )
+    parser_revoke.add_argument(
+        '--key-hash',
+        nargs='+',
+        help='批量: 按公钥SHA-256选择（可以是前缀）'
+    )
+    parser_revoke.add_argument(
+        '--resume',
+        action='store_true',
+        help='批量: 继续吊销日志中未完成的证书'
+    )
+    parser_revoke.add_argument(
+        '--reissue',
+        action='store_true',
+        help='批量: 吊销后颁发替换证书'
+    )
+    parser_revoke.add_argument(
+        '--journal',
+        help='批量: 吊销进度日志文件（默认使用配置文件或 ./revocations.jsonl）'
+    )
+    parser_revoke.add_argument(
+        '--concurrency',
+        type=int,
+        default=8,
+        help='批量: 并发吊销数 (默认: 8)'
+    )
+    parser_revoke.add_argument(
+        '--rate',
+        type=float,
+        default=10.0,
+        help='批量: 每秒最多吊销请求数 (默认: 10)'
+    )
+    parser_revoke.add_argument(
+        '-y', '--yes',
+        action='store_true',
+        help='批量: 跳过确认'
+    )
 
     # test-dns命令
     parser_test = subparsers.add_parser('test-dns', help='测试DNS API')
 
+    # plan命令
+    parser_plan = subparsers.add_parser('plan', help='按速率限制规划证书订单')
+    parser_plan.add_argument(
+        '-d', '--domains',
+        nargs='+',
+        help='域名列表（不指定则使用配置文件中的所有域名）'
+    )
+
+    # bundles命令
+    parser_bundles = subparsers.add_parser('bundles', help='为已有证书生成PKCS#12、HAProxy、DER等证书包')
+    parser_bundles.add_argument(
+        '-d', '--domains',
+        nargs='+',
+        help='只处理这些证书目录（默认全部）'
+    )
+    parser_bundles.add_argument(
+        '-f', '--formats',
+        nargs='+',
+        help='证书包格式（默认使用 certificate.bundle_formats）'
+    )
+
+    # ocsp命令
+    parser_ocsp = subparsers.add_parser('ocsp', help='获取或刷新证书的OCSP响应（ocsp.der）')
+    parser_ocsp.add_argument(
+        '--force',
+        action='store_true',
+        help='忽略仍然有效的缓存响应，全部重新获取'
+    )
+
+    # distribute命令
+    parser_distribute = subparsers.add_parser('distribute', help='把证书分发到配置的节点')
+    parser_distribute.add_argument(
+        '-n', '--nodes',
+        nargs='+',
+        help='只分发到这些节点（默认全部）'
+    )
+    parser_distribute.add_argument(
+        '--force',
+        action='store_true',
+        help='忽略已分发的内容哈希，全部重新传输'
+    )
+
+    # queue命令
+    parser_queue = subparsers.add_parser('queue', help='分片续期工作队列（协调节点/工作节点）')
+    parser_queue.add_argument(
+        'action',
+        choices=['enqueue', 'worker', 'status'],
+        help='enqueue: 加入到期的证书; worker: 运行工作节点; status: 查看队列'
+    )
+    parser_queue.add_argument(
+        '--worker-id',
+        help='工作节点标识（默认 主机名-进程号）'
+    )
+
+    # verify命令
+    parser_verify = subparsers.add_parser('verify', help='验证服务端点上部署的证书')
+    parser_verify.add_argument(
+        '-e', '--endpoints',
+        nargs='+',
+        help='端点地址，如 https://example.com mysql://db.example.com:3306 postgres://db.example.com（不指定则使用配置文件）'
+    )
+    parser_verify.add_argument(
+        '--timeout',
+        type=float,
+        help='每个端点的超时（秒，默认5）'
+    )
+    parser_verify.add_argument(
+        '--concurrency',
+        type=int,
+        help='最大并发连接数 (默认: 100)'
+    )
+    parser_verify.add_argument(
+        '--insecure',
+        action='store_true',
+        help='不校验证书链和主机名，只比较序列号'
+    )
+    parser_verify.add_argument(
+        '--cafile',
+        help='额外信任的根证书文件'
+    )
+
+    # metrics命令
+    parser_metrics = subparsers.add_parser('metrics', help='输出Prometheus指标')
+    parser_metrics.add_argument(
+        '-o', '--textfile',
+        help='写出node-exporter textfile（不指定则使用配置文件，均未指定时打印到标准输出）'
+    )
+
+    # api命令
+    subparsers.add_parser('api', help='按需颁发的任务API（HTTP）')
+
+    # daemon命令
+    parser_daemon = subparsers.add_parser('daemon', help='守护进程模式')
+    parser_daemon.add_argument(
+        '-i', '--interval',
+        type=int,
+        help='续期检查间隔（秒，默认使用配置文件或43200）'
+    )
+
     args = parser.parse_args()
 
     # 设置日志
@@ -383,21 +1240,48 @@ def main():
         print(f"错误: 加载配置文件失败: {e}")
         sys.exit(1)
 
+    # 启用性能追踪（如已配置）
+    from tracing import setup_tracing
+    setup_tracing(config.get('tracing'))
+
     # 执行命令
-    if args.command == 'issue':
-        cmd_issue(args, config)
-    elif args.command == 'renew':
-        cmd_renew(args, config)
-    elif args.command == 'info':
-        cmd_info(args, config)
-    elif args.command == 'list':
-        cmd_list(args, config)
-    elif args.command == 'revoke':
-        cmd_revoke(args, config)
-    elif args.command == 'test-dns':
-        cmd_test_dns(args, config)
-    else:
-        parser.print_help()
+    try:
+        if args.command == 'issue':
+            cmd_issue(args, config)
+        elif args.command == 'renew':
+            cmd_renew(args, config)
+        elif args.command == 'info':
+            cmd_info(args, config)
+        elif args.command == 'list':
+            cmd_list(args, config)
+        elif args.command == 'revoke':
+            cmd_revoke(args, config)
+        elif args.command == 'test-dns':
+            cmd_test_dns(args, config)
+        elif args.command == 'plan':
+            cmd_plan(args, config)
+        elif args.command == 'bundles':
+            cmd_bundles(args, config)
+        elif args.command == 'ocsp':
+            cmd_ocsp(args, config)
+        elif args.command == 'distribute':
+            cmd_distribute(args, config)
+        elif args.command == 'queue':
+            cmd_queue(args, config)
+        elif args.command == 'verify':
+            cmd_verify(args, config)
+        elif args.command == 'metrics':
+            cmd_metrics(args, config)
+        elif args.command == 'api':
+            cmd_api(args, config)
+        elif args.command == 'daemon':
+            cmd_daemon(args, config)
+        else:
+            parser.print_help()
+    finally:
+        # cron模式下每次运行结束后写出指标
+        if args.command in ('issue', 'renew', 'revoke'):
+            write_metrics_textfile(config)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Prometheus指标
+记录证书状态、DNS.LA API延迟、ACME订单结果等指标，
+支持HTTP端点（守护进程模式）和node-exporter textfile（cron模式）两种导出方式
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from fsutil import write_atomic
+from tracing import escape_label
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'letsencrypt_dnsla'
+
+# 默认的直方图分桶（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROPAGATION_BUCKETS = (5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+DEPLOY_HOOK_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    parts = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类"""
+
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.TYPE}',
+        ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """只增计数器"""
+
+    TYPE = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """可任意设置的数值"""
+
+    TYPE = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def remove(self, **labels) -> None:
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def get(self, **labels) -> Optional[float]:
+        return self._values.get(self._key(labels))
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._values.items())
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {bucket_count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class CertificateInventory:
+    """
+    证书到期时间缓存
+
+    启动时扫描一次证书目录，之后由证书管理器在颁发成功后增量更新。
+    剩余天数在采集时根据缓存的到期时间计算，不会重新读取证书文件。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 域名 -> (到期时间戳, cert.pem的mtime)
+        self._expiry: Dict[str, Tuple[float, float]] = {}
+
+    def update(self, domain: str, not_valid_after: datetime, mtime: float = 0.0) -> None:
+        """记录（或更新）一个证书的到期时间"""
+        with self._lock:
+            self._expiry[domain] = (not_valid_after.timestamp(), mtime)
+
+    def remove(self, domain: str) -> None:
+        with self._lock:
+            self._expiry.pop(domain, None)
+
+    def refresh(self, cert_dir: str, loader: Callable[[str], Optional[Dict]]) -> int:
+        """
+        同步证书目录，只解析新增或修改过的cert.pem
+
+        Args:
+            cert_dir: 证书存储目录
+            loader: 读取证书信息的函数（如 CertificateManager.get_certificate_info）
+
+        Returns:
+            重新解析的证书数量
+        """
+        root = Path(cert_dir)
+        if not root.exists():
+            return 0
+
+        parsed = 0
+        seen = set()
+        for domain_dir in root.iterdir():
+            cert_file = domain_dir / 'cert.pem'
+            try:
+                mtime = cert_file.stat().st_mtime
+            except OSError:
+                continue
+            seen.add(domain_dir.name)
+            cached = self._expiry.get(domain_dir.name)
+            if cached and cached[1] == mtime:
+                continue
+            info = loader(str(cert_file))
+            if info:
+                self.update(domain_dir.name, info['not_valid_after'], mtime)
+                parsed += 1
+
+        with self._lock:
+            for domain in list(self._expiry):
+                if domain not in seen:
+                    del self._expiry[domain]
+        return parsed
+
+    def render(self) -> List[str]:
+        now = time.time()
+        with self._lock:
+            items = sorted(self._expiry.items())
+        days_name = f'{PREFIX}_certificate_days_remaining'
+        expiry_name = f'{PREFIX}_certificate_expiry_timestamp_seconds'
+        lines = [
+            f'# HELP {days_name} Days until the certificate expires.',
+            f'# TYPE {days_name} gauge',
+        ]
+        for domain, (expiry, _) in items:
+            days = int((expiry - now) // 86400)
+            lines.append(f'{days_name}{{domain="{escape_label(domain)}"}} {days}')
+        lines += [
+            f'# HELP {expiry_name} Certificate notAfter as a Unix timestamp.',
+            f'# TYPE {expiry_name} gauge',
+        ]
+        for domain, (expiry, _) in items:
+            lines.append(f'{expiry_name}{{domain="{escape_label(domain)}"}} {_format_value(expiry)}')
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        self.inventory = CertificateInventory()
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """生成Prometheus文本格式"""
+        lines = self.inventory.render()
+        for metric in self.metrics:
+            lines += metric.header()
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str) -> None:
+        """原子写出node-exporter textfile"""
+        write_atomic(path, self.render())
+        logger.debug(f"指标已写出: {path}")
+
+
+# 全局注册表和指标
+registry = MetricsRegistry()
+
+CERT_RENEWAL_SECONDS = registry.register(Gauge(
+    f'{PREFIX}_certificate_last_renewal_duration_seconds',
+    'Duration of the last successful issuance for the certificate.',
+    ['domain'],
+))
+CERT_RENEWAL_TIMESTAMP = registry.register(Gauge(
+    f'{PREFIX}_certificate_last_renewal_timestamp_seconds',
+    'Unix timestamp of the last successful issuance for the certificate.',
+    ['domain'],
+))
+DNSLA_REQUEST_SECONDS = registry.register(Histogram(
+    f'{PREFIX}_dnsla_request_duration_seconds',
+    'Latency of DNS.LA API requests.',
+    ['method', 'endpoint'],
+))
+DNSLA_REQUEST_ERRORS = registry.register(Counter(
+    f'{PREFIX}_dnsla_request_errors_total',
+    'DNS.LA API requests that failed.',
+    ['method', 'endpoint'],
+))
+ACME_ORDERS = registry.register(Counter(
+    f'{PREFIX}_acme_orders_total',
+    'ACME orders by outcome.',
+    ['outcome'],
+))
+ACME_REVOCATIONS = registry.register(Counter(
+    f'{PREFIX}_acme_revocations_total',
+    'Certificate revocations by outcome.',
+    ['outcome'],
+))
+DEPLOY_HOOK_SECONDS = registry.register(Histogram(
+    f'{PREFIX}_deploy_hook_duration_seconds',
+    'Duration of coalesced service reload hooks.',
+    ['service'],
+    buckets=DEPLOY_HOOK_BUCKETS,
+))
+DEPLOY_HOOK_FAILURES = registry.register(Counter(
+    f'{PREFIX}_deploy_hook_failures_total',
+    'Service reload hooks that failed, by reason (exit, timeout, error).',
+    ['service', 'reason'],
+))
+DISTRIBUTED_BUNDLES = registry.register(Counter(
+    f'{PREFIX}_distributed_bundles_total',
+    'Certificate bundles per distribution node, by outcome (sent, skipped, failed).',
+    ['node', 'outcome'],
+))
+CERT_SERVER_REQUESTS = registry.register(Counter(
+    f'{PREFIX}_cert_server_requests_total',
+    'Certificate API requests, by route and HTTP status.',
+    ['route', 'status'],
+))
+CERT_SERVER_WATCHERS = registry.register(Gauge(
+    f'{PREFIX}_cert_server_event_streams',
+    'Open server-sent event streams on the certificate API.',
+))
+OCSP_FETCHES = registry.register(Counter(
+    f'{PREFIX}_ocsp_fetches_total',
+    'OCSP responses requested, by outcome (fetched, revoked, error).',
+    ['outcome'],
+))
+OCSP_FETCH_SECONDS = registry.register(Histogram(
+    f'{PREFIX}_ocsp_fetch_seconds',
+    'Latency of OCSP requests.',
+))
+OCSP_NEXT_UPDATE = registry.register(Gauge(
+    f'{PREFIX}_ocsp_next_update_timestamp_seconds',
+    'nextUpdate of the cached OCSP response for the certificate.',
+    ['domain'],
+))
+LOCK_ACQUISITIONS = registry.register(Counter(
+    f'{PREFIX}_lock_acquisitions_total',
+    'Certificate lease acquisition attempts, by outcome (acquired, busy).',
+    ['outcome'],
+))
+LEADER = registry.register(Gauge(
+    f'{PREFIX}_leader',
+    'Whether this node currently holds the daemon leader lease.',
+))
+WORK_QUEUE_JOBS = registry.register(Gauge(
+    f'{PREFIX}_work_queue_jobs',
+    'Renewal jobs in the work queue, by status (ready, leased, done, failed).',
+    ['status'],
+))
+WORK_QUEUE_PROCESSED = registry.register(Counter(
+    f'{PREFIX}_work_queue_processed_total',
+    'Renewal jobs processed by this worker, by outcome (done, retry, failed).',
+    ['outcome'],
+))
+JOB_API_JOBS = registry.register(Counter(
+    f'{PREFIX}_job_api_jobs_total',
+    'Issuance API jobs, by outcome (submitted, coalesced, succeeded, failed).',
+    ['outcome'],
+))
+JOB_API_RUNNING = registry.register(Gauge(
+    f'{PREFIX}_job_api_running_jobs',
+    'Issuance API jobs currently running.',
+))
+JOB_API_REQUESTS = registry.register(Counter(
+    f'{PREFIX}_job_api_requests_total',
+    'Issuance API requests, by route and HTTP status.',
+    ['route', 'status'],
+))
+PROPAGATION_SECONDS = registry.register(Histogram(
+    f'{PREFIX}_propagation_wait_seconds',
+    'Time spent waiting for challenge records to propagate.',
+    buckets=PROPAGATION_BUCKETS,
+))
+
+
+def observe_dnsla_request(method: str, endpoint: str, duration: float, error: Optional[Exception]) -> None:
+    """DNS.LA请求钩子，记录延迟和错误"""
+    DNSLA_REQUEST_SECONDS.observe(duration, method=method, endpoint=endpoint)
+    if error is not None:
+        DNSLA_REQUEST_ERRORS.inc(method=method, endpoint=endpoint)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics 请求处理"""
+
+    registry: MetricsRegistry = registry
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format % args)
+
+
+def start_http_server(host: str, port: int, metrics_registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动 /metrics HTTP端点
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        metrics_registry: 指标注册表（默认全局注册表）
+
+    Returns:
+        HTTP服务器实例（调用shutdown()停止）
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': metrics_registry or registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logger.info(f"指标端点已启动: http://{host}:{server.server_address[1]}/metrics")
+    return server
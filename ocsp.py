@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+OCSP响应预取
+按证书AIA扩展中的OCSP地址获取响应，校验后保存为证书目录中的 ocsp.der
+（nginx ssl_stapling_file 等直接使用），在响应有效期过半时刷新
+"""
+
+import logging
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.x509 import ocsp
+from cryptography.x509.oid import AuthorityInformationAccessOID, ExtendedKeyUsageOID
+
+import metrics
+from chain_store import load_intermediates
+from fsutil import write_atomic
+
+logger = logging.getLogger(__name__)
+
+OCSP_FILE = 'ocsp.der'
+
+# 响应没有 nextUpdate 时的刷新间隔
+DEFAULT_REFRESH = timedelta(hours=12)
+
+
+class OCSPError(Exception):
+    """OCSP请求失败或响应无效"""
+
+
+def ocsp_url(cert: x509.Certificate) -> Optional[str]:
+    """证书AIA扩展中的OCSP地址，没有时返回None"""
+    try:
+        aia = cert.extensions.get_extension_for_class(x509.AuthorityInformationAccess).value
+    except x509.ExtensionNotFound:
+        return None
+    for description in aia:
+        if description.access_method == AuthorityInformationAccessOID.OCSP:
+            return description.access_location.value
+    return None
+
+
+def load_chain(cert_path: Path) -> Tuple[x509.Certificate, Optional[x509.Certificate]]:
+    """
+    返回 (服务器证书, 签发者证书)
+
+    有 cert.pem 和 chain.pem 时只解析服务器证书，中间证书使用证书链存储的解析缓存；
+    否则解析 fullchain.pem。
+    """
+    cert_file, chain_file = cert_path / 'cert.pem', cert_path / 'chain.pem'
+    if cert_file.exists() and chain_file.exists():
+        intermediates = load_intermediates(str(chain_file))
+        if intermediates:
+            return x509.load_pem_x509_certificate(cert_file.read_bytes()), intermediates[0]
+    certs = x509.load_pem_x509_certificates((cert_path / 'fullchain.pem').read_bytes())
+    return certs[0], certs[1] if len(certs) > 1 else None
+
+
+def _verify_signature(public_key, signature: bytes, data: bytes, algorithm) -> None:
+    if isinstance(public_key, rsa.RSAPublicKey):
+        public_key.verify(signature, data, padding.PKCS1v15(), algorithm)
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        public_key.verify(signature, data, ec.ECDSA(algorithm))
+    elif isinstance(public_key, ed25519.Ed25519PublicKey):
+        public_key.verify(signature, data)
+    else:
+        raise OCSPError(f"不支持的响应签名密钥: {type(public_key).__name__}")
+
+
+def _is_delegated_responder(candidate: x509.Certificate, issuer: x509.Certificate) -> bool:
+    """响应中携带的证书是否为签发者授权的OCSP签名证书"""
+    try:
+        candidate.verify_directly_issued_by(issuer)
+        usage = candidate.extensions.get_extension_for_class(x509.ExtendedKeyUsage).value
+    except (ValueError, TypeError, InvalidSignature, x509.ExtensionNotFound):
+        return False
+    return ExtendedKeyUsageOID.OCSP_SIGNING in usage
+
+
+def validate_response(response: ocsp.OCSPResponse, cert: x509.Certificate, issuer: x509.Certificate,
+                      now: Optional[datetime] = None) -> None:
+    """
+    校验OCSP响应: 状态成功、对应该证书、由签发者（或其授权的响应者）签名、仍在有效期内
+
+    Raises:
+        OCSPError: 响应无效
+    """
+    if response.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL:
+        raise OCSPError(f"OCSP响应状态: {response.response_status.name}")
+    if response.serial_number != cert.serial_number:
+        raise OCSPError("OCSP响应的序列号与证书不一致")
+
+    signers = [issuer] + [candidate for candidate in response.certificates
+                          if _is_delegated_responder(candidate, issuer)]
+    for signer in signers:
+        try:
+            _verify_signature(signer.public_key(), response.signature,
+                              response.tbs_response_bytes, response.signature_hash_algorithm)
+            break
+        except InvalidSignature:
+            continue
+    else:
+        raise OCSPError("OCSP响应签名无效")
+
+    now = now or datetime.now(timezone.utc)
+    if response.next_update_utc is not None and response.next_update_utc <= now:
+        raise OCSPError(f"OCSP响应已过期（nextUpdate {response.next_update_utc.isoformat()}）")
+
+
+def refresh_time(response: ocsp.OCSPResponse) -> datetime:
+    """响应有效期过半的时间（需要刷新的时间）"""
+    if response.next_update_utc is None:
+        return response.this_update_utc + DEFAULT_REFRESH
+    return response.this_update_utc + (response.next_update_utc - response.this_update_utc) / 2
+
+
+def fetch_response(cert: x509.Certificate, issuer: x509.Certificate, url: str,
+                   timeout: float = 10) -> Tuple[bytes, ocsp.OCSPResponse]:
+    """
+    向OCSP响应者POST请求
+
+    Returns:
+        (DER编码的响应, 解析后的响应)
+
+    Raises:
+        OCSPError: 请求失败或响应无法解析
+    """
+    request = ocsp.OCSPRequestBuilder().add_certificate(cert, issuer, hashes.SHA1()).build()
+    http_request = urllib.request.Request(
+        url, data=request.public_bytes(serialization.Encoding.DER),
+        method='POST', headers={'Content-Type': 'application/ocsp-request'}
+    )
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as http_response:
+            der = http_response.read()
+    except OSError as e:
+        raise OCSPError(f"请求 {url} 失败: {e}") from e
+    try:
+        return der, ocsp.load_der_ocsp_response(der)
+    except ValueError as e:
+        raise OCSPError(f"无法解析OCSP响应: {e}") from e
+
+
+class OCSPResult:
+    """一个证书的OCSP刷新结果"""
+
+    __slots__ = ('domain', 'status', 'next_update', 'refresh_at', 'error')
+
+    def __init__(self, domain: str, status: str, next_update: Optional[datetime] = None,
+                 refresh_at: Optional[datetime] = None, error: str = ''):
+        """
+        Args:
+            domain: 证书目录名
+            status: fetched（已更新）、fresh（缓存仍有效）、revoked、no_url（证书没有OCSP地址）或 error
+            next_update: 缓存响应的 nextUpdate
+            refresh_at: 下次刷新时间
+            error: 错误信息
+        """
+        self.domain = domain
+        self.status = status
+        self.next_update = next_update
+        self.refresh_at = refresh_at
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ('fetched', 'fresh', 'no_url')
+
+    def __repr__(self) -> str:
+        return f"OCSPResult({self.domain!r}, {self.status!r})"
+
+
+class OCSPPrefetcher:
+    """
+    OCSP响应预取
+
+    扫描证书目录，对缺少响应、响应属于旧证书或有效期已过半的证书并发请求OCSP响应，
+    校验通过且状态为good的响应原子写入 <证书目录>/ocsp.der。
+    """
+
+    def __init__(
+            self,
+            cert_dir: str,
+            max_workers: int = 16,
+            timeout: float = 10,
+            clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc)
+    ):
+        """
+        Args:
+            cert_dir: 证书存储目录
+            max_workers: 最多并发的OCSP请求数
+            timeout: 单个请求的超时（秒）
+            clock: 返回当前UTC时间的函数（测试用）
+        """
+        self.cert_dir = cert_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.clock = clock
+
+    def cached(self, cert_path: Path, cert: x509.Certificate) -> Optional[ocsp.OCSPResponse]:
+        """读取已缓存且属于该证书的响应"""
+        try:
+            response = ocsp.load_der_ocsp_response((cert_path / OCSP_FILE).read_bytes())
+        except (OSError, ValueError):
+            return None
+        if (response.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL
+                or response.serial_number != cert.serial_number):
+            return None
+        return response
+
+    def refresh_certificate(self, cert_path: Path, force: bool = False) -> OCSPResult:
+        """
+        刷新单个证书目录的OCSP响应
+
+        Args:
+            cert_path: 证书目录
+            force: 忽略缓存的响应，总是重新请求
+
+        Returns:
+            刷新结果
+        """
+        domain = cert_path.name
+        try:
+            cert, issuer = load_chain(cert_path)
+        except (OSError, ValueError) as e:
+            return OCSPResult(domain, 'error', error=f"读取证书失败: {e}")
+        url = ocsp_url(cert)
+        if not url:
+            return OCSPResult(domain, 'no_url')
+        if issuer is None:
+            return OCSPResult(domain, 'error', error="fullchain.pem 中没有签发者证书")
+
+        now = self.clock()
+        cached = None if force else self.cached(cert_path, cert)
+        if cached is not None and now < refresh_time(cached):
+            return OCSPResult(domain, 'fresh', cached.next_update_utc, refresh_time(cached))
+
+        start = time.perf_counter()
+        try:
+            der, response = fetch_response(cert, issuer, url, self.timeout)
+            validate_response(response, cert, issuer, now)
+        except OCSPError as e:
+            metrics.OCSP_FETCHES.inc(outcome='error')
+            logger.warning(f"获取 {domain} 的OCSP响应失败: {e}")
+            current = cached or self.cached(cert_path, cert)
+            if current is not None and current.next_update_utc is not None and current.next_update_utc <= now:
+                current = None
+            if current is None:
+                # 属于旧证书或已过期的响应不能继续装订
+                (cert_path / OCSP_FILE).unlink(missing_ok=True)
+            # 该证书的响应仍未过期时继续使用
+            next_update = current.next_update_utc if current is not None else None
+            return OCSPResult(domain, 'error', next_update, error=str(e))
+        finally:
+            metrics.OCSP_FETCH_SECONDS.observe(time.perf_counter() - start)
+
+        if response.certificate_status == ocsp.OCSPCertStatus.REVOKED:
+            # 不缓存吊销状态，避免服务端装订吊销响应；之前缓存的good响应也不能再装订，需要尽快替换证书
+            (cert_path / OCSP_FILE).unlink(missing_ok=True)
+            metrics.OCSP_FETCHES.inc(outcome='revoked')
+            logger.error(f"证书 {domain} 已被吊销（{response.revocation_time_utc}）")
+            return OCSPResult(domain, 'revoked', response.next_update_utc, error="证书已被吊销")
+        if response.certificate_status != ocsp.OCSPCertStatus.GOOD:
+            metrics.OCSP_FETCHES.inc(outcome='error')
+            return OCSPResult(domain, 'error', error=f"OCSP证书状态: {response.certificate_status.name}")
+
+        write_atomic(str(cert_path / OCSP_FILE), der)
+        metrics.OCSP_FETCHES.inc(outcome='fetched')
+        if response.next_update_utc is not None:
+            metrics.OCSP_NEXT_UPDATE.set(response.next_update_utc.timestamp(), domain=domain)
+        logger.info(f"已更新 {domain} 的OCSP响应")
+        return OCSPResult(domain, 'fetched', response.next_update_utc, refresh_time(response))
+
+    def refresh(self, force: bool = False, domains: Optional[List[str]] = None) -> List[OCSPResult]:
+        """
+        并发刷新证书目录中的所有证书
+
+        Args:
+            force: 忽略缓存的响应，总是重新请求
+            domains: 只刷新这些证书目录（默认全部）
+
+        Returns:
+            每个证书的刷新结果（按证书目录名排序）
+        """
+        root = Path(self.cert_dir)
+        if not root.exists():
+            return []
+        paths = [path for path in sorted(root.iterdir())
+                 if path.is_dir() and (path / 'fullchain.pem').exists()
+                 and (domains is None or path.name in domains)]
+        if not paths:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(paths))) as executor:
+            return list(executor.map(lambda path: self.refresh_certificate(path, force), paths))
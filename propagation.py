@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+DNS记录生效检查
+直接向权威DNS服务器查询TXT记录（避免递归解析器的否定缓存），
+并按托管域名记录实际生效耗时，据此得出每个域名的等待上限
+"""
+
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from fsutil import write_atomic
+
+logger = logging.getLogger(__name__)
+
+DNS_PORT = 53
+TYPE_TXT = 16
+CLASS_IN = 1
+
+
+def _encode_name(name: str) -> bytes:
+    parts = []
+    for label in name.rstrip('.').split('.'):
+        encoded = label.encode('idna') if not label.startswith('_') else label.encode('ascii')
+        parts.append(struct.pack('!B', len(encoded)) + encoded)
+    return b''.join(parts) + b'\x00'
+
+
+def _skip_name(data: bytes, offset: int) -> int:
+    """跳过报文中的域名（支持压缩指针），返回之后的偏移"""
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += length + 1
+
+
+def build_txt_query(name: str, query_id: int) -> bytes:
+    """构造TXT查询报文（不请求递归）"""
+    header = struct.pack('!HHHHHH', query_id, 0, 1, 0, 0, 0)
+    return header + _encode_name(name) + struct.pack('!HH', TYPE_TXT, CLASS_IN)
+
+
+def parse_txt_response(data: bytes, query_id: int) -> List[str]:
+    """
+    解析TXT查询响应
+
+    Returns:
+        TXT记录值列表（每条记录的多个字符串会拼接在一起）
+
+    Raises:
+        ValueError: 报文ID不匹配或响应码表示错误（NXDOMAIN除外）
+    """
+    response_id, flags, qdcount, ancount, _, _ = struct.unpack('!HHHHHH', data[:12])
+    if response_id != query_id:
+        raise ValueError("DNS响应ID不匹配")
+    rcode = flags & 0x000F
+    if rcode == 3:  # NXDOMAIN
+        return []
+    if rcode != 0:
+        raise ValueError(f"DNS响应错误 (rcode: {rcode})")
+
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+
+    values = []
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, _, _, rdlength = struct.unpack('!HHIH', data[offset:offset + 10])
+        offset += 10
+        rdata = data[offset:offset + rdlength]
+        offset += rdlength
+        if rtype != TYPE_TXT:
+            continue
+        chunks, position = [], 0
+        while position < len(rdata):
+            length = rdata[position]
+            chunks.append(rdata[position + 1:position + 1 + length])
+            position += length + 1
+        values.append(b''.join(chunks).decode('utf-8', errors='replace'))
+    return values
+
+
+def query_txt(name: str, server: str, timeout: float = 3.0, port: int = DNS_PORT) -> List[str]:
+    """
+    通过UDP向指定DNS服务器查询TXT记录
+
+    Args:
+        name: 完整域名
+        server: DNS服务器地址或主机名（可带端口，如 127.0.0.1:5353）
+        timeout: 超时时间（秒）
+        port: DNS端口
+    """
+    if server.count(':') == 1:
+        server, port = server.split(':')
+        port = int(port)
+    query_id = random.randint(0, 0xFFFF)
+    address = socket.getaddrinfo(server, port, type=socket.SOCK_DGRAM)[0]
+    with socket.socket(address[0], socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(build_txt_query(name, query_id), address[4])
+        data, _ = sock.recvfrom(4096)
+    return parse_txt_response(data, query_id)
+
+
+class ZoneStats:
+    """
+    按托管域名持久化的统计数据
+
+    - 验证记录从添加到在所有权威服务器可见的耗时（最近若干次）
+    - 托管域名允许的最小TTL（添加低TTL记录被拒绝后记录，MIN_TTL_MAX_AGE 后过期，
+      重新从配置的TTL开始尝试，套餐变更后可以降回更低的TTL）
+    """
+
+    MAX_SAMPLES = 50
+    MIN_TTL_MAX_AGE = 7 * 86400
+
+    def __init__(self, path: Optional[str] = None, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            path: JSON文件路径（为空时只保存在内存中）
+            clock: 时钟（测试时可替换）
+        """
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取域名统计失败，将重新统计: {e}")
+
+    def _zone(self, zone: str) -> Dict:
+        return self._data.setdefault(zone, {'propagation': [], 'min_ttl': None})
+
+    def _save(self) -> None:
+        if self.path:
+            write_atomic(self.path, json.dumps(self._data, indent=2, sort_keys=True))
+
+    def observe_propagation(self, zone: str, seconds: float) -> None:
+        """记录一次生效耗时"""
+        with self._lock:
+            samples = self._zone(zone)['propagation']
+            samples.append(round(seconds, 2))
+            del samples[:-self.MAX_SAMPLES]
+            self._save()
+
+    def propagation_samples(self, zone: str) -> List[float]:
+        return list(self._data.get(zone, {}).get('propagation', []))
+
+    def propagation_deadline(
+            self,
+            zone: str,
+            default: float,
+            margin: float = 1.5,
+            min_samples: int = 3,
+            minimum: float = 10,
+            maximum: float = 900
+    ) -> float:
+        """
+        计算托管域名的等待上限
+
+        样本不足时使用默认值；否则取最近样本的p95乘以余量系数，并限制在[minimum, maximum]内。
+
+        Args:
+            zone: 托管域名
+            default: 没有足够样本时的等待上限（即配置的 propagation_seconds）
+            margin: 余量系数
+            min_samples: 开始使用学习值所需的最少样本数
+            minimum: 等待上限的下限
+            maximum: 等待上限的上限
+        """
+        samples = sorted(self.propagation_samples(zone))
+        if len(samples) < min_samples:
+            return default
+        p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+        return max(minimum, min(maximum, p95 * margin))
+
+    def min_ttl(self, zone: str) -> int:
+        """记住的最小TTL，没有记录或已过期时返回0"""
+        data = self._data.get(zone, {})
+        if self.clock() - data.get('min_ttl_time', 0) > self.MIN_TTL_MAX_AGE:
+            return 0
+        return data.get('min_ttl') or 0
+
+    def set_min_ttl(self, zone: str, ttl: int) -> None:
+        with self._lock:
+            zone_data = self._zone(zone)
+            zone_data['min_ttl'] = ttl
+            zone_data['min_ttl_time'] = self.clock()
+            self._save()
+
+
+class PropagationChecker:
+    """
+    轮询权威DNS服务器直到所有验证值可见
+
+    每个托管域名有独立的等待上限（由 ZoneStats 学习得出），
+    每个验证域名只需在所有服务器上看到全部期望值一次即视为生效。
+    """
+
+    def __init__(
+            self,
+            nameservers: List[str],
+            stats: ZoneStats,
+            interval: float = 2.0,
+            timeout: float = 3.0,
+            query: Callable[..., List[str]] = query_txt,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        Args:
+            nameservers: 权威DNS服务器列表
+            stats: 域名统计
+            interval: 轮询间隔（秒）
+            timeout: 单次查询超时（秒）
+            query: 查询函数 query(name, server, timeout=...)
+            clock: 单调时钟（测试时可替换）
+            sleep: 等待函数（测试时可替换）
+        """
+        self.nameservers = nameservers
+        self.stats = stats
+        self.interval = interval
+        self.timeout = timeout
+        self.query = query
+        self.clock = clock
+        self.sleep = sleep
+
+    def _visible(self, name: str, values: Set[str]) -> bool:
+        for server in self.nameservers:
+            try:
+                found = set(self.query(name, server, timeout=self.timeout))
+            except (OSError, ValueError) as e:
+                logger.debug(f"查询 {name} @ {server} 失败: {e}")
+                return False
+            if not values <= found:
+                return False
+        return True
+
+    def wait(self, expected: Dict[str, Dict[str, Set[str]]], default_seconds: float) -> bool:
+        """
+        等待验证记录生效
+
+        Args:
+            expected: {托管域名: {验证域名: 期望的TXT值集合}}
+            default_seconds: 没有学习数据时的等待上限
+
+        Returns:
+            是否所有记录都在等待上限内生效（某个托管域名超时后继续等待其他托管域名，
+            全部生效或超时后才返回）
+        """
+        start = self.clock()
+        timed_out = False
+        deadlines = {zone: self.stats.propagation_deadline(zone, default_seconds) for zone in expected}
+        pending = {zone: dict(names) for zone, names in expected.items()}
+        for zone, deadline in deadlines.items():
+            logger.info(f"  {zone}: 最多等待 {deadline:.0f} 秒")
+
+        while True:
+            elapsed = self.clock() - start
+            for zone in list(pending):
+                names = pending[zone]
+                for name in list(names):
+                    if self._visible(name, names[name]):
+                        del names[name]
+                if not names:
+                    logger.info(f"  {zone}: 验证记录已生效（{elapsed:.1f}秒）")
+                    self.stats.observe_propagation(zone, elapsed)
+                    del pending[zone]
+                elif elapsed >= deadlines[zone]:
+                    logger.warning(f"  {zone}: {elapsed:.0f} 秒内验证记录未全部生效")
+                    # 超时也作为一次样本，使下次的等待上限随之增长
+                    self.stats.observe_propagation(zone, elapsed)
+                    del pending[zone]
+                    timed_out = True
+
+            if not pending:
+                return not timed_out
+            self.sleep(self.interval)
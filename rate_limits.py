@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Let's Encrypt 速率限制规划
+在本地记录颁发历史，按CA的限制把域名打包成证书订单，
+会超出限制的订单推迟到限制窗口滑过之后
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from fsutil import write_atomic
+
+logger = logging.getLogger(__name__)
+
+WEEK = 7 * 24 * 3600
+HOUR = 3600
+# 已颁发的域名集合的保留时长，用于识别续期（续期通常在颁发后60天左右）
+RENEWAL_LOOKBACK = 180 * 24 * 3600
+
+# 常见的多级公共后缀（未使用完整的Public Suffix List）
+MULTI_LABEL_SUFFIXES = {
+    'com.cn', 'net.cn', 'org.cn', 'gov.cn', 'edu.cn', 'ac.cn',
+    'com.hk', 'com.tw', 'co.uk', 'org.uk', 'co.jp', 'com.au', 'com.sg',
+}
+
+
+class RateLimits:
+    """Let's Encrypt 的限制值（可按CA调整）"""
+
+    def __init__(
+            self,
+            max_sans: int = 100,
+            certificates_per_domain: int = 50,
+            certificates_per_domain_window: float = WEEK,
+            duplicate_certificates: int = 5,
+            duplicate_window: float = WEEK,
+            failed_validations: int = 5,
+            failed_validation_window: float = HOUR
+    ):
+        """
+        Args:
+            max_sans: 每个证书最多的域名数
+            certificates_per_domain: 每个注册域名在窗口内最多的证书数
+            certificates_per_domain_window: 注册域名限制的窗口（秒）
+            duplicate_certificates: 完全相同域名集合的证书在窗口内最多的数量
+            duplicate_window: 重复证书限制的窗口（秒）
+            failed_validations: 每个主机名在窗口内最多的验证失败次数
+            failed_validation_window: 验证失败限制的窗口（秒）
+        """
+        self.max_sans = max_sans
+        self.certificates_per_domain = certificates_per_domain
+        self.certificates_per_domain_window = certificates_per_domain_window
+        self.duplicate_certificates = duplicate_certificates
+        self.duplicate_window = duplicate_window
+        self.failed_validations = failed_validations
+        self.failed_validation_window = failed_validation_window
+
+
+def registered_domain(name: str) -> str:
+    """
+    返回名称所属的注册域名（如 www.example.com.cn -> example.com.cn）
+
+    Args:
+        name: 域名（可以是通配符）
+    """
+    labels = name.lower().rstrip('.').lstrip('*.').split('.')
+    if len(labels) >= 3 and '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def certificate_key(names: Iterable[str]) -> str:
+    """证书域名集合的规范形式（CA按不区分大小写的集合判断重复证书）"""
+    return ','.join(sorted({name.lower() for name in names}))
+
+
+class IssuanceHistory:
+    """
+    本地颁发历史（JSON文件）
+
+    记录每次成功颁发的域名集合和每次验证失败的主机名，只保留最长限制窗口内的数据；
+    另外记录每个域名集合最近一次颁发的时间（保留 RENEWAL_LOOKBACK），用于识别续期。
+    """
+
+    def __init__(self, path: Optional[str] = None, retention: float = WEEK):
+        """
+        Args:
+            path: JSON文件路径（为空时只保存在内存中）
+            retention: 保留时长（秒）
+        """
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+        # [(时间, 证书域名集合), ...]
+        self.issuances: List[Tuple[float, str]] = []
+        # [(时间, 主机名), ...]
+        self.failures: List[Tuple[float, str]] = []
+        # 证书域名集合 -> 最近一次颁发时间
+        self.issued: Dict[str, float] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.issuances = [tuple(item) for item in data.get('issuances', [])]
+            self.failures = [tuple(item) for item in data.get('failures', [])]
+            self.issued = dict(data.get('issued', {}))
+            for when, key in self.issuances:
+                self.issued[key] = max(when, self.issued.get(key, 0))
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取颁发历史失败: {e}")
+
+    def _save(self, now: float) -> None:
+        cutoff = now - self.retention
+        self.issuances = [item for item in self.issuances if item[0] > cutoff]
+        self.failures = [item for item in self.failures if item[0] > cutoff]
+        self.issued = {key: when for key, when in self.issued.items() if when > now - RENEWAL_LOOKBACK}
+        if self.path:
+            write_atomic(self.path, json.dumps({'issuances': self.issuances, 'failures': self.failures,
+                                                'issued': self.issued}))
+
+    def record_issuance(self, names: Iterable[str], when: float) -> None:
+        with self._lock:
+            key = certificate_key(names)
+            self.issuances.append((when, key))
+            self.issued[key] = max(when, self.issued.get(key, 0))
+            self._save(when)
+
+    def is_renewal(self, names: Iterable[str]) -> bool:
+        """之前颁发过完全相同域名集合的证书（CA按续期处理）"""
+        return certificate_key(names) in self.issued
+
+    def record_failure(self, names: Iterable[str], when: float) -> None:
+        with self._lock:
+            self.failures.extend((when, name.lower()) for name in names)
+            self._save(when)
+
+
+class PlannedOrder:
+    """规划结果中的一个证书订单"""
+
+    __slots__ = ('names', 'not_before', 'reason')
+
+    def __init__(self, names: List[str], not_before: float, reason: str = ''):
+        self.names = names
+        self.not_before = not_before
+        self.reason = reason
+
+    def __repr__(self) -> str:
+        return f"PlannedOrder({self.names[0]!r}, sans={len(self.names)}, not_before={self.not_before}, reason={self.reason!r})"
+
+
+def pack_names(names: Iterable[str], max_sans: int = 100,
+               group_key: Callable[[str], str] = registered_domain) -> List[List[str]]:
+    """
+    把域名打包成尽量少的证书
+
+    同一注册域名的名称尽量放在同一个证书中（减少占用的注册域名额度），
+    按组从大到小首次适应装箱，超过 max_sans 的组拆分。
+
+    Args:
+        names: 域名列表
+        max_sans: 每个证书最多的域名数
+        group_key: 分组函数
+
+    Returns:
+        证书域名列表的列表
+    """
+    groups: Dict[str, List[str]] = {}
+    for name in dict.fromkeys(names):
+        groups.setdefault(group_key(name), []).append(name)
+
+    chunks = []
+    for group in groups.values():
+        for i in range(0, len(group), max_sans):
+            chunks.append(group[i:i + max_sans])
+
+    bins: List[List[str]] = []
+    for chunk in sorted(chunks, key=len, reverse=True):
+        for certificate in bins:
+            if len(certificate) + len(chunk) <= max_sans:
+                certificate.extend(chunk)
+                break
+        else:
+            bins.append(list(chunk))
+    return bins
+
+
+class OrderPlanner:
+    """
+    速率限制规划器
+
+    检查每个证书订单是否会超出注册域名、重复证书和验证失败限制，
+    可以立即执行的订单排在前面，其余订单推迟到相关记录滑出窗口之后。
+    """
+
+    def __init__(
+            self,
+            history: IssuanceHistory,
+            limits: Optional[RateLimits] = None,
+            clock: Callable[[], float] = time.time
+    ):
+        """
+        Args:
+            history: 颁发历史
+            limits: 限制值（默认Let's Encrypt）
+            clock: 时间函数（测试时使用模拟时钟）
+        """
+        self.history = history
+        self.limits = limits or RateLimits()
+        self.clock = clock
+
+    @staticmethod
+    def _available_at(times: List[float], limit: int, window: float, now: float) -> float:
+        """窗口内已有 times 次时，下一次最早可以在什么时候发生"""
+        recent = sorted(t for t in times if t > now - window)
+        if len(recent) < limit:
+            return now
+        return recent[len(recent) - limit] + window
+
+    def plan(self, certificates: List[List[str]]) -> List[PlannedOrder]:
+        """
+        为一批证书规划执行时间
+
+        Args:
+            certificates: 证书域名列表的列表
+
+        Returns:
+            按 not_before 排序的订单
+        """
+        limits = self.limits
+        now = self.clock()
+
+        # 规划中的订单也计入额度
+        domain_times: Dict[str, List[float]] = {}
+        duplicate_times: Dict[str, List[float]] = {}
+        for when, key in self.history.issuances:
+            duplicate_times.setdefault(key, []).append(when)
+            for domain in {registered_domain(name) for name in key.split(',')}:
+                domain_times.setdefault(domain, []).append(when)
+        failure_times: Dict[str, List[float]] = {}
+        for when, name in self.history.failures:
+            failure_times.setdefault(name, []).append(when)
+
+        planned = []
+        for names in certificates:
+            if len(names) > limits.max_sans:
+                raise ValueError(f"证书 {names[0]} 包含 {len(names)} 个域名，超过上限 {limits.max_sans}")
+
+            key = certificate_key(names)
+            # 续期（相同域名集合）不受每个注册域名的证书数限制，只受重复证书限制
+            domains = [] if self.history.is_renewal(names) else sorted({registered_domain(name) for name in names})
+            not_before, reason = now, ''
+
+            def consider(at: float, why: str):
+                nonlocal not_before, reason
+                if at > not_before:
+                    not_before, reason = at, why
+
+            # 推迟后的订单也会占用额度，因此在确定的时间点上重新检查，直到满足所有限制
+            while True:
+                start = not_before
+                consider(self._available_at(duplicate_times.get(key, []), limits.duplicate_certificates,
+                                            limits.duplicate_window, not_before), 'duplicate_certificate')
+                for domain in domains:
+                    consider(self._available_at(domain_times.get(domain, []), limits.certificates_per_domain,
+                                                limits.certificates_per_domain_window, not_before),
+                             f'certificates_per_domain:{domain}')
+                for name in names:
+                    consider(self._available_at(failure_times.get(name.lower(), []), limits.failed_validations,
+                                                limits.failed_validation_window, not_before),
+                             f'failed_validation:{name}')
+                if not_before == start:
+                    break
+
+            duplicate_times.setdefault(key, []).append(not_before)
+            for domain in domains:
+                domain_times.setdefault(domain, []).append(not_before)
+            planned.append(PlannedOrder(list(names), not_before, reason))
+
+        planned.sort(key=lambda order: order.not_before)
+        delayed = [order for order in planned if order.not_before > now]
+        if delayed:
+            logger.info(f"{len(delayed)} 个订单因速率限制推迟")
+        return planned
+
+    def plan_names(self, names: Iterable[str]) -> List[PlannedOrder]:
+        """把域名打包成证书后规划"""
+        return self.plan(pack_names(names, self.limits.max_sans))
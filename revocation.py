@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+批量吊销
+按选择条件（域名、序列号、颁发时间窗口、公钥哈希）从证书目录选出证书，
+在速率限制下并发吊销，进度写入JSONL日志以便中断后继续，最后批量颁发替换证书
+"""
+
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+import metrics
+from acme_client import issuing_account
+
+logger = logging.getLogger(__name__)
+
+# 吊销原因
+REASONS = {
+    0: 'unspecified',
+    1: 'keyCompromise',
+    3: 'affiliationChanged',
+    4: 'superseded',
+    5: 'cessationOfOperation',
+}
+
+
+def parse_serial(value: str) -> int:
+    """
+    解析序列号
+
+    带 0x 前缀、包含冒号或十六进制字母的按十六进制解析（openssl的格式），
+    纯数字按十进制解析（info 命令显示的格式）
+    """
+    text = value.strip().lower()
+    if text.startswith('0x'):
+        return int(text[2:], 16)
+    text = text.replace(':', '')
+    if text.isdigit() and ':' not in value:
+        return int(text)
+    return int(text, 16)
+
+
+def public_key_hash(cert: x509.Certificate) -> str:
+    """证书公钥（SubjectPublicKeyInfo DER）的SHA-256，与 openssl pkey -pubout -outform DER | sha256sum 一致"""
+    der = cert.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return hashlib.sha256(der).hexdigest()
+
+
+class RevocationTarget:
+    """被选中的一个证书"""
+
+    __slots__ = ('cert_file', 'domain', 'serial', 'names', 'not_before', 'key_hash', 'pem', 'account')
+
+    def __init__(self, cert_file: str, domain: str, serial: int, names: List[str],
+                 not_before: float, key_hash: str, pem: str, account: Optional[str] = None):
+        self.cert_file = cert_file
+        self.domain = domain
+        self.serial = serial
+        self.names = names
+        self.not_before = not_before
+        self.key_hash = key_hash
+        # 证书内容随选择结果一起写入日志，证书文件被替换后仍可以继续吊销
+        self.pem = pem
+        # 颁发账户（使用账户池时用该账户吊销），同样在替换证书写入后保持不变
+        self.account = account
+
+    @property
+    def serial_hex(self) -> str:
+        return format(self.serial, 'x')
+
+    @classmethod
+    def from_certificate(cls, cert_file: Path, cert: x509.Certificate) -> 'RevocationTarget':
+        try:
+            san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+            names = san.value.get_values_for_type(x509.DNSName)
+        except x509.ExtensionNotFound:
+            names = []
+        pem = cert.public_bytes(serialization.Encoding.PEM).decode('ascii')
+        return cls(str(cert_file), cert_file.parent.name, cert.serial_number, names,
+                   cert.not_valid_before_utc.timestamp(), public_key_hash(cert), pem,
+                   issuing_account(cert_file.parent))
+
+    def to_dict(self) -> Dict:
+        return {
+            'cert_file': self.cert_file,
+            'domain': self.domain,
+            'serial': self.serial_hex,
+            'names': self.names,
+            'not_before': self.not_before,
+            'key_hash': self.key_hash,
+            'pem': self.pem,
+            'account': self.account,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RevocationTarget':
+        return cls(data['cert_file'], data['domain'], int(data['serial'], 16), list(data['names']),
+                   data['not_before'], data['key_hash'], data['pem'], data.get('account'))
+
+    def __repr__(self) -> str:
+        return f"RevocationTarget({self.domain!r}, serial={self.serial_hex})"
+
+
+class CertificateSelector:
+    """
+    证书选择条件
+
+    各条件之间是“且”的关系，同一条件的多个值是“或”的关系；
+    至少需要一个条件，避免误选证书目录中的全部证书。
+    """
+
+    def __init__(
+            self,
+            domains: Iterable[str] = (),
+            serials: Iterable[str] = (),
+            issued_after: Optional[datetime] = None,
+            issued_before: Optional[datetime] = None,
+            key_hashes: Iterable[str] = ()
+    ):
+        """
+        Args:
+            domains: 域名或通配模式（如 *.example.com），匹配证书目录名或证书中的任一域名
+            serials: 序列号（十进制或十六进制）
+            issued_after: 只选择此时间之后颁发的证书
+            issued_before: 只选择此时间之前颁发的证书
+            key_hashes: 公钥SHA-256（十六进制，可以是前缀）
+        """
+        self.domains = [domain.lower() for domain in domains]
+        self.serials = {parse_serial(serial) for serial in serials}
+        self.issued_after = self._timestamp(issued_after)
+        self.issued_before = self._timestamp(issued_before)
+        self.key_hashes = [key_hash.lower().replace(':', '') for key_hash in key_hashes]
+        if not (self.domains or self.serials or self.key_hashes
+                or self.issued_after is not None or self.issued_before is not None):
+            raise ValueError("至少需要一个选择条件")
+
+    @staticmethod
+    def _timestamp(value: Optional[datetime]) -> Optional[float]:
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+    def matches(self, target: RevocationTarget) -> bool:
+        if self.domains:
+            candidates = [target.domain.lower()] + [name.lower() for name in target.names]
+            if not any(fnmatch.fnmatchcase(name, pattern) for pattern in self.domains for name in candidates):
+                return False
+        if self.serials and target.serial not in self.serials:
+            return False
+        if self.issued_after is not None and target.not_before < self.issued_after:
+            return False
+        if self.issued_before is not None and target.not_before >= self.issued_before:
+            return False
+        if self.key_hashes and not any(target.key_hash.startswith(h) for h in self.key_hashes):
+            return False
+        return True
+
+    def select(self, cert_dir: str) -> List[RevocationTarget]:
+        """
+        扫描证书目录（<cert_dir>/<域名>/cert.pem）并返回匹配的证书
+
+        Args:
+            cert_dir: 证书存储目录
+
+        Returns:
+            按域名排序的证书列表
+        """
+        targets = []
+        for cert_file in sorted(Path(cert_dir).glob('*/cert.pem')):
+            try:
+                cert = x509.load_pem_x509_certificate(cert_file.read_bytes(), default_backend())
+            except (OSError, ValueError) as e:
+                logger.warning(f"跳过无法读取的证书 {cert_file}: {e}")
+                continue
+            target = RevocationTarget.from_certificate(cert_file, cert)
+            if self.matches(target):
+                targets.append(target)
+        return targets
+
+
+class RevocationJournal:
+    """
+    吊销进度日志（JSONL，每行一个事件）
+
+    事件: selected（选中的证书，记录是否要求重新颁发）、revoked、failed、reissued、reissue_failed。
+    每个事件写入后立即 fsync，进程中断后可以从日志继续。日志可以由多次运行共用，
+    没有要求重新颁发的证书吊销后即完成。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, event: str, serial: str, **fields) -> None:
+        entry = {'time': time.time(), 'event': event, 'serial': serial, **fields}
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def entries(self) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # 写入时中断留下的不完整行
+                    logger.warning(f"忽略吊销日志中的无效行: {line.strip()[:80]}")
+        return entries
+
+    def state(self) -> Dict[str, str]:
+        """{序列号: 最后一个进度事件}（再次选中不会覆盖已有的进度）"""
+        state = {}
+        for entry in self.entries():
+            if entry['event'] == 'selected' and entry['serial'] in state:
+                continue
+            state[entry['serial']] = entry['event']
+        return state
+
+    def _selections(self) -> Dict[str, Dict]:
+        """{序列号: 最近一次 selected 事件}（按首次选中的顺序）"""
+        selections: Dict[str, Dict] = {}
+        for entry in self.entries():
+            if entry['event'] == 'selected':
+                selections[entry['serial']] = entry
+        return selections
+
+    def targets(self) -> List[RevocationTarget]:
+        """日志中记录的所有选中证书（按首次选中的顺序）"""
+        return [RevocationTarget.from_dict(entry['target']) for entry in self._selections().values()]
+
+    def reissue_requested(self, serial: str) -> bool:
+        """选中该证书的运行是否要求重新颁发"""
+        return bool(self._selections().get(serial, {}).get('reissue'))
+
+    def pending(self, serials: Optional[Iterable[str]] = None) -> List[RevocationTarget]:
+        """
+        尚未完成的证书: 未吊销，或要求重新颁发但还没有成功颁发替换证书
+
+        Args:
+            serials: 只检查这些序列号（本次运行的证书，默认检查日志中的全部证书）
+        """
+        state = self.state()
+        selections = self._selections()
+        wanted = set(serials) if serials is not None else None
+        pending = []
+        for serial, entry in selections.items():
+            if wanted is not None and serial not in wanted:
+                continue
+            event = state.get(serial)
+            if event == 'reissued' or (event == 'revoked' and not entry.get('reissue')):
+                continue
+            pending.append(RevocationTarget.from_dict(entry['target']))
+        return pending
+
+
+class RateLimiter:
+    """按固定间隔放行请求的线程安全限速器"""
+
+    def __init__(self, rate: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            rate: 每秒最多请求数（<= 0 表示不限速）
+            clock: 时间函数（测试时可替换）
+            sleep: 等待函数（测试时可替换）
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = self.clock()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            self.sleep(at - now)
+
+
+def _is_already_revoked(error: Exception) -> bool:
+    return str(getattr(error, 'typ', '')).endswith(':alreadyRevoked')
+
+
+class BulkRevoker:
+    """
+    批量吊销
+
+    选中的证书先写入日志，然后在限速器控制下并发吊销；已在日志中标记为吊销的证书
+    不会重复吊销（CA返回 alreadyRevoked 也视为成功）。全部吊销后把成功吊销的证书
+    交给证书管理器的批量颁发流程重新颁发。
+    """
+
+    def __init__(
+            self,
+            manager,
+            journal: RevocationJournal,
+            reason: int = 0,
+            max_workers: int = 8,
+            rate: float = 10.0,
+            limiter: Optional[RateLimiter] = None
+    ):
+        """
+        Args:
+            manager: 证书管理器（CertificateManager）
+            journal: 吊销进度日志
+            reason: 吊销原因代码
+            max_workers: 最大并发数
+            rate: 每秒最多吊销请求数
+            limiter: 自定义限速器（测试时使用）
+        """
+        if reason not in REASONS:
+            raise ValueError(f"无效的吊销原因: {reason}")
+        self.manager = manager
+        self.journal = journal
+        self.reason = reason
+        self.max_workers = max_workers
+        self.limiter = limiter or RateLimiter(rate)
+
+    def record_selection(self, targets: List[RevocationTarget], reissue: bool = False) -> None:
+        """
+        把新选中的证书写入日志
+
+        已在日志中的证书跳过；之前没有要求重新颁发、本次要求时再记录一次选中事件。
+        """
+        known = self.journal.state()
+        for target in targets:
+            if target.serial_hex not in known or (reissue and not self.journal.reissue_requested(target.serial_hex)):
+                self.journal.append('selected', target.serial_hex, target=target.to_dict(), reissue=reissue)
+
+    def _revoke_one(self, target: RevocationTarget) -> bool:
+        self.limiter.acquire()
+        try:
+            cert = x509.load_pem_x509_certificate(target.pem.encode('ascii'), default_backend())
+            self.manager.revoke(cert, self.reason, target.account)
+        except Exception as e:
+            if _is_already_revoked(e):
+                logger.info(f"证书已被吊销过: {target.domain} ({target.serial_hex})")
+            else:
+                logger.error(f"吊销失败: {target.domain} ({target.serial_hex}): {e}")
+                metrics.ACME_REVOCATIONS.inc(outcome='error')
+                self.journal.append('failed', target.serial_hex, error=str(e))
+                return False
+        logger.info(f"已吊销: {target.domain} ({target.serial_hex})")
+        metrics.ACME_REVOCATIONS.inc(outcome='revoked')
+        self.journal.append('revoked', target.serial_hex, reason=REASONS[self.reason])
+        return True
+
+    def revoke(self, targets: List[RevocationTarget], reissue: bool = False) -> Dict[str, bool]:
+        """
+        并发吊销（跳过日志中已吊销的证书）
+
+        Args:
+            targets: 要吊销的证书
+            reissue: 之后是否为这些证书颁发替换证书（记录在日志中，未完成时 --resume 继续）
+
+        Returns:
+            {十六进制序列号: 是否已吊销}
+        """
+        self.record_selection(targets, reissue)
+        state = self.journal.state()
+        results = {}
+        todo = []
+        for target in targets:
+            if state.get(target.serial_hex) in ('revoked', 'reissued', 'reissue_failed'):
+                results[target.serial_hex] = True
+            else:
+                todo.append(target)
+        if len(todo) < len(targets):
+            logger.info(f"{len(targets) - len(todo)} 个证书已在之前的运行中吊销")
+
+        if todo:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(todo))) as executor:
+                for target, ok in zip(todo, executor.map(self._revoke_one, todo)):
+                    results[target.serial_hex] = ok
+        return results
+
+    def reissue(
+            self,
+            targets: List[RevocationTarget],
+            cert_dir: str,
+            key_size: int = 2048,
+            max_wait: float = 0
+    ) -> Dict[str, Optional[Path]]:
+        """
+        为已吊销的证书颁发替换证书（使用新的私钥）
+
+        Returns:
+            {主域名: 证书目录路径或None}
+        """
+        state = self.journal.state()
+        todo = [target for target in targets if state.get(target.serial_hex) in ('revoked', 'reissue_failed')]
+        if not todo:
+            return {}
+
+        # 证书目录名是主域名，替换证书写入原来的目录（同一目录只颁发一次）
+        certificates: Dict[str, List[str]] = {}
+        for target in todo:
+            names = [target.domain] + [name for name in target.names if name != target.domain]
+            certificates.setdefault(target.domain, names)
+
+        results, deferred = self.manager.issue_batch(list(certificates.values()), cert_dir, key_size, max_wait)
+        for order in deferred:
+            logger.warning(f"替换证书 {order.names[0]} 因速率限制推迟，稍后使用 --resume 继续")
+        for target in todo:
+            cert_path = results.get(target.domain)
+            if cert_path:
+                self.journal.append('reissued', target.serial_hex, cert_path=str(cert_path))
+            else:
+                self.journal.append('reissue_failed', target.serial_hex)
+        return results
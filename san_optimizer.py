@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+SAN分组优化
+根据主机名清单和CA的每证书域名上限，选择证书分组：
+用通配符替代同一父域名下的多个主机名以减少挑战，
+尽量少的订单，并在多次续期之间保持分组稳定（未变化的分组可以复用有效授权）
+"""
+
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+from fsutil import write_atomic
+from rate_limits import pack_names, registered_domain
+
+logger = logging.getLogger(__name__)
+
+
+def parent_domain(name: str) -> Optional[str]:
+    """返回去掉第一个标签后的父域名（顶级注册域名本身没有可用的父域名）"""
+    labels = name.split('.')
+    if len(labels) <= 2:
+        return None
+    return '.'.join(labels[1:])
+
+
+def covered_by(name: str, wildcards: Set[str]) -> bool:
+    """名称是否被某个通配符覆盖（通配符只覆盖一级）"""
+    parent = parent_domain(name)
+    return parent is not None and f'*.{parent}' in wildcards
+
+
+def choose_identifiers(names: Iterable[str], wildcard_threshold: int = 0) -> List[str]:
+    """
+    选择实际申请的标识
+
+    - 已有通配符覆盖的显式主机名会被去掉
+    - wildcard_threshold > 0 时，同一父域名下至少有这么多个直接子主机名的，改用 *.父域名
+
+    Args:
+        names: 主机名清单
+        wildcard_threshold: 使用通配符的最少子主机名数（0表示不自动使用通配符）
+
+    Returns:
+        标识列表（保持原顺序，新增的通配符放在被替代的第一个主机名的位置）
+    """
+    names = list(dict.fromkeys(name.lower().rstrip('.') for name in names))
+    wildcards = {name for name in names if name.startswith('*.')}
+
+    if wildcard_threshold > 0:
+        children: Dict[str, int] = {}
+        for name in names:
+            parent = parent_domain(name)
+            if not name.startswith('*.') and parent:
+                children[parent] = children.get(parent, 0) + 1
+        wildcards |= {f'*.{parent}' for parent, count in children.items() if count >= wildcard_threshold}
+
+    identifiers = []
+    for name in names:
+        if name.startswith('*.') or not covered_by(name, wildcards):
+            identifiers.append(name)
+        else:
+            wildcard = f'*.{parent_domain(name)}'
+            if wildcard not in identifiers:
+                identifiers.append(wildcard)
+    return identifiers
+
+
+class SANOptimizer:
+    """
+    证书分组优化器
+
+    上一次的分组保存在状态文件中；重新分组时保留未变化的分组和分组的主域名（证书目录），
+    新名称只放入同一注册域名且仍有空位的分组，没有时新建分组。只有当分组数比最优数量多出
+    max_extra_orders 以上时才完全重新打包。
+    """
+
+    def __init__(
+            self,
+            max_sans: int = 100,
+            wildcard_threshold: int = 0,
+            max_extra_orders: int = 1,
+            state_file: Optional[str] = None
+    ):
+        """
+        Args:
+            max_sans: 每个证书最多的域名数
+            wildcard_threshold: 使用通配符的最少子主机名数（0表示不自动使用通配符）
+            max_extra_orders: 为保持分组稳定，允许比最优分组多出的订单数
+            state_file: 分组状态文件（可选）
+        """
+        self.max_sans = max_sans
+        self.wildcard_threshold = wildcard_threshold
+        self.max_extra_orders = max_extra_orders
+        self.state_file = state_file
+        self.groups: List[List[str]] = self._load()
+
+    def _load(self) -> List[List[str]]:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return []
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get('groups', [])
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取分组状态失败: {e}")
+            return []
+
+    def _save(self) -> None:
+        if self.state_file:
+            write_atomic(self.state_file, json.dumps({'groups': self.groups}, indent=2))
+
+    def optimize(self, names: Iterable[str]) -> List[List[str]]:
+        """
+        计算证书分组并保存
+
+        Args:
+            names: 主机名清单
+
+        Returns:
+            证书域名列表的列表（每个列表的第一个名称为主域名）
+        """
+        identifiers = choose_identifiers(names, self.wildcard_threshold)
+        wanted = set(identifiers)
+        optimal = -(-len(identifiers) // self.max_sans)
+
+        # 保留上一次的分组，去掉不再需要的名称
+        groups = []
+        for group in self.groups:
+            kept = [name for name in group if name in wanted]
+            if kept:
+                groups.append(kept)
+        placed = {name for group in groups for name in group}
+
+        # 新名称只放入已包含同一注册域名且有空位的分组，否则新建分组；
+        # 放入其他注册域名的分组会改变该证书的名称集合，使其无法复用授权并占用对方域名的额度
+        for name in identifiers:
+            if name in placed:
+                continue
+            domain = registered_domain(name)
+            target = next((g for g in groups if len(g) < self.max_sans
+                           and any(registered_domain(member) == domain for member in g)), None)
+            if target is None:
+                target = []
+                groups.append(target)
+            target.append(name)
+            placed.add(name)
+
+        if len(groups) > optimal + self.max_extra_orders:
+            logger.info(f"分组数 {len(groups)} 超过最优值 {optimal}，重新打包")
+            groups = pack_names(identifiers, self.max_sans)
+
+        changed = sum(1 for group in groups if group not in self.groups)
+        logger.info(f"{len(identifiers)} 个标识分为 {len(groups)} 个证书（{changed} 个分组有变化）")
+        self.groups = groups
+        self._save()
+        return [list(group) for group in groups]
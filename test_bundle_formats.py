@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+证书包格式测试
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+import bundle_formats
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from bundle_formats import BundleWriter, register_format
+
+
+@pytest.fixture
+def issued(tmp_path):
+    """通过 save_certificate 保存一个证书，返回 (客户端, 证书目录, 私钥)"""
+    ca = StubCA()
+    writer = BundleWriter(['pkcs12', 'haproxy', 'der'], {'pkcs12_password': 'changeit'})
+    client = StubACMEClient(StubACMEServer(lambda name: [], ca=ca), str(tmp_path / 'accounts'))
+    client.bundle_writer = writer
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    csr = x509.load_pem_x509_csr(client._generate_csr(['example.com', 'www.example.com'], key))
+    cert_path = tmp_path / 'certs' / 'example.com'
+    order = SimpleNamespace(fullchain_pem=ca.issue(csr))
+    assert client.save_certificate(order, cert_path, ['example.com', 'www.example.com'], key)
+    return ca, cert_path, key
+
+
+def test_formats_are_written_at_issuance(issued):
+    ca, cert_path, key = issued
+    leaf = x509.load_pem_x509_certificate((cert_path / 'cert.pem').read_bytes())
+
+    p12 = pkcs12.load_pkcs12((cert_path / 'bundle.p12').read_bytes(), b'changeit')
+    assert p12.cert.certificate == leaf
+    assert [cert.certificate for cert in p12.additional_certs] == [ca.intermediate_cert]
+    assert p12.key.private_numbers() == key.private_numbers()
+    assert p12.cert.friendly_name == b'example.com'
+
+    combined = (cert_path / 'haproxy.pem').read_bytes()
+    assert x509.load_pem_x509_certificates(combined) == [leaf, ca.intermediate_cert]
+    assert serialization.load_pem_private_key(combined, password=None).private_numbers() == key.private_numbers()
+
+    assert x509.load_der_x509_certificate((cert_path / 'cert.der').read_bytes()) == leaf
+    assert (cert_path / 'bundle.p12').stat().st_mode & 0o777 == 0o600
+    assert (cert_path / 'haproxy.pem').stat().st_mode & 0o777 == 0o600
+    assert (cert_path / 'cert.der').stat().st_mode & 0o777 == 0o644
+    assert not list(cert_path.glob('.tmp-*'))
+
+
+def test_custom_format_and_existing_certificates(issued, monkeypatch):
+    _, cert_path, _ = issued
+    monkeypatch.setattr(bundle_formats, 'FORMATS', dict(bundle_formats.FORMATS))
+
+    @register_format('key-der', 'privkey.der', mode=0o600)
+    def build_key_der(domain, cert, intermediates, private_key, options):
+        return private_key.private_bytes(serialization.Encoding.DER, serialization.PrivateFormat.PKCS8,
+                                         serialization.NoEncryption())
+
+    written = BundleWriter(['key-der', 'pkcs12']).write_existing(cert_path)
+    assert [path.name for path in written] == ['privkey.der', 'bundle.p12']
+    # 未设置密码时不加密
+    assert pkcs12.load_pkcs12((cert_path / 'bundle.p12').read_bytes(), None).key is not None
+    assert serialization.load_der_private_key((cert_path / 'privkey.der').read_bytes(), password=None)
+
+
+def test_unknown_format_and_config():
+    with pytest.raises(ValueError, match='jks'):
+        BundleWriter(['pkcs12', 'jks'])
+    assert BundleWriter.from_config({'key_size': 2048}) is None
+    writer = BundleWriter.from_config({'bundle_formats': ['der']})
+    assert [bundle_format.filename for bundle_format in writer.formats] == ['cert.der']
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+证书服务API测试
+"""
+
+import json
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.fake_acme import StubCA
+from benchmarks.fake_tls import make_certificate
+from cert_server import CertificateServer
+
+
+@pytest.fixture
+def cert_dir(tmp_path):
+    cert_dir = tmp_path / 'certs'
+    ca = StubCA()
+    make_certificate(ca, ['example.com', 'www.example.com'], cert_dir / 'example.com')
+    make_certificate(ca, ['api.example.com'], cert_dir / 'api.example.com')
+    return cert_dir, ca
+
+
+@pytest.fixture
+def server(cert_dir):
+    server = CertificateServer(str(cert_dir[0]), port=0, poll_interval=60, keepalive=0.2).start()
+    yield server
+    server.stop()
+
+
+def get(url: str, headers=None, timeout: float = 10):
+    """返回 (状态码, 响应头, 响应体)，304和错误状态不抛异常"""
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_bundle_etags_and_conditional_requests(server, cert_dir):
+    status, headers, body = get(f"{server.url}/certificates/example.com")
+    bundle = json.loads(body)
+    assert status == 200 and headers['ETag'] == bundle['etag']
+    assert bundle['metadata']['domains'] == ['example.com', 'www.example.com']
+    assert bundle['files']['privkey.pem'] == (cert_dir[0] / 'example.com' / 'privkey.pem').read_text()
+
+    assert get(f"{server.url}/certificates/example.com", {'If-None-Match': bundle['etag']})[0] == 304
+    status, headers, body = get(f"{server.url}/certificates/example.com/fullchain.pem")
+    assert body == (cert_dir[0] / 'example.com' / 'fullchain.pem').read_bytes()
+    assert get(f"{server.url}/certificates/example.com/fullchain.pem",
+               {'If-None-Match': f'"other", {headers["ETag"]}'})[0] == 304
+
+    status, headers, body = get(f"{server.url}/certificates")
+    assert sorted(json.loads(body)['certificates']) == ['api.example.com', 'example.com']
+    assert get(f"{server.url}/certificates", {'If-None-Match': headers['ETag']})[0] == 304
+    assert get(f"{server.url}/certificates/missing.example")[0] == 404
+    assert get(f"{server.url}/certificates/example.com/missing.pem")[0] == 404
+
+
+def test_long_poll_returns_when_certificate_is_renewed(server, cert_dir):
+    _, headers, _ = get(f"{server.url}/certificates/example.com")
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(
+        get(f"{server.url}/certificates/example.com?wait=10", {'If-None-Match': headers['ETag']})))
+    waiter.start()
+    time.sleep(0.3)
+    assert not results
+
+    make_certificate(cert_dir[1], ['example.com'], cert_dir[0] / 'example.com')
+    start = time.perf_counter()
+    assert server.store.refresh() == ['example.com']
+    waiter.join(timeout=5)
+    assert time.perf_counter() - start < 2
+    status, new_headers, body = results[0]
+    assert status == 200 and new_headers['ETag'] != headers['ETag']
+    assert json.loads(body)['metadata']['domains'] == ['example.com']
+
+    # 没有变化时等待到超时后返回304
+    assert get(f"{server.url}/certificates/example.com?wait=0.2", {'If-None-Match': new_headers['ETag']})[0] == 304
+
+
+def test_event_stream_and_resume(server, cert_dir):
+    with urllib.request.urlopen(f"{server.url}/events", timeout=10) as stream:
+        assert stream.readline().startswith(b': version')
+        stream.readline()
+        make_certificate(cert_dir[1], ['api.example.com'], cert_dir[0] / 'api.example.com')
+        shutil.rmtree(str(cert_dir[0] / 'example.com'))
+        server.store.refresh()
+
+        events = []
+        while len(events) < 2:
+            line = stream.readline().decode().strip()
+            if line.startswith('id:'):
+                event_id = int(line[3:])
+            elif line.startswith('event:'):
+                events.append((event_id, line[6:].strip(), json.loads(stream.readline().decode()[5:])['name']))
+        assert server.store.watchers == 1
+    assert [event[1:] for event in events] == [('updated', 'api.example.com'), ('removed', 'example.com')]
+
+    # 用 Last-Event-ID 续传时只收到之后的变化
+    changes = server.store.changes_since(events[0][0])
+    assert [(name, bundle) for _, name, bundle in changes] == [('example.com', None)]
+
+
+def test_mismatched_key_is_not_served_until_consistent(server, cert_dir, tmp_path):
+    _, headers, _ = get(f"{server.url}/certificates/api.example.com")
+    make_certificate(cert_dir[1], ['api.example.com'], tmp_path / 'renewed')
+    # 新证书已写入、私钥尚未写入
+    shutil.copy(str(tmp_path / 'renewed' / 'fullchain.pem'), str(cert_dir[0] / 'api.example.com'))
+    assert server.store.refresh() == []
+    assert get(f"{server.url}/certificates/api.example.com")[1]['ETag'] == headers['ETag']
+
+    shutil.copy(str(tmp_path / 'renewed' / 'privkey.pem'), str(cert_dir[0] / 'api.example.com'))
+    assert server.store.refresh() == ['api.example.com']
+
+
+def test_token_is_required_when_configured(cert_dir):
+    server = CertificateServer(str(cert_dir[0]), port=0, token='secret').start()
+    try:
+        assert get(f"{server.url}/certificates")[0] == 401
+        assert get(f"{server.url}/certificates", {'Authorization': 'Bearer secret'})[0] == 200
+    finally:
+        server.stop()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+中间证书链存储测试
+"""
+
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import chain_store
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from chain_store import ChainStore, load_intermediates, split_chain
+
+
+def fullchain(ca: StubCA, name: str, separator: str = '\n') -> str:
+    key = ec.generate_private_key(ec.SECP256R1())
+    csr = (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)]))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(name)]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    # Let's Encrypt 返回的证书链中PEM块之间没有空行
+    blocks = x509.load_pem_x509_certificates(ca.issue(csr).encode())
+    return separator.join(cert.public_bytes(serialization.Encoding.PEM).decode().strip() for cert in blocks) + '\n'
+
+
+def test_split_chain_does_not_depend_on_blank_lines():
+    ca = StubCA()
+    for separator in ('\n', '\n\n'):
+        leaf, intermediates = split_chain(fullchain(ca, 'example.com', separator))
+        assert leaf.subject.rfc4514_string() == 'CN=example.com'
+        assert intermediates == [ca.intermediate_cert]
+
+
+def test_save_certificate_links_shared_chain(tmp_path):
+    ca = StubCA()
+    client = StubACMEClient(StubACMEServer(lambda name: [], ca=ca), str(tmp_path / 'accounts'))
+    cert_dir = tmp_path / 'certs'
+    for name in ('a.example.com', 'b.example.com', 'c.example.com'):
+        (cert_dir / name).mkdir(parents=True)
+        assert client.save_certificate(SimpleNamespace(fullchain_pem=fullchain(ca, name)), cert_dir / name, [name])
+
+    stored = list((cert_dir / '.chains').glob('*.pem'))
+    assert len(stored) == 1
+    assert stored[0].stat().st_nlink == 4
+    assert (cert_dir / 'a.example.com' / 'chain.pem').samefile(stored[0])
+    assert x509.load_pem_x509_certificates((cert_dir / 'b.example.com' / 'cert.pem').read_bytes())[0] \
+        .subject.rfc4514_string() == 'CN=b.example.com'
+    assert (cert_dir / 'c.example.com' / 'fullchain.pem').read_text().startswith(
+        (cert_dir / 'c.example.com' / 'cert.pem').read_text())
+
+
+def test_symlink_and_copy_modes(tmp_path):
+    ca = StubCA()
+    for mode in ('symlink', 'copy'):
+        store = ChainStore(str(tmp_path / mode), link=mode)
+        cert_path = tmp_path / mode / 'example.com'
+        cert_path.mkdir(parents=True)
+        store.save(cert_path, fullchain(ca, 'example.com'))
+        chain_file = cert_path / 'chain.pem'
+        assert chain_file.is_symlink() == (mode == 'symlink')
+        assert load_intermediates(str(chain_file)) == [ca.intermediate_cert]
+
+
+def test_parsed_chains_are_cached_and_unreferenced_chains_pruned(tmp_path, monkeypatch):
+    old_ca, new_ca = StubCA(), StubCA()
+    store = ChainStore(str(tmp_path))
+    for name in ('a.example.com', 'b.example.com'):
+        (tmp_path / name).mkdir()
+        store.save(tmp_path / name, fullchain(old_ca, name))
+
+    parses = []
+    original = chain_store.x509.load_pem_x509_certificates
+    monkeypatch.setattr(chain_store.x509, 'load_pem_x509_certificates',
+                        lambda data: parses.append(1) or original(data))
+    first = load_intermediates(str(tmp_path / 'a.example.com' / 'chain.pem'))
+    assert load_intermediates(str(tmp_path / 'b.example.com' / 'chain.pem')) is first
+    assert len(parses) == 1
+
+    for name in ('a.example.com', 'b.example.com'):
+        store.save(tmp_path / name, fullchain(new_ca, name))
+    assert load_intermediates(str(tmp_path / 'a.example.com' / 'chain.pem')) == [new_ca.intermediate_cert]
+    assert len(os.listdir(str(tmp_path / '.chains'))) == 2
+    assert store.prune() == 1
+    assert len(os.listdir(str(tmp_path / '.chains'))) == 1
+
+
+def test_prune_keeps_copied_chains_and_waits_for_saves(tmp_path):
+    ca = StubCA()
+    store = ChainStore(str(tmp_path), link='copy')
+    (tmp_path / 'example.com').mkdir()
+    store.save(tmp_path / 'example.com', fullchain(ca, 'example.com'))
+    assert store.prune() == 0
+    assert len(list((tmp_path / '.chains').glob('*.pem'))) == 1
+
+    # 每次保存都写入新的证书链，同时不断清理：chain.pem 始终指向存在的证书链
+    store = ChainStore(str(tmp_path), link='symlink')
+    stop = threading.Event()
+
+    def prune():
+        while not stop.is_set():
+            store.prune()
+
+    thread = threading.Thread(target=prune)
+    thread.start()
+    try:
+        for i in range(20):
+            other = StubCA()
+            store.save(tmp_path / 'example.com', fullchain(other, 'example.com'))
+            assert load_intermediates(str(tmp_path / 'example.com' / 'chain.pem')) == [other.intermediate_cert]
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_store_works_without_fcntl(tmp_path):
+    # Windows上没有 fcntl：acme_client 仍可导入，证书链存储退回其他锁方式
+    script = (
+        "import sys\n"
+        "sys.modules['fcntl'] = None\n"
+        "sys.modules['msvcrt'] = None\n"
+        "import acme_client\n"
+        "from benchmarks.fake_acme import StubCA\n"
+        "from chain_store import ChainStore\n"
+        "from test_chain_store import fullchain\n"
+        "from pathlib import Path\n"
+        "root = Path(sys.argv[1])\n"
+        "(root / 'example.com').mkdir()\n"
+        "store = ChainStore(str(root))\n"
+        "store.save(root / 'example.com', fullchain(StubCA(), 'example.com'))\n"
+        "assert store.prune() == 0\n"
+    )
+    subprocess.run([sys.executable, '-c', script, str(tmp_path)], check=True,
+                   cwd=str(Path(__file__).parent))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+配置加载测试
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import config_loader
+from config_loader import ConfigError, load_compiled
+
+CONFIG = """
+letsencrypt:
+  email: "ops@example.com"
+dnsla:
+  api_id: "id"
+  api_secret: "secret"
+domains:
+  - domain: "example.com"
+    domain_id: 5435272
+    subdomains: ["@", "www", "*.example.com"]
+  - domain: "example.net"
+    domain_id: "42"
+"""
+
+
+def test_compiled_config_has_defaults_and_indexes(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(CONFIG)
+
+    config = load_compiled(str(path))
+
+    assert config['letsencrypt']['cert_dir'] == './certs'
+    assert config['certificate']['key_size'] == 2048
+    assert dict(config.zones) == {'example.com': '5435272', 'example.net': '42'}
+    assert config.names['example.com'] == ('example.com', 'www.example.com', '*.example.com')
+    assert config.all_names[-1] == 'example.net'
+    with pytest.raises(TypeError):
+        config['letsencrypt']['email'] = 'other@example.com'
+
+
+def test_cache_is_reused_until_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / 'config.yaml'
+    path.write_text(CONFIG)
+    load_compiled(str(path))
+
+    compiled = []
+    original = config_loader.compile_config
+    monkeypatch.setattr(config_loader, 'compile_config', lambda text: compiled.append(text) or original(text))
+
+    assert load_compiled(str(path))['dnsla']['api_id'] == 'id'
+    assert compiled == []
+
+    path.write_text(CONFIG.replace('"id"', '"new-id"'))
+    assert load_compiled(str(path))['dnsla']['api_id'] == 'new-id'
+    assert len(compiled) == 1
+
+
+def test_validation_reports_all_errors(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text("letsencrypt: {}\ndnsla: {api_id: x, api_secret: y}\n"
+                    "domains: [{domain: a.com}]\ncertificate: {key_size: big}\n")
+
+    with pytest.raises(ConfigError) as excinfo:
+        load_compiled(str(path))
+
+    assert excinfo.value.errors == [
+        'letsencrypt.email: 缺少必填项',
+        'certificate.key_size: 应为 int，实际为 str',
+        'domains[0].domain_id: 缺少必填项',
+    ]
+
+
+def test_validation_covers_optional_sections(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(CONFIG + "deploy: {services: {nginx: {domains: [a.com]}}}\n"
+                    "distribute: {nodes: [{name: web1}]}\n"
+                    "coordination: {backend: sqlite}\n"
+                    "work_queue: []\n"
+                    "verify: {endpoints: ['https://a.com:443', {server_name: a.com}]}\n"
+                    "job_api: {listen: 'localhost'}\n")
+
+    with pytest.raises(ConfigError) as excinfo:
+        load_compiled(str(path))
+
+    assert excinfo.value.errors == [
+        'work_queue: 应为映射',
+        'coordination.path: 缺少必填项',
+        "job_api.listen: 应为 host:port 形式，实际为 'localhost'",
+        'deploy.services.nginx.command: 缺少必填项',
+        'distribute.nodes[0].path: 缺少必填项',
+        'verify.endpoints[1].url: 缺少必填项',
+    ]
+
+    # 未配置的可选段不会被填充
+    path.write_text(CONFIG)
+    assert 'deploy' not in load_compiled(str(path))
+
+
+def test_cache_hit_does_not_import_yaml(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(CONFIG)
+    load_compiled(str(path))
+
+    script = ("import sys, config_loader; config_loader.load_compiled(sys.argv[1]); "
+              "assert 'yaml' not in sys.modules")
+    subprocess.run([sys.executable, '-c', script, str(path)], check=True, cwd=os.path.dirname(config_loader.__file__))
+
+
+def test_writable_cache_is_not_unpickled(tmp_path, monkeypatch):
+    path = tmp_path / 'config.yaml'
+    path.write_text(CONFIG)
+    load_compiled(str(path))
+    cache = config_loader.default_cache_file(path)
+
+    loaded = []
+    original = config_loader.pickle.load
+    monkeypatch.setattr(config_loader.pickle, 'load', lambda f: loaded.append(f) or original(f))
+
+    # 组可写的缓存不反序列化，重新编译并以0600写回
+    os.chmod(cache, 0o664)
+    assert load_compiled(str(path))['dnsla']['api_id'] == 'id'
+    assert loaded == []
+    assert os.stat(cache).st_mode & 0o777 == 0o600
+
+    assert load_compiled(str(path))['dnsla']['api_id'] == 'id'
+    assert len(loaded) == 1
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+部署钩子测试
+"""
+
+import json
+import logging
+import sys
+import threading
+import time
+
+import metrics
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from benchmarks.fake_dnsla import FakeDNSLAServer
+from cert_manager import CertificateManager
+from deploy_hooks import DeployHooks, DeployTarget
+from dnsla_client import DNSLAClient
+
+logging.basicConfig(level=logging.WARNING)
+
+# 把钩子环境变量追加到文件中的命令
+RECORD = ("import json, os, sys; "
+          "open(sys.argv[1], 'a').write(json.dumps({k: v for k, v in os.environ.items() "
+          "if k.startswith('DEPLOY_')}) + '\\n')")
+
+
+def recorder(name, log_file, domains=('*',)):
+    return DeployTarget(name, [sys.executable, '-c', RECORD, str(log_file)], domains)
+
+
+def read_calls(log_file):
+    if not log_file.exists():
+        return []
+    return [json.loads(line) for line in log_file.read_text().splitlines()]
+
+
+def test_reloads_are_coalesced_per_service(tmp_path):
+    nginx_log, mysql_log = tmp_path / 'nginx.log', tmp_path / 'mysql.log'
+    hooks = DeployHooks([recorder('nginx', nginx_log), recorder('mysql', mysql_log, ['db.*'])])
+
+    for domain in ('example.com', 'api.example.com', 'db.example.com'):
+        hooks.notify(domain, str(tmp_path / domain))
+    hooks.notify('example.com', str(tmp_path / 'example.com'), ['example.com', 'www.example.com'])
+    assert hooks.pending() == {
+        'nginx': ['api.example.com', 'db.example.com', 'example.com'],
+        'mysql': ['db.example.com'],
+    }
+
+    results = hooks.flush()
+    assert all(result.ok for result in results.values())
+    nginx_calls, mysql_calls = read_calls(nginx_log), read_calls(mysql_log)
+    assert len(nginx_calls) == 1 and len(mysql_calls) == 1
+    assert nginx_calls[0]['DEPLOY_DOMAINS'] == 'api.example.com db.example.com example.com'
+    assert mysql_calls[0]['DEPLOY_CERT_PATHS'] == str(tmp_path / 'db.example.com')
+
+    # 没有新的变化时不再执行
+    assert hooks.flush() == {}
+    assert len(read_calls(nginx_log)) == 1
+
+
+def test_failed_reload_is_retried_on_next_flush(tmp_path):
+    marker = tmp_path / 'marker'
+    # 第一次执行失败，之后成功
+    flaky = DeployTarget('nginx', [sys.executable, '-c',
+                                   'import os, sys; p = sys.argv[1]; ok = os.path.exists(p); '
+                                   'open(p, "w").close(); sys.exit(0 if ok else 1)', str(marker)])
+    hooks = DeployHooks([flaky])
+    hooks.notify('example.com', str(tmp_path / 'example.com'))
+
+    assert not hooks.flush()['nginx'].ok
+    assert hooks.pending() == {'nginx': ['example.com']}
+    result = hooks.flush()['nginx']
+    assert result.ok and result.domains == ['example.com']
+    assert hooks.pending() == {}
+
+
+def test_results_of_concurrent_flush_are_recorded_per_certificate(tmp_path):
+    hooks = DeployHooks([DeployTarget('nginx', [sys.executable, '-c', 'import time; time.sleep(0.5)'])])
+    hooks.notify('a.example.com', str(tmp_path / 'a.example.com'))
+    other = threading.Thread(target=hooks.flush)
+    other.start()
+    time.sleep(0.2)
+
+    # 另一个线程的 flush 已经取走了待处理的证书：等待它完成后仍能拿到本证书的结果
+    hooks.notify('b.example.com', str(tmp_path / 'b.example.com'))
+    own = hooks.flush()
+    other.join()
+    assert own['nginx'].domains == ['b.example.com']
+    assert hooks.results_for('a.example.com')['nginx'].ok
+    assert hooks.results_for('b.example.com')['nginx'].ok
+    hooks.notify('a.example.com', str(tmp_path / 'a.example.com'))
+    assert hooks.results_for('a.example.com') == {}
+
+
+def test_hooks_run_in_parallel_with_timeouts(tmp_path):
+    sleep = [sys.executable, '-c', 'import time; time.sleep(0.5)']
+    hooks = DeployHooks([
+        DeployTarget('a', sleep),
+        DeployTarget('b', sleep),
+        DeployTarget('slow', [sys.executable, '-c', 'import time; time.sleep(30)'], timeout=0.2),
+        DeployTarget('broken', [sys.executable, '-c', 'raise SystemExit(3)']),
+        DeployTarget('missing', [str(tmp_path / 'no-such-command')]),
+    ], max_workers=5)
+    for target in hooks.targets:
+        hooks.notify('example.com', str(tmp_path))
+    before = metrics.DEPLOY_HOOK_FAILURES.get(service='slow', reason='timeout')
+
+    start = time.perf_counter()
+    results = hooks.flush()
+    assert time.perf_counter() - start < 2
+
+    assert results['a'].ok and results['b'].ok
+    assert results['slow'].timed_out
+    assert results['broken'].returncode == 3 and results['broken'].failure_reason == 'exit'
+    assert results['missing'].failure_reason == 'error'
+    assert metrics.DEPLOY_HOOK_FAILURES.get(service='slow', reason='timeout') == before + 1
+    assert metrics.DEPLOY_HOOK_SECONDS.count(service='a') >= 1
+
+
+def test_manager_reloads_once_per_batch(tmp_path):
+    log_file = tmp_path / 'nginx.log'
+    with FakeDNSLAServer() as dns_server:
+        domain_id = dns_server.add_domain('example.com')
+        acme = StubACMEClient(StubACMEServer(dns_server.resolve_txt, ca=StubCA()), str(tmp_path / 'accounts'))
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        manager = CertificateManager(dns, acme, 'example.com', domain_id, propagation_seconds=0,
+                                     deploy_hooks=DeployHooks([recorder('nginx', log_file)]))
+
+        results, _ = manager.issue_batch([['example.com'], ['www.example.com'], ['api.example.com']],
+                                         cert_dir=str(tmp_path / 'certs'))
+        assert all(results.values())
+        assert read_calls(log_file) == []
+
+        assert manager.flush_deploy_hooks()['nginx'].ok
+    calls = read_calls(log_file)
+    assert len(calls) == 1
+    assert calls[0]['DEPLOY_DOMAINS'].split() == ['api.example.com', 'example.com', 'www.example.com']
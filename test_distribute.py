@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+证书分发测试
+SSH传输使用本地替身（benchmarks/fake_ssh.py），通知和拉取使用本地HTTP服务
+"""
+
+import functools
+import http.server
+import io
+import json
+import sys
+import tarfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+import metrics
+from distribute import Distributor, Node
+
+FAKE_SSH = [sys.executable, str(Path(__file__).parent / 'benchmarks' / 'fake_ssh.py')]
+
+
+def write_bundle(cert_dir: Path, domain: str, serial: str) -> None:
+    path = cert_dir / domain
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'fullchain.pem').write_text(f"chain {serial}\n")
+    (path / 'privkey.pem').write_text(f"key {serial}\n")
+
+
+@pytest.fixture
+def cert_dir(tmp_path):
+    cert_dir = tmp_path / 'certs'
+    write_bundle(cert_dir, 'example.com', '1')
+    write_bundle(cert_dir, 'api.example.com', '1')
+    write_bundle(cert_dir, 'other.org', '1')
+    return cert_dir
+
+
+@pytest.fixture
+def http_server():
+    """记录POST请求体的HTTP服务，同时以静态文件方式提供 directory 中的文件"""
+    received = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers['Content-Length'])
+            received.append(json.loads(self.rfile.read(length)))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    def start(directory: Path):
+        server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), functools.partial(Handler, directory=str(directory)))
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}", received
+
+    servers = []
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_ssh_delivers_bundles_and_skips_unchanged(cert_dir, tmp_path):
+    node = Node('web1', 'ssh', str(tmp_path / 'web1'), host='web1.internal', user='deploy',
+                port=2222, domains=['*.example.com', 'example.com'])
+    state_file = str(tmp_path / 'state.json')
+    distributor = Distributor([node], state_file=state_file, ssh_command=FAKE_SSH)
+
+    result, = distributor.distribute(str(cert_dir))
+    assert result.ok, result.error
+    assert sorted(result.sent) == ['api.example.com', 'example.com'] and result.skipped == 0
+    assert (tmp_path / 'web1' / 'example.com' / 'privkey.pem').read_text() == "key 1\n"
+    assert not (tmp_path / 'web1' / 'other.org').exists()
+    assert not list((tmp_path / 'web1').glob('.*'))
+
+    # 新的分发器从状态文件读取已分发的哈希
+    before = metrics.DISTRIBUTED_BUNDLES.get(node='web1', outcome='skipped')
+    result, = Distributor([node], state_file=state_file, ssh_command=FAKE_SSH).distribute(str(cert_dir))
+    assert result.sent == [] and result.skipped == 2
+    assert metrics.DISTRIBUTED_BUNDLES.get(node='web1', outcome='skipped') == before + 2
+
+    result, = distributor.distribute(str(cert_dir), force=True)
+    assert len(result.sent) == 2
+
+
+def test_changed_bundle_is_resent_with_delta_notification(cert_dir, tmp_path, http_server):
+    url, received = http_server(tmp_path)
+    node = Node('web1', 'ssh', str(tmp_path / 'web1'), host='web1', notify_url=url,
+                remote_command='echo "$DEPLOY_DOMAINS" > "$base/.reloaded"')
+    distributor = Distributor([node], ssh_command=FAKE_SSH)
+    distributor.distribute(str(cert_dir))
+    assert len(received[0]['changed']) == 3
+
+    write_bundle(cert_dir, 'example.com', '2')
+    result, = distributor.distribute(str(cert_dir))
+    assert result.ok and result.sent == ['example.com']
+    assert received[1]['node'] == 'web1'
+    assert [item['domain'] for item in received[1]['changed']] == ['example.com']
+    assert (tmp_path / 'web1' / 'example.com' / 'fullchain.pem').read_text() == "chain 2\n"
+    assert (tmp_path / 'web1' / '.reloaded').read_text() == "example.com\n"
+
+
+def test_failed_node_is_retried_on_next_run(cert_dir, tmp_path):
+    node = Node('web1', 'ssh', str(tmp_path / 'web1'), host='web1', remote_command='exit 3')
+    distributor = Distributor([node], ssh_command=FAKE_SSH)
+    result, = distributor.distribute(str(cert_dir))
+    assert not result.ok and 'ssh' in result.error and result.sent == []
+    assert distributor.changes(node, {}) == []
+    assert distributor.state == {}
+
+
+def test_pull_node_publishes_archives_and_manifest(cert_dir, tmp_path, http_server):
+    publish = tmp_path / 'publish'
+    url, received = http_server(publish)
+    node = Node('sidecars', 'pull', str(publish), domains=['other.org'],
+                base_url=f"{url}/", notify_url=url)
+    Distributor([node]).distribute(str(cert_dir))
+
+    assert received[0]['changed'][0]['url'] == f"{url}/other.org.tar"
+    with urllib.request.urlopen(f"{url}/manifest.json") as response:
+        manifest = json.loads(response.read())
+    assert list(manifest) == ['other.org']
+    with urllib.request.urlopen(received[0]['changed'][0]['url']) as response:
+        archive = tarfile.open(fileobj=io.BytesIO(response.read()))
+    # 静态HTTP发布不包含私钥
+    assert archive.getnames() == ['other.org/fullchain.pem']
+
+
+def test_failed_notification_is_retried(cert_dir, tmp_path, http_server):
+    url, received = http_server(tmp_path)
+    node = Node('local', 'local', str(tmp_path / 'mount'), domains=['other.org'],
+                notify_url='http://127.0.0.1:1/unreachable')
+    distributor = Distributor([node])
+    result, = distributor.distribute(str(cert_dir))
+    # 通知失败时不记录分发状态，下次运行重新发送
+    assert not result.ok and '通知失败' in result.error
+    assert distributor.state == {}
+
+    node.notify_url = url
+    result, = distributor.distribute(str(cert_dir))
+    assert result.ok and result.sent == ['other.org']
+    assert [item['domain'] for item in received[0]['changed']] == ['other.org']
+
+
+def test_nodes_are_distributed_in_parallel(cert_dir, tmp_path):
+    nodes = [Node(f'node{i}', 'ssh', str(tmp_path / f'node{i}'), host=f'node{i}', remote_command='sleep 0.5')
+             for i in range(6)]
+    nodes.append(Node('mount', 'local', str(tmp_path / 'mount')))
+    start = time.perf_counter()
+    results = Distributor(nodes, ssh_command=FAKE_SSH).distribute(str(cert_dir))
+    assert time.perf_counter() - start < 2.5
+    assert all(result.ok and len(result.sent) == 3 for result in results)
+    assert (tmp_path / 'mount' / 'other.org' / 'fullchain.pem').exists()
+
+
+def test_node_config_validation():
+    with pytest.raises(ValueError):
+        Node.from_config({'name': 'x', 'transport': 'sftp', 'path': '/tmp'})
+    with pytest.raises(ValueError):
+        Node.from_config({'name': 'x', 'path': '/tmp'})
+    distributor = Distributor.from_config({'nodes': [{'name': 'x', 'transport': 'local', 'path': '/tmp'}]})
+    assert distributor.nodes[0].wants('anything.example')
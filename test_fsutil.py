@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+文件系统工具测试
+"""
+
+import os
+import stat
+
+import pytest
+
+import fsutil
+from fsutil import write_atomic
+
+
+def test_write_atomic_sets_mode_and_leaves_no_temp_files(tmp_path):
+    path = tmp_path / 'nested' / 'privkey.pem'
+    write_atomic(str(path), b'key\n', mode=0o600)
+    assert path.read_bytes() == b'key\n'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    write_atomic(str(path), '证书\n')
+    assert path.read_text(encoding='utf-8') == '证书\n'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+    # 写入失败时保留原文件并删除临时文件
+    with pytest.raises(TypeError):
+        write_atomic(str(path), 123)
+    assert path.read_text(encoding='utf-8') == '证书\n'
+    assert os.listdir(path.parent) == ['privkey.pem']
+
+
+def test_write_atomic_syncs_before_replace(tmp_path, monkeypatch):
+    calls = []
+    fsync, replace = os.fsync, os.replace
+    monkeypatch.setattr(fsutil.os, 'fsync', lambda fd: calls.append('fsync') or fsync(fd))
+    monkeypatch.setattr(fsutil.os, 'replace', lambda src, dst: calls.append('replace') or replace(src, dst))
+
+    write_atomic(str(tmp_path / 'cert.pem'), 'cert')
+
+    # 临时文件先刷盘再重命名，POSIX上随后刷新目录项
+    assert calls[:2] == ['fsync', 'replace']
+    assert (tmp_path / 'cert.pem').read_text() == 'cert'
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+按需颁发任务API测试
+"""
+
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from benchmarks.fake_dnsla import FakeDNSLAServer
+from cert_manager import CertificateManager
+from deploy_hooks import DeployHooks, DeployTarget
+from dnsla_client import DNSLAClient
+from job_api import JobConflict, JobRunner, JobServer
+
+
+class GatedManager:
+    """颁发在 gate 打开前一直阻塞的证书管理器替身"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.calls = []
+        self._local = threading.local()
+
+    @contextmanager
+    def report_progress(self, callback):
+        self._local.callback = callback
+        yield
+
+    def issue_certificate(self, domains, cert_dir, key_size):
+        self.calls.append(('issue', domains))
+        self._local.callback('order')
+        self.started.release()
+        self.gate.wait(10)
+        return Path(cert_dir) / domains[0]
+
+    def renew_certificate(self, domains, cert_dir, key_size, renew_days):
+        self.calls.append(('renew', domains))
+        self.started.release()
+        self.gate.wait(10)
+        return Path(cert_dir) / domains[0]
+
+    def flush_deploy_hooks(self, domain=None):
+        return {}
+
+
+def request(url, method='GET', body=None, token=None, headers=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers=dict(headers or {}))
+    if token:
+        req.add_header('Authorization', f'Bearer {token}')
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            return response.status, response.read(), response.headers
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), e.headers
+
+
+def test_issue_job_runs_on_shared_manager(tmp_path):
+    cert_dir = str(tmp_path / 'certs')
+    with FakeDNSLAServer() as dns_server:
+        domain_id = dns_server.add_domain('example.com')
+        acme = StubACMEClient(StubACMEServer(dns_server.resolve_txt, ca=StubCA()), str(tmp_path / 'accounts'))
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        manager = CertificateManager(dns, acme, 'example.com', domain_id, propagation_seconds=0)
+        server = JobServer(JobRunner(manager, cert_dir), port=0, token='secret').start()
+        try:
+            assert request(f'{server.url}/jobs', 'POST', {'domains': ['example.com']})[0] == 401
+            status, body, headers = request(f'{server.url}/jobs', 'POST',
+                                            {'domains': ['example.com', 'www.example.com']}, token='secret')
+            assert status == 202
+            job = json.loads(body)
+            assert headers['Location'] == f"/jobs/{job['id']}" and not job['coalesced']
+
+            status, body, _ = request(f"{server.url}/jobs/{job['id']}?wait=60", token='secret')
+            job = json.loads(body)
+            assert job['status'] == 'succeeded'
+            assert Path(job['cert_path'], 'fullchain.pem').exists()
+            stages = [event['stage'] for event in job['events'] if event['event'] == 'progress']
+            assert stages == ['order', 'challenges', 'dns_setup', 'propagation', 'validation', 'cleanup', 'save']
+
+            # 续期任务：证书仍然有效时直接成功
+            _, body, _ = request(f'{server.url}/jobs', 'POST',
+                                 {'type': 'renew', 'domains': ['example.com', 'www.example.com']}, token='secret')
+            _, body, _ = request(f"{server.url}/jobs/{json.loads(body)['id']}?wait=60", token='secret')
+            assert json.loads(body)['stage'] == 'up_to_date'
+            assert dns_server.record_count() == 0
+        finally:
+            server.stop()
+
+
+def test_job_and_daemon_renewal_of_same_certificate_do_not_overlap(tmp_path):
+    cert_dir = str(tmp_path / 'certs')
+    with FakeDNSLAServer() as dns_server:
+        domain_id = dns_server.add_domain('example.com')
+        acme_server = StubACMEServer(dns_server.resolve_txt, ca=StubCA(), latency=0.05)
+        acme = StubACMEClient(acme_server, str(tmp_path / 'accounts'))
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        hooks = DeployHooks([DeployTarget('nginx', [sys.executable, '-c', 'import time; time.sleep(0.3)'])])
+        manager = CertificateManager(dns, acme, 'example.com', domain_id, propagation_seconds=0,
+                                     deploy_hooks=hooks)
+        runner = JobRunner(manager, cert_dir)
+        try:
+            # 守护进程线程与任务API同时续期同一证书：只创建一个订单，另一方看到新证书
+            daemon = threading.Thread(target=lambda: (
+                manager.renew_certificate(['example.com'], cert_dir), manager.flush_deploy_hooks()))
+            daemon.start()
+            job, _ = runner.submit('renew', ['example.com'])
+            daemon.join()
+            assert runner.wait(lambda: job.finished, 30)
+            assert acme_server.calls['new_order'] == 1
+            assert job.status == 'succeeded'
+            # 重载可能由守护进程线程的 flush 执行；颁发了新证书的任务仍然记录结果，证书已是最新的任务不记录
+            assert job.hooks == ({} if job.stage == 'up_to_date' else {'nginx': True})
+        finally:
+            runner.close()
+
+
+def test_requests_for_same_san_set_are_coalesced(tmp_path):
+    manager = GatedManager()
+    runner = JobRunner(manager, str(tmp_path), max_concurrency=1)
+    try:
+        first, coalesced = runner.submit('issue', ['a.example.com', 'www.a.example.com'])
+        assert not coalesced
+        assert manager.started.acquire(timeout=10)
+        again, coalesced = runner.submit('issue', ['www.a.example.com', 'a.example.com'])
+        assert coalesced and again is first and first.requests == 2
+
+        # 并发上限为1：其他证书排队，排队中的续期遇到颁发请求时升级
+        queued, _ = runner.submit('renew', ['b.example.com'])
+        assert queued.status == 'queued'
+        upgraded, coalesced = runner.submit('issue', ['b.example.com'])
+        assert coalesced and upgraded.kind == 'issue'
+
+        manager.gate.set()
+        assert runner.wait(lambda: first.finished and queued.finished, 10)
+        assert manager.calls == [('issue', ['a.example.com', 'www.a.example.com']), ('issue', ['b.example.com'])]
+        assert [event for _, event, _ in first.events] == ['queued', 'started', 'progress', 'coalesced', 'succeeded']
+
+        # 完成后同一组域名可以再次提交
+        manager.gate.clear()
+        renew, coalesced = runner.submit('renew', ['a.example.com'])
+        assert not coalesced and renew is not first
+        assert runner.wait(lambda: renew.status == 'running', 10)
+        with pytest.raises(JobConflict):
+            runner.submit('issue', ['a.example.com'])
+        manager.gate.set()
+    finally:
+        runner.close()
+
+
+def test_progress_events_stream_and_validation(tmp_path):
+    manager = GatedManager()
+    server = JobServer(JobRunner(manager, str(tmp_path)), port=0, keepalive=0.2).start()
+    try:
+        for body in ({'domains': []}, {'domains': ['bad domain']}, {'type': 'revoke', 'domains': ['a.example.com']}):
+            status, response, _ = request(f'{server.url}/jobs', 'POST', body)
+            assert status == 400 and json.loads(response)['error']
+        assert request(f'{server.url}/jobs/missing')[0] == 404
+
+        _, body, _ = request(f'{server.url}/jobs', 'POST', {'domains': ['A.example.com']})
+        job_id = json.loads(body)['id']
+        assert manager.started.acquire(timeout=10)
+        threading.Timer(0.5, manager.gate.set).start()
+
+        # 事件流在任务完成后关闭
+        with urllib.request.urlopen(f'{server.url}/jobs/{job_id}/events', timeout=30) as response:
+            stream = response.read().decode()
+        events = [line.split(': ', 1)[1] for line in stream.splitlines() if line.startswith('event: ')]
+        assert events == ['queued', 'started', 'progress', 'succeeded']
+        ids = [int(line.split(': ')[1]) for line in stream.splitlines() if line.startswith('id: ')]
+
+        # Last-Event-ID 续传只返回之后的事件
+        _, resumed, _ = request(f'{server.url}/jobs/{job_id}/events', headers={'Last-Event-ID': str(ids[1])})
+        assert [line for line in resumed.decode().splitlines() if line.startswith('event: ')] == \
+            ['event: progress', 'event: succeeded']
+
+        _, listing, _ = request(f'{server.url}/jobs')
+        assert [job['domains'] for job in json.loads(listing)] == [['a.example.com']]
+    finally:
+        server.stop()
+
+
+def test_failing_deploy_hooks_still_finish_the_job(tmp_path):
+    class FailingHooksManager(GatedManager):
+        def flush_deploy_hooks(self, domain=None):
+            raise OSError('reload failed')
+
+    manager = FailingHooksManager()
+    manager.gate.set()
+    runner = JobRunner(manager, str(tmp_path))
+    try:
+        job, _ = runner.submit('issue', ['a.example.com'])
+        assert runner.wait(lambda: job.finished, 10)
+        # 证书已颁发，重载失败记录在任务中，合并键已释放
+        assert job.status == 'succeeded' and job.error == '重载服务失败: reload failed'
+        assert job.events[-1][1] == 'succeeded'
+        again, coalesced = runner.submit('issue', ['a.example.com'])
+        assert not coalesced
+        assert runner.wait(lambda: again.finished, 10)
+    finally:
+        runner.close()
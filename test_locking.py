@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+分布式锁和主节点选举测试
+"""
+
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from benchmarks.fake_dnsla import FakeDNSLAServer
+from cert_manager import CertificateManager
+from dnsla_client import DNSLAClient
+from locking import FileLockBackend, LeaderElector, LockHeld, LockManager, SQLiteLockBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def backend_factory(request, tmp_path):
+    def create(clock=time.time):
+        if request.param == 'file':
+            return FileLockBackend(str(tmp_path / 'locks'), clock=clock)
+        return SQLiteLockBackend(str(tmp_path / 'locks.db'), clock=clock)
+    return create
+
+
+def test_lease_exclusion_expiry_and_fencing(backend_factory):
+    clock = FakeClock()
+    backend = backend_factory(clock)
+
+    first = backend.acquire('cert:example.com', 'node-a', ttl=30)
+    assert first is not None
+    assert backend.acquire('cert:example.com', 'node-b', ttl=30) is None
+    assert backend.holder('cert:example.com').owner == 'node-a'
+
+    clock.now += 20
+    assert backend.renew(first, ttl=30)
+    clock.now += 20
+    assert backend.acquire('cert:example.com', 'node-b', ttl=30) is None
+
+    # node-a 停止续约后租约过期，node-b 接管并获得更大的 fencing token
+    clock.now += 31
+    second = backend.acquire('cert:example.com', 'node-b', ttl=30)
+    assert second is not None and second.token > first.token
+    assert not backend.renew(first, ttl=30)
+    backend.release(first)
+    assert backend.holder('cert:example.com').owner == 'node-b'
+
+    backend.release(second)
+    assert backend.holder('cert:example.com') is None
+    assert backend.acquire('cert:example.com', 'node-a', ttl=30).token > second.token
+
+
+def test_concurrent_holders_are_exclusive(backend_factory):
+    locks = [LockManager(backend_factory(), f'node-{i}', ttl=0.3) for i in range(8)]
+    active, overlaps, completed = [], [], []
+
+    def worker(manager):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                with manager.hold('cert:example.com'):
+                    active.append(manager.node_id)
+                    if len(active) > 1:
+                        overlaps.append(list(active))
+                    # 持有时间超过ttl，依靠后台续约保持租约
+                    time.sleep(0.4)
+                    active.remove(manager.node_id)
+                    completed.append(manager.node_id)
+                    return
+            except LockHeld:
+                time.sleep(0.01)
+
+    threads = [threading.Thread(target=worker, args=(manager,)) for manager in locks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not overlaps
+    assert sorted(completed) == sorted(manager.node_id for manager in locks)
+
+
+def test_threads_in_one_process_are_exclusive(backend_factory):
+    # 守护进程和按需颁发API共用一个 LockManager（同一个 node_id）
+    locks = LockManager(backend_factory(), 'node-a', ttl=30)
+    entered, release = threading.Event(), threading.Event()
+
+    def holder():
+        with locks.hold('cert:example.com'):
+            entered.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    assert entered.wait(10)
+    with pytest.raises(LockHeld):
+        with locks.hold('cert:example.com'):
+            pass
+    # 失败的获取不会释放其他线程持有的租约
+    assert locks.backend.holder('cert:example.com').owner == 'node-a'
+    release.set()
+    thread.join()
+    with locks.hold('cert:example.com') as lease:
+        assert locks.check(lease)
+
+
+def test_issuance_stops_when_lease_is_taken_over(tmp_path):
+    backend = SQLiteLockBackend(str(tmp_path / 'locks.db'))
+    cert_dir = str(tmp_path / 'certs')
+    with FakeDNSLAServer() as dns_server:
+        domain_id = dns_server.add_domain('example.com')
+        acme = StubACMEClient(StubACMEServer(dns_server.resolve_txt, ca=StubCA()), str(tmp_path / 'accounts'))
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        manager = CertificateManager(dns, acme, 'example.com', domain_id, propagation_seconds=0,
+                                     locks=LockManager(backend, 'node-a', ttl=30))
+
+        def take_over(stage):
+            # 模拟 node-a 暂停超过租约有效期，node-b 接管
+            if stage == 'validation':
+                backend.release(backend.holder('cert:example.com'))
+                assert backend.acquire('cert:example.com', 'node-b', ttl=30)
+
+        with manager.report_progress(take_over):
+            assert manager.issue_certificate(['example.com'], cert_dir) is None
+        assert not (tmp_path / 'certs' / 'example.com' / 'fullchain.pem').exists()
+        # 验证记录留给接管的节点复用和清理
+        assert dns_server.record_count() == 1
+        assert backend.holder('cert:example.com').owner == 'node-b'
+
+
+def test_manager_skips_certificate_held_by_another_node(tmp_path):
+    backend = SQLiteLockBackend(str(tmp_path / 'locks.db'))
+    cert_dir = str(tmp_path / 'certs')
+    with FakeDNSLAServer() as dns_server:
+        domain_id = dns_server.add_domain('example.com')
+        acme_server = StubACMEServer(dns_server.resolve_txt, ca=StubCA())
+
+        def node(name):
+            acme = StubACMEClient(acme_server, str(tmp_path / name / 'accounts'))
+            dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+            return CertificateManager(dns, acme, 'example.com', domain_id, propagation_seconds=0,
+                                      locks=LockManager(backend, name, ttl=30))
+
+        node_a, node_b = node('node-a'), node('node-b')
+        with node_b.locks.hold('cert:example.com'):
+            assert node_a.renew_certificate(['example.com'], cert_dir) is None
+            assert dns_server.record_count() == 0
+
+        cert_path = node_a.renew_certificate(['example.com'], cert_dir)
+        assert cert_path is not None
+        issued = (cert_path / 'cert.pem').stat().st_mtime_ns
+        # 持有锁后重新检查共享存储上的证书，不会重复续期
+        assert node_b.renew_certificate(['example.com'], cert_dir) == cert_path
+        assert (cert_path / 'cert.pem').stat().st_mtime_ns == issued
+
+
+def test_leader_failover(backend_factory):
+    clock = FakeClock()
+    backend = backend_factory(clock)
+    node_a = LeaderElector(backend, 'node-a', ttl=15)
+    node_b = LeaderElector(backend, 'node-b', ttl=15)
+
+    assert node_a.campaign()
+    assert not node_b.campaign()
+    clock.now += 5
+    assert node_a.campaign() and not node_b.campaign()
+
+    # node-a 崩溃（不再续约），租约过期后 node-b 接管
+    clock.now += 16
+    assert not node_a.is_leader
+    assert node_b.campaign()
+    assert not node_a.campaign()
+
+    # 主节点正常退出时释放租约，其他节点不必等待过期
+    node_b.stop()
+    assert not node_b.is_leader
+    assert node_a.campaign()
+
+
+def test_lock_backends_do_not_require_fcntl_unless_used(tmp_path):
+    # 没有 fcntl 的平台（Windows）上证书管理器不加载 locking，sqlite 后端照常可用
+    script = (
+        "import sys\n"
+        "sys.modules['fcntl'] = None\n"
+        "import cert_manager\n"
+        "assert 'locking' not in sys.modules\n"
+        "from locking import LockManager, SQLiteLockBackend\n"
+        "manager = LockManager(SQLiteLockBackend(sys.argv[1] + '/locks.db'), 'node1')\n"
+        "with manager.hold('cert:example.com') as lease:\n"
+        "    assert manager.check(lease)\n"
+    )
+    subprocess.run([sys.executable, '-c', script, str(tmp_path)], check=True,
+                   cwd=str(Path(__file__).parent))
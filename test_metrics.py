@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Prometheus指标测试
+"""
+
+import os
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from metrics import CertificateInventory, Counter, Gauge, Histogram, MetricsRegistry, start_http_server
+
+
+def make_registry() -> MetricsRegistry:
+    registry = MetricsRegistry()
+    registry.register(Counter('orders_total', 'ACME orders.', ['outcome'])).inc(outcome='valid')
+    registry.register(Gauge('leader', 'Leader lease.')).set(1)
+    return registry
+
+
+def test_registry_renders_exposition_format():
+    registry = MetricsRegistry()
+    orders = registry.register(Counter('orders_total', 'ACME orders.', ['outcome']))
+    leader = registry.register(Gauge('leader', 'Leader lease.'))
+    orders.inc(outcome='valid')
+    orders.inc(2, outcome='valid')
+    orders.inc(outcome='invalid')
+    leader.set(0.5)
+
+    # 同一指标的样本按标签排序，整数值不带小数点
+    assert registry.render() == '\n'.join([
+        '# HELP letsencrypt_dnsla_certificate_days_remaining Days until the certificate expires.',
+        '# TYPE letsencrypt_dnsla_certificate_days_remaining gauge',
+        '# HELP letsencrypt_dnsla_certificate_expiry_timestamp_seconds Certificate notAfter as a Unix timestamp.',
+        '# TYPE letsencrypt_dnsla_certificate_expiry_timestamp_seconds gauge',
+        '# HELP orders_total ACME orders.',
+        '# TYPE orders_total counter',
+        'orders_total{outcome="invalid"} 1',
+        'orders_total{outcome="valid"} 3',
+        '# HELP leader Leader lease.',
+        '# TYPE leader gauge',
+        'leader 0.5',
+    ]) + '\n'
+
+    leader.remove()
+    assert leader.get() is None and orders.get(outcome='valid') == 3
+
+
+def test_label_values_are_escaped():
+    gauge = Gauge('hook', 'Hook.', ['service', 'reason'])
+    gauge.set(1, service='a"b\\c\nd')
+
+    # 未提供的标签为空字符串
+    assert gauge.render() == ['hook{service="a\\"b\\\\c\\nd",reason=""} 1']
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('wait_seconds', 'Wait.', ['zone'], buckets=(5, 1, 10))
+    for value in (0.5, 1, 3, 20):
+        histogram.observe(value, zone='example.com')
+
+    assert histogram.buckets == (1, 5, 10, float('inf'))
+    assert histogram.count(zone='example.com') == 4 and histogram.count(zone='other.com') == 0
+    assert histogram.render() == [
+        'wait_seconds_bucket{zone="example.com",le="1"} 2',
+        'wait_seconds_bucket{zone="example.com",le="5"} 3',
+        'wait_seconds_bucket{zone="example.com",le="10"} 3',
+        'wait_seconds_bucket{zone="example.com",le="+Inf"} 4',
+        'wait_seconds_sum{zone="example.com"} 24.5',
+        'wait_seconds_count{zone="example.com"} 4',
+    ]
+
+
+def test_inventory_update_and_incremental_refresh(tmp_path):
+    now = datetime.now(timezone.utc)
+    expiry = {'a.com': now + timedelta(days=30, hours=1), 'b.com': now + timedelta(days=10, hours=1)}
+    for domain in expiry:
+        (tmp_path / domain).mkdir()
+        (tmp_path / domain / 'cert.pem').write_text('cert')
+    # 没有证书的目录被忽略
+    (tmp_path / 'empty').mkdir()
+
+    loaded = []
+
+    def loader(path):
+        loaded.append(os.path.basename(os.path.dirname(path)))
+        return {'not_valid_after': expiry[loaded[-1]]}
+
+    inventory = CertificateInventory()
+    assert inventory.refresh(str(tmp_path), loader) == 2
+    assert sorted(loaded) == ['a.com', 'b.com']
+    assert 'letsencrypt_dnsla_certificate_days_remaining{domain="a.com"} 30' in inventory.render()
+
+    # 未修改的证书不会重新解析
+    loaded.clear()
+    assert inventory.refresh(str(tmp_path), loader) == 0
+    assert loaded == []
+
+    # 增量更新（颁发成功后）直接生效，且记录的mtime与文件一致时refresh不会覆盖
+    expiry['a.com'] = now + timedelta(days=90, hours=1)
+    inventory.update('a.com', expiry['a.com'], (tmp_path / 'a.com' / 'cert.pem').stat().st_mtime)
+    assert inventory.refresh(str(tmp_path), loader) == 0
+
+    # 删除的证书从缓存中移除，修改过的证书重新解析
+    (tmp_path / 'b.com' / 'cert.pem').unlink()
+    os.utime(tmp_path / 'a.com' / 'cert.pem', (0, 0))
+    assert inventory.refresh(str(tmp_path), loader) == 1
+    assert loaded == ['a.com']
+
+    lines = inventory.render()
+    assert 'letsencrypt_dnsla_certificate_days_remaining{domain="a.com"} 90' in lines
+    assert f'letsencrypt_dnsla_certificate_expiry_timestamp_seconds{{domain="a.com"}} ' \
+           f'{expiry["a.com"].timestamp()!r}' in lines
+    assert not any('b.com' in line for line in lines)
+
+    assert inventory.refresh(str(tmp_path / 'missing'), loader) == 0
+
+
+def test_write_textfile(tmp_path):
+    registry = make_registry()
+    path = tmp_path / 'textfile' / 'letsencrypt.prom'
+    registry.write_textfile(str(path))
+
+    assert path.read_text() == registry.render()
+    assert 'orders_total{outcome="valid"} 1' in path.read_text().splitlines()
+    assert os.listdir(path.parent) == ['letsencrypt.prom']
+
+
+def test_http_endpoint_serves_metrics():
+    registry = make_registry()
+    server = start_http_server('127.0.0.1', 0, registry)
+    try:
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        with urllib.request.urlopen(f'{base_url}/metrics') as response:
+            assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+            assert response.read().decode('utf-8') == registry.render()
+
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            urllib.request.urlopen(f'{base_url}/other')
+        assert excinfo.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+OCSP响应预取测试
+使用本地OCSP响应者（benchmarks/fake_ocsp.py）
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography.x509 import ocsp
+
+from benchmarks.fake_acme import StubCA
+from benchmarks.fake_ocsp import StubOCSPResponder
+from benchmarks.fake_tls import make_certificate
+from ocsp import OCSP_FILE, OCSPPrefetcher
+
+
+@pytest.fixture
+def responder():
+    ca = StubCA()
+    with StubOCSPResponder(ca) as responder:
+        ca.ocsp_url = responder.url
+        yield responder
+
+
+def issue(responder: StubOCSPResponder, cert_dir, name: str):
+    cert_file, _, _ = make_certificate(responder.ca, [name], cert_dir / name)
+    return responder.register(cert_file)
+
+
+def test_prefetch_caches_and_refreshes_at_half_validity(responder, tmp_path):
+    cert_dir = tmp_path / 'certs'
+    certs = [issue(responder, cert_dir, name) for name in ('a.example.com', 'b.example.com')]
+    now = [datetime.now(timezone.utc)]
+    prefetcher = OCSPPrefetcher(str(cert_dir), clock=lambda: now[0])
+
+    results = prefetcher.refresh()
+    assert [result.status for result in results] == ['fetched', 'fetched']
+    staple = ocsp.load_der_ocsp_response((cert_dir / 'a.example.com' / OCSP_FILE).read_bytes())
+    assert staple.serial_number == certs[0].serial_number
+    assert staple.certificate_status == ocsp.OCSPCertStatus.GOOD
+
+    assert [result.status for result in prefetcher.refresh()] == ['fresh', 'fresh']
+    assert responder.requests == 2
+
+    # 7天有效期过半后刷新
+    now[0] += timedelta(days=3, hours=12)
+    assert [result.status for result in prefetcher.refresh()] == ['fetched', 'fetched']
+    assert responder.requests == 4
+
+
+def test_renewed_certificate_gets_new_response(responder, tmp_path):
+    cert_dir = tmp_path / 'certs'
+    issue(responder, cert_dir, 'example.com')
+    prefetcher = OCSPPrefetcher(str(cert_dir))
+    prefetcher.refresh()
+
+    renewed = issue(responder, cert_dir, 'example.com')
+    result, = prefetcher.refresh()
+    assert result.status == 'fetched'
+    staple = ocsp.load_der_ocsp_response((cert_dir / 'example.com' / OCSP_FILE).read_bytes())
+    assert staple.serial_number == renewed.serial_number
+
+
+def test_invalid_and_revoked_responses_are_not_stapled(responder, tmp_path):
+    cert_dir = tmp_path / 'certs'
+    issue(responder, cert_dir, 'example.com')
+    revoked = issue(responder, cert_dir, 'revoked.example.com')
+    make_certificate(StubCA(), ['no-ocsp.example.com'], cert_dir / 'no-ocsp.example.com')
+    prefetcher = OCSPPrefetcher(str(cert_dir))
+    prefetcher.refresh()
+    assert (cert_dir / 'revoked.example.com' / OCSP_FILE).exists()
+
+    # 吊销后之前缓存的good响应被删除
+    responder.revoked.add(revoked.serial_number)
+    results = {result.domain: result for result in prefetcher.refresh(force=True)}
+    assert results['revoked.example.com'].status == 'revoked'
+    assert results['no-ocsp.example.com'].status == 'no_url' and results['no-ocsp.example.com'].ok
+    assert not (cert_dir / 'revoked.example.com' / OCSP_FILE).exists()
+
+    # 证书更新后签名无效的响应被拒绝，属于旧证书的响应被删除
+    issue(responder, cert_dir, 'example.com')
+    responder.corrupt_signature = True
+    result, = prefetcher.refresh(domains=['example.com'])
+    assert result.status == 'error' and '签名' in result.error
+    assert not (cert_dir / 'example.com' / OCSP_FILE).exists()
+
+
+def test_expired_response_is_removed_when_fetch_fails(responder, tmp_path):
+    cert_dir = tmp_path / 'certs'
+    issue(responder, cert_dir, 'example.com')
+    now = [datetime.now(timezone.utc)]
+    prefetcher = OCSPPrefetcher(str(cert_dir), clock=lambda: now[0])
+    prefetcher.refresh()
+
+    # 获取失败时保留仍然有效的响应
+    responder.corrupt_signature = True
+    now[0] += timedelta(days=4)
+    result, = prefetcher.refresh()
+    assert result.status == 'error' and result.next_update is not None
+    assert (cert_dir / 'example.com' / OCSP_FILE).exists()
+
+    # nextUpdate 之后不再装订
+    now[0] += timedelta(days=4)
+    result, = prefetcher.refresh()
+    assert result.status == 'error' and result.next_update is None
+    assert not (cert_dir / 'example.com' / OCSP_FILE).exists()
+
+
+def test_fetches_run_concurrently(responder, tmp_path):
+    cert_dir = tmp_path / 'certs'
+    for i in range(12):
+        issue(responder, cert_dir, f'host{i}.example.com')
+    responder.delay = 0.3
+    start = time.perf_counter()
+    results = OCSPPrefetcher(str(cert_dir), max_workers=16).refresh()
+    assert time.perf_counter() - start < 2
+    assert all(result.status == 'fetched' for result in results)
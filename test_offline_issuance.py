@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+离线颁发测试
+使用本地DNS.LA模拟服务器和进程内ACME桩，不访问任何外部服务
+"""
+
+import http.server
+import logging
+import math
+import threading
+import time
+
+import pytest
+from acme import messages
+
+from account_pool import AccountPool
+from acme_client import TracingClientNetwork
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from benchmarks.fake_dnsla import CNAME_TYPE, FakeDNSLAServer, FakeNameserver, TXT_TYPE
+from cert_manager import CertificateManager
+from delegation import ChallengeDelegation
+import dnsla_client
+from dnsla_client import DNSLAClient, DNSRecord
+from propagation import PropagationChecker, ZoneStats
+from rate_limits import IssuanceHistory, OrderPlanner, RateLimits
+
+logging.basicConfig(level=logging.WARNING)
+
+BASE_DOMAIN = 'example.com'
+
+
+@pytest.fixture(scope='module')
+def stub_ca():
+    return StubCA()
+
+
+@pytest.fixture
+def dns_server():
+    with FakeDNSLAServer() as server:
+        yield server
+
+
+@pytest.fixture
+def manager(dns_server, stub_ca, tmp_path):
+    domain_id = dns_server.add_domain(BASE_DOMAIN)
+    acme_server = StubACMEServer(dns_server.resolve_txt, ca=stub_ca)
+    acme = StubACMEClient(acme_server, str(tmp_path / 'accounts'))
+    dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+    return CertificateManager(dns, acme, BASE_DOMAIN, domain_id, propagation_seconds=0)
+
+
+def test_issue_certificate_offline(manager, dns_server, tmp_path):
+    domains = ['example.com', 'www.example.com']
+    cert_path = manager.issue_certificate(domains, cert_dir=str(tmp_path / 'certs'))
+
+    assert cert_path is not None
+    info = manager.get_certificate_info(str(cert_path / 'cert.pem'))
+    assert sorted(info['domains']) == sorted(domains)
+    assert info['days_remaining'] >= 89
+    # 验证记录已清理
+    assert dns_server.record_count() == 0
+
+
+def test_issue_fails_when_record_cannot_be_added(manager, dns_server, tmp_path):
+    dns_server.fail_next('POST', '/api/record')
+
+    assert manager.issue_certificate(['example.com'], cert_dir=str(tmp_path / 'certs')) is None
+    assert dns_server.record_count() == 0
+
+
+def test_fake_server_paginates_and_authenticates(dns_server):
+    domain_id = dns_server.add_domain(BASE_DOMAIN)
+    for i in range(5):
+        dns_server.add_record(domain_id, TXT_TYPE, f'host{i}', f'value{i}')
+
+    client = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+    first = client.get_record_list(domain_id, page_index=1, page_size=2)
+    last = client.get_record_list(domain_id, page_index=3, page_size=2)
+    assert [r['host'] for r in first] == ['host0', 'host1']
+    assert [r['host'] for r in last] == ['host4']
+
+    bad_client = DNSLAClient('test-id', 'wrong-secret', base_url=dns_server.base_url)
+    assert bad_client.get_domain_info(BASE_DOMAIN) is None
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_iter_records_builds_slim_records(dns_server, monkeypatch, streaming):
+    if not streaming:
+        monkeypatch.setattr(dnsla_client, 'ijson', None)
+    elif dnsla_client.ijson is None:
+        pytest.skip('ijson未安装')
+    domain_id = dns_server.add_domain(BASE_DOMAIN)
+    for i in range(5):
+        dns_server.add_record(domain_id, TXT_TYPE, f'host{i}', f'value{i}')
+    dns_server.add_record(domain_id, CNAME_TYPE, 'www', 'example.net.')
+
+    client = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+    with client.count_requests() as counter:
+        records = list(client.iter_records(domain_id, record_type='TXT', page_size=2))
+
+    assert [(r.host, r.data) for r in records] == [(f'host{i}', f'value{i}') for i in range(5)]
+    assert all(isinstance(r, DNSRecord) and not hasattr(r, '__dict__') for r in records)
+    assert counter.by_endpoint() == {'GET /api/recordList': 3}
+
+
+def issuance_budget(san_count: int, txt_records: int = 0) -> dict:
+    """
+    颁发N个域名的证书: 最多N次添加、N次删除，
+    列表查询每100条TXT记录一页（区域中TXT记录不超过100条时为1次）
+    """
+    return {
+        'POST /api/record': san_count,
+        'DELETE /api/record': san_count,
+        'GET /api/recordList': max(1, math.ceil(txt_records / 100)),
+    }
+
+
+@pytest.mark.parametrize('san_count', [1, 3, 10])
+def test_issue_request_budget(manager, tmp_path, san_count):
+    domains = [BASE_DOMAIN] + [f'host{i}.{BASE_DOMAIN}' for i in range(san_count - 1)]
+
+    with manager.dns.count_requests() as counter:
+        with counter.operation('issue'):
+            assert manager.issue_certificate(domains, cert_dir=str(tmp_path / 'certs')) is not None
+
+    counter.assert_budget(issuance_budget(san_count), operation='issue')
+
+
+@pytest.mark.parametrize('txt_records,pages', [(100, 1), (150, 2), (250, 3)])
+def test_issue_request_budget_pages_through_txt_records(manager, dns_server, tmp_path, txt_records, pages):
+    for i in range(txt_records):
+        dns_server.add_record(manager.domain_id, TXT_TYPE, f'other{i}', f'value{i}')
+    domains = [BASE_DOMAIN, f'www.{BASE_DOMAIN}']
+
+    with manager.dns.count_requests() as counter:
+        assert manager.issue_certificate(domains, cert_dir=str(tmp_path / 'certs')) is not None
+
+    # 列表查询按页计数，TXT记录数恰好是整页时不多查一页空页
+    assert counter.by_endpoint()['GET /api/recordList'] == pages
+    counter.assert_budget(issuance_budget(len(domains), txt_records))
+
+
+def test_stale_challenge_records_are_replaced(manager, dns_server, tmp_path):
+    domain_id = manager.domain_id
+    dns_server.add_record(domain_id, TXT_TYPE, '_acme-challenge.www', 'stale-value')
+    dns_server.add_record(domain_id, TXT_TYPE, 'unrelated', 'keep-me')
+
+    with manager.dns.count_requests() as counter:
+        cert_path = manager.issue_certificate(['example.com', 'www.example.com'], cert_dir=str(tmp_path / 'certs'))
+
+    assert cert_path is not None
+    assert dns_server.resolve_txt('_acme-challenge.www.example.com') == []
+    assert dns_server.resolve_txt('unrelated.example.com') == ['keep-me']
+    # 额外的一次删除用于清理旧记录，列表查询仍然只有一次
+    counter.assert_budget({'POST /api/record': 2, 'DELETE /api/record': 3, 'GET /api/recordList': 1})
+
+
+def test_issue_across_zones(manager, dns_server, tmp_path):
+    # example.net 未配置，由 get_domain_info 自动发现
+    dns_server.add_domain('example.net')
+    domains = ['a.example.com', 'b.example.com', 'b.example.net']
+
+    with manager.dns.count_requests() as counter:
+        cert_path = manager.issue_certificate(domains, cert_dir=str(tmp_path / 'certs'))
+
+    assert cert_path is not None
+    assert sorted(manager.get_certificate_info(str(cert_path / 'cert.pem'))['domains']) == sorted(domains)
+    assert 'example.net' in manager.zones
+    assert dns_server.record_count() == 0
+    # 每个托管域名一次列表查询；发现 example.net 需要查询 b.example.net 和 example.net
+    counter.assert_budget({
+        'POST /api/record': 3,
+        'DELETE /api/record': 3,
+        'GET /api/recordList': 2,
+        'GET /api/domain': 2,
+    })
+
+
+def test_issue_fails_for_unmanaged_zone(manager, dns_server, tmp_path):
+    assert manager.issue_certificate(['www.example.org'], cert_dir=str(tmp_path / 'certs')) is None
+    assert dns_server.record_count() == 0
+
+
+def test_zone_lookup_errors_are_not_cached_as_missing(manager, dns_server, tmp_path):
+    dns_server.add_domain('example.net')
+    # 查询 b.example.net 时DNS.LA临时出错：本次颁发失败，不会退回到更短的后缀，也不记为不存在
+    dns_server.fail_next('GET', '/api/domain')
+    assert manager.issue_certificate(['b.example.net'], cert_dir=str(tmp_path / 'certs')) is None
+    assert manager._missing_zones == {}
+    assert manager.issue_certificate(['b.example.net'], cert_dir=str(tmp_path / 'certs')) is not None
+
+    # 确认不存在的托管域名只缓存 MISSING_ZONE_TTL 秒
+    assert manager.issue_certificate(['www.example.org'], cert_dir=str(tmp_path / 'certs')) is None
+    dns_server.add_domain('example.org')
+    assert manager.issue_certificate(['www.example.org'], cert_dir=str(tmp_path / 'certs')) is None
+    # 缓存过期后重新查询
+    manager._missing_zones = dict.fromkeys(manager._missing_zones, 0)
+    assert manager.issue_certificate(['www.example.org'], cert_dir=str(tmp_path / 'certs')) is not None
+
+
+def test_issue_follows_challenge_cname(dns_server, stub_ca, tmp_path):
+    domain_id = dns_server.add_domain(BASE_DOMAIN)
+    validation_zone_id = dns_server.add_domain('acme.example.net')
+    dns_server.add_record(domain_id, CNAME_TYPE, '_acme-challenge.www', 'www.acme.example.net.')
+
+    acme_server = StubACMEServer(dns_server.resolve_txt, ca=stub_ca)
+    acme = StubACMEClient(acme_server, str(tmp_path / 'accounts'))
+    dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+    manager = CertificateManager(dns, acme, BASE_DOMAIN, domain_id, propagation_seconds=0,
+                                 zones={'acme.example.net': validation_zone_id}, follow_cnames=True)
+
+    written_zones = []
+    add_txt_record = dns.add_txt_record
+    dns.add_txt_record = lambda domain_id, host, value, ttl=600, **kwargs: (
+        written_zones.append(domain_id) or add_txt_record(domain_id, host, value, ttl, **kwargs))
+
+    # CNAME查询失败且没有缓存：订单失败，不把验证记录写入生产域名
+    dns_server.fail_next('GET', '/api/recordList')
+    assert manager.issue_certificate(['www.example.com'], cert_dir=str(tmp_path / 'certs')) is None
+    assert written_zones == []
+
+    assert manager.issue_certificate(['www.example.com'], cert_dir=str(tmp_path / 'certs')) is not None
+    assert written_zones == [validation_zone_id]
+
+    # CNAME目标已缓存，第二次颁发不再查询生产域名
+    acme_server.valid_authorizations.clear()
+    with dns.count_requests() as counter:
+        assert manager.issue_certificate(['www.example.com'], cert_dir=str(tmp_path / 'certs')) is not None
+    counter.assert_budget(issuance_budget(1))
+
+
+def test_cname_lookup_errors_are_not_cached(dns_server, tmp_path):
+    domain_id = dns_server.add_domain(BASE_DOMAIN)
+    dns_server.add_record(domain_id, CNAME_TYPE, '_acme-challenge.www', 'www.acme.example.net.')
+    dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+    now = [1000.0]
+    cache_file = tmp_path / 'cname-cache.json'
+    delegation = ChallengeDelegation(dns, lambda name: (BASE_DOMAIN, domain_id), ttl=60,
+                                     cache_file=str(cache_file), clock=lambda: now[0])
+    name = '_acme-challenge.www.example.com'
+
+    # API错误不等于没有CNAME：没有缓存时失败（不写入生产域名），也不写入缓存
+    dns_server.fail_next('GET', '/api/recordList')
+    with pytest.raises(Exception):
+        delegation.resolve(name)
+    assert not cache_file.exists()
+    assert delegation.resolve(name) == 'www.acme.example.net'
+
+    # 缓存过期后查询失败时继续使用过期的目标
+    now[0] += 61
+    dns_server.fail_next('GET', '/api/recordList')
+    assert delegation.resolve(name) == 'www.acme.example.net'
+    assert delegation.resolve(name) == 'www.acme.example.net'
+
+
+def test_wildcard_and_apex_share_challenge_host(manager, dns_server, tmp_path):
+    domains = ['example.com', '*.example.com']
+
+    with manager.dns.count_requests() as counter:
+        cert_path = manager.issue_certificate(domains, cert_dir=str(tmp_path / 'certs'))
+
+    # 两个验证值同时存在于 _acme-challenge 主机头，两个挑战都能通过
+    assert cert_path is not None
+    assert sorted(manager.get_certificate_info(str(cert_path / 'cert.pem'))['domains']) == sorted(domains)
+    assert dns_server.record_count() == 0
+    counter.assert_budget(issuance_budget(2))
+
+
+def test_propagation_checker_learns_zone_deadline(stub_ca, tmp_path):
+    with FakeDNSLAServer(visibility_delay=0.2) as dns_server, FakeNameserver(dns_server) as nameserver:
+        domain_id = dns_server.add_domain(BASE_DOMAIN)
+        acme = StubACMEClient(StubACMEServer(dns_server.resolve_txt, ca=stub_ca), str(tmp_path / 'accounts'))
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        stats_file = tmp_path / 'zone-stats.json'
+        checker = PropagationChecker([f'{nameserver.host}:{nameserver.port}'], ZoneStats(str(stats_file)),
+                                     interval=0.05, timeout=1)
+        manager = CertificateManager(dns, acme, BASE_DOMAIN, domain_id, propagation_seconds=30,
+                                     propagation_checker=checker)
+
+        for i in range(3):
+            assert manager.issue_certificate([f'www{i}.example.com'], cert_dir=str(tmp_path / 'certs')) is not None
+
+    # 每次只等待到记录在权威服务器可见，而不是固定的30秒
+    samples = ZoneStats(str(stats_file)).propagation_samples(BASE_DOMAIN)
+    assert len(samples) == 3
+    assert all(0.2 <= sample < 5 for sample in samples)
+    assert checker.stats.propagation_deadline(BASE_DOMAIN, 30) < 30
+
+
+def test_propagation_keeps_waiting_for_other_zones_after_one_times_out():
+    stats = ZoneStats()
+    for _ in range(3):
+        stats.observe_propagation('fast.example', 1)
+    now = [0.0]
+    visible = {'_acme-challenge.fast.example': float('inf'), '_acme-challenge.slow.example': 30}
+
+    def query(name, server, timeout):
+        return ['value'] if now[0] >= visible[name] else []
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    checker = PropagationChecker(['ns'], stats, interval=1, query=query, clock=lambda: now[0], sleep=sleep)
+    expected = {'fast.example': {'_acme-challenge.fast.example': {'value'}},
+                'slow.example': {'_acme-challenge.slow.example': {'value'}}}
+    # fast.example 10秒（下限）后超时，slow.example 仍在自己的60秒上限内等到生效
+    assert checker.wait(expected, 60) is False
+    assert stats.propagation_samples('fast.example')[-1] == 10
+    assert stats.propagation_samples('slow.example') == [30]
+
+
+def test_challenge_ttl_adapts_to_zone_minimum(stub_ca, tmp_path):
+    with FakeDNSLAServer(min_ttl=300) as dns_server:
+        domain_id = dns_server.add_domain(BASE_DOMAIN)
+        acme = StubACMEClient(StubACMEServer(dns_server.resolve_txt, ca=stub_ca), str(tmp_path / 'accounts'))
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        manager = CertificateManager(dns, acme, BASE_DOMAIN, domain_id, propagation_seconds=0, challenge_ttl=60)
+
+        with dns.count_requests() as counter:
+            assert manager.issue_certificate(['www.example.com'], cert_dir=str(tmp_path / 'certs')) is not None
+        # TTL 60 和 120 被拒绝，300 成功
+        counter.assert_budget({'POST /api/record': 3, 'DELETE /api/record': 1, 'GET /api/recordList': 1})
+        assert manager.zone_stats.min_ttl(BASE_DOMAIN) == 300
+
+        # 之后直接使用记住的最小TTL
+        with dns.count_requests() as counter:
+            assert manager.issue_certificate(['api.example.com'], cert_dir=str(tmp_path / 'certs')) is not None
+        assert counter.by_endpoint()['POST /api/record'] == 1
+
+        # 记住的最小TTL过期后重新从配置的TTL开始尝试
+        manager.zone_stats.clock = lambda: time.time() + ZoneStats.MIN_TTL_MAX_AGE + 1
+        assert manager.zone_stats.min_ttl(BASE_DOMAIN) == 0
+
+
+def test_challenge_ttl_is_not_raised_on_other_errors(manager, dns_server, tmp_path):
+    manager.challenge_ttl = 60
+    dns_server.fail_next('POST', '/api/record')
+    with manager.dns.count_requests() as counter:
+        assert manager.issue_certificate(['www.example.com'], cert_dir=str(tmp_path / 'certs')) is None
+    # 服务端错误不是TTL被拒绝：不重试更高的TTL，也不记住最小TTL
+    assert counter.by_endpoint()['POST /api/record'] == 1
+    assert manager.zone_stats.min_ttl(BASE_DOMAIN) == 0
+
+
+def test_account_pool_spreads_orders_and_skips_rate_limited(dns_server, stub_ca, tmp_path):
+    domain_id = dns_server.add_domain(BASE_DOMAIN)
+    acme_server = StubACMEServer(dns_server.resolve_txt, ca=stub_ca, orders_per_account=1, retry_after=60)
+    clients = [StubACMEClient(acme_server, str(tmp_path / f'account{i}')) for i in range(2)]
+    now = [1000.0]
+    pool = AccountPool(clients, orders_per_window=5, state_file=str(tmp_path / 'pool.json'), clock=lambda: now[0])
+    dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+    manager = CertificateManager(dns, pool, BASE_DOMAIN, domain_id, propagation_seconds=0)
+
+    for name in ('a', 'b'):
+        assert manager.issue_certificate([f'{name}.example.com'], cert_dir=str(tmp_path / 'certs')) is not None
+    # 两个订单分别使用两个账户
+    assert sorted(acme_server.account_orders.values()) == [1, 1]
+
+    # 两个账户都被CA限速: 订单失败，额度退回，账户按Retry-After暂停
+    assert manager.issue_certificate(['c.example.com'], cert_dir=str(tmp_path / 'certs')) is None
+    assert pool.remaining() == {str(c.account_dir): 4 for c in clients}
+    assert all(budget.blocked_until == 1060.0 for budget in pool.budgets.values())
+
+    # 状态持久化，新的账户池沿用限速状态
+    restored = AccountPool(clients, orders_per_window=5, state_file=str(tmp_path / 'pool.json'), clock=lambda: now[0])
+    assert restored.start_order(['d.example.com'], str(tmp_path / 'certs')) is None
+    assert acme_server.calls['new_order'] == 4
+
+
+def test_registration_cache_is_bound_to_account_key_and_directory(stub_ca, tmp_path):
+    acme = StubACMEClient(StubACMEServer(lambda name: [], ca=stub_ca), str(tmp_path / 'account'))
+    regr = messages.RegistrationResource(body=messages.Registration.from_data(email=acme.email),
+                                         uri='https://acme.stub/acct/1')
+    acme._save_registration(regr)
+    assert acme._load_registration() == regr
+
+    # 其他CA的目录地址不复用这个账户
+    acme.directory_url = 'https://ca.internal/directory'
+    assert acme._load_registration() is None
+    acme.directory_url = StubACMEClient.STAGING_URL
+
+    # 账户密钥被替换后，旧的账户URI不能与新密钥一起使用
+    (tmp_path / 'account' / 'account.key').unlink()
+    replaced = StubACMEClient(StubACMEServer(lambda name: [], ca=stub_ca), str(tmp_path / 'account'))
+    assert replaced.account_id != acme.account_id
+    assert replaced._load_registration() is None
+
+
+def test_retry_after_belongs_to_the_latest_response():
+    statuses = [(429, '30'), (200, None), (503, None)]
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, retry_after = statuses.pop(0)
+            self.send_response(status)
+            if retry_after:
+                self.send_header('Retry-After', retry_after)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/new-order"
+    try:
+        net = TracingClientNetwork(None)
+        net._send_request('GET', url)
+        assert net.retry_after == 30
+        # 其他线程看不到本线程的值
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(net.retry_after))
+        thread.start()
+        thread.join()
+        assert seen == [None]
+        # 之后的响应覆盖之前的Retry-After
+        net._send_request('GET', url)
+        assert net.retry_after is None
+        net._send_request('GET', url)
+        assert net.retry_after is None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_issue_batch_defers_orders_over_rate_limit(manager, tmp_path):
+    manager.planner = OrderPlanner(IssuanceHistory(), RateLimits(certificates_per_domain=1))
+
+    results, deferred = manager.issue_batch([['a.example.com'], ['b.example.com']], cert_dir=str(tmp_path / 'certs'))
+
+    assert results['a.example.com'] is not None
+    assert [order.names for order in deferred] == [['b.example.com']]
+    assert deferred[0].reason == 'certificates_per_domain:example.com'
+    assert len(manager.planner.history.issuances) == 1
+
+
+def test_unchanged_group_reuses_valid_authorizations(manager, tmp_path):
+    domains = ['example.com', 'www.example.com']
+    assert manager.issue_certificate(domains, cert_dir=str(tmp_path / 'certs')) is not None
+
+    with manager.dns.count_requests() as counter:
+        assert manager.issue_certificate(domains, cert_dir=str(tmp_path / 'certs')) is not None
+    # 授权仍然有效: 不需要任何DNS记录操作
+    assert counter.total() == 0
+
+
+def test_failed_validation_counts_only_invalid_names(manager, tmp_path):
+    manager.planner = OrderPlanner(IssuanceHistory())
+    server = manager.acme.stub_server
+    resolve = server.resolver
+    # bad.example.com 的TXT记录对CA不可见，其他名称验证成功
+    server.resolver = lambda name: [] if name == '_acme-challenge.bad.example.com' else resolve(name)
+
+    domains = ['example.com', 'www.example.com', 'bad.example.com']
+    assert manager.issue_certificate(domains, cert_dir=str(tmp_path / 'certs')) is None
+    assert [name for _, name in manager.planner.history.failures] == ['bad.example.com']
+    # 授权失败后不再反复轮询
+    assert server.calls['poll_and_finalize'] == 1
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+速率限制规划测试
+使用模拟时钟，不访问CA
+"""
+
+import pytest
+
+from rate_limits import (
+    HOUR, WEEK, IssuanceHistory, OrderPlanner, RateLimits, pack_names, registered_domain
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_registered_domain():
+    assert registered_domain('a.b.example.com') == 'example.com'
+    assert registered_domain('*.example.com') == 'example.com'
+    assert registered_domain('www.example.com.cn') == 'example.com.cn'
+
+
+def test_pack_names_minimizes_orders_and_keeps_domains_together():
+    names = [f'h{i}.a.com' for i in range(150)] + [f'h{i}.b.com' for i in range(40)] + ['c.com']
+    certificates = pack_names(names, max_sans=100)
+
+    assert len(certificates) == 2
+    assert all(len(certificate) <= 100 for certificate in certificates)
+    assert sorted(name for certificate in certificates for name in certificate) == sorted(names)
+    # b.com 的40个名称没有被拆开
+    assert sum(1 for certificate in certificates if any(n.endswith('.b.com') for n in certificate)) == 1
+
+
+def test_duplicate_certificate_limit_delays_until_window_slides(clock):
+    history = IssuanceHistory()
+    for i in range(5):
+        history.record_issuance(['example.com', 'www.example.com'], clock.now - (5 - i) * HOUR)
+    planner = OrderPlanner(history, clock=clock)
+
+    plan = planner.plan([['www.example.com', 'example.com'], ['other.example.net']])
+
+    assert plan[0].names == ['other.example.net'] and plan[0].not_before == clock.now
+    # 最早的一次重复证书滑出7天窗口后才能再次颁发
+    assert plan[1].not_before == clock.now - 5 * HOUR + WEEK
+    assert plan[1].reason == 'duplicate_certificate'
+
+
+def test_certificates_per_domain_counts_planned_orders(clock):
+    planner = OrderPlanner(IssuanceHistory(), RateLimits(certificates_per_domain=3), clock=clock)
+
+    plan = planner.plan([[f'h{i}.example.com'] for i in range(5)])
+
+    assert [order.not_before for order in plan] == [clock.now] * 3 + [clock.now + WEEK] * 2
+    assert plan[-1].reason == 'certificates_per_domain:example.com'
+
+
+def test_renewals_are_exempt_from_certificates_per_domain(clock, tmp_path):
+    history = IssuanceHistory(str(tmp_path / 'history.json'))
+    # 60天前颁发的证书早已不在7天窗口内，仍然识别为续期
+    history.record_issuance(['www.example.com', 'example.com'], clock.now - 60 * 24 * HOUR)
+    history.record_issuance(['api.example.com'], clock.now - 600)
+    assert [key for _, key in history.issuances] == ['api.example.com']
+
+    planner = OrderPlanner(IssuanceHistory(str(tmp_path / 'history.json')),
+                           RateLimits(certificates_per_domain=1), clock=clock)
+    renewal, new = planner.plan([['example.com', 'www.example.com'], ['mail.example.com']])
+    assert renewal.names == ['example.com', 'www.example.com'] and renewal.not_before == clock.now
+    assert new.reason == 'certificates_per_domain:example.com'
+
+
+def test_failed_validations_delay_hostname(clock, tmp_path):
+    history = IssuanceHistory(str(tmp_path / 'history.json'))
+    for _ in range(5):
+        history.record_failure(['bad.example.com'], clock.now - 600)
+
+    # 历史持久化后重新加载
+    planner = OrderPlanner(IssuanceHistory(str(tmp_path / 'history.json')), clock=clock)
+    plan = planner.plan([['bad.example.com', 'good.example.com']])
+    assert plan[0].not_before == clock.now - 600 + HOUR
+
+    clock.now += HOUR
+    assert planner.plan([['bad.example.com']])[0].not_before == clock.now
+
+
+def test_oversized_certificate_is_rejected(clock):
+    planner = OrderPlanner(IssuanceHistory(), clock=clock)
+    with pytest.raises(ValueError):
+        planner.plan([[f'h{i}.example.com' for i in range(101)]])
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+批量吊销测试
+使用本地DNS.LA模拟服务器和进程内ACME桩颁发证书，然后按条件批量吊销
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from account_pool import AccountPool
+from acme_client import issuing_account
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from benchmarks.fake_dnsla import FakeDNSLAServer
+from cert_manager import CertificateManager
+from dnsla_client import DNSLAClient
+from revocation import BulkRevoker, CertificateSelector, RateLimiter, RevocationJournal, parse_serial
+
+logging.basicConfig(level=logging.WARNING)
+
+DOMAINS = [['example.com', 'www.example.com'], ['api.example.com'], ['mail.example.com']]
+
+
+@pytest.fixture
+def issued(tmp_path):
+    """颁发三个证书，返回 (证书管理器, ACME服务器桩, 证书目录)"""
+    with FakeDNSLAServer() as dns_server:
+        domain_id = dns_server.add_domain('example.com')
+        acme_server = StubACMEServer(dns_server.resolve_txt, ca=StubCA())
+        acme = StubACMEClient(acme_server, str(tmp_path / 'accounts'))
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        manager = CertificateManager(dns, acme, 'example.com', domain_id, propagation_seconds=0)
+        cert_dir = str(tmp_path / 'certs')
+        for names in DOMAINS:
+            assert manager.issue_certificate(names, cert_dir=cert_dir)
+        yield manager, acme_server, cert_dir
+
+
+def test_parse_serial():
+    assert parse_serial('255') == 255
+    assert parse_serial('0xff') == 255
+    assert parse_serial('ff') == 255
+    assert parse_serial('01:00') == 256
+
+
+def test_selector_combines_criteria(issued):
+    manager, _, cert_dir = issued
+    assert [t.domain for t in CertificateSelector(domains=['*.example.com']).select(cert_dir)] == \
+        ['api.example.com', 'example.com', 'mail.example.com']
+    assert [t.domain for t in CertificateSelector(domains=['api.*', 'mail.*']).select(cert_dir)] == \
+        ['api.example.com', 'mail.example.com']
+
+    target = CertificateSelector(domains=['api.example.com']).select(cert_dir)[0]
+    assert [t.domain for t in CertificateSelector(serials=[hex(target.serial)]).select(cert_dir)] == ['api.example.com']
+    assert [t.domain for t in CertificateSelector(key_hashes=[target.key_hash[:12]]).select(cert_dir)] == \
+        ['api.example.com']
+
+    now = datetime.now(timezone.utc)
+    assert len(CertificateSelector(issued_after=now - timedelta(days=1)).select(cert_dir)) == 3
+    assert CertificateSelector(domains=['api.*'], issued_before=now - timedelta(days=1)).select(cert_dir) == []
+
+    with pytest.raises(ValueError):
+        CertificateSelector()
+
+
+def test_bulk_revoke_resumes_and_reissues(issued, tmp_path):
+    manager, acme_server, cert_dir = issued
+    targets = CertificateSelector(domains=['*.example.com']).select(cert_dir)
+    journal = RevocationJournal(str(tmp_path / 'revocations.jsonl'))
+
+    # 第一次运行有一个吊销请求失败
+    acme_server.fail_revocations = 1
+    results = BulkRevoker(manager, journal, reason=1, max_workers=3, rate=0).revoke(targets, reissue=True)
+    assert sum(results.values()) == 2
+    assert len(acme_server.revoked) == 2
+    assert len(journal.pending()) == 3
+
+    # 从日志继续: 只重试失败的证书，然后重新颁发全部
+    revoker = BulkRevoker(manager, journal, reason=1, rate=0)
+    pending = journal.pending()
+    assert all(revoker.revoke(pending).values())
+    assert acme_server.calls['revoke'] == 4
+    assert sorted(acme_server.revoked) == sorted(t.serial for t in targets)
+
+    reissued = revoker.reissue(pending, cert_dir)
+    assert sorted(reissued) == ['api.example.com', 'example.com', 'mail.example.com']
+    assert all(reissued.values())
+    assert journal.pending() == []
+
+    # 替换证书使用新的密钥
+    replacements = CertificateSelector(domains=['*.example.com']).select(cert_dir)
+    assert {t.key_hash for t in replacements}.isdisjoint(t.key_hash for t in targets)
+
+
+def test_already_revoked_counts_as_revoked(issued, tmp_path):
+    manager, acme_server, cert_dir = issued
+    target = CertificateSelector(domains=['mail.example.com']).select(cert_dir)[0]
+    acme_server.revoked.append(target.serial)
+
+    journal = RevocationJournal(str(tmp_path / 'revocations.jsonl'))
+    assert BulkRevoker(manager, journal, rate=0).revoke([target]) == {target.serial_hex: True}
+    assert journal.state()[target.serial_hex] == 'revoked'
+
+
+def test_journal_scopes_pending_to_reissue_requests_and_runs(issued, tmp_path):
+    manager, acme_server, cert_dir = issued
+    journal = RevocationJournal(str(tmp_path / 'revocations.jsonl'))
+    mail, = CertificateSelector(domains=['mail.example.com']).select(cert_dir)
+    api, = CertificateSelector(domains=['api.example.com']).select(cert_dir)
+
+    # 不要求重新颁发：吊销后即完成，--resume 不会再次提供这个证书
+    revoker = BulkRevoker(manager, journal, rate=0)
+    assert revoker.revoke([mail]) == {mail.serial_hex: True}
+    assert journal.pending() == []
+
+    # 同一日志中的另一次运行要求重新颁发：只看本次运行的证书
+    assert revoker.revoke([api], reissue=True) == {api.serial_hex: True}
+    assert [t.serial_hex for t in journal.pending()] == [api.serial_hex]
+    revoker.reissue([api], cert_dir)
+    assert journal.pending([api.serial_hex]) == [] and journal.pending() == []
+
+    # 之前吊销过的证书再次选中并要求重新颁发：保留吊销进度，等待替换证书
+    assert revoker.revoke([mail], reissue=True) == {mail.serial_hex: True}
+    assert acme_server.calls['revoke'] == 2
+    assert journal.state()[mail.serial_hex] == 'revoked'
+    assert [t.serial_hex for t in journal.pending()] == [mail.serial_hex]
+
+
+def test_pool_revokes_with_issuing_account(tmp_path):
+    with FakeDNSLAServer() as dns_server:
+        domain_id = dns_server.add_domain('example.com')
+        acme_server = StubACMEServer(dns_server.resolve_txt, ca=StubCA())
+        pool = AccountPool([StubACMEClient(acme_server, str(tmp_path / f'account{i}')) for i in range(2)])
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        manager = CertificateManager(dns, pool, 'example.com', domain_id, propagation_seconds=0)
+        cert_dir = tmp_path / 'certs'
+        for names in DOMAINS:
+            assert manager.issue_certificate(names, cert_dir=str(cert_dir))
+
+        accounts = {name[0]: issuing_account(cert_dir / name[0]) for name in DOMAINS}
+        assert set(accounts.values()) == {client.account_id for client in pool.clients}
+
+        # 没有颁发账户记录的证书（如升级前颁发的）依次尝试各账户
+        second = next(name for name, account in accounts.items() if account == pool.clients[1].account_id)
+        (cert_dir / second / '.account').unlink()
+        targets = CertificateSelector(domains=['*.example.com']).select(str(cert_dir))
+        journal = RevocationJournal(str(tmp_path / 'revocations.jsonl'))
+        assert all(BulkRevoker(manager, journal, rate=0).revoke(targets).values())
+        assert sorted(acme_server.revoked) == sorted(t.serial for t in targets)
+        assert {t.domain: t.account for t in journal.targets()} == dict(accounts, **{second: None})
+
+
+def test_rate_limiter_spaces_requests():
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+
+    limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+    for _ in range(3):
+        limiter.acquire()
+    assert waits == [0.25, 0.5]
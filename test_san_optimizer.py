@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+SAN分组优化测试
+"""
+
+from san_optimizer import SANOptimizer, choose_identifiers
+
+
+def test_choose_identifiers_uses_wildcards_over_threshold():
+    names = ['example.com', 'a.example.com', 'b.example.com', 'c.example.com', 'x.dev.example.com']
+
+    assert choose_identifiers(names) == names
+    assert choose_identifiers(names, wildcard_threshold=3) == ['example.com', '*.example.com', 'x.dev.example.com']
+    # 已配置的通配符覆盖显式主机名
+    assert choose_identifiers(['*.example.com', 'www.example.com', 'example.com']) == ['*.example.com', 'example.com']
+
+
+def test_optimizer_minimizes_orders():
+    names = [f'h{i}.example.com' for i in range(250)]
+    groups = SANOptimizer(max_sans=100).optimize(names)
+
+    assert [len(group) for group in groups] == [100, 100, 50]
+
+
+def test_groups_stay_stable_across_renewals(tmp_path):
+    state_file = str(tmp_path / 'groups.json')
+    names = [f'h{i}.example.com' for i in range(150)]
+    first = SANOptimizer(max_sans=100, state_file=state_file).optimize(names)
+
+    # 删除一个名称、新增一个名称: 新名称填入空出的位置，另一个分组不变
+    names = names[1:] + ['new.example.com']
+    second = SANOptimizer(max_sans=100, state_file=state_file).optimize(names)
+
+    assert second[0] == first[0][1:] + ['new.example.com']
+    assert second[1] == first[1]
+
+
+def test_fragmented_groups_are_repacked(tmp_path):
+    state_file = str(tmp_path / 'groups.json')
+    SANOptimizer(max_sans=10, state_file=state_file).optimize([f'h{i}.example.com' for i in range(40)])
+
+    # 每个分组只剩一个名称，超过最优分组数后重新打包
+    remaining = [f'h{i}.example.com' for i in (0, 10, 20, 30)]
+    assert SANOptimizer(max_sans=10, state_file=state_file).optimize(remaining) == [remaining]
+
+
+def test_new_names_join_groups_of_the_same_registered_domain(tmp_path):
+    state_file = str(tmp_path / 'groups.json')
+    SANOptimizer(max_sans=10, state_file=state_file).optimize([f'h{i}.example.com' for i in range(5)])
+
+    # 其他注册域名的新名称不放入已有分组（即使有空位），同一注册域名的新名称填入已有分组
+    groups = SANOptimizer(max_sans=10, state_file=state_file).optimize(
+        [f'h{i}.example.com' for i in range(5)] + ['www.example.org', 'new.example.com', 'example.org'])
+
+    assert groups == [[f'h{i}.example.com' for i in range(5)] + ['new.example.com'],
+                      ['www.example.org', 'example.org']]
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+TLS端点验证测试
+使用本地TLS端点（直接TLS、MySQL和PostgreSQL的STARTTLS握手）
+"""
+
+import time
+
+import pytest
+
+from benchmarks.fake_acme import StubCA
+from benchmarks.fake_tls import FakeTLSFleet, make_certificate, root_ca_file
+from tls_verify import CertificateInventory, Endpoint, verify_endpoints
+
+
+@pytest.fixture
+def certificates(tmp_path):
+    """证书目录中的当前证书，以及一个已被替换的旧证书"""
+    ca = StubCA()
+    cert_dir = tmp_path / 'certs'
+    current = make_certificate(ca, ['localhost'], cert_dir / 'localhost')
+    stale = make_certificate(ca, ['localhost'], tmp_path / 'stale')
+    return ca, cert_dir, current, stale
+
+
+def local(url: str) -> Endpoint:
+    return Endpoint(url.replace('127.0.0.1', 'localhost'))
+
+
+def test_endpoint_parsing():
+    assert (Endpoint('example.com').protocol, Endpoint('example.com').port) == ('https', 443)
+    endpoint = Endpoint('postgres://10.0.0.5', server_name='db.example.com')
+    assert (endpoint.host, endpoint.port, endpoint.server_name) == ('10.0.0.5', 5432, 'db.example.com')
+    assert Endpoint('mysql://db.example.com:13680').port == 13680
+    with pytest.raises(ValueError):
+        Endpoint('ftp://example.com')
+    with pytest.raises(ValueError):
+        Endpoint('tls://example.com')
+
+
+def test_verify_protocols_and_serials(certificates, tmp_path):
+    ca, cert_dir, current, stale = certificates
+    with FakeTLSFleet() as fleet:
+        endpoints = [
+            local(fleet.add('https', current[0], current[1])),
+            local(fleet.add('mysql', current[0], current[1])),
+            local(fleet.add('postgres', current[0], current[1])),
+            local(fleet.add('postgres', stale[0], stale[1])),
+            local(fleet.add('mysql', current[0], current[1], ssl_enabled=False)),
+        ]
+        results = verify_endpoints(endpoints, CertificateInventory.from_cert_dir(str(cert_dir)),
+                                   timeout=3, cafile=root_ca_file(ca, tmp_path))
+
+    assert [result.status for result in results] == ['ok', 'ok', 'ok', 'mismatch', 'error']
+    assert results[0].served_serial == current[2]
+    assert results[3].served_serial == stale[2] and results[3].expected_serial == current[2]
+    assert all(result.latency > 0 for result in results[:4])
+    assert 'SSL' in results[4].error
+
+
+def test_chain_verification_and_unknown_certificate(certificates, tmp_path):
+    _, cert_dir, current, _ = certificates
+    with FakeTLSFleet() as fleet:
+        url = fleet.add('https', current[0], current[1])
+        inventory = CertificateInventory.from_cert_dir(str(cert_dir))
+
+        # 不信任 StubCA 时握手失败
+        assert verify_endpoints([local(url)], inventory, timeout=3)[0].status == 'error'
+        # 只比较序列号；用IP访问时按 server_name 查找证书
+        assert verify_endpoints([local(url)], inventory, timeout=3, verify_chain=False)[0].ok
+        assert verify_endpoints([Endpoint(url)], inventory, timeout=3, verify_chain=False)[0].status == 'unknown'
+
+
+def test_endpoints_are_checked_concurrently(certificates):
+    _, cert_dir, current, _ = certificates
+    with FakeTLSFleet() as fleet:
+        endpoints = [local(fleet.add('postgres', current[0], current[1], delay=0.3)) for _ in range(10)]
+        start = time.perf_counter()
+        results = verify_endpoints(endpoints, CertificateInventory.from_cert_dir(str(cert_dir)),
+                                   timeout=3, verify_chain=False)
+        assert time.perf_counter() - start < 1.5
+    assert all(result.ok for result in results)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+性能追踪测试
+"""
+
+import json
+import threading
+
+import pytest
+
+import tracing
+from tracing import JSONLinesExporter, PrometheusTextfileExporter, Tracer, escape_label
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def flush(self):
+        pass
+
+
+def test_disabled_tracer_returns_shared_noop_span():
+    tracer = Tracer()
+    with tracer.span('issue', domains=1) as span:
+        span.set_attribute('ignored', True)
+    assert tracer.span('other') is span
+
+
+def test_spans_nest_per_thread():
+    tracer = Tracer()
+    exporter = ListExporter()
+    tracer.add_exporter(exporter)
+
+    def request():
+        with tracer.span('dnsla.request'):
+            pass
+
+    with tracer.span('issue', domains=2):
+        with tracer.span('issue.dns_setup') as inner:
+            inner.set_attribute('records', 2)
+            # 其他线程的span不以本线程的span为父span
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+        with pytest.raises(ValueError):
+            with tracer.span('issue.validation'):
+                raise ValueError('invalid')
+    with tracer.span('issue.save'):
+        pass
+
+    # span在结束时导出，子span先于父span
+    assert [(span.name, span.parent) for span in exporter.spans] == [
+        ('dnsla.request', None),
+        ('issue.dns_setup', 'issue'),
+        ('issue.validation', 'issue'),
+        ('issue', None),
+        ('issue.save', None),
+    ]
+    spans = {span.name: span for span in exporter.spans}
+    assert spans['issue.dns_setup'].attributes == {'records': 2}
+    assert spans['issue.validation'].error == 'ValueError' and spans['issue'].error is None
+    assert spans['issue'].duration >= spans['issue.dns_setup'].duration + spans['issue.validation'].duration
+
+
+def test_jsonl_exporter_appends_one_object_per_span(tmp_path):
+    path = tmp_path / 'trace.jsonl'
+    tracer = Tracer()
+    tracer.add_exporter(JSONLinesExporter(str(path)))
+
+    with tracer.span('issue', domain='例子.example.com'):
+        with tracer.span('acme.request', path=tmp_path):
+            pass
+
+    lines = path.read_text(encoding='utf-8').splitlines()
+    # 非ASCII字符原样写出，不可序列化的属性转为字符串
+    assert '例子' in lines[1]
+    records = [json.loads(line) for line in lines]
+    assert [(record['name'], record['parent']) for record in records] == [('acme.request', 'issue'), ('issue', None)]
+    assert records[0]['attributes'] == {'path': str(tmp_path)}
+    assert set(records[1]) == {'name', 'parent', 'start', 'duration', 'error', 'attributes'}
+
+
+def test_prometheus_textfile_escapes_labels(tmp_path):
+    assert escape_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+    path = tmp_path / 'spans.prom'
+    exporter = PrometheusTextfileExporter(str(path))
+    tracer = Tracer()
+    tracer.add_exporter(exporter)
+    for _ in range(2):
+        with tracer.span('issue "quoted"\n'):
+            pass
+    with pytest.raises(KeyError):
+        with tracer.span('issue "quoted"\n'):
+            raise KeyError('missing')
+    tracer.flush()
+
+    lines = path.read_text().splitlines()
+    metric = PrometheusTextfileExporter.METRIC
+    assert lines[:2] == [f'# HELP {metric} Duration of traced spans.', f'# TYPE {metric} summary']
+    assert f'{metric}_count{{span="issue \\"quoted\\"\\n",error=""}} 2' in lines
+    assert f'{metric}_count{{span="issue \\"quoted\\"\\n",error="KeyError"}} 1' in lines
+    assert len(lines) == 6
+
+
+def test_setup_tracing_enables_configured_exporters(tmp_path):
+    try:
+        assert not tracing.setup_tracing(None).enabled
+        tracer = tracing.setup_tracing({'jsonl_file': str(tmp_path / 'trace.jsonl'),
+                                        'prometheus_textfile': str(tmp_path / 'spans.prom')})
+        assert tracer is tracing.tracer and tracer.enabled
+        assert [type(exporter) for exporter in tracer.exporters] == [JSONLinesExporter, PrometheusTextfileExporter]
+    finally:
+        tracing.tracer.reset()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+分片续期工作队列测试
+"""
+
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from benchmarks.fake_acme import StubACMEClient, StubACMEServer, StubCA
+from benchmarks.fake_dnsla import FakeDNSLAServer
+from cert_manager import CertificateManager
+from dnsla_client import DNSLAClient
+from work_queue import Coordinator, HashRing, SQLiteWorkQueue, Worker, zone_of
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return SQLiteWorkQueue(str(tmp_path / 'queue.db'), visibility_timeout=60, worker_ttl=30,
+                           max_attempts=3, clock=clock)
+
+
+def test_hash_ring_moves_few_keys_and_zone_keys():
+    keys = [f'zone{i}.example' for i in range(2000)]
+    before = HashRing(['w1', 'w2', 'w3'])
+    after = HashRing(['w1', 'w2', 'w3', 'w4'])
+    moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+    # 新节点只接管约 1/4 的键，且只从其他节点移到新节点
+    assert 0.15 < len(moved) / len(keys) < 0.35
+    assert all(after.node_for(key) == 'w4' for key in moved)
+    assert max(Counter(after.node_for(key) for key in keys).values()) < len(keys) * 0.4
+
+    zones = ['example.com', 'sub.example.com', 'example.net']
+    assert zone_of('*.www.sub.example.com', zones) == 'sub.example.com'
+    assert zone_of('api.example.com', zones) == 'example.com'
+    assert zone_of('www.other.org', zones) == 'other.org'
+
+
+def test_visibility_timeout_retries_and_failure(queue, clock):
+    assert queue.enqueue(['example.com', 'www.example.com'], 'example.com')
+    assert not queue.enqueue(['example.com'], 'example.com')
+
+    [job] = queue.claim('w1')
+    assert job.domains == ['example.com', 'www.example.com'] and job.attempts == 1
+    assert queue.claim('w1') == []
+    assert queue.stats()['leased'] == 1
+
+    # 工作节点在确认前崩溃：超时后任务重新可见，旧的确认无效
+    clock.now += 61
+    [retry] = queue.claim('w1')
+    assert retry.id == job.id and retry.attempts == 2
+    assert not queue.ack(job)
+
+    queue.nack(retry, 'DNS错误', delay=10)
+    assert queue.claim('w1') == []
+    clock.now += 10
+    [last] = queue.claim('w1')
+    queue.nack(last, 'DNS错误')
+    assert queue.stats() == {'ready': 0, 'leased': 0, 'done': 0, 'failed': 1}
+
+    # 失败的任务不阻止重新加入
+    assert queue.enqueue(['example.com'], 'example.com')
+    [job] = queue.claim('w1')
+    assert queue.extend(job)
+    clock.now += 50
+    assert queue.ack(job)
+    assert queue.stats()['done'] == 1
+
+
+def test_jobs_are_sharded_by_zone_and_rebalanced(queue, clock):
+    zones = [f'zone{i}.example' for i in range(12)]
+    for zone in zones:
+        for host in ('a', 'b'):
+            queue.enqueue([f'{host}.{zone}'], zone)
+    queue.heartbeat('w1')
+    queue.heartbeat('w2')
+
+    owners = {}
+    for worker in ('w1', 'w2'):
+        for job in queue.claim(worker, limit=100):
+            owners.setdefault(job.zone, set()).add(worker)
+    # 每个托管域名的任务都由同一个节点领取，两个节点都分到了任务
+    assert len(owners) == len(zones)
+    assert all(len(workers) == 1 for workers in owners.values())
+    assert {next(iter(workers)) for workers in owners.values()} == {'w1', 'w2'}
+
+    # w2 失去心跳后，它的分片在可见性超时后由 w1 接管
+    clock.now += 61
+    queue.heartbeat('w1')
+    taken = queue.claim('w1', limit=100)
+    assert len(taken) == 24
+    for job in taken:
+        assert queue.ack(job)
+
+    # 其他分片积压超过 steal_after 时，空闲节点也会帮忙
+    queue.heartbeat('w2')
+    w2_zone = next(zone for zone, workers in owners.items() if workers == {'w2'})
+    queue.enqueue([f'c.{w2_zone}'], w2_zone)
+    assert queue.claim('w1') == []
+    clock.now += 301
+    queue.heartbeat('w2')
+    assert [job.zone for job in queue.claim('w1')] == [w2_zone]
+
+
+class SlowManager:
+    """每个续期耗时 delay 秒的证书管理器替身"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def renew_certificate(self, domains, cert_dir, key_size, renew_days):
+        time.sleep(self.delay)
+        return cert_dir
+
+    def flush_deploy_hooks(self):
+        return {}
+
+
+def test_batch_stays_leased_while_worker_is_busy(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / 'queue.db'), visibility_timeout=0.6, worker_ttl=0.6, steal_after=0)
+    for host in ('a', 'b', 'c'):
+        queue.enqueue([f'{host}.example.com'], 'example.com')
+    worker = Worker(queue, SlowManager(0.5), 'w1', str(tmp_path), batch_size=3)
+
+    # 批次总耗时超过可见性超时和心跳超时：排队中的任务和 w1 本身都不能被视为超时
+    stolen, stop = [], threading.Event()
+
+    def other_worker():
+        while not stop.wait(0.05):
+            stolen.extend(queue.claim('w2', limit=3))
+
+    thread = threading.Thread(target=other_worker)
+    thread.start()
+    try:
+        assert worker.run_once() == 3
+    finally:
+        stop.set()
+        thread.join()
+    assert stolen == []
+    assert queue.stats()['done'] == 3
+
+
+def test_worker_renews_due_certificates(tmp_path):
+    cert_dir = str(tmp_path / 'certs')
+    queue = SQLiteWorkQueue(str(tmp_path / 'queue.db'))
+    with FakeDNSLAServer() as dns_server:
+        domain_id = dns_server.add_domain('example.com')
+        acme = StubACMEClient(StubACMEServer(dns_server.resolve_txt, ca=StubCA()), str(tmp_path / 'accounts'))
+        dns = DNSLAClient('test-id', 'test-secret', base_url=dns_server.base_url)
+        manager = CertificateManager(dns, acme, 'example.com', domain_id, propagation_seconds=0)
+
+        certificates = [['a.example.com'], ['b.example.com', 'www.b.example.com'], ['c.example.com']]
+        coordinator = Coordinator(queue, ['example.com'])
+        assert coordinator.enqueue_due(certificates, cert_dir, renew_days=30) == 3
+
+        worker = Worker(queue, manager, 'w1', cert_dir, batch_size=2)
+        assert worker.run_once() == 2
+        assert worker.run_once() == 1
+        assert worker.run_once() == 0
+        assert queue.stats()['done'] == 3
+        assert dns_server.record_count() == 0
+
+        # 新证书不再到期，不会重新加入
+        assert coordinator.enqueue_due(certificates, cert_dir, renew_days=30) == 0
+
+
+def test_worker_backs_off_when_queue_fails(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / 'queue.db'))
+    outcomes = [OSError('database is locked'), OSError('database is locked'), [], OSError('disk I/O error')]
+
+    def claim(worker_id, limit):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    queue.claim = claim
+
+    class RecordingStop(threading.Event):
+        def __init__(self):
+            super().__init__()
+            self.waits = []
+
+        def wait(self, timeout=None):
+            self.waits.append(timeout)
+            if not outcomes:
+                self.set()
+            return self.is_set()
+
+    # 队列错误不会终止工作节点，连续失败时指数退避，成功后重置
+    stop = RecordingStop()
+    Worker(queue, SlowManager(0), 'w1', str(tmp_path)).run(stop, poll_interval=10, max_backoff=15)
+    assert stop.waits == [10, 15, 10, 10]
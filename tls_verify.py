@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+TLS端点验证
+部署后并发连接各服务端点（HTTPS/TLS、MySQL和PostgreSQL的STARTTLS握手），
+确认服务端返回的证书序列号与本地证书目录中的证书一致，并记录握手耗时
+"""
+
+import asyncio
+import logging
+import ssl
+import struct
+import time
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+from cert_info import list_certificates
+
+logger = logging.getLogger(__name__)
+
+# 协议 -> 默认端口
+DEFAULT_PORTS = {
+    'https': 443,
+    'tls': None,
+    'mysql': 3306,
+    'mariadb': 3306,
+    'postgres': 5432,
+    'postgresql': 5432,
+}
+
+# PostgreSQL SSLRequest: 长度8 + 请求码80877103
+POSTGRES_SSL_REQUEST = struct.pack('!II', 8, 80877103)
+
+# MySQL能力标志
+MYSQL_CLIENT_PROTOCOL_41 = 0x00000200
+MYSQL_CLIENT_SSL = 0x00000800
+MYSQL_CLIENT_SECURE_CONNECTION = 0x00008000
+MYSQL_UTF8MB4 = 45
+
+
+class Endpoint:
+    """一个需要验证的服务端点"""
+
+    __slots__ = ('url', 'protocol', 'host', 'port', 'server_name', 'certificate')
+
+    def __init__(self, url: str, server_name: Optional[str] = None, certificate: Optional[str] = None):
+        """
+        Args:
+            url: 端点地址，如 https://example.com、mysql://db.example.com:3306、postgres://10.0.0.5
+            server_name: SNI和主机名校验使用的名称（默认使用地址中的主机名）
+            certificate: 应该部署的证书（证书目录名，默认按 server_name 在证书目录中查找）
+        """
+        parts = urlsplit(url if '://' in url else f'https://{url}')
+        protocol = parts.scheme.lower()
+        if protocol not in DEFAULT_PORTS:
+            raise ValueError(f"不支持的协议: {protocol}")
+        port = parts.port or DEFAULT_PORTS[protocol]
+        if not parts.hostname or not port:
+            raise ValueError(f"端点地址缺少主机名或端口: {url}")
+        self.url = url
+        self.protocol = protocol
+        self.host = parts.hostname
+        self.port = port
+        self.server_name = server_name or parts.hostname
+        self.certificate = certificate
+
+    @classmethod
+    def from_config(cls, item) -> 'Endpoint':
+        if isinstance(item, str):
+            return cls(item)
+        return cls(item['url'], item.get('server_name'), item.get('certificate'))
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.url!r})"
+
+
+class EndpointResult:
+    """一个端点的验证结果"""
+
+    __slots__ = ('endpoint', 'served_serial', 'expected_serial', 'latency', 'error')
+
+    def __init__(self, endpoint: Endpoint, served_serial: Optional[int] = None,
+                 expected_serial: Optional[int] = None, latency: Optional[float] = None, error: str = ''):
+        self.endpoint = endpoint
+        self.served_serial = served_serial
+        self.expected_serial = expected_serial
+        self.latency = latency
+        self.error = error
+
+    @property
+    def status(self) -> str:
+        """ok、mismatch（序列号不一致）、unknown（本地没有对应证书）或 error"""
+        if self.error:
+            return 'error'
+        if self.expected_serial is None:
+            return 'unknown'
+        return 'ok' if self.served_serial == self.expected_serial else 'mismatch'
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 'ok'
+
+    def __repr__(self) -> str:
+        return f"EndpointResult({self.endpoint.url!r}, status={self.status}, latency={self.latency})"
+
+
+class CertificateInventory:
+    """本地证书目录中的证书序列号，按证书目录名和证书域名查找"""
+
+    def __init__(self, certificates: Iterable[Dict]):
+        self.by_directory: Dict[str, int] = {}
+        self.by_name: Dict[str, int] = {}
+        for info in certificates:
+            self.by_directory[info['domain']] = info['serial_number']
+            for name in info['domains']:
+                self.by_name.setdefault(name.lower(), info['serial_number'])
+
+    @classmethod
+    def from_cert_dir(cls, cert_dir: str) -> 'CertificateInventory':
+        return cls(list_certificates(cert_dir))
+
+    def expected_serial(self, endpoint: Endpoint) -> Optional[int]:
+        if endpoint.certificate:
+            return self.by_directory.get(endpoint.certificate)
+        name = endpoint.server_name.lower()
+        if name in self.by_directory:
+            return self.by_directory[name]
+        if name in self.by_name:
+            return self.by_name[name]
+        labels = name.split('.', 1)
+        if len(labels) == 2:
+            return self.by_name.get(f'*.{labels[1]}')
+        return None
+
+
+def create_context(verify_chain: bool = True, cafile: Optional[str] = None) -> ssl.SSLContext:
+    """
+    创建客户端TLS上下文
+
+    Args:
+        verify_chain: 是否校验证书链和主机名（测试环境证书可以关闭，只比较序列号）
+        cafile: 额外信任的根证书文件
+    """
+    context = ssl.create_default_context(cafile=cafile)
+    if not verify_chain:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def _mysql_ssl_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """读取MySQL初始握手包，发送SSLRequest包"""
+    header = await reader.readexactly(4)
+    length = int.from_bytes(header[:3], 'little')
+    payload = await reader.readexactly(length)
+    if payload[:1] == b'\xff':
+        raise ConnectionError(f"MySQL拒绝连接: {payload[3:].decode('utf-8', 'replace')}")
+
+    # 协议版本(1) + 服务器版本(以\0结尾) + 连接ID(4) + 随机数(8) + 填充(1) + 能力标志低16位(2)
+    version_end = payload.index(b'\x00', 1)
+    offset = version_end + 1 + 4 + 8 + 1
+    capabilities = int.from_bytes(payload[offset:offset + 2], 'little')
+    if not capabilities & MYSQL_CLIENT_SSL:
+        raise ConnectionError("MySQL服务器未启用SSL")
+
+    flags = MYSQL_CLIENT_PROTOCOL_41 | MYSQL_CLIENT_SSL | MYSQL_CLIENT_SECURE_CONNECTION
+    body = struct.pack('<IIB', flags, 16 * 1024 * 1024, MYSQL_UTF8MB4) + b'\x00' * 23
+    writer.write(len(body).to_bytes(3, 'little') + b'\x01' + body)
+    await writer.drain()
+
+
+async def _postgres_ssl_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """发送PostgreSQL SSLRequest，服务器回复 S 表示可以开始TLS握手"""
+    writer.write(POSTGRES_SSL_REQUEST)
+    await writer.drain()
+    answer = await reader.readexactly(1)
+    if answer != b'S':
+        raise ConnectionError("PostgreSQL服务器未启用SSL")
+
+
+STARTTLS = {
+    'mysql': _mysql_ssl_request,
+    'mariadb': _mysql_ssl_request,
+    'postgres': _postgres_ssl_request,
+    'postgresql': _postgres_ssl_request,
+}
+
+
+async def fetch_certificate(endpoint: Endpoint, context: ssl.SSLContext,
+                            timeout: float = 5.0) -> Tuple[x509.Certificate, float]:
+    """
+    完成TLS握手并返回服务端证书
+
+    Returns:
+        (服务端证书, 握手耗时秒数；直接TLS包括TCP连接，STARTTLS只计TLS握手)
+    """
+    loop = asyncio.get_running_loop()
+    starttls = STARTTLS.get(endpoint.protocol)
+
+    writer = None
+    try:
+        if starttls is None:
+            start = time.perf_counter()
+            reader, writer = await asyncio.open_connection(
+                endpoint.host, endpoint.port, ssl=context, server_hostname=endpoint.server_name,
+                ssl_handshake_timeout=timeout
+            )
+            latency = time.perf_counter() - start
+            transport = writer.transport
+        else:
+            reader, writer = await asyncio.open_connection(endpoint.host, endpoint.port)
+            await starttls(reader, writer)
+            start = time.perf_counter()
+            transport = await loop.start_tls(
+                writer.transport, writer.transport.get_protocol(), context,
+                server_hostname=endpoint.server_name, ssl_handshake_timeout=timeout
+            )
+            latency = time.perf_counter() - start
+        der = transport.get_extra_info('ssl_object').getpeercert(binary_form=True)
+        transport.close()
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        raise
+    return x509.load_der_x509_certificate(der, default_backend()), latency
+
+
+async def verify_endpoint(endpoint: Endpoint, expected_serial: Optional[int], context: ssl.SSLContext,
+                          timeout: float = 5.0) -> EndpointResult:
+    """验证单个端点（连接、STARTTLS和握手共用 timeout）"""
+    try:
+        cert, latency = await asyncio.wait_for(fetch_certificate(endpoint, context, timeout), timeout)
+    except asyncio.TimeoutError:
+        return EndpointResult(endpoint, expected_serial=expected_serial, error=f"超时 ({timeout} 秒)")
+    except (OSError, ssl.SSLError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+        return EndpointResult(endpoint, expected_serial=expected_serial, error=str(e) or type(e).__name__)
+    return EndpointResult(endpoint, cert.serial_number, expected_serial, latency)
+
+
+async def verify_endpoints_async(
+        endpoints: List[Endpoint],
+        inventory: CertificateInventory,
+        context: ssl.SSLContext,
+        timeout: float = 5.0,
+        concurrency: int = 100
+) -> List[EndpointResult]:
+    """并发验证所有端点（最多 concurrency 个同时进行），结果顺序与 endpoints 一致"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(endpoint: Endpoint) -> EndpointResult:
+        async with semaphore:
+            return await verify_endpoint(endpoint, inventory.expected_serial(endpoint), context, timeout)
+
+    return list(await asyncio.gather(*(run(endpoint) for endpoint in endpoints)))
+
+
+def verify_endpoints(
+        endpoints: List[Endpoint],
+        inventory: CertificateInventory,
+        timeout: float = 5.0,
+        concurrency: int = 100,
+        verify_chain: bool = True,
+        cafile: Optional[str] = None
+) -> List[EndpointResult]:
+    """
+    验证端点上部署的证书
+
+    Args:
+        endpoints: 端点列表
+        inventory: 本地证书清单
+        timeout: 每个端点的超时（秒）
+        concurrency: 最大并发连接数
+        verify_chain: 是否校验证书链和主机名
+        cafile: 额外信任的根证书文件
+
+    Returns:
+        验证结果列表
+    """
+    context = create_context(verify_chain, cafile)
+    return asyncio.run(verify_endpoints_async(endpoints, inventory, context, timeout, concurrency))
+
+
+def endpoints_from_config(config: Mapping) -> List[Endpoint]:
+    """
+    根据 verify 配置创建端点列表
+
+    配置示例:
+        verify:
+          timeout: 5
+          endpoints:
+            - "https://example.com"
+            - url: "mysql://10.0.0.5:3306"
+              server_name: "db.example.com"
+    """
+    return [Endpoint.from_config(item) for item in config.get('endpoints') or []]
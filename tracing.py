@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+性能追踪
+为证书颁发流程记录各阶段及每次HTTP调用的耗时（span），
+并导出为JSON Lines或Prometheus textfile格式
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fsutil import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空span，所有操作均为空操作"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """一次计时区间"""
+
+    __slots__ = ('tracer', 'name', 'attributes', 'parent', 'start_time',
+                 'duration', 'error', '_start')
+
+    def __init__(self, tracer: 'Tracer', name: str, attributes: Dict, parent: Optional[str]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start_time = 0.0
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self._start = 0.0
+
+    def set_attribute(self, key: str, value) -> None:
+        """设置span属性"""
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer._pop(self)
+        return False
+
+    def to_dict(self) -> Dict:
+        """转换为可序列化的字典"""
+        return {
+            'name': self.name,
+            'parent': self.parent,
+            'start': self.start_time,
+            'duration': self.duration,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class JSONLinesExporter:
+    """将每个完成的span追加为一行JSON"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 输出文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+    def flush(self) -> None:
+        pass
+
+
+class PrometheusTextfileExporter:
+    """
+    按span名称聚合耗时，写出node-exporter textfile格式
+
+    文件在flush()时原子替换，适合cron模式下每次运行结束后写出。
+    """
+
+    METRIC = 'letsencrypt_dnsla_span_duration_seconds'
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: textfile输出路径（通常位于node-exporter的textfile目录）
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # (span名称, error) -> [count, sum]
+        self._stats: Dict[Tuple[str, str], List[float]] = {}
+
+    def export(self, span: Span) -> None:
+        key = (span.name, span.error or '')
+        with self._lock:
+            stat = self._stats.setdefault(key, [0, 0.0])
+            stat[0] += 1
+            stat[1] += span.duration
+
+    def render(self) -> str:
+        """生成Prometheus文本格式"""
+        lines = [
+            f'# HELP {self.METRIC} Duration of traced spans.',
+            f'# TYPE {self.METRIC} summary',
+        ]
+        with self._lock:
+            items = sorted(self._stats.items())
+        for (name, error), (count, total) in items:
+            labels = f'span="{escape_label(name)}",error="{escape_label(error)}"'
+            lines.append(f'{self.METRIC}_count{{{labels}}} {int(count)}')
+            lines.append(f'{self.METRIC}_sum{{{labels}}} {total:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self) -> None:
+        write_atomic(self.path, self.render())
+
+
+class Tracer:
+    """
+    span追踪器
+
+    未启用时span()返回共享的空span，调用开销仅为一次属性判断。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.exporters: List = []
+        self._local = threading.local()
+
+    def span(self, name: str, **attributes):
+        """
+        创建span（用作上下文管理器）
+
+        Args:
+            name: span名称（如 issue.dns_setup、dnsla.request）
+            **attributes: span属性
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        stack = getattr(self._local, 'stack', None)
+        parent = stack[-1].name if stack else None
+        return Span(self, name, attributes, parent)
+
+    def add_exporter(self, exporter) -> None:
+        """添加导出器并启用追踪"""
+        self.exporters.append(exporter)
+        self.enabled = True
+
+    def flush(self) -> None:
+        """刷新所有导出器"""
+        for exporter in self.exporters:
+            try:
+                exporter.flush()
+            except Exception as e:
+                logger.error(f"导出追踪数据失败: {e}")
+
+    def reset(self) -> None:
+        """移除所有导出器并关闭追踪"""
+        self.enabled = False
+        self.exporters = []
+
+    def _push(self, span: Span) -> None:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+
+    def _pop(self, span: Span) -> None:
+        stack = self._local.stack
+        if stack and stack[-1] is span:
+            stack.pop()
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.debug(f"导出span失败: {e}")
+
+
+def escape_label(value: str) -> str:
+    """转义Prometheus标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# 全局追踪器
+tracer = Tracer()
+
+
+def setup_tracing(config: Optional[Dict]) -> Tracer:
+    """
+    根据配置启用追踪
+
+    配置示例:
+        tracing:
+          jsonl_file: ./trace.jsonl
+          prometheus_textfile: /var/lib/node_exporter/letsencrypt_spans.prom
+
+    Args:
+        config: tracing配置段，为空时不启用
+
+    Returns:
+        全局追踪器
+    """
+    if not config:
+        return tracer
+    if config.get('jsonl_file'):
+        tracer.add_exporter(JSONLinesExporter(config['jsonl_file']))
+    if config.get('prometheus_textfile'):
+        tracer.add_exporter(PrometheusTextfileExporter(config['prometheus_textfile']))
+    if tracer.enabled:
+        logger.info("性能追踪已启用")
+    return tracer
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+分片续期工作队列
+协调节点把到期的证书加入队列，多个工作节点（进程或主机）拉取任务；任务按托管域名
+一致性哈希分配给存活的工作节点，同一托管域名的DNS.LA缓存留在同一节点上。
+任务至少执行一次：领取后在可见性超时内未确认的任务会重新出现在队列中
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Type
+
+import metrics
+from cert_info import read_certificate_info
+
+if TYPE_CHECKING:
+    from cert_manager import CertificateManager
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """一致性哈希环（每个节点 replicas 个虚拟节点），节点增减时只有约 1/N 的键改变归属"""
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 100):
+        self.nodes = sorted(set(nodes))
+        self._ring: List[Tuple[int, str]] = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._keys = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+
+    def node_for(self, key: str) -> Optional[str]:
+        """键所属的节点（环为空时返回None）"""
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+def zone_of(name: str, zones: Iterable[str]) -> str:
+    """名称所属的托管域名（最长后缀匹配，未配置时取最后两级）"""
+    name = name.lstrip('*.').rstrip('.').lower()
+    matches = [zone for zone in zones if name == zone or name.endswith('.' + zone)]
+    if matches:
+        return max(matches, key=len)
+    return '.'.join(name.split('.')[-2:])
+
+
+class Job:
+    """领取的任务"""
+
+    __slots__ = ('id', 'domains', 'zone', 'attempts', 'receipt')
+
+    def __init__(self, id: int, domains: List[str], zone: str, attempts: int, receipt: str):
+        self.id = id
+        self.domains = domains
+        self.zone = zone
+        self.attempts = attempts
+        self.receipt = receipt
+
+    def __repr__(self) -> str:
+        return f"Job({self.id}, {self.domains[0]!r}, zone={self.zone!r}, attempts={self.attempts})"
+
+
+class WorkQueue(ABC):
+    """队列存储接口"""
+
+    def __init__(self, visibility_timeout: float = 600, worker_ttl: float = 60, max_attempts: int = 5,
+                 steal_after: Optional[float] = 300, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            visibility_timeout: 领取后未确认的任务重新可见的时间（秒），处理期间自动延长
+            worker_ttl: 工作节点心跳超时（秒），超时的节点不再参与分片
+            max_attempts: 最多执行次数，超过后任务标记为失败
+            steal_after: 本分片没有任务的节点可以领取其他分片中等待超过这么久的任务（秒），
+                         None 表示严格按分片领取
+            clock: 时钟（测试用）
+        """
+        self.visibility_timeout = visibility_timeout
+        self.worker_ttl = worker_ttl
+        self.max_attempts = max_attempts
+        self.steal_after = steal_after
+        self.clock = clock
+
+    @classmethod
+    @abstractmethod
+    def from_config(cls, config: Mapping) -> 'WorkQueue':
+        """根据 work_queue 配置创建队列"""
+
+    @abstractmethod
+    def enqueue(self, domains: Sequence[str], zone: str) -> bool:
+        """加入任务（同一主域名已有未完成的任务时不重复加入），返回是否新加入"""
+
+    @abstractmethod
+    def claim(self, worker_id: str, limit: int = 1) -> List[Job]:
+        """为工作节点领取属于其分片的可见任务（同时记录心跳）"""
+
+    @abstractmethod
+    def extend(self, job: Job, timeout: Optional[float] = None) -> bool:
+        """延长任务的可见性超时，任务已被重新领取时返回False"""
+
+    @abstractmethod
+    def ack(self, job: Job) -> bool:
+        """确认完成，任务已超时被重新领取时返回False（另一节点会再执行一次）"""
+
+    @abstractmethod
+    def nack(self, job: Job, error: str, delay: float = 0) -> None:
+        """处理失败，delay 秒后重试；达到最多次数后标记为失败"""
+
+    @abstractmethod
+    def heartbeat(self, worker_id: str) -> None:
+        """记录工作节点心跳"""
+
+    @abstractmethod
+    def deregister(self, worker_id: str) -> None:
+        """工作节点退出，分片立即重新分配"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """各状态的任务数（ready、leased、done、failed）"""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """SQLite中的队列（本机多进程或共享存储上的多个节点）"""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 存活节点集合 -> 哈希环
+        self._rings: Dict[Tuple[str, ...], HashRing] = {}
+        with self._transaction() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, domains TEXT NOT NULL, '
+                'zone TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                'visible_at REAL NOT NULL, owner TEXT, receipt TEXT, error TEXT, '
+                'enqueued_at REAL NOT NULL, finished_at REAL)'
+            )
+            # 每个主域名最多一个未完成的任务
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending ON jobs (name) WHERE status = 'ready'")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (status, visible_at)")
+            conn.execute('CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, last_seen REAL NOT NULL)')
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> 'SQLiteWorkQueue':
+        return cls(
+            config['path'],
+            visibility_timeout=config.get('visibility_timeout', 600),
+            worker_ttl=config.get('worker_ttl', 60),
+            max_attempts=config.get('max_attempts', 5),
+            steal_after=config.get('steal_after', 300),
+        )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def _ring(self, workers: Tuple[str, ...]) -> HashRing:
+        ring = self._rings.get(workers)
+        if ring is None:
+            self._rings = {workers: HashRing(workers)}
+            ring = self._rings[workers]
+        return ring
+
+    def enqueue(self, domains: Sequence[str], zone: str) -> bool:
+        now = self.clock()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (name, domains, zone, status, visible_at, enqueued_at) "
+                "VALUES (?, ?, ?, 'ready', ?, ?)",
+                (domains[0], json.dumps(list(domains)), zone, now, now)
+            )
+            return cursor.rowcount == 1
+
+    def claim(self, worker_id: str, limit: int = 1) -> List[Job]:
+        now = self.clock()
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO workers (id, last_seen) VALUES (?, ?)', (worker_id, now))
+            workers = tuple(row[0] for row in conn.execute(
+                'SELECT id FROM workers WHERE last_seen > ? ORDER BY id', (now - self.worker_ttl,)))
+            ring = self._ring(workers)
+            zones = [row[0] for row in conn.execute(
+                "SELECT DISTINCT zone FROM jobs WHERE status = 'ready' AND visible_at <= ?", (now,))]
+            owned = [zone for zone in zones if ring.node_for(zone) == worker_id]
+            rows = []
+            if owned:
+                placeholders = ','.join('?' * len(owned))
+                rows = conn.execute(
+                    f"SELECT id, domains, zone, attempts FROM jobs WHERE status = 'ready' AND visible_at <= ? "
+                    f"AND zone IN ({placeholders}) ORDER BY id LIMIT ?",
+                    (now, *owned, limit)
+                ).fetchall()
+            if not rows and self.steal_after is not None:
+                # 其他分片积压时帮忙处理等待最久的任务（这些托管域名的缓存不在本节点上）
+                rows = conn.execute(
+                    "SELECT id, domains, zone, attempts FROM jobs WHERE status = 'ready' AND visible_at <= ? "
+                    "ORDER BY visible_at LIMIT ?",
+                    (now - self.steal_after, limit)
+                ).fetchall()
+            jobs = []
+            for job_id, domains, zone, attempts in rows:
+                receipt = uuid.uuid4().hex
+                conn.execute(
+                    'UPDATE jobs SET attempts = attempts + 1, visible_at = ?, owner = ?, receipt = ? WHERE id = ?',
+                    (now + self.visibility_timeout, worker_id, receipt, job_id)
+                )
+                jobs.append(Job(job_id, json.loads(domains), zone, attempts + 1, receipt))
+            return jobs
+
+    def extend(self, job: Job, timeout: Optional[float] = None) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET visible_at = ? WHERE id = ? AND receipt = ? AND status = 'ready'",
+                (self.clock() + (timeout or self.visibility_timeout), job.id, job.receipt)
+            )
+            return cursor.rowcount == 1
+
+    def ack(self, job: Job) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, error = NULL "
+                "WHERE id = ? AND receipt = ? AND status = 'ready'",
+                (self.clock(), job.id, job.receipt)
+            )
+            return cursor.rowcount == 1
+
+    def nack(self, job: Job, error: str, delay: float = 0) -> None:
+        now = self.clock()
+        with self._transaction() as conn:
+            if job.attempts >= self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? "
+                    "WHERE id = ? AND receipt = ? AND status = 'ready'",
+                    (now, error, job.id, job.receipt)
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET visible_at = ?, owner = NULL, receipt = NULL, error = ? "
+                    "WHERE id = ? AND receipt = ? AND status = 'ready'",
+                    (now + delay, error, job.id, job.receipt)
+                )
+
+    def heartbeat(self, worker_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO workers (id, last_seen) VALUES (?, ?)', (worker_id, self.clock()))
+
+    def deregister(self, worker_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM workers WHERE id = ?', (worker_id,))
+
+    def stats(self) -> Dict[str, int]:
+        now = self.clock()
+        with self._transaction() as conn:
+            counts = {'ready': 0, 'leased': 0, 'done': 0, 'failed': 0}
+            for status, count in conn.execute(
+                    "SELECT CASE WHEN status = 'ready' AND visible_at > ? AND receipt IS NOT NULL "
+                    "THEN 'leased' ELSE status END, COUNT(*) FROM jobs GROUP BY 1", (now,)):
+                counts[status] = count
+        for status, count in counts.items():
+            metrics.WORK_QUEUE_JOBS.set(count, status=status)
+        return counts
+
+
+# 后端名称 -> 队列类
+QUEUE_BACKENDS: Dict[str, Type[WorkQueue]] = {
+    'sqlite': SQLiteWorkQueue,
+}
+
+
+def create_queue(config: Mapping) -> WorkQueue:
+    """
+    根据 work_queue 配置创建队列
+
+    配置示例:
+        work_queue:
+          backend: sqlite
+          path: /shared/letsencrypt/queue.db
+          visibility_timeout: 600
+    """
+    backend = config.get('backend', 'sqlite')
+    if backend not in QUEUE_BACKENDS:
+        raise ValueError(f"不支持的队列后端: {backend}（可用: {', '.join(sorted(QUEUE_BACKENDS))}）")
+    return QUEUE_BACKENDS[backend].from_config(config)
+
+
+class Coordinator:
+    """协调节点：把到期的证书加入队列"""
+
+    def __init__(self, queue: WorkQueue, zones: Iterable[str]):
+        """
+        Args:
+            queue: 工作队列
+            zones: 已知的托管域名（决定任务的分片键）
+        """
+        self.queue = queue
+        self.zones = list(zones)
+
+    def enqueue_due(self, certificates: List[List[str]], cert_dir: str, renew_days: int) -> int:
+        """
+        把不存在或将在 renew_days 天内过期的证书加入队列
+
+        Returns:
+            新加入的任务数
+        """
+        added = 0
+        for domains in certificates:
+            cert_file = Path(cert_dir) / domains[0] / 'cert.pem'
+            info = read_certificate_info(str(cert_file)) if cert_file.exists() else None
+            if info and info['days_remaining'] > renew_days:
+                continue
+            if self.queue.enqueue(domains, zone_of(domains[0], self.zones)):
+                added += 1
+        if added:
+            logger.info(f"已加入 {added} 个续期任务")
+        self.queue.stats()
+        return added
+
+
+class Worker:
+    """工作节点：领取属于本节点分片的任务并续期"""
+
+    def __init__(self, queue: WorkQueue, manager: 'CertificateManager', worker_id: str, cert_dir: str,
+                 key_size: int = 2048, renew_days: int = 30, batch_size: int = 10,
+                 retry_delay: float = 60):
+        """
+        Args:
+            queue: 工作队列
+            manager: 证书管理器（在本节点的所有任务间复用）
+            worker_id: 工作节点标识（哈希环上的节点）
+            cert_dir: 证书存储目录
+            key_size: RSA密钥大小
+            renew_days: 提前续期天数（执行时重新检查，其他节点已续期的证书直接确认）
+            batch_size: 每次领取的任务数
+            retry_delay: 失败重试的基础延迟（秒），按执行次数指数增加
+        """
+        self.queue = queue
+        self.manager = manager
+        self.worker_id = worker_id
+        self.cert_dir = cert_dir
+        self.key_size = key_size
+        self.renew_days = renew_days
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+
+    @contextmanager
+    def _keepalive(self, jobs: List[Job]) -> Iterator[Callable[[Job], None]]:
+        """
+        处理一批任务期间，每 min(visibility_timeout, worker_ttl)/3 秒记录本节点心跳，
+        并延长批次中尚未完成的所有任务的可见性超时（不只是正在执行的任务）
+
+        Yields:
+            done(job): 任务已确认或已放弃，不再延长
+        """
+        pending = list(jobs)
+        lock = threading.Lock()
+        stop = threading.Event()
+        interval = min(self.queue.visibility_timeout, self.queue.worker_ttl) / 3
+
+        def done(job: Job) -> None:
+            with lock:
+                if job in pending:
+                    pending.remove(job)
+
+        def keepalive():
+            while not stop.wait(interval):
+                try:
+                    self.queue.heartbeat(self.worker_id)
+                    with lock:
+                        for job in list(pending):
+                            if not self.queue.extend(job):
+                                logger.warning(f"任务 {job} 已超时，可能由其他节点重新执行")
+                                pending.remove(job)
+                except Exception as e:
+                    logger.warning(f"延长任务可见性超时失败: {e}")
+
+        thread = threading.Thread(target=keepalive, name=f'keepalive-{self.worker_id}', daemon=True)
+        thread.start()
+        try:
+            yield done
+        finally:
+            stop.set()
+            thread.join()
+
+    def process(self, job: Job) -> bool:
+        """执行一个任务（处理期间自动延长可见性超时）"""
+        with self._keepalive([job]) as done:
+            return self._execute(job, done)
+
+    def _execute(self, job: Job, done: Callable[[Job], None]) -> bool:
+        try:
+            cert_path = self.manager.renew_certificate(job.domains, self.cert_dir, self.key_size, self.renew_days)
+            error = None if cert_path else '续期失败'
+        except Exception as e:
+            cert_path, error = None, str(e)
+        # 确认之前停止延长，避免把已确认的任务误报为超时
+        done(job)
+
+        if cert_path:
+            self.queue.ack(job)
+            metrics.WORK_QUEUE_PROCESSED.inc(outcome='done')
+            return True
+        delay = min(self.retry_delay * 2 ** (job.attempts - 1), 3600)
+        logger.warning(f"任务 {job} 失败: {error}")
+        self.queue.nack(job, error, delay)
+        metrics.WORK_QUEUE_PROCESSED.inc(outcome='retry' if job.attempts < self.queue.max_attempts else 'failed')
+        return False
+
+    def run_once(self) -> int:
+        """领取并执行一批任务，返回执行的任务数"""
+        jobs = self.queue.claim(self.worker_id, self.batch_size)
+        if not jobs:
+            return 0
+        # 批次中排在后面的任务等待期间同样需要延长可见性超时
+        with self._keepalive(jobs) as done:
+            for job in jobs:
+                self._execute(job, done)
+        self.manager.flush_deploy_hooks()
+        return len(jobs)
+
+    def run(self, stop: Optional[threading.Event] = None, poll_interval: float = 10,
+            max_backoff: float = 300) -> None:
+        """
+        持续执行，队列为空时每 poll_interval 秒检查一次（同时作为心跳）
+
+        队列不可用等错误不会终止工作节点：记录日志后按连续失败次数指数退避，最长 max_backoff 秒
+        """
+        stop = stop or threading.Event()
+        failures = 0
+        try:
+            while not stop.is_set():
+                try:
+                    processed = self.run_once()
+                except Exception as e:
+                    failures += 1
+                    delay = min(poll_interval * 2 ** (failures - 1), max_backoff)
+                    logger.error(f"工作节点 {self.worker_id} 处理任务失败: {e}，{delay:.0f} 秒后重试")
+                    stop.wait(delay)
+                    continue
+                failures = 0
+                if not processed:
+                    stop.wait(poll_interval)
+        finally:
+            self.queue.deregister(self.worker_id)